@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in tracing of the HTTP calls made by a connector
+
+The connectors make their calls to the native repositories and to GMN through
+Requests, either directly or through the DataONE client libraries, which use
+Requests sessions. Tracing wraps the send() method of the Requests transport
+adapter, so every call made through Requests is traced, without changes to the
+code that makes the call.
+
+For each call, the method, the URL with the variable parts replaced by
+placeholders, the status, the number of bytes in the response body, the time to
+the first byte (until the response headers have been received) and the total
+time (until the body has been read or the response closed) are recorded. The
+calls are aggregated into per-endpoint latency histograms, and a summary is
+logged when the process exits.
+
+Tracing is enabled with CONNECTOR_HTTP_TRACE=1 in the environment. The
+connectors call install_if_enabled() at startup, which does nothing without it:
+
+  connector_util.http_trace.install_if_enabled()
+
+install() enables tracing regardless of the environment.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+  import urllib.parse as urlparse
+except ImportError:
+  import urlparse
+
+ENABLE_ENV = 'CONNECTOR_HTTP_TRACE'
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (
+  0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180, 600
+)
+
+# Query parameters that select the operation, so their values are kept in the
+# URL template. The values of other parameters are replaced with placeholders.
+OPERATION_PARAM_SET = {'verb', 'service', 'request', 'metadataPrefix'}
+
+# Names of the path elements that follow "eml" in PASTA URLs.
+PASTA_PATH_NAME_LIST = ['scope', 'identifier', 'revision', 'entity']
+
+# DataONE REST API resources that take a single identifier as the path element
+# after the resource name.
+D1_RESOURCE_RX = re.compile(
+  r'^(.*/v[12]/(?:object|meta|checksum|isAuthorized|accessRules|archive|'
+  r'replicaNotifications|dirtySystemMetadata|error|replicate|log|query|'
+  r'resolve|generate|views/[^/]+|packages/[^/]+))/.+$'
+)
+NUMBER_RX = re.compile(r'^\d+$')
+# Long hex strings, UUIDs and percent-encoded identifiers.
+ID_RX = re.compile(r'^([0-9a-fA-F-]{16,}|.*%[0-9a-fA-F]{2}.*)$')
+
+_original_send = None
+
+
+class Tracer(object):
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self._buckets = buckets
+    self._lock = threading.Lock()
+    self._endpoint_dict = {}
+
+  def record(self, method, url_template, status, byte_count, ttfb_sec, total_sec):
+    """Add a call to the histograms of its endpoint. {status} is the HTTP status
+    code, or None if no response was received."""
+    with self._lock:
+      endpoint = self._endpoint_dict.get((method, url_template))
+      if endpoint is None:
+        endpoint = self._endpoint_dict[(method, url_template)] = {
+          'method': method,
+          'url_template': url_template,
+          'count': 0,
+          'error_count': 0,
+          'status_dict': {},
+          'bytes': 0,
+          'total_sec': 0.0,
+          'max_sec': 0.0,
+          'ttfb_bucket_counts': [0] * (len(self._buckets) + 1),
+          'total_bucket_counts': [0] * (len(self._buckets) + 1),
+        }
+      endpoint['count'] += 1
+      if status is None or status >= 400:
+        endpoint['error_count'] += 1
+      status_str = 'error' if status is None else str(status)
+      endpoint['status_dict'][status_str] = (
+        endpoint['status_dict'].get(status_str, 0) + 1
+      )
+      endpoint['bytes'] += byte_count
+      endpoint['total_sec'] += total_sec
+      endpoint['max_sec'] = max(endpoint['max_sec'], total_sec)
+      endpoint['ttfb_bucket_counts'][self._find_bucket(ttfb_sec)] += 1
+      endpoint['total_bucket_counts'][self._find_bucket(total_sec)] += 1
+
+  def get_summary(self):
+    """Return a list with a dict for each endpoint, holding the call count,
+    statuses, bytes, and time to first byte and total time percentiles, slowest
+    endpoints first. The percentiles are the upper bounds of the histogram
+    buckets that hold them."""
+    with self._lock:
+      endpoint_list = [dict(e) for e in self._endpoint_dict.values()]
+    for endpoint in endpoint_list:
+      endpoint['status_dict'] = dict(endpoint['status_dict'])
+      for kind in 'ttfb', 'total':
+        bucket_counts = endpoint.pop('{}_bucket_counts'.format(kind))
+        for q in 50, 90, 99:
+          endpoint['{}_p{}_sec'.format(kind, q)] = self._find_quantile(
+            bucket_counts, endpoint['count'], q / 100, endpoint['max_sec']
+          )
+    return sorted(endpoint_list, key=lambda e: e['total_sec'], reverse=True)
+
+  def log_summary(self):
+    endpoint_list = self.get_summary()
+    if not endpoint_list:
+      return
+    logging.info(
+      'HTTP trace summary. calls={} endpoints={} total_sec={:.2f}'.format(
+        sum(e['count'] for e in endpoint_list), len(endpoint_list),
+        sum(e['total_sec'] for e in endpoint_list)
+      )
+    )
+    for e in endpoint_list:
+      logging.info(
+        '{} {} calls={} errors={} status={} bytes={} total_sec={:.2f} '
+        'ttfb_p50<={} total_p50<={} total_p90<={} total_p99<={} '
+        'max={:.3f}'.format(
+          e['method'], e['url_template'], e['count'], e['error_count'],
+          ','.join(
+            '{}:{}'.format(k, v) for k, v in sorted(e['status_dict'].items())
+          ), e['bytes'], e['total_sec'], e['ttfb_p50_sec'], e['total_p50_sec'],
+          e['total_p90_sec'], e['total_p99_sec'], e['max_sec']
+        )
+      )
+
+  def reset(self):
+    with self._lock:
+      self._endpoint_dict.clear()
+
+  def _find_bucket(self, sec):
+    """Return the index of the bucket for {sec}. The last bucket holds the
+    values above the largest bound."""
+    for i, upper_bound in enumerate(self._buckets):
+      if sec <= upper_bound:
+        return i
+    return len(self._buckets)
+
+  def _find_quantile(self, bucket_counts, count, q, max_sec):
+    cumulative_count = 0
+    for i, bucket_count in enumerate(bucket_counts):
+      cumulative_count += bucket_count
+      if cumulative_count >= q * count:
+        return self._buckets[i] if i < len(self._buckets) else max_sec
+    return max_sec
+
+
+tracer = Tracer()
+
+
+def install():
+  """Trace all calls made through Requests in this process, and log the summary
+  when the process exits. Calling install() again has no effect."""
+  global _original_send
+  # Imported here so that importing this module is cheap when tracing is off.
+  import requests.adapters
+  if _original_send is not None:
+    return
+  _original_send = requests.adapters.HTTPAdapter.send
+  requests.adapters.HTTPAdapter.send = _traced_send
+  atexit.register(_log_summary_at_exit)
+
+
+def install_if_enabled():
+  """Call install() if tracing is enabled in the environment."""
+  if is_enabled_in_environment():
+    install()
+
+
+def uninstall():
+  global _original_send
+  import requests.adapters
+  if _original_send is None:
+    return
+  requests.adapters.HTTPAdapter.send = _original_send
+  _original_send = None
+
+
+def _log_summary_at_exit():
+  if _original_send is not None:
+    tracer.log_summary()
+
+
+def is_enabled_in_environment():
+  return os.environ.get(ENABLE_ENV, '').lower() in ('1', 'true', 'yes')
+
+
+def template_url(url):
+  """Return {url} with the parts that vary between calls to the same endpoint,
+  such as identifiers, replaced by placeholders."""
+  url_tup = urlparse.urlsplit(url)
+  path = url_tup.path
+  m = D1_RESOURCE_RX.match(path)
+  if m:
+    path = m.group(1) + '/{pid}'
+  else:
+    path = '/'.join(_template_path_element_list(path.split('/')))
+  query_list = sorted(
+    (k if k not in OPERATION_PARAM_SET else '{}={}'.format(k, v))
+    for k, v in urlparse.parse_qsl(url_tup.query, keep_blank_values=True)
+  )
+  return '{}://{}{}{}'.format(
+    url_tup.scheme, url_tup.netloc, path,
+    '?' + '&'.join(query_list) if query_list else ''
+  )
+
+
+def _template_path_element_list(element_list):
+  template_list = []
+  pasta_name_iter = None
+  for element in element_list:
+    if pasta_name_iter is not None:
+      template_list.append('{{{}}}'.format(next(pasta_name_iter, 'id')))
+    elif NUMBER_RX.match(element):
+      template_list.append('{n}')
+    elif ID_RX.match(element):
+      template_list.append('{id}')
+    else:
+      template_list.append(element)
+    if element == 'eml' and pasta_name_iter is None:
+      pasta_name_iter = iter(PASTA_PATH_NAME_LIST)
+  return template_list
+
+
+def _traced_send(adapter, request, *args, **kwargs):
+  call = _Call(request.method, template_url(request.url))
+  try:
+    response = _original_send(adapter, request, *args, **kwargs)
+  except Exception:
+    call.finish()
+    raise
+  call.first_byte(response.status_code)
+  if response.raw is None:
+    call.finish()
+  else:
+    response.raw = _TracedRaw(response.raw, call)
+  return response
+
+
+class _Call(object):
+  def __init__(self, method, url_template):
+    self._method = method
+    self._url_template = url_template
+    self._start_sec = time.time()
+    self._ttfb_sec = None
+    self._status = None
+    self._byte_count = 0
+    self._is_finished = False
+
+  def first_byte(self, status):
+    self._ttfb_sec = time.time() - self._start_sec
+    self._status = status
+
+  def add_bytes(self, byte_count):
+    self._byte_count += byte_count
+
+  def finish(self):
+    if self._is_finished:
+      return
+    self._is_finished = True
+    total_sec = time.time() - self._start_sec
+    tracer.record(
+      self._method, self._url_template, self._status, self._byte_count,
+      total_sec if self._ttfb_sec is None else self._ttfb_sec, total_sec
+    )
+
+
+class _TracedRaw(object):
+  """Wrap the urllib3 response, to count the bytes in the body, and to finish
+  the call when the body has been read or the response is closed."""
+
+  def __init__(self, raw, call):
+    self._raw = raw
+    self._call = call
+
+  def stream(self, *args, **kwargs):
+    try:
+      for chunk in self._raw.stream(*args, **kwargs):
+        self._call.add_bytes(len(chunk))
+        yield chunk
+    finally:
+      self._call.finish()
+
+  def read(self, amt=None, *args, **kwargs):
+    data = self._raw.read(amt, *args, **kwargs)
+    self._call.add_bytes(len(data or b''))
+    if amt is None or not data:
+      self._call.finish()
+    return data
+
+  def close(self):
+    self._call.finish()
+    return self._raw.close()
+
+  def release_conn(self):
+    self._call.finish()
+    return self._raw.release_conn()
+
+  def __iter__(self):
+    return iter(self.stream())
+
+  def __getattr__(self, name):
+    return getattr(self._raw, name)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lazy formatting of log message arguments
+
+Dumps of records and System Metadata written with, e.g.,
+
+  logging.debug(pprint.pformat(record_dict))
+
+are formatted for every record, even when the debug level is disabled. The
+wrappers in this module defer the formatting until the log record is emitted,
+so a dump that is filtered out by the log level costs only the creation of the
+wrapper:
+
+  logging.debug('record=%s', connector_util.lazy_log.pformat(record_dict))
+
+The wrappers must be passed as arguments to the logging call. Formatting them
+into the message with str.format() or % defeats the purpose.
+
+To compare the cost per object of the debug dumps in the PASTA adapter's
+_generate_sys_meta_for_object(), formatted eagerly and lazily, with the log
+level at INFO:
+
+  $ python -m connector_util.lazy_log --benchmark
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+import pprint
+import sys
+import timeit
+
+# Default number of characters of a value that are included by truncated().
+DEFAULT_MAX_LEN = 1000
+# Default number of objects for which the dumps are timed by --benchmark.
+DEFAULT_BENCHMARK_COUNT = 10000
+
+
+class Lazy(object):
+  """Call {fn} with the given arguments when the wrapper is formatted, and
+  format the returned value."""
+  __slots__ = ('_fn', '_args', '_kwargs')
+
+  def __init__(self, fn, *args, **kwargs):
+    self._fn = fn
+    self._args = args
+    self._kwargs = kwargs
+
+  def __str__(self):
+    return _to_str(self._fn(*self._args, **self._kwargs))
+
+  __repr__ = __str__
+
+
+def call(fn, *args, **kwargs):
+  """Defer {fn}(*args, **kwargs) until the log record is emitted."""
+  return Lazy(fn, *args, **kwargs)
+
+
+def pformat(obj):
+  """Defer pprint.pformat({obj}) until the log record is emitted."""
+  return Lazy(pprint.pformat, obj)
+
+
+def truncated(value, max_len=DEFAULT_MAX_LEN):
+  """Defer formatting {value}, and include only its first {max_len}
+  characters. For dumps of objects that may be large, such as Science Objects.
+  """
+  return Lazy(_truncate, value, max_len)
+
+
+def _truncate(value, max_len):
+  # Large bytes values are cut before they are decoded.
+  if isinstance(value, bytes) and len(value) > max_len:
+    return '{}... ({} bytes total)'.format(
+      _to_str(value[:max_len]), len(value)
+    )
+  s = _to_str(value)
+  if len(s) <= max_len:
+    return s
+  return '{}... ({} characters total)'.format(s[:max_len], len(s))
+
+
+def _to_str(value):
+  """Bytes, such as serialized XML, are decoded so that they are logged as text
+  instead of as a bytes literal on Python 3."""
+  if isinstance(value, bytes) and not isinstance(value, str):
+    return value.decode('utf-8', 'replace')
+  return str(value)
+
+
+# ------------------------------------------------------------------------------
+
+
+def benchmark(count=DEFAULT_BENCHMARK_COUNT):
+  """Return the time per object, in seconds, of the debug dumps of an object
+  and its Science Object, as an (eager_sec, lazy_sec) tuple. The dumps are
+  filtered out by the log level, as in production.
+
+  The eager dumps are those that _generate_sys_meta_for_object() wrote before
+  it used the wrappers: pprint.pformat() of the object_meta and of its header,
+  and the Science Object. The object_meta is a typical one for a data entity,
+  with the access rules as a list in place of the EMLAccess object.
+  """
+  object_meta = {
+    'resource_id':
+      'https://pasta.lternet.edu/package/data/eml/knb-lter-nin/6/1/'
+      '0123456789abcdef0123456789abcdef',
+    'header': {
+      'content-type': 'text/csv',
+      'content-length': '102400',
+      'content-disposition': 'attachment; filename=table.csv',
+    },
+    'permissions': [
+      ('uid=dcosta,o=LTER,dc=ecoinformatics,dc=org', 'changePermission'),
+      ('uid=NIN,o=lter,dc=ecoinformatics,dc=org', 'changePermission'),
+      ('public', 'read'),
+    ],
+    'checksum': '0123456789abcdef0123456789abcdef01234567',
+    'format_id': 'text/csv',
+    'd1_replication_policy': b'<replicationPolicy replicationAllowed="false"/>',
+  }
+  sci_obj = b'1,2,3,4,5,6,7,8,9,10\n' * 5000
+  logger = logging.getLogger(__name__ + '.benchmark')
+  logger.setLevel(logging.INFO)
+
+  def eager():
+    logger.debug(pprint.pformat(object_meta))
+    logger.debug(pprint.pformat(object_meta['header']))
+    logger.debug(sci_obj)
+
+  def lazy():
+    logger.debug('object_meta=%s', pformat(object_meta))
+    logger.debug('sci_obj=%s', truncated(sci_obj))
+
+  return (
+    timeit.timeit(eager, number=count) / count,
+    timeit.timeit(lazy, number=count) / count,
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+  )
+  parser.add_argument(
+    '--benchmark', action='store_true',
+    help='Print the cost per object of the debug dumps, eager and lazy'
+  )
+  parser.add_argument(
+    '--count', type=int, default=DEFAULT_BENCHMARK_COUNT,
+    help='Number of objects to time'
+  )
+  args = parser.parse_args()
+  if not args.benchmark:
+    parser.error('Nothing to do. Use --benchmark')
+
+  eager_sec, lazy_sec = benchmark(args.count)
+  print(
+    'Debug dumps at INFO level, per object: eager: {:.2f} usec, lazy: {:.2f} '
+    'usec, {:.1f}x'.format(
+      eager_sec * 1000000, lazy_sec * 1000000, eager_sec / lazy_sec
+    )
+  )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Record each connector run in a shared, local SQLite ledger
+
+Each run is recorded with the connector and node it ran for, its start and end
+times, how many records it saw, created, updated, skipped and failed, the number
+of requests made to the native repository and the number of bytes received, and
+the time spent in each phase of the run.
+
+All connectors on a host write to the same ledger file, set by the
+CONNECTOR_RUN_LEDGER_PATH environment variable, or ~/connector_run_ledger.sqlite
+by default. A failure to write to the ledger is logged, and does not stop the
+run.
+
+Usage in a connector:
+
+  import connector_util.run_ledger
+
+  with connector_util.run_ledger.record_run('r2r', 'urn:node:mnTestR2R') as run:
+    with run.phase('list'):
+      page_bytes = get_page()
+    run.add_request(len(page_bytes))
+    for record in parse_page(page_bytes):
+      run.count('seen')
+      ...
+      run.count('created')
+
+The run is recorded as "running" when it starts, and as "completed" or "failed"
+when the with block exits. A run that is still "running" after the connector
+has exited was killed.
+
+To print throughput trends and flag slow runs:
+
+  $ python -m connector_util.run_ledger --connector r2r --runs 20
+
+A completed run is flagged as slow if the number of records seen per second is
+less than the median of the previous runs of the same connector and node by more
+than --slow-factor. For runs that saw no records, the durations are compared
+instead. With --check, the exit status is 1 if the latest run of any connector
+and node failed or was slow, for use from cron or a monitoring system.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import contextlib
+import datetime
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+LEDGER_PATH_ENV = 'CONNECTOR_RUN_LEDGER_PATH'
+DEFAULT_LEDGER_PATH = '~/connector_run_ledger.sqlite'
+
+COUNTER_LIST = ['seen', 'created', 'updated', 'skipped', 'failed']
+
+# Connectors on the same host may write to the ledger at the same time.
+SQLITE_TIMEOUT_SEC = 30
+
+DEFAULT_RUN_COUNT = 20
+DEFAULT_WINDOW = 10
+DEFAULT_SLOW_FACTOR = 2.0
+# Runs are not flagged until there are this many previous runs to compare to.
+MIN_BASELINE_RUN_COUNT = 3
+
+SCHEMA_SQL = """
+create table if not exists run (
+  id integer primary key,
+  connector text not null,
+  node text not null,
+  start_time real not null,
+  end_time real,
+  status text not null,
+  seen integer not null default 0,
+  created integer not null default 0,
+  updated integer not null default 0,
+  skipped integer not null default 0,
+  failed integer not null default 0,
+  bytes integer not null default 0,
+  requests integer not null default 0,
+  error text
+);
+create index if not exists run_connector_node_start_time
+  on run (connector, node, start_time);
+create table if not exists run_phase (
+  run_id integer not null references run (id),
+  phase text not null,
+  seconds real not null,
+  primary key (run_id, phase)
+);
+"""
+
+
+@contextlib.contextmanager
+def record_run(connector, node, ledger_path=None):
+  """Record a run of {connector} for {node} in the ledger. Yields a Run, for
+  counting records, requests and bytes, and timing phases."""
+  run = Run(connector, node, ledger_path)
+  run.start()
+  try:
+    yield run
+  except BaseException as e:
+    run.finish(error=repr(e))
+    raise
+  else:
+    run.finish()
+
+
+class Run(object):
+  def __init__(self, connector, node, ledger_path=None):
+    self.connector = connector
+    self.node = node
+    self.ledger_path = get_ledger_path(ledger_path)
+    self.counter_dict = dict.fromkeys(COUNTER_LIST, 0)
+    self.bytes = 0
+    self.requests = 0
+    self.phase_dict = {}
+    self.start_time = None
+    self.end_time = None
+    self.status = None
+    self.error = None
+    self._run_id = None
+
+  def count(self, counter, n=1):
+    """Add {n} to {counter}, which is one of COUNTER_LIST."""
+    if counter not in self.counter_dict:
+      raise ValueError(
+        'Unknown counter. counter="{}" valid="{}"'.format(
+          counter, ', '.join(COUNTER_LIST)
+        )
+      )
+    self.counter_dict[counter] += n
+
+  def add_request(self, byte_count=0):
+    """Record a request to the native repository that returned {byte_count}
+    bytes."""
+    self.requests += 1
+    self.bytes += byte_count
+
+  def add_bytes(self, byte_count):
+    """Record {byte_count} bytes transferred without a request to the native
+    repository, e.g., read from a local cache of its content."""
+    self.bytes += byte_count
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """Add the time spent in the with block to phase {name}. A phase can be
+    entered any number of times during a run."""
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.phase_dict[name] = (
+        self.phase_dict.get(name, 0.0) + time.time() - start_time
+      )
+
+  def start(self):
+    self.start_time = time.time()
+    self.status = 'running'
+    try:
+      with _connect(self.ledger_path) as connection:
+        self._run_id = connection.execute(
+          'insert into run (connector, node, start_time, status) '
+          'values (?, ?, ?, ?)',
+          (self.connector, self.node, self.start_time, self.status)
+        ).lastrowid
+    except (sqlite3.Error, EnvironmentError) as e:
+      logging.error(
+        'Unable to record run start in ledger. path="{}" error="{}"'.format(
+          self.ledger_path, str(e)
+        )
+      )
+
+  def finish(self, error=None):
+    self.end_time = time.time()
+    self.status = 'completed' if error is None else 'failed'
+    self.error = error
+    if self._run_id is None:
+      return
+    try:
+      with _connect(self.ledger_path) as connection:
+        connection.execute(
+          'update run set end_time = ?, status = ?, seen = ?, created = ?, '
+          'updated = ?, skipped = ?, failed = ?, bytes = ?, requests = ?, '
+          'error = ? where id = ?', [self.end_time, self.status] +
+          [self.counter_dict[c] for c in COUNTER_LIST] +
+          [self.bytes, self.requests, self.error, self._run_id]
+        )
+        connection.executemany(
+          'insert or replace into run_phase (run_id, phase, seconds) '
+          'values (?, ?, ?)',
+          [(self._run_id, k, v) for k, v in self.phase_dict.items()]
+        )
+    except (sqlite3.Error, EnvironmentError) as e:
+      logging.error(
+        'Unable to record run end in ledger. path="{}" error="{}"'.format(
+          self.ledger_path, str(e)
+        )
+      )
+
+
+def get_ledger_path(ledger_path=None):
+  return os.path.expanduser(
+    ledger_path or os.environ.get(LEDGER_PATH_ENV) or DEFAULT_LEDGER_PATH
+  )
+
+
+# ------------------------------------------------------------------------------
+
+
+def select_runs(ledger_path=None, connector=None, node=None, run_count=None):
+  """Return the latest {run_count} runs, optionally limited to {connector} and
+  {node}, oldest first. Each run is a dict holding the columns of the run table,
+  and a phase_dict of the seconds spent in each phase."""
+  where_list = []
+  arg_list = []
+  if connector is not None:
+    where_list.append('connector = ?')
+    arg_list.append(connector)
+  if node is not None:
+    where_list.append('node = ?')
+    arg_list.append(node)
+  sql = 'select * from run'
+  if where_list:
+    sql += ' where ' + ' and '.join(where_list)
+  sql += ' order by start_time desc, id desc'
+  if run_count is not None:
+    sql += ' limit ?'
+    arg_list.append(run_count)
+  with _connect(get_ledger_path(ledger_path)) as connection:
+    run_list = [dict(row) for row in connection.execute(sql, arg_list)]
+    for run_dict in run_list:
+      run_dict['phase_dict'] = dict(
+        connection.execute(
+          'select phase, seconds from run_phase where run_id = ?',
+          (run_dict['id'], )
+        ).fetchall()
+      )
+  return list(reversed(run_list))
+
+
+def find_slow_runs(
+    run_list, window=DEFAULT_WINDOW, slow_factor=DEFAULT_SLOW_FACTOR
+):
+  """Return a dict of run ID to the reason the run was flagged as slow, for the
+  completed runs in {run_list}. Each run is compared with the {window} previous
+  completed runs of the same connector and node."""
+  slow_dict = {}
+  history_dict = {}
+  for run_dict in run_list:
+    if run_dict['status'] != 'completed':
+      continue
+    history_list = history_dict.setdefault(
+      (run_dict['connector'], run_dict['node']), []
+    )
+    baseline_list = history_list[-window:]
+    history_list.append(run_dict)
+    if len(baseline_list) < MIN_BASELINE_RUN_COUNT:
+      continue
+    if run_dict['seen']:
+      median_rate = median([get_rate(r) for r in baseline_list])
+      if get_rate(run_dict) * slow_factor < median_rate:
+        slow_dict[run_dict['id']] = (
+          '{:.2f} records/s, median {:.2f} records/s'.format(
+            get_rate(run_dict), median_rate
+          )
+        )
+    else:
+      median_duration = median([get_duration(r) for r in baseline_list])
+      if get_duration(run_dict) > median_duration * slow_factor:
+        slow_dict[run_dict['id']] = '{:.1f} s, median {:.1f} s'.format(
+          get_duration(run_dict), median_duration
+        )
+  return slow_dict
+
+
+def get_duration(run_dict):
+  return max((run_dict['end_time'] or time.time()) - run_dict['start_time'], 0)
+
+
+def get_rate(run_dict):
+  """Return the number of records seen per second."""
+  duration = get_duration(run_dict)
+  return run_dict['seen'] / duration if duration else 0.0
+
+
+def median(value_list):
+  value_list = sorted(value_list)
+  i = len(value_list) // 2
+  if len(value_list) % 2:
+    return value_list[i]
+  return (value_list[i - 1] + value_list[i]) / 2
+
+
+# ------------------------------------------------------------------------------
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+  )
+  parser.add_argument(
+    '--ledger-path', help='Ledger file (default: ${} or {})'.format(
+      LEDGER_PATH_ENV, DEFAULT_LEDGER_PATH
+    )
+  )
+  parser.add_argument('--connector', help='Show only runs of this connector')
+  parser.add_argument('--node', help='Show only runs for this node')
+  parser.add_argument(
+    '--runs', type=int, default=DEFAULT_RUN_COUNT,
+    help='Number of runs to show for each connector and node'
+  )
+  parser.add_argument(
+    '--window', type=int, default=DEFAULT_WINDOW,
+    help='Number of previous runs to compare each run with'
+  )
+  parser.add_argument(
+    '--slow-factor', type=float, default=DEFAULT_SLOW_FACTOR,
+    help='Flag runs that are this many times slower than the median'
+  )
+  parser.add_argument(
+    '--check', action='store_true',
+    help='Exit with status 1 if the latest run of any connector and node '
+    'failed or was slow'
+  )
+  args = parser.parse_args()
+
+  ledger_path = get_ledger_path(args.ledger_path)
+  if not os.path.exists(ledger_path):
+    print('No runs recorded. path="{}"'.format(ledger_path))
+    return 0
+
+  # All runs are read, so that the oldest shown run is compared with a full
+  # window of earlier runs.
+  run_list = select_runs(ledger_path, args.connector, args.node)
+  slow_dict = find_slow_runs(run_list, args.window, args.slow_factor)
+  group_dict = {}
+  for run_dict in run_list:
+    group_dict.setdefault(
+      (run_dict['connector'], run_dict['node']), []
+    ).append(run_dict)
+
+  is_ok = True
+  for (connector, node), group_list in sorted(group_dict.items()):
+    print_group(connector, node, group_list[-args.runs:], slow_dict)
+    latest_dict = group_list[-1]
+    if latest_dict['status'] == 'failed' or latest_dict['id'] in slow_dict:
+      is_ok = False
+  return 0 if is_ok or not args.check else 1
+
+
+def print_group(connector, node, run_list, slow_dict):
+  print('{} {}'.format(connector, node))
+  print(
+    '  {:<19} {:<9} {:>8} {:>7} {:>7} {:>7} {:>7} {:>7} {:>9} {:>9} {:>8}'.
+    format(
+      'Start (UTC)', 'Status', 'Sec', 'Seen', 'Created', 'Updated', 'Skipped',
+      'Failed', 'Rec/s', 'KiB/s', 'Requests'
+    )
+  )
+  for run_dict in run_list:
+    duration = get_duration(run_dict)
+    print(
+      '  {:<19} {:<9} {:>8.1f} {:>7} {:>7} {:>7} {:>7} {:>7} {:>9.2f} {:>9.1f} '
+      '{:>8}{}'.format(
+        datetime.datetime.utcfromtimestamp(run_dict['start_time']
+                                           ).strftime('%Y-%m-%d %H:%M:%S'),
+        run_dict['status'], duration, run_dict['seen'], run_dict['created'],
+        run_dict['updated'], run_dict['skipped'], run_dict['failed'],
+        get_rate(run_dict), run_dict['bytes'] / 1024 / duration
+        if duration else 0.0, run_dict['requests'],
+        format_flag(run_dict, slow_dict)
+      )
+    )
+  completed_list = [r for r in run_list if r['status'] == 'completed']
+  if len(completed_list) >= 2:
+    print(
+      '  Trend: median {:.2f} records/s, latest {:.2f} records/s'.format(
+        median([get_rate(r) for r in completed_list]),
+        get_rate(completed_list[-1])
+      )
+    )
+  print()
+
+
+def format_flag(run_dict, slow_dict):
+  if run_dict['status'] == 'failed':
+    return '  FAILED: {}'.format(run_dict['error'])
+  if run_dict['id'] not in slow_dict:
+    return ''
+  flag_str = '  SLOW: {}'.format(slow_dict[run_dict['id']])
+  if run_dict['phase_dict']:
+    phase, seconds = max(
+      run_dict['phase_dict'].items(), key=lambda phase_tup: phase_tup[1]
+    )
+    flag_str += ', longest phase: {} {:.1f} s'.format(phase, seconds)
+  return flag_str
+
+
+@contextlib.contextmanager
+def _connect(ledger_path):
+  """Open the ledger, creating it if required, and commit on exit."""
+  connection = sqlite3.connect(ledger_path, timeout=SQLITE_TIMEOUT_SEC)
+  try:
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA_SQL)
+    with connection:
+      yield connection
+  finally:
+    connection.close()
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Spooled uploads of Science Objects to GMN
+
+A SpooledUpload holds a Science Object while it is uploaded to GMN. The object
+is written to the upload in chunks, e.g., as it is downloaded from the native
+repository, and the checksum and size are computed as the chunks are written,
+so the object is not read again to generate the System Metadata. Objects up to
+max_memory_size bytes are held in memory. Larger objects are spooled to a
+temporary file, so the memory used for each object stays bounded.
+
+When the object has been written, the upload is rewound and passed to the
+DataONE client as the file-like object to upload:
+
+  with connector_util.spooled_upload.from_response(response) as upload:
+    sysmeta_pyxb.size = upload.size
+    sysmeta_pyxb.checksum = dataoneTypes.checksum(upload.checksum)
+    sysmeta_pyxb.checksum.algorithm = upload.algorithm
+    client.create(pid, upload, sysmeta_pyxb)
+
+The temporary file, if any, is deleted when the upload is closed.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import tempfile
+
+DEFAULT_ALGORITHM = 'SHA-1'
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# Objects larger than this are spooled to disk.
+DEFAULT_MAX_MEMORY_SIZE = 1024 * 1024
+
+# DataONE checksum algorithm names to hashlib names.
+ALGORITHM_DICT = {
+  'MD5': 'md5',
+  'SHA-1': 'sha1',
+  'SHA-224': 'sha224',
+  'SHA-256': 'sha256',
+  'SHA-384': 'sha384',
+  'SHA-512': 'sha512',
+}
+
+
+class SpooledUpload(object):
+  def __init__(
+      self, algorithm=DEFAULT_ALGORITHM, max_memory_size=DEFAULT_MAX_MEMORY_SIZE
+  ):
+    """{algorithm} is the DataONE name of the checksum algorithm, e.g.,
+    "MD5"."""
+    if algorithm not in ALGORITHM_DICT:
+      raise ValueError(
+        'Unsupported checksum algorithm. algorithm="{}"'.format(algorithm)
+      )
+    self.algorithm = algorithm
+    self.size = 0
+    self._hash = hashlib.new(ALGORITHM_DICT[algorithm])
+    self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  @property
+  def checksum(self):
+    """Hex digest of the bytes written so far."""
+    return self._hash.hexdigest()
+
+  @property
+  def len(self):
+    """Number of bytes left to read. The multipart encoder used by the DataONE
+    client reads the length of a file-like object from this attribute, and
+    would otherwise call fileno(), which moves an object that is held in memory
+    to disk."""
+    return self.size - self._file.tell()
+
+  @property
+  def is_on_disk(self):
+    return self._file._rolled
+
+  def write(self, data):
+    """Append {data} to the object. Text is encoded to UTF-8."""
+    if not isinstance(data, bytes):
+      data = data.encode('utf-8')
+    self._hash.update(data)
+    self._file.write(data)
+    self.size += len(data)
+
+  def write_chunks(self, chunk_iter):
+    for chunk in chunk_iter:
+      if chunk:
+        self.write(chunk)
+
+  def write_stream(self, flo, chunk_size=DEFAULT_CHUNK_SIZE):
+    self.write_chunks(iter(lambda: flo.read(chunk_size), b''))
+
+  def write_text(self, text, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Append {text}, encoded to UTF-8 one chunk at a time, so that a second
+    copy of a large document is not created in memory."""
+    for i in range(0, len(text), chunk_size):
+      self.write(text[i:i + chunk_size])
+
+  def rewind(self):
+    """Move to the start of the object, for reading. Must be called after
+    the object has been written, and before each upload of the object."""
+    self._file.seek(0)
+    return self
+
+  def read(self, size=-1):
+    return self._file.read(size)
+
+  def seek(self, offset, whence=0):
+    return self._file.seek(offset, whence)
+
+  def tell(self):
+    return self._file.tell()
+
+  def close(self):
+    self._file.close()
+
+
+def from_chunks(chunk_iter, algorithm=DEFAULT_ALGORITHM, **kwargs):
+  """Spool the bytes from an iterator, e.g., Response.iter_content()."""
+  upload = SpooledUpload(algorithm, **kwargs)
+  upload.write_chunks(chunk_iter)
+  return upload.rewind()
+
+
+def from_response(
+    response, algorithm=DEFAULT_ALGORITHM, chunk_size=DEFAULT_CHUNK_SIZE,
+    **kwargs
+):
+  """Spool the body of a Requests response. The request must have been made
+  with stream=True for the body to be streamed."""
+  return from_chunks(response.iter_content(chunk_size), algorithm, **kwargs)
+
+
+def from_stream(
+    flo, algorithm=DEFAULT_ALGORITHM, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs
+):
+  upload = SpooledUpload(algorithm, **kwargs)
+  upload.write_stream(flo, chunk_size)
+  return upload.rewind()
+
+
+def from_text(text, algorithm=DEFAULT_ALGORITHM, **kwargs):
+  """Spool {text} encoded to UTF-8."""
+  upload = SpooledUpload(algorithm, **kwargs)
+  upload.write_text(text)
+  return upload.rewind()
+
+
+def from_dom(dom, algorithm=DEFAULT_ALGORITHM, indent='\t', newl='\n', **kwargs):
+  """Spool the minidom Document {dom}. The bytes are the same as from
+  dom.toprettyxml(indent, newl, encoding='utf-8'), but the document is written
+  directly to the upload instead of to a string."""
+  upload = SpooledUpload(algorithm, **kwargs)
+  dom.writexml(upload, '', indent, newl, 'utf-8')
+  return upload.rewind()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""System Metadata rendered from a precompiled template
+
+Building System Metadata with the pyxb bindings creates and validates a binding
+object for each element, which is a noticeable part of the CPU time of a
+harvest. Most of the System Metadata is the same for every object created by a
+connector: the rights holder, submitter, Member Nodes, often the format ID and
+the access policy. A SysMetaTemplate renders these fields to XML once, when the
+template is created, and then renders only the fields that differ between
+objects, such as the identifier, size and checksum:
+
+  template = SysMetaTemplate(
+    formatId='eml://ecoinformatics.org/eml-2.1.1',
+    rightsHolder=RIGHTS_HOLDER,
+    submitter=SUBMITTER,
+    authoritativeMemberNode=NODE_ID,
+    originMemberNode=NODE_ID,
+    accessPolicy=PUBLIC_READ_ACCESS_POLICY,
+  )
+  sysmeta = template.create(
+    identifier=pid, size=size, checksum=('SHA-1', checksum),
+    dateUploaded=date_uploaded, dateSysMetadataModified=now,
+  )
+  client.create(pid, sciobj_flo, sysmeta)
+
+The DataONE client serializes System Metadata with toxml('utf-8'), so the
+object returned by create() can be passed to it in place of the pyxb binding.
+
+The values are rendered in the same lexical form as the pyxb bindings use, so
+the document is the same as from the bindings after canonicalization. The
+replica element is not supported.
+
+Values:
+  - checksum: (algorithm, hex value) tuple
+  - accessPolicy: List of (subject_list, permission_list) tuples, one for each
+    allow rule
+  - replicationPolicy: Dict with the optional keys replicationAllowed (bool),
+    numberReplicas (int), preferredMemberNode and blockedMemberNode (lists of
+    node IDs)
+  - dateUploaded, dateSysMetadataModified: datetime. A datetime with a time
+    zone is rendered in UTC.
+  - archived: bool
+  - mediaType: Media type name
+  - Other fields: str or int
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import xml.sax.saxutils
+
+try:
+  _TEXT_TYPE = unicode
+except NameError:
+  _TEXT_TYPE = str
+
+V1_NAMESPACE = 'http://ns.dataone.org/service/types/v1'
+V2_NAMESPACE = 'http://ns.dataone.org/service/types/v2.0'
+
+# Elements of SystemMetadata, in schema order. The last 3 were added in v2.
+FIELD_LIST = [
+  'serialVersion',
+  'identifier',
+  'formatId',
+  'size',
+  'checksum',
+  'submitter',
+  'rightsHolder',
+  'accessPolicy',
+  'replicationPolicy',
+  'obsoletes',
+  'obsoletedBy',
+  'archived',
+  'dateUploaded',
+  'dateSysMetadataModified',
+  'originMemberNode',
+  'authoritativeMemberNode',
+  'seriesId',
+  'mediaType',
+  'fileName',
+]
+V2_FIELD_SET = {'seriesId', 'mediaType', 'fileName'}
+
+PUBLIC_READ_ACCESS_POLICY = [(['public'], ['read'])]
+
+# Same prolog and root as from toxml('utf-8') on a pyxb binding.
+PROLOG = u'<?xml version="1.0" encoding="utf-8"?>'
+
+
+class SysMeta(object):
+  """System Metadata rendered by a SysMetaTemplate. Can be passed to the
+  DataONE client in place of a pyxb binding."""
+
+  def __init__(self, sysmeta_xml):
+    self._sysmeta_xml = sysmeta_xml
+
+  def toxml(self, encoding=None):
+    """Return the document as UTF-8 bytes, or as text if {encoding} is None."""
+    if encoding is None:
+      return self._sysmeta_xml.decode('utf-8')
+    if encoding.lower() != 'utf-8':
+      raise ValueError('Unsupported encoding. encoding="{}"'.format(encoding))
+    return self._sysmeta_xml
+
+
+class SysMetaTemplate(object):
+  def __init__(self, namespace=V2_NAMESPACE, **static_field_dict):
+    """{static_field_dict} holds the fields that are the same for every object,
+    which are rendered only once."""
+    _check_field_names(namespace, static_field_dict)
+    self.namespace = namespace
+    self.static_field_dict = static_field_dict
+    # Compile the template to a list of alternating literal XML and field names,
+    # starting and ending with literal XML.
+    self._segment_list = []
+    literal_list = [
+      PROLOG, u'<ns1:systemMetadata xmlns:ns1={}>'.format(
+        xml.sax.saxutils.quoteattr(namespace)
+      )
+    ]
+    for field_name in FIELD_LIST:
+      if field_name in V2_FIELD_SET and namespace != V2_NAMESPACE:
+        continue
+      if field_name in static_field_dict:
+        literal_list.append(
+          render_field(field_name, static_field_dict[field_name])
+        )
+      else:
+        self._segment_list.append(u''.join(literal_list))
+        self._segment_list.append(field_name)
+        literal_list = []
+    literal_list.append(u'</ns1:systemMetadata>')
+    self._segment_list.append(u''.join(literal_list))
+
+  def render(self, **field_dict):
+    """Return the System Metadata XML document as UTF-8 bytes. {field_dict}
+    holds the fields for this object. Fields that are missing or None are
+    omitted."""
+    _check_field_names(self.namespace, field_dict)
+    duplicate_set = set(field_dict) & set(self.static_field_dict)
+    if duplicate_set:
+      raise ValueError(
+        'Fields are already set in the template. fields="{}"'.format(
+          ', '.join(sorted(duplicate_set))
+        )
+      )
+    segment_list = self._segment_list
+    xml_list = [segment_list[0]]
+    for i in range(1, len(segment_list), 2):
+      field_name = segment_list[i]
+      xml_list.append(render_field(field_name, field_dict.get(field_name)))
+      xml_list.append(segment_list[i + 1])
+    return u''.join(xml_list).encode('utf-8')
+
+  def create(self, **field_dict):
+    """Return the System Metadata as a SysMeta object."""
+    return SysMeta(self.render(**field_dict))
+
+
+def render_field(field_name, value):
+  """Return the XML element for a System Metadata field."""
+  if value is None:
+    return u''
+  return _RENDER_DICT.get(field_name, _render_text)(field_name, value)
+
+
+def format_datetime(dt):
+  """Format a datetime as the pyxb xs:dateTime binding does. A datetime with a
+  time zone is converted to UTC."""
+  suffix = u''
+  if dt.tzinfo is not None and dt.utcoffset() is not None:
+    dt = (dt - dt.utcoffset()).replace(tzinfo=None)
+    suffix = u'Z'
+  iso_str = _to_text(dt.isoformat())
+  if u'.' in iso_str:
+    iso_str = iso_str.rstrip(u'0')
+  return iso_str + suffix
+
+
+def _check_field_names(namespace, field_dict):
+  unknown_set = set(field_dict) - set(FIELD_LIST)
+  if namespace != V2_NAMESPACE:
+    unknown_set |= set(field_dict) & V2_FIELD_SET
+  if unknown_set:
+    raise ValueError(
+      'Unsupported System Metadata fields. fields="{}"'.format(
+        ', '.join(sorted(unknown_set))
+      )
+    )
+
+
+def _render_text(field_name, value):
+  return u'<{0}>{1}</{0}>'.format(field_name, _escape(value))
+
+
+def _render_checksum(field_name, value):
+  algorithm, checksum = value
+  return u'<{0} algorithm={1}>{2}</{0}>'.format(
+    field_name, _quote(algorithm), _escape(checksum)
+  )
+
+
+def _render_access_policy(field_name, value):
+  xml_list = [u'<{}>'.format(field_name)]
+  for subject_list, permission_list in value:
+    xml_list.append(u'<allow>')
+    xml_list.extend(
+      u'<subject>{}</subject>'.format(_escape(s)) for s in subject_list
+    )
+    xml_list.extend(
+      u'<permission>{}</permission>'.format(_escape(p)) for p in permission_list
+    )
+    xml_list.append(u'</allow>')
+  xml_list.append(u'</{}>'.format(field_name))
+  return u''.join(xml_list)
+
+
+def _render_replication_policy(field_name, value):
+  attr_list = []
+  if value.get('replicationAllowed') is not None:
+    attr_list.append(
+      u' replicationAllowed="{}"'.
+      format(_format_boolean(value['replicationAllowed']))
+    )
+  if value.get('numberReplicas') is not None:
+    attr_list.append(u' numberReplicas="{}"'.format(int(value['numberReplicas'])))
+  xml_list = [u'<{}{}>'.format(field_name, u''.join(attr_list))]
+  for node_field_name in ('preferredMemberNode', 'blockedMemberNode'):
+    xml_list.extend(
+      _render_text(node_field_name, node_id)
+      for node_id in value.get(node_field_name, [])
+    )
+  xml_list.append(u'</{}>'.format(field_name))
+  return u''.join(xml_list)
+
+
+def _render_boolean(field_name, value):
+  return u'<{0}>{1}</{0}>'.format(field_name, _format_boolean(value))
+
+
+def _render_datetime(field_name, value):
+  return u'<{0}>{1}</{0}>'.format(field_name, format_datetime(value))
+
+
+def _render_media_type(field_name, value):
+  return u'<{} name={}/>'.format(field_name, _quote(value))
+
+
+def _format_boolean(value):
+  return u'true' if value else u'false'
+
+
+def _escape(value):
+  return xml.sax.saxutils.escape(_to_text(value))
+
+
+def _quote(value):
+  return xml.sax.saxutils.quoteattr(_to_text(value))
+
+
+def _to_text(value):
+  if isinstance(value, bytes):
+    return value.decode('utf-8')
+  if isinstance(value, _TEXT_TYPE):
+    return value
+  return u'{}'.format(value)
+
+
+_RENDER_DICT = {
+  'checksum': _render_checksum,
+  'accessPolicy': _render_access_policy,
+  'replicationPolicy': _render_replication_policy,
+  'archived': _render_boolean,
+  'dateUploaded': _render_datetime,
+  'dateSysMetadataModified': _render_datetime,
+  'mediaType': _render_media_type,
+}
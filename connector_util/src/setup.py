@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""DataONE SlenderNode Connector utilities package
+"""
+
+import setuptools
+
+
+def main():
+  setuptools.setup(
+    name='dataone.connector_util',
+    version='3.0.4',
+    description='Utilities shared by the DataONE SlenderNode Connectors',
+    author='DataONE Project',
+    author_email='developers@dataone.org',
+    url='https://github.com/DataONEorg/SlenderNodes',
+    license='Apache License, Version 2.0',
+    packages=setuptools.find_packages(exclude=['tests']),
+    include_package_data=True,
+    install_requires=[],
+    entry_points={
+      'console_scripts': [
+        'connector-run-ledger = connector_util.run_ledger:main',
+      ],
+    },
+    classifiers=[
+      'Development Status :: 5 - Production/Stable',
+      'Intended Audience :: Developers',
+      'Topic :: Scientific/Engineering',
+      'License :: OSI Approved :: Apache Software License',
+      'Programming Language :: Python :: 2',
+      'Programming Language :: Python :: 2.7',
+      'Programming Language :: Python :: 3',
+      'Programming Language :: Python :: 3.6',
+    ],
+    keywords=(
+      'DataONE SlenderNode connector'
+    ),
+  )
+
+
+if __name__ == '__main__':
+  main()
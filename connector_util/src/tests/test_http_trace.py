@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the HTTP call tracing
+"""
+
+import threading
+
+try:
+  import http.server as http_server
+except ImportError:
+  import BaseHTTPServer as http_server
+
+import pytest
+
+import connector_util.http_trace as http_trace
+
+
+class _Handler(http_server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = b'x' * 1000
+    self.send_response(200 if self.path.startswith('/ok') else 404)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def server_url():
+  server = http_server.HTTPServer(('127.0.0.1', 0), _Handler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+  server.shutdown()
+  server.server_close()
+
+
+class TestHttpTrace:
+  def test_1000(self):
+    """template_url(): PASTA, DataONE and OAI-PMH URLs"""
+    assert http_trace.template_url(
+      'https://pasta.lternet.edu/package/data/eml/knb-lter-nin/6/1/abc'
+    ) == (
+      'https://pasta.lternet.edu/package/data/eml/'
+      '{scope}/{identifier}/{revision}/{entity}'
+    )
+    assert http_trace.template_url(
+      'https://gmn.lternet.edu/mn/v2/meta/doi%3A10.6073%2Fpasta%2F1234'
+    ) == 'https://gmn.lternet.edu/mn/v2/meta/{pid}'
+    assert http_trace.template_url(
+      'https://gmn.lternet.edu/mn/v2/object?start=100&count=1'
+    ) == 'https://gmn.lternet.edu/mn/v2/object?count&start'
+    assert http_trace.template_url(
+      'https://ws.pangaea.de/oai/provider?verb=ListRecords&resumptionToken=abc'
+    ) == 'https://ws.pangaea.de/oai/provider?resumptionToken&verb=ListRecords'
+    assert http_trace.template_url(
+      'http://get.iedadata.org/metadata/iso/usap/609539iso.xml'
+    ) == 'http://get.iedadata.org/metadata/iso/usap/609539iso.xml'
+    assert http_trace.template_url(
+      'http://get.iedadata.org/metadata/iso/609539'
+    ) == 'http://get.iedadata.org/metadata/iso/{n}'
+
+  def test_1010(self):
+    """Tracer: Calls are aggregated per endpoint, slowest first"""
+    tracer = http_trace.Tracer()
+    for sec in 0.02, 0.02, 0.2, 3.0:
+      tracer.record('GET', 'https://a/x', 200, 10, sec / 2, sec)
+    tracer.record('GET', 'https://a/y', None, 0, 0.001, 0.001)
+    x_dict, y_dict = tracer.get_summary()
+    assert x_dict['url_template'] == 'https://a/x'
+    assert (x_dict['count'], x_dict['error_count'], x_dict['bytes']) == (
+      4, 0, 40
+    )
+    assert x_dict['total_p50_sec'] == 0.025
+    assert x_dict['total_p99_sec'] == 5
+    assert y_dict['status_dict'] == {'error': 1}
+    assert y_dict['error_count'] == 1
+
+  def test_1020(self, server_url):
+    """install(): Calls made through Requests are traced"""
+    requests = pytest.importorskip('requests')
+    http_trace.tracer.reset()
+    http_trace.install()
+    try:
+      requests.get(server_url + '/ok/1')
+      requests.get(server_url + '/ok/2')
+      requests.Session().get(server_url + '/missing', stream=True).close()
+    finally:
+      http_trace.uninstall()
+    requests.get(server_url + '/ok/3')
+    summary_dict = {
+      e['url_template']: e for e in http_trace.tracer.get_summary()
+    }
+    ok_dict = summary_dict[server_url + '/ok/{n}']
+    assert (ok_dict['count'], ok_dict['bytes']) == (2, 2000)
+    assert ok_dict['status_dict'] == {'200': 2}
+    assert summary_dict[server_url + '/missing']['status_dict'] == {'404': 1}
+
+  def test_1030(self, monkeypatch):
+    """install_if_enabled(): Tracing follows CONNECTOR_HTTP_TRACE"""
+    requests = pytest.importorskip('requests')
+    original_send = requests.adapters.HTTPAdapter.send
+    monkeypatch.delenv(http_trace.ENABLE_ENV, raising=False)
+    http_trace.install_if_enabled()
+    assert requests.adapters.HTTPAdapter.send is original_send
+    monkeypatch.setenv(http_trace.ENABLE_ENV, '1')
+    http_trace.install_if_enabled()
+    try:
+      assert requests.adapters.HTTPAdapter.send is not original_send
+    finally:
+      http_trace.uninstall()
+    assert requests.adapters.HTTPAdapter.send is original_send
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the lazy formatting of log message arguments
+"""
+
+import logging
+
+import connector_util.lazy_log as lazy_log
+
+
+class TestLazyLog:
+  def test_1000(self, caplog):
+    """Arguments are formatted only when the record is emitted"""
+    call_list = []
+
+    def fn(value):
+      call_list.append(value)
+      return value
+
+    logger = logging.getLogger('connector_util.tests.lazy_log')
+    with caplog.at_level(logging.INFO, logger=logger.name):
+      logger.debug('%s', lazy_log.call(fn, 'filtered'))
+      logger.info('%s', lazy_log.call(fn, 'emitted'))
+    # Each handler formats the emitted record.
+    assert 'filtered' not in call_list
+    assert 'emitted' in call_list
+    assert caplog.messages == ['emitted']
+
+  def test_1010(self):
+    """pformat(): Formats like pprint.pformat()"""
+    assert str(lazy_log.pformat({'b': [1, 2], 'a': 1})) == "{'a': 1, 'b': [1, 2]}"
+
+  def test_1020(self):
+    """truncated(): Long values are cut, and bytes are logged as text"""
+    assert str(lazy_log.truncated(b'<a/>')) == '<a/>'
+    assert str(lazy_log.truncated('x' * 20, 10)) == (
+      'xxxxxxxxxx... (20 characters total)'
+    )
+    assert str(lazy_log.truncated(b'y' * 20, 10)) == (
+      'yyyyyyyyyy... (20 bytes total)'
+    )
+
+  def test_1030(self):
+    """benchmark(): Returns the eager and lazy time per object"""
+    eager_sec, lazy_sec = lazy_log.benchmark(count=10)
+    assert eager_sec > 0
+    assert lazy_sec > 0
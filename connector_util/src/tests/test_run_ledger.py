@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the connector run ledger
+"""
+
+import pytest
+
+import connector_util.run_ledger as run_ledger
+
+
+def _add_run(ledger_path, seen, seconds, start_time):
+  run = run_ledger.Run('test_connector', 'urn:node:mnTest', ledger_path)
+  run.start()
+  run.start_time = start_time
+  run.count('seen', seen)
+  run.finish()
+  run.end_time = start_time + seconds
+  with run_ledger._connect(ledger_path) as connection:
+    connection.execute(
+      'update run set start_time = ?, end_time = ? where id = ?',
+      (run.start_time, run.end_time, run._run_id)
+    )
+
+
+class TestRunLedger:
+  def test_1000(self, tmpdir):
+    """record_run(): Counters, requests and phases are recorded"""
+    ledger_path = str(tmpdir.join('ledger.sqlite'))
+    with run_ledger.record_run('r2r', 'urn:node:mnTestR2R', ledger_path) as run:
+      with run.phase('list'):
+        run.add_request(100)
+      with run.phase('list'):
+        run.add_request(50)
+      run.count('seen', 3)
+      run.count('created')
+      run.count('skipped', 2)
+    run_dict, = run_ledger.select_runs(ledger_path)
+    assert run_dict['connector'] == 'r2r'
+    assert run_dict['status'] == 'completed'
+    assert run_dict['end_time'] >= run_dict['start_time']
+    assert (run_dict['seen'], run_dict['created'], run_dict['skipped']) == (
+      3, 1, 2
+    )
+    assert (run_dict['requests'], run_dict['bytes']) == (2, 150)
+    assert list(run_dict['phase_dict']) == ['list']
+
+  def test_1010(self, tmpdir):
+    """record_run(): A run that raises is recorded as failed"""
+    ledger_path = str(tmpdir.join('ledger.sqlite'))
+    with pytest.raises(ValueError):
+      with run_ledger.record_run('femc', 'urn:node:mnTestFEMC', ledger_path):
+        raise ValueError('test')
+    run_dict, = run_ledger.select_runs(ledger_path)
+    assert run_dict['status'] == 'failed'
+    assert 'test' in run_dict['error']
+
+  def test_1020(self):
+    """count(): Unknown counter raises ValueError"""
+    with pytest.raises(ValueError):
+      run_ledger.Run('femc', 'urn:node:mnTestFEMC', 'unused').count('unknown')
+
+  def test_1030(self, tmpdir):
+    """record_run(): An unwritable ledger does not stop the run"""
+    ledger_path = str(tmpdir.join('missing_dir', 'ledger.sqlite'))
+    with run_ledger.record_run('femc', 'urn:node:mnTestFEMC', ledger_path) as run:
+      run.count('seen')
+    assert run.status == 'completed'
+
+  def test_1040(self, tmpdir):
+    """find_slow_runs(): Flags a run with less than half the median rate"""
+    ledger_path = str(tmpdir.join('ledger.sqlite'))
+    for i, (seen, seconds) in enumerate(
+        [(100, 10), (100, 12), (100, 9), (100, 11), (100, 30), (0, 5), (0, 20)]
+    ):
+      _add_run(ledger_path, seen, seconds, 1000000 + i * 3600)
+    run_list = run_ledger.select_runs(ledger_path)
+    slow_dict = run_ledger.find_slow_runs(run_list, window=10, slow_factor=2.0)
+    assert sorted(slow_dict) == [run_list[4]['id']]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test the spooled uploads
+"""
+
+import hashlib
+import io
+import xml.dom.minidom
+
+import pytest
+
+import connector_util.spooled_upload as spooled_upload
+
+TEST_XML = (
+  u'<?xml version="1.0" encoding="utf-8"?><eml:eml xmlns:eml="eml://test">'
+  u'<title>Straße å 中</title><empty/></eml:eml>'
+).encode('utf-8')
+
+
+class TestSpooledUpload:
+  def test_1000(self):
+    """from_chunks(): Checksum and size are computed while writing, and the
+    upload reads back the same bytes"""
+    data = b'0123456789' * 1000
+    chunk_list = [data[i:i + 333] for i in range(0, len(data), 333)]
+    with spooled_upload.from_chunks(chunk_list, 'MD5') as upload:
+      assert upload.algorithm == 'MD5'
+      assert upload.size == len(data)
+      assert upload.checksum == hashlib.md5(data).hexdigest()
+      assert upload.len == len(data)
+      assert upload.read() == data
+      assert upload.len == 0
+      assert upload.rewind().read() == data
+
+  def test_1010(self):
+    """Objects larger than max_memory_size are spooled to disk"""
+    data = b'x' * 10000
+    with spooled_upload.from_stream(io.BytesIO(data), chunk_size=100) as upload:
+      assert not upload.is_on_disk
+      assert upload.checksum == hashlib.sha1(data).hexdigest()
+    with spooled_upload.from_stream(
+        io.BytesIO(data), chunk_size=100, max_memory_size=1000
+    ) as upload:
+      assert upload.is_on_disk
+      assert upload.read() == data
+
+  def test_1020(self):
+    """from_dom(): Same bytes as toprettyxml()"""
+    dom = xml.dom.minidom.parseString(TEST_XML)
+    pretty_xml = dom.toprettyxml(encoding='utf-8')
+    with spooled_upload.from_dom(dom, 'MD5') as upload:
+      assert upload.read() == pretty_xml
+      assert upload.size == len(pretty_xml)
+      assert upload.checksum == hashlib.md5(pretty_xml).hexdigest()
+
+  def test_1030(self):
+    """from_text(): Text is encoded to UTF-8 in chunks"""
+    text = TEST_XML.decode('utf-8') * 100
+    upload = spooled_upload.SpooledUpload()
+    upload.write_text(text, chunk_size=7)
+    upload.rewind()
+    assert upload.read() == text.encode('utf-8')
+    assert upload.size == len(text.encode('utf-8'))
+    upload.close()
+
+  def test_1040(self):
+    """Unsupported checksum algorithm raises ValueError"""
+    with pytest.raises(ValueError):
+      spooled_upload.SpooledUpload('CRC32')
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# This work was created by participants in the DataONE project, and is
+# jointly copyrighted by participating institutions in DataONE. For
+# more information on DataONE, see our web site at http://dataone.org.
+#
+#   Copyright 2009-2018 DataONE
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# limitations under the License.
+"""Test the System Metadata template
+"""
+
+import datetime
+import xml.etree.ElementTree
+
+import pytest
+
+import connector_util.sysmeta_template as sysmeta_template
+
+V2_TAG = '{{{}}}systemMetadata'.format(sysmeta_template.V2_NAMESPACE)
+
+TEST_STATIC_FIELD_DICT = {
+  'serialVersion': 1,
+  'formatId': 'eml://ecoinformatics.org/eml-2.1.1',
+  'submitter': 'CN=urn:node:TEST,DC=dataone,DC=org',
+  'rightsHolder': 'CN=urn:node:TEST,DC=dataone,DC=org',
+  'accessPolicy': sysmeta_template.PUBLIC_READ_ACCESS_POLICY,
+  'originMemberNode': 'urn:node:TEST',
+  'authoritativeMemberNode': 'urn:node:TEST',
+}
+
+TEST_OBJECT_FIELD_DICT = {
+  'identifier': u'doi:10.5072/<Straße&中>',
+  'size': 1234,
+  'checksum': ('SHA-1', '0123456789abcdef0123456789abcdef01234567'),
+  'replicationPolicy': {
+    'replicationAllowed': True,
+    'numberReplicas': 2,
+    'preferredMemberNode': ['urn:node:A'],
+    'blockedMemberNode': ['urn:node:B', 'urn:node:C'],
+  },
+  'obsoletes': 'doi:10.5072/OLD',
+  'archived': False,
+  'dateUploaded': datetime.datetime(2020, 1, 2, 3, 4, 5, 120000),
+  'dateSysMetadataModified': datetime.datetime(2020, 1, 2, 3, 4, 5),
+  'seriesId': 'series',
+  'mediaType': 'text/csv',
+  'fileName': 'table "1".csv',
+}
+
+
+def _render(**field_dict):
+  template = sysmeta_template.SysMetaTemplate(**TEST_STATIC_FIELD_DICT)
+  return template.render(**field_dict)
+
+
+class TestSysMetaTemplate:
+  def test_1000(self):
+    """render(): Fields are rendered in schema order, with escaping"""
+    root_el = xml.etree.ElementTree.fromstring(_render(**TEST_OBJECT_FIELD_DICT))
+    assert root_el.tag == V2_TAG
+    assert [el.tag for el in root_el] == [
+      f for f in sysmeta_template.FIELD_LIST if f != 'obsoletedBy'
+    ]
+    assert root_el.findtext('identifier') == TEST_OBJECT_FIELD_DICT['identifier']
+    assert root_el.find('checksum').get('algorithm') == 'SHA-1'
+    assert root_el.findtext('archived') == 'false'
+    assert root_el.find('mediaType').get('name') == 'text/csv'
+    assert root_el.findtext('fileName') == 'table "1".csv'
+    assert [
+      el.text for el in root_el.find('accessPolicy/allow')
+    ] == ['public', 'read']
+    replication_el = root_el.find('replicationPolicy')
+    assert replication_el.get('replicationAllowed') == 'true'
+    assert replication_el.get('numberReplicas') == '2'
+    assert [el.text for el in replication_el] == [
+      'urn:node:A', 'urn:node:B', 'urn:node:C'
+    ]
+
+  def test_1010(self):
+    """render(): Fields that are missing or None are omitted"""
+    root_el = xml.etree.ElementTree.fromstring(
+      _render(identifier='pid', size=0, obsoletes=None)
+    )
+    assert [el.tag for el in root_el] == [
+      'serialVersion', 'identifier', 'formatId', 'size', 'submitter',
+      'rightsHolder', 'accessPolicy', 'originMemberNode',
+      'authoritativeMemberNode'
+    ]
+    assert root_el.findtext('size') == '0'
+
+  def test_1020(self):
+    """Unknown fields and fields that are already set in the template raise
+    ValueError"""
+    with pytest.raises(ValueError):
+      _render(identifier='pid', unknown='x')
+    with pytest.raises(ValueError):
+      _render(identifier='pid', submitter='other')
+    with pytest.raises(ValueError):
+      sysmeta_template.SysMetaTemplate(
+        namespace=sysmeta_template.V1_NAMESPACE, seriesId='series'
+      )
+
+  def test_1030(self):
+    """format_datetime(): Same lexical form as the pyxb bindings"""
+    assert sysmeta_template.format_datetime(
+      datetime.datetime(2020, 1, 2, 3, 4, 5)
+    ) == '2020-01-02T03:04:05'
+    assert sysmeta_template.format_datetime(
+      datetime.datetime(2020, 1, 2, 3, 4, 5, 120000)
+    ) == '2020-01-02T03:04:05.12'
+    try:
+      tz = datetime.timezone(datetime.timedelta(hours=5))
+    except AttributeError:
+      pytest.skip('datetime.timezone requires Python 3')
+    assert sysmeta_template.format_datetime(
+      datetime.datetime(2020, 1, 2, 8, 4, 5, 120000, tz)
+    ) == '2020-01-02T03:04:05.12Z'
+
+  def test_1040(self):
+    """create(): toxml() returns UTF-8 bytes or text"""
+    sysmeta = sysmeta_template.SysMetaTemplate(
+      namespace=sysmeta_template.V1_NAMESPACE
+    ).create(identifier=u'Straße')
+    assert sysmeta.toxml('utf-8') == (
+      u'<?xml version="1.0" encoding="utf-8"?><ns1:systemMetadata '
+      u'xmlns:ns1="http://ns.dataone.org/service/types/v1">'
+      u'<identifier>Straße</identifier></ns1:systemMetadata>'
+    ).encode('utf-8')
+    assert sysmeta.toxml() == sysmeta.toxml('utf-8').decode('utf-8')
+    with pytest.raises(ValueError):
+      sysmeta.toxml('latin-1')
+
+  def test_1050(self):
+    """Same document as from the pyxb bindings after canonicalization"""
+    dataoneTypes = pytest.importorskip('d1_common.types.dataoneTypes')
+    if not hasattr(xml.etree.ElementTree, 'canonicalize'):
+      pytest.skip('canonicalize() requires Python 3.8')
+    field_dict = dict(TEST_OBJECT_FIELD_DICT)
+    field_dict['dateUploaded'] = datetime.datetime(
+      2020, 1, 2, 3, 4, 5, 120000, datetime.timezone.utc
+    )
+
+    sysmeta_pyxb = dataoneTypes.systemMetadata()
+    sysmeta_pyxb.serialVersion = 1
+    sysmeta_pyxb.identifier = field_dict['identifier']
+    sysmeta_pyxb.formatId = TEST_STATIC_FIELD_DICT['formatId']
+    sysmeta_pyxb.size = field_dict['size']
+    sysmeta_pyxb.checksum = dataoneTypes.checksum(field_dict['checksum'][1])
+    sysmeta_pyxb.checksum.algorithm = 'SHA-1'
+    sysmeta_pyxb.submitter = TEST_STATIC_FIELD_DICT['submitter']
+    sysmeta_pyxb.rightsHolder = TEST_STATIC_FIELD_DICT['rightsHolder']
+    access_rule_pyxb = dataoneTypes.AccessRule()
+    access_rule_pyxb.subject.append('public')
+    access_rule_pyxb.permission.append(dataoneTypes.Permission('read'))
+    sysmeta_pyxb.accessPolicy = dataoneTypes.accessPolicy()
+    sysmeta_pyxb.accessPolicy.append(access_rule_pyxb)
+    replication_policy_pyxb = dataoneTypes.replicationPolicy()
+    replication_policy_pyxb.replicationAllowed = True
+    replication_policy_pyxb.numberReplicas = 2
+    replication_policy_pyxb.preferredMemberNode = ['urn:node:A']
+    replication_policy_pyxb.blockedMemberNode = ['urn:node:B', 'urn:node:C']
+    sysmeta_pyxb.replicationPolicy = replication_policy_pyxb
+    sysmeta_pyxb.obsoletes = field_dict['obsoletes']
+    sysmeta_pyxb.archived = False
+    sysmeta_pyxb.dateUploaded = field_dict['dateUploaded']
+    sysmeta_pyxb.dateSysMetadataModified = field_dict['dateSysMetadataModified']
+    sysmeta_pyxb.originMemberNode = TEST_STATIC_FIELD_DICT['originMemberNode']
+    sysmeta_pyxb.authoritativeMemberNode = (
+      TEST_STATIC_FIELD_DICT['authoritativeMemberNode']
+    )
+    sysmeta_pyxb.seriesId = field_dict['seriesId']
+    sysmeta_pyxb.mediaType = dataoneTypes.MediaType(name='text/csv')
+    sysmeta_pyxb.fileName = field_dict['fileName']
+
+    def canonicalize(xml_bytes):
+      return xml.etree.ElementTree.canonicalize(
+        xml_bytes.decode('utf-8'), rewrite_prefixes=True
+      )
+
+    assert canonicalize(_render(**field_dict)) == canonicalize(
+      sysmeta_pyxb.toxml('utf-8')
+    )
@@ -42,6 +42,7 @@ logger = logging.getLogger(__name__)
 # logger.setLevel(logging.ERROR)
 
 import os
+import connector_util.run_ledger
 import d1_client_manager
 import requests
 import xml.etree.ElementTree as ET
@@ -79,6 +80,9 @@ SYSMETA_DICT = \
    'originMN': 'urn:node:mnTestFEMC',  # Use your node's DataONE URI
    'formatId': 'eml://ecoinformatics.org/eml-2.1.1'  # the DataONE supported formatID.
    }
+# Render the system metadata from a template which is prepared once, instead of building it with the pyxb bindings
+# for every record. The documents are the same. Set to False to use the pyxb bindings.
+SYSMETA_FROM_TEMPLATE = True
 
 created_count = 0  # global incrementer for metadata records harvested.
 updated_count = 0  # incrementer for records updated each time program is run
@@ -86,22 +90,32 @@ updated_count = 0  # incrementer for records updated each time program is run
 # ********************************************** MAIN PROGRAM **********************************************************
 
 def main():
+  # Record the run in the run ledger shared by all connectors on this host.
+  with connector_util.run_ledger.record_run('femc', SYSMETA_DICT['authoritativeMN']) as run:
+    harvest(run)
+
+
+def harvest(run):
   requests.packages.urllib3.disable_warnings()
   client_mgr = d1_client_manager.D1ClientManager(
-    MN_BASE_URL, CERT, KEY, SYSMETA_DICT) # This client manager handles all the DataONE api stuff.
-  harvester = FEMC_Harvester(REST_BASE_URL, REST_API_KEY) # This harvester handles functionality specific to FEMC.
+    MN_BASE_URL, CERT, KEY, SYSMETA_DICT, SYSMETA_FROM_TEMPLATE) # This client manager handles all the DataONE api stuff.
+  harvester = FEMC_Harvester(REST_BASE_URL, REST_API_KEY, run) # This harvester handles functionality specific to FEMC.
   last_harvest_time = client_mgr.get_last_harvest_time()  # Latest record date in GMN becomes start time for new query
   last_harvest_epoch_time = calendar.timegm(
     time.strptime(last_harvest_time, "%Y-%m-%d %H:%M:%S.%f")) # FEMC endpoint needs dates in epoch time, so convert
-  recordlist = harvester.getRecordsList(
-    last_harvest_epoch_time)  # start of by asking the FEMC endpoint for any newly modified /created records
+  with run.phase('list'):
+    recordlist = harvester.getRecordsList(
+      last_harvest_epoch_time)  # start of by asking the FEMC endpoint for any newly modified /created records
 
   if recordlist is not None:  # So long as the query returned any items,
     for item in recordlist:  # then for each of those records:
+      run.count('seen')
       projectID = item.find('fkProjectID').text # get the project/dataset identifiers
       datasetID = item.find('fkDatasetID').text
-      science_metadata = harvester.getScienceMetadata(projectID, datasetID) # and pass to function to get the EML record
-      harvester.process_record(client_mgr,projectID, datasetID, science_metadata) #figure out if an update or new record
+      with run.phase('fetch'):
+        science_metadata = harvester.getScienceMetadata(projectID, datasetID) # and pass to function to get the EML record
+      with run.phase('gmn'):
+        harvester.process_record(client_mgr,projectID, datasetID, science_metadata) #figure out if an update or new record
 
   tracking_log = open(file_name, file_action) # make a note of how many records added to GMN or updated this round
   tracking_log.write(datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S") +
@@ -112,12 +126,14 @@ def main():
 
 # *****************************************************************************************
 class FEMC_Harvester:
-  def __init__(self, baseURL, apiKEY):
+  def __init__(self, baseURL, apiKEY, run):
     """
     :param baseURL: The FEMC rest service base URL, not to be confused with the base URL configured for GMN.
+    :param run: connector_util.run_ledger.Run that records the requests and records of this run.
     """
     self.baseURL = baseURL
     self.apiKEY = apiKEY
+    self.run = run
 
   def getRecordsList(self, last_harvest_time):
     """
@@ -134,6 +150,7 @@ class FEMC_Harvester:
                   '/X-API-KEY/' + self.apiKEY
     try:
       r = requests.get(request_url, headers=headers)
+      self.run.add_request(len(r.content))
       # print 'Status code is {} for request: {}\n\n'.format(r.status_code, r.url)
       if r.status_code == requests.codes.ok:
         root = ET.fromstring(r.content)
@@ -161,6 +178,7 @@ class FEMC_Harvester:
                   '/X-API-KEY/' + self.apiKEY
     try: # try to execute the request here. If it doesn't work out, then log an  error
       r = requests.get(request_url, headers=headers)
+      self.run.add_request(len(r.content))
       # print 'Status code is {} for request: {}\n\n'.format(r.status_code, r.url)
       if r.status_code == requests.codes.ok:
         science_metadata = ET.fromstring(r.content)
@@ -199,25 +217,29 @@ class FEMC_Harvester:
 
     # if identifier exists already call update method.
     if (checkExistsDict['outcome'] == 'yes'):
-      if client_mgr.update_science_metadata(
-          minidom.parseString(scimeta).toprettyxml(encoding='utf-8'),
-                                                  identifier,
-                                                  datetime.datetime.now()):
+      with d1_client_manager.spool_science_metadata(minidom.parseString(scimeta)) as scimeta_upload:
+        is_updated = client_mgr.update_science_metadata(scimeta_upload, identifier, datetime.datetime.now())
+      if is_updated:
         updated_count += 1  # function returns 1 if successful; track the number of updated objects
+        self.run.count('updated')
         print 'Identifier {} UPDATED'.format(identifier)
+      else:
+        self.run.count('failed')
 
     # if check failed for some reason, it have logged that an issue occurred and skip over the record.
     elif checkExistsDict['outcome'] == 'failed':
-      pass
+      self.run.count('failed')
 
     # If this identifer is not already found in GMN in any way, so create a new object in GMN
     elif checkExistsDict['outcome'] == 'no':
-      if client_mgr.load_science_metadata(minidom.parseString(scimeta).toprettyxml(encoding='utf-8'),
-                                          identifier,
-                                          datetime.datetime.now()
-                                          ):
+      with d1_client_manager.spool_science_metadata(minidom.parseString(scimeta)) as scimeta_upload:
+        is_created = client_mgr.load_science_metadata(scimeta_upload, identifier, datetime.datetime.now())
+      if is_created:
         created_count += 1  # track number of successfully created new objects
+        self.run.count('created')
         # print 'Identifier {} CREATED'.format(identifier)
+      else:
+        self.run.count('failed')
 
     else:
       pass
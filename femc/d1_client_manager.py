@@ -12,12 +12,13 @@ ________________________________________________________________________________
 # Tested on dataone.libclient version 2.0.0
 
 import datetime
-import StringIO
 import logging
 import requests
-import hashlib
 import sys
 
+import connector_util.spooled_upload
+import connector_util.sysmeta_template
+
 # D1.
 import d1_common.types.dataoneTypes_v2_0 as v2
 import d1_common.const
@@ -35,7 +36,38 @@ def _generate_version_pid(native_identifier):
     return native_identifier + datetime.datetime.now().strftime("_%Y%m%d_%H%M")
 
 
-def _generate_system_metadata(scimeta_bytes, native_identifier_sid, version_pid, record_date, symeta_settings_dict):
+def spool_science_metadata(scimeta_dom):
+    """Write the science metadata document, pretty printed, to a rewindable file for upload to GMN. The MD5 checksum
+    and size used in the system metadata are computed while the document is written, and large documents are spooled to
+    disk instead of being held in memory."""
+    return connector_util.spooled_upload.from_dom(scimeta_dom, 'MD5')
+
+
+def _create_sysmeta_template(sysmeta_settings_dict):
+    """Render the system metadata fields which are the same for every object loaded into GMN once, so that only the
+    fields which differ between objects are rendered for each object. See _render_system_metadata()."""
+    return connector_util.sysmeta_template.SysMetaTemplate(
+        formatId=sysmeta_settings_dict['formatId'],
+        rightsHolder=sysmeta_settings_dict['rightsholder'],
+        submitter=sysmeta_settings_dict['submitter'],
+        authoritativeMemberNode=sysmeta_settings_dict['authoritativeMN'],
+        originMemberNode=sysmeta_settings_dict['originMN'],
+        accessPolicy=connector_util.sysmeta_template.PUBLIC_READ_ACCESS_POLICY)
+
+
+def _render_system_metadata(sysmeta_template, scimeta_upload, native_identifier_sid, version_pid, record_date):
+    """Render the same system metadata as _generate_system_metadata() from a template created by
+    _create_sysmeta_template(), without building it with the pyxb bindings."""
+    return sysmeta_template.create(
+        seriesId=native_identifier_sid,
+        identifier=version_pid,
+        size=scimeta_upload.size,
+        checksum=(scimeta_upload.algorithm, scimeta_upload.checksum),
+        dateUploaded=record_date,
+        dateSysMetadataModified=datetime.datetime.now())
+
+
+def _generate_system_metadata(scimeta_upload, native_identifier_sid, version_pid, record_date, symeta_settings_dict):
     """This function generates a system metadata document for describing the science metadata record being loaded. Some
     of the fields, such as checksum and size, are based off the bytes of the science metadata object itself. Other
     system metadata fields are passed to D1ClientManager in a dict which is configured in the main adapter program."""
@@ -43,11 +75,9 @@ def _generate_system_metadata(scimeta_bytes, native_identifier_sid, version_pid,
     sys_meta.seriesId = native_identifier_sid
     sys_meta.identifier = version_pid
     sys_meta.formatId = symeta_settings_dict['formatId']
-    sys_meta.size = len(scimeta_bytes)
-    # sys_meta.checksum = \
-    #    d1_common.checksum.create_checksum_object_from_stream(StringIO.StringIO(scimeta_bytes), algorithm='MD5')
-    sys_meta.checksum = dataoneTypes.checksum(hashlib.md5(scimeta_bytes).hexdigest())
-    sys_meta.checksum.algorithm = 'MD5'
+    sys_meta.size = scimeta_upload.size
+    sys_meta.checksum = dataoneTypes.checksum(scimeta_upload.checksum)
+    sys_meta.checksum.algorithm = scimeta_upload.algorithm
     #sys_meta.dateUploaded = datetime.datetime.strptime(record_date, "%Y-%m-%d %H:%M:%SZ")
     sys_meta.dateUploaded = record_date
     sys_meta.dateSysMetadataModified = datetime.datetime.now()
@@ -75,7 +105,7 @@ def _generate_public_access_policy():
 
 class D1ClientManager:
     # Initialize the client manager with an instance of a member node client
-    def __init__(self, gmn_baseurl, auth_cert, auth_cert_key, sysmeta_settings_dict):
+    def __init__(self, gmn_baseurl, auth_cert, auth_cert_key, sysmeta_settings_dict, sysmeta_from_template=True):
         """
         :param gmn_baseurl: The base URL configured for the Generic Member Node installation.
         :param auth_cert: Certificate used for authenticating with the GMN server to make changes. If the adapter script
@@ -88,6 +118,8 @@ class D1ClientManager:
          still in development or is registered.
         :param sysmeta_settings_dict: System metadata settings which apply to every object loaded into GMN are 
          configured in the main script, and then passed within a dict to be used while creating and updating objects.
+        :param sysmeta_from_template: If True, the system metadata is rendered from a template which is prepared once,
+         instead of being built with the pyxb bindings for every object. The documents are the same.
          """
 
         self.client = d1_client.mnclient_2_0.MemberNodeClient_2_0(
@@ -99,6 +131,15 @@ class D1ClientManager:
             # verify_tls=False
             )
         self.sysmeta_settings_dict = sysmeta_settings_dict
+        self.sysmeta_template = None
+        if sysmeta_from_template:
+            self.sysmeta_template = _create_sysmeta_template(sysmeta_settings_dict)
+
+    def _generate_system_metadata(self, scimeta_upload, native_identifier_sid, version_pid, record_date):
+        if self.sysmeta_template is not None:
+            return _render_system_metadata(self.sysmeta_template, scimeta_upload, native_identifier_sid, version_pid, record_date)
+        return _generate_system_metadata(scimeta_upload, native_identifier_sid, version_pid, record_date,
+                                         self.sysmeta_settings_dict)
 
     def get_last_harvest_time(self):
         try:
@@ -151,11 +192,11 @@ class D1ClientManager:
             return checkExistsDict
             # return 'yes'
 
-    def load_science_metadata(self, sci_metadata_bytes, native_identifier_sid, record_date):
+    def load_science_metadata(self, scimeta_upload, native_identifier_sid, record_date):
         """
         Loads a new science metadata record into GMN using the .create() method from the Member Node API. 
         
-        :param sci_metadata_bytes: The bytes of the science metadata record as a utf-encoded string.
+        :param scimeta_upload: The science metadata record, as returned by spool_science_metadata().
         :param native_identifier_sid: The unique identifier of the metadata record in the native repository.
         :param record_date: The datestamp parsed from the record, or the current date if This becomes the dateUploaded in GMN.
         :return: True if the object successfully created or False if not. This allows the main program to track the
@@ -163,15 +204,15 @@ class D1ClientManager:
         """
         try:
             version_pid = _generate_version_pid(native_identifier_sid)
-            system_metadata= _generate_system_metadata(sci_metadata_bytes, native_identifier_sid,
-                                      version_pid, record_date, self.sysmeta_settings_dict)
+            system_metadata = self._generate_system_metadata(scimeta_upload, native_identifier_sid, version_pid,
+                                                             record_date)
         except Exception, e:
             logging.error('Failed to generate system metadata. Unable to create SID: ' + native_identifier_sid +
                           ' / PID: ' + version_pid)
             logging.error(e)
             return False
         try:
-            self.client.create(version_pid, StringIO.StringIO(sci_metadata_bytes), system_metadata)
+            self.client.create(version_pid, scimeta_upload.rewind(), system_metadata)
         except Exception, e:
             logging.error('Failed to create object with SID: ' + native_identifier_sid + ' / PID: ' + version_pid)
             logging.error(e)
@@ -179,7 +220,7 @@ class D1ClientManager:
         else:
             return True
 
-    def update_science_metadata(self, sci_metadata_bytes, native_identifier_sid, record_date):
+    def update_science_metadata(self, scimeta_upload, native_identifier_sid, record_date):
         """
         When a record is harvested from an  query whose native repository identifier already exists as a seriesId
         in GMN, then it is understood that the record has been modified in the native repository. The .update() API
@@ -187,7 +228,8 @@ class D1ClientManager:
         new object. The .update() method automates setting the obsoletes / obsoleted by properties of both old and new 
         objects in order to encode the relationship between the two, so there is no need to explicitly assign them.
         
-        :param sci_metadata_bytes: The bytes of the new version of the science metadata record as a utf-encoded string.
+        :param scimeta_upload: The new version of the science metadata record, as returned by
+         spool_science_metadata().
         :param native_identifier_sid: The identifier of the record in its native repository which is implemented as the
          seriesId property in GMN.        
         :param record_date: If the native system record includes a date modified in the native system, then that date
@@ -199,11 +241,10 @@ class D1ClientManager:
         try:
             old_version_system_metadata = self.client.getSystemMetadata(native_identifier_sid)
             old_version_pid = old_version_system_metadata.identifier.value()
-            new_version_system_metadata = _generate_system_metadata(sci_metadata_bytes, native_identifier_sid,
-                                                                    new_version_pid, record_date,
-                                                                    self.sysmeta_settings_dict)
+            new_version_system_metadata = self._generate_system_metadata(scimeta_upload, native_identifier_sid,
+                                                                         new_version_pid, record_date)
             self.client.update(old_version_pid,
-                               StringIO.StringIO(sci_metadata_bytes),
+                               scimeta_upload.rewind(),
                                new_version_pid,
                                new_version_system_metadata)
         except Exception, e:
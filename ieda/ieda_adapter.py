@@ -33,15 +33,12 @@ IEDA receives content from 3 contributing repositories. For now, MN will only
 hold objects from EarthChem.
 """
 import datetime
-import io
 import logging
-import pprint
 import requests
 import sys
 import xml.etree.ElementTree as ET
 
 import d1_client.mnclient_2_0
-import d1_common.checksum
 import d1_common.const
 import d1_common.date_time
 import d1_common.system_metadata
@@ -50,6 +47,11 @@ import d1_common.types.exceptions
 import d1_common.wrap.access_policy
 import d1_common.xml
 
+import connector_util.http_trace
+import connector_util.lazy_log
+import connector_util.run_ledger
+import connector_util.spooled_upload
+import connector_util.sysmeta_template
 import d1_client
 import schema_org
 
@@ -69,6 +71,13 @@ BASE_URL = 'https://gmn.test.dataone.org/mn'
 CERT_PEM_PATH = './urn_node_mnTestIEDA.pem'
 CERT_KEY_PATH = './urn_node_mnTestIEDA.key'
 
+# Log the records read from IEDA, and other debug level messages.
+DEBUG_LOG_BOOL = False
+
+# Render the System Metadata from a template that is prepared once per run,
+# instead of building it with the pyxb bindings for each record.
+SYSMETA_FROM_TEMPLATE = True
+
 NS_DICT = {
   'gmd': 'http://www.isotc211.org/2005/gmd',
   'gco': 'http://www.isotc211.org/2005/gco',
@@ -78,30 +87,51 @@ NS_DICT = {
 def main():
   logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
-    level=logging.DEBUG,
+    level=logging.DEBUG if DEBUG_LOG_BOOL else logging.INFO,
   )
+  # Opt-in tracing of the HTTP calls, enabled with CONNECTOR_HTTP_TRACE=1.
+  connector_util.http_trace.install_if_enabled()
+
+  # Record the run in the run ledger shared by all connectors on this host.
+  with connector_util.run_ledger.record_run(
+      'ieda', SCIMETA_AUTHORITATIVE_MEMBER_NODE
+  ) as run:
+    harvest(run)
 
-  resource_list = schema_org.load_resources_from_sitemap(IEDA_SITE_MAP)
+
+def harvest(run):
+  with run.phase('list'):
+    resource_list = schema_org.load_resources_from_sitemap(IEDA_SITE_MAP)
+  run.add_request()
 
   logging.info('Found resources: {}'.format(len(resource_list)))
 
   gmn_client = create_gmn_client()
+  sysmeta_template = (
+    create_sysmeta_template() if SYSMETA_FROM_TEMPLATE else None
+  )
 
   for resource_dict in resource_list:
     logging.info('-' * 80)
-    entry_dict = schema_org.load_schema_org(resource_dict)
+    run.count('seen')
+    with run.phase('schema_org'):
+      entry_dict = schema_org.load_schema_org(resource_dict)
+    run.add_request()
 
     result_dict = {
       **resource_dict,
       **entry_dict,
     }
 
-    logging.info(pprint.pformat(result_dict))
+    logging.debug(
+      'result_dict=%s', connector_util.lazy_log.pformat(result_dict)
+    )
 
     if 'error' in result_dict:
       logging.error(
         'error="{}" url="{}"'.format(result_dict['error'], result_dict['url'])
       )
+      run.count('failed')
       continue
 
     # {
@@ -119,35 +149,50 @@ def main():
 
     if is_in_gmn(gmn_client, pid):
       logging.info('Skipped. Already in GMN.')
+      run.count('skipped')
       continue
 
-    scimeta_xml_bytes = download_scimeta_xml(result_dict['metadata_url'])
-
-    pid_sysmeta_pyxb = generate_system_metadata(scimeta_xml_bytes, pid, sid)
-
-    head_sysmeta_pyxb = get_sysmeta(gmn_client, sid)
-
-    # logging.info(sysmeta_pyxb.toxml('utf-8'))
-
-    if head_sysmeta_pyxb:
-      head_pid = head_sysmeta_pyxb.identifier.value()
-      logging.info(
-        'SID already exists on GMN. Adding to chain. head_pid="{}"'
-        .format(head_pid)
-      )
-      gmn_client.update(
-        head_pid, io.BytesIO(scimeta_xml_bytes), pid, pid_sysmeta_pyxb
-      )
-    else:
-      logging.info(
-        'SID does not exist on GMN. Starting new chain. pid="{}"'.format(pid)
-      )
-      gmn_client.create(pid, io.BytesIO(scimeta_xml_bytes), pid_sysmeta_pyxb)
+    with run.phase('download'):
+      scimeta_upload = download_scimeta_xml(result_dict['metadata_url'])
+    run.add_request(scimeta_upload.size)
+
+    with scimeta_upload:
+      if sysmeta_template is not None:
+        pid_sysmeta_pyxb = render_system_metadata(
+          sysmeta_template, scimeta_upload, pid, sid
+        )
+      else:
+        pid_sysmeta_pyxb = generate_system_metadata(scimeta_upload, pid, sid)
+
+      head_sysmeta_pyxb = get_sysmeta(gmn_client, sid)
+
+      # logging.info(sysmeta_pyxb.toxml('utf-8'))
+
+      if head_sysmeta_pyxb:
+        head_pid = head_sysmeta_pyxb.identifier.value()
+        logging.info(
+          'SID already exists on GMN. Adding to chain. head_pid="{}"'
+          .format(head_pid)
+        )
+        with run.phase('gmn'):
+          gmn_client.update(head_pid, scimeta_upload, pid, pid_sysmeta_pyxb)
+        run.count('updated')
+      else:
+        logging.info(
+          'SID does not exist on GMN. Starting new chain. pid="{}"'.format(pid)
+        )
+        with run.phase('gmn'):
+          gmn_client.create(pid, scimeta_upload, pid_sysmeta_pyxb)
+        run.count('created')
 
 
 def download_scimeta_xml(scimeta_url):
+  """Stream the SciMeta to a SpooledUpload. The checksum and size are computed
+  during the download, and large documents are spooled to disk."""
   try:
-    return requests.get(scimeta_url).content
+    return connector_util.spooled_upload.from_response(
+      requests.get(scimeta_url, stream=True)
+    )
   except requests.HTTPError as e:
     raise AdapterException(
       'Unable to download SciMeta. error="{}"'.format(str(e))
@@ -190,9 +235,35 @@ def get_sysmeta(gmn_client, sid):
     return None
 
 
-def generate_system_metadata(scimeta_bytes, pid, sid):
+def create_sysmeta_template():
+  """Render the System Metadata fields that are the same for all records."""
+  return connector_util.sysmeta_template.SysMetaTemplate(
+    formatId=SCIMETA_FORMAT_ID,
+    submitter=SCIMETA_SUBMITTER,
+    rightsHolder=SCIMETA_RIGHTS_HOLDER,
+    accessPolicy=connector_util.sysmeta_template.PUBLIC_READ_ACCESS_POLICY,
+    originMemberNode=SCIMETA_AUTHORITATIVE_MEMBER_NODE,
+    authoritativeMemberNode=SCIMETA_AUTHORITATIVE_MEMBER_NODE,
+  )
+
+
+def render_system_metadata(sysmeta_template, scimeta_upload, pid, sid):
+  """Render the same System Metadata as generate_system_metadata(), from a
+  template created by create_sysmeta_template()."""
+  return sysmeta_template.create(
+    identifier=pid,
+    seriesId=sid,
+    size=scimeta_upload.size,
+    checksum=(scimeta_upload.algorithm, scimeta_upload.checksum),
+    dateUploaded=d1_common.date_time.utc_now(),
+    dateSysMetadataModified=datetime.datetime.now(),
+  )
+
+
+def generate_system_metadata(scimeta_upload, pid, sid):
   """
-  :param scimeta_bytes: Bytes of the node's original metadata document.
+  :param scimeta_upload: SpooledUpload holding the node's original metadata
+  document.
   :param native_identifier_sid: Node's system identifier for this object, which
   becomes the series ID.
   :param record_date: Date metadata document was created/modified in the source
@@ -211,10 +282,9 @@ def generate_system_metadata(scimeta_bytes, pid, sid):
   sysmeta_pyxb = v2.systemMetadata()
   sysmeta_pyxb.seriesId = sid
   sysmeta_pyxb.formatId = SCIMETA_FORMAT_ID
-  sysmeta_pyxb.size = len(scimeta_bytes)
-  sysmeta_pyxb.checksum = d1_common.checksum.create_checksum_object_from_string(
-    scimeta_bytes
-  )
+  sysmeta_pyxb.size = scimeta_upload.size
+  sysmeta_pyxb.checksum = v2.checksum(scimeta_upload.checksum)
+  sysmeta_pyxb.checksum.algorithm = scimeta_upload.algorithm
   sysmeta_pyxb.identifier = pid
   sysmeta_pyxb.dateUploaded = d1_common.date_time.utc_now()
   sysmeta_pyxb.dateSysMetadataModified = datetime.datetime.now()
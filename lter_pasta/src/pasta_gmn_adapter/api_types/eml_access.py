@@ -23,13 +23,16 @@
   Roger Dahl
 """
 
+import hashlib
 import logging
-
-import pyxb
+import xml.etree.ElementTree as ET
 
 import d1_common.types.dataoneTypes
 
-import pasta_gmn_adapter.api_types.generated.eml_access
+# Parsed access rules, by SHA-1 of the EML access document. Packages typically
+# have the same access rules on the package and all its members.
+_rule_cache_dict = {}
+RULE_CACHE_MAX_SIZE = 10000
 
 
 # Raised when the Data Package Manager returns an error response.
@@ -47,45 +50,128 @@ class EMLAccessException(Exception):
 
 
 class EMLAccess(object):
-  def __init__(self, eml_access_xml=None):
+  """Access rules from an EML access document.
+
+  By default, the document is parsed with ElementTree, which is much faster than
+  the pyxb binding, and only the allow and deny rules are extracted. The pyxb
+  binding, which also validates the document against the schema, can be selected
+  with {use_pyxb}.
+  """
+
+  def __init__(self, eml_access_xml=None, use_pyxb=False):
+    self._eml_access_xml = eml_access_xml
+    self._allow_list = []
+    self._deny_list = []
     if eml_access_xml is not None:
-      self._eml_access = self.deserialize(eml_access_xml)
+      if use_pyxb:
+        self._allow_list, self._deny_list = self.deserialize_pyxb(eml_access_xml)
+      else:
+        self._allow_list, self._deny_list = self.deserialize(eml_access_xml)
 
   def deserialize(self, eml_access_xml):
+    """Return the allow and deny rules of an EML access document, as lists of
+    (principal_list, permission_list) tuples."""
+    if isinstance(eml_access_xml, str):
+      eml_access_xml = eml_access_xml.encode('utf-8')
+    rule_hash = hashlib.sha1(eml_access_xml).hexdigest()
+    try:
+      return _rule_cache_dict[rule_hash]
+    except KeyError:
+      pass
+    try:
+      rules = parse_eml_access(eml_access_xml)
+    except (ET.ParseError, EMLAccessException):
+      logging.exception('Invalid document. Exception:')
+      raise
+    if len(_rule_cache_dict) >= RULE_CACHE_MAX_SIZE:
+      _rule_cache_dict.clear()
+    _rule_cache_dict[rule_hash] = rules
+    return rules
+
+  def deserialize_pyxb(self, eml_access_xml):
+    import pyxb
+    import pasta_gmn_adapter.api_types.generated.eml_access
     try:
-      return pasta_gmn_adapter.api_types.generated.eml_access.CreateFromDocument(
+      eml_access = pasta_gmn_adapter.api_types.generated.eml_access.CreateFromDocument(
         eml_access_xml
       )
     except pyxb.BadDocumentError:
       logging.exception('Invalid document. Exception:')
       raise
+    return (
+      [([str(p) for p in a.principal], [str(e) for e in a.permission])
+       for a in eml_access.allow],
+      [([str(p) for p in d.principal], [str(e) for e in d.permission])
+       for d in eml_access.deny],
+    )
 
   def serialize(self):
-    return self._eml_access.toxml()
+    if isinstance(self._eml_access_xml, bytes):
+      return self._eml_access_xml.decode('utf-8')
+    return self._eml_access_xml
 
   def _raise_if_access_rules_not_supported_by_dataone(self):
     '''DataONE is more limited than EML in which access rules are supported.'''
     # DataONE does not support deny rules.
-    if len(self._eml_access.deny) > 0:
+    if len(self._deny_list) > 0:
       raise EMLAccessException(
         'Access rules contain one or more deny rules, which are unsupported by DataONE'
       )
 
-  def get_as_dataone_rules(self):
+  def get_as_dataone_rule_list(self):
+    """Return the DataONE allow rules as a list of (subject_list,
+    permission_list) tuples."""
     # DataONE's allow rules are almost the same as EML. The principal in EML is
     # the subject in DataONE. EML supports "all" as a synonym of
     # "changePermission". The "all" synonym is not supported in DataONE, so it
     # is translated to "changePermission".
+    return [(
+      list(principal_list), [
+        'changePermission' if permission_str == 'all' else permission_str
+        for permission_str in permission_list
+      ]
+    ) for principal_list, permission_list in self._allow_list]
+
+  def get_as_dataone_rules(self):
     accessPolicy = d1_common.types.dataoneTypes.accessPolicy()
-    for a in self._eml_access.allow:
+    for principal_list, permission_list in self.get_as_dataone_rule_list():
       accessRule = d1_common.types.dataoneTypes.AccessRule()
-      for p in a.principal:
+      for p in principal_list:
         accessRule.subject.append(p)
-      for e in a.permission:
-        permission_str = str(e)
-        if permission_str == 'all':
-          permission_str = 'changePermission'
+      for permission_str in permission_list:
         permission = d1_common.types.dataoneTypes.Permission(permission_str)
         accessRule.permission.append(permission)
       accessPolicy.append(accessRule)
     return accessPolicy
+
+
+def parse_eml_access(eml_access_xml):
+  """Parse an EML access document with ElementTree. Return the allow and deny
+  rules as lists of (principal_list, permission_list) tuples, in document
+  order."""
+  root_el = ET.fromstring(eml_access_xml)
+  if _local_name(root_el.tag) != 'access':
+    raise EMLAccessException(
+      'Expected EML access document. root="{}"'.format(root_el.tag)
+    )
+  rule_dict = {'allow': [], 'deny': []}
+  for rule_el in root_el:
+    try:
+      rule_list = rule_dict[_local_name(rule_el.tag)]
+    except KeyError:
+      continue
+    principal_list = []
+    permission_list = []
+    for el in rule_el:
+      tag = _local_name(el.tag)
+      if tag == 'principal':
+        principal_list.append(el.text or '')
+      elif tag == 'permission':
+        # Permission is an enumeration, so whitespace is collapsed.
+        permission_list.append((el.text or '').strip())
+    rule_list.append((principal_list, permission_list))
+  return rule_dict['allow'], rule_dict['deny']
+
+
+def _local_name(tag):
+  return tag.rsplit('}', 1)[-1]
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`async_data_package_manager_client`
+===========================================
+
+:Synopsis:
+  asyncio client for the PASTA Package Manager REST API. Provides the same
+  methods as DataPackageManagerClient, as coroutines.
+
+  URL construction and response handling are shared with the synchronous
+  client, so both return the same values and raise the same exceptions.
+
+  Requests are sent over asyncio streams, using a new connection for each
+  request. The synchronous client also opens a new connection per request, to
+  work around invalid responses from PASTA on reused connections. With no
+  connection pool, the number of requests in flight is bounded only by
+  {max_concurrency}, so a single thread can wait on hundreds of requests at
+  once.
+"""
+
+import asyncio
+import logging
+import ssl
+import time
+import urllib.parse
+
+import requests.exceptions
+import requests.structures
+import requests.utils
+
+import d1_common.url
+
+import pasta_gmn_adapter.app.data_package_manager_client
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.metrics
+from pasta_gmn_adapter import settings
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+class AsyncResponse(object):
+  """The parts of requests.Response that the response handlers use."""
+
+  def __init__(self, method, url, status_code, reason, headers, content):
+    self.method = method
+    self.url = url
+    self.status_code = status_code
+    self.reason = reason
+    self.headers = headers
+    self.content = content
+
+  @property
+  def text(self):
+    # Same default encoding as requests.Response.text for text/* types.
+    encoding = requests.utils.get_encoding_from_headers(self.headers)
+    return self.content.decode(encoding or 'utf-8', errors='replace')
+
+
+class AsyncDataPackageManagerClient(
+    pasta_gmn_adapter.app.data_package_manager_client.DataPackageManagerBase
+):
+  """PASTA Data Package Manager web service API methods that are used by the
+  PASTA GMN Adapter, as coroutines.
+
+  Error responses are translated into exceptions.
+  """
+
+  def __init__(
+      self, base_url=None, add_basic_auth_header=True, timeout=None,
+      max_concurrency=DEFAULT_MAX_CONCURRENCY, verify_tls=False
+  ):
+    self.base_url = base_url or settings.PASTA_BASE_URL
+    logging.debug('PASTA BaseURL: {0}'.format(self.base_url))
+    self._timeout = timeout or settings.PASTA_RESPONSE_TIMEOUT
+    self._max_concurrency = max_concurrency
+    # Created on first use, so that it belongs to the running event loop.
+    self._semaphore = None
+    self._headers = requests.structures.CaseInsensitiveDict({
+      'User-Agent': settings.PASTA_GMN_ADAPTER_USER_AGENT,
+      'Connection': 'close',
+      'Accept-Encoding': 'identity',
+    })
+    self._auth_header = (
+      self._mk_http_basic_auth_header() if add_basic_auth_header else None
+    )
+    self._ssl_context = ssl.create_default_context()
+    # Debug: Disable server side certificate verification
+    if not verify_tls:
+      self._ssl_context.check_hostname = False
+      self._ssl_context.verify_mode = ssl.CERT_NONE
+
+  # ----------------------------------------------------------------------------
+  # HTTP.
+  # ----------------------------------------------------------------------------
+
+  async def GET(self, rest_path, query=None):
+    return await self.GET_URL(self._make_url(rest_path, query))
+
+  async def GET_URL(self, url):
+    return await self.request('GET', url)
+
+  async def HEAD_URL(self, url):
+    return await self.request('HEAD', url)
+
+  async def request(self, method, url, add_basic_auth_header=True):
+    """Send a request and read the complete response. The timeout applies to
+    the request as a whole."""
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self._max_concurrency)
+    headers = requests.structures.CaseInsensitiveDict(self._headers)
+    if add_basic_auth_header and self._auth_header is not None:
+      headers.update((self._auth_header,))
+    async with self._semaphore:
+      start_sec = time.time()
+      try:
+        response = await asyncio.wait_for(
+          self._send(method, url, headers), self._timeout
+        )
+      except asyncio.TimeoutError:
+        elapsed_sec = time.time() - start_sec
+        pasta_gmn_adapter.app.deadline.deadline.add_timed_out_request(
+          elapsed_sec
+        )
+        pasta_gmn_adapter.app.metrics.registry.inc(
+          'pasta_gmn_adapter_timed_out_request_seconds_total',
+          {'service': 'pasta'}, elapsed_sec
+        )
+        raise requests.exceptions.Timeout(
+          'Request timed out. url="{}" timeout={} sec'.format(
+            url, self._timeout
+          )
+        )
+    self._record_response(response, time.time() - start_sec)
+    return response
+
+  def _make_url(self, rest_path, query=None):
+    if isinstance(rest_path, str):
+      rest_path = [rest_path]
+    url = d1_common.url.joinPathElements(
+      self.base_url, self.encode_and_join_path_elements(*rest_path)
+    )
+    if query:
+      url += '?' + urllib.parse.urlencode(query)
+    return url
+
+  async def _send(self, method, url, headers):
+    parts = urllib.parse.urlsplit(url)
+    is_https = parts.scheme == 'https'
+    reader, writer = await asyncio.open_connection(
+      parts.hostname, parts.port or (443 if is_https else 80),
+      ssl=self._ssl_context if is_https else None
+    )
+    try:
+      writer.write(self._format_request_head(method, parts, headers))
+      await writer.drain()
+      status_code, reason, response_headers = await self._read_response_head(
+        reader
+      )
+      content = await self._read_response_body(
+        reader, method, status_code, response_headers
+      )
+    finally:
+      writer.close()
+      try:
+        await writer.wait_closed()
+      except OSError:
+        # The response has been read, or a more relevant error is being raised.
+        pass
+    return AsyncResponse(
+      method, url, status_code, reason, response_headers, content
+    )
+
+  def _format_request_head(self, method, parts, headers):
+    target = parts.path or '/'
+    if parts.query:
+      target += '?' + parts.query
+    line_list = [
+      '{} {} HTTP/1.1'.format(method, target),
+      'Host: {}'.format(parts.netloc),
+    ]
+    line_list.extend('{}: {}'.format(k, v) for k, v in headers.items())
+    return ('\r\n'.join(line_list) + '\r\n\r\n').encode('latin-1')
+
+  async def _read_response_head(self, reader):
+    status_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+    try:
+      _version, status_code, reason = (status_line.split(' ', 2) + [''])[:3]
+      status_code = int(status_code)
+    except ValueError:
+      raise requests.exceptions.ConnectionError(
+        'Invalid status line in response: "{}"'.format(status_line)
+      )
+    headers = requests.structures.CaseInsensitiveDict()
+    while True:
+      line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+      if not line:
+        break
+      name, _, value = line.partition(':')
+      name, value = name.strip(), value.strip()
+      headers[name] = (
+        '{}, {}'.format(headers[name], value) if name in headers else value
+      )
+    return status_code, reason, headers
+
+  async def _read_response_body(self, reader, method, status_code, headers):
+    if method == 'HEAD' or status_code in (204, 304) or status_code < 200:
+      return b''
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+      return await self._read_chunked_body(reader)
+    if 'Content-Length' in headers:
+      return await reader.readexactly(int(headers['Content-Length']))
+    # The connection is not reused, so the body ends when it is closed.
+    return await reader.read()
+
+  async def _read_chunked_body(self, reader):
+    chunk_list = []
+    while True:
+      size_line = await reader.readline()
+      chunk_size = int(size_line.split(b';')[0].strip(), 16)
+      if not chunk_size:
+        break
+      chunk_list.append(await reader.readexactly(chunk_size))
+      await reader.readline()
+    # Skip any trailers.
+    while (await reader.readline()).strip():
+      pass
+    return b''.join(chunk_list)
+
+  def _record_response(self, response, elapsed_sec):
+    labels = {'service': 'pasta', 'method': response.method}
+    pasta_gmn_adapter.app.metrics.registry.observe(
+      'pasta_gmn_adapter_upstream_request_seconds', elapsed_sec, labels
+    )
+    if response.status_code >= 400:
+      labels['status'] = response.status_code
+      pasta_gmn_adapter.app.metrics.registry.inc(
+        'pasta_gmn_adapter_upstream_request_errors_total', labels
+      )
+
+  async def _get_data_redirect_header(self, redirect_url):
+    # As with the synchronous client, the credentials for PASTA are not passed
+    # on to the temporary URL.
+    return await self.request('HEAD', redirect_url, add_basic_auth_header=False)
+
+  # ----------------------------------------------------------------------------
+  # Data Package Manager web service API wrappers
+  # ----------------------------------------------------------------------------
+
+  # List Data Entities
+
+  async def list_data_entities(self, package_id):
+    """List the entity IDs of the data members of a package"""
+    response = await self.list_data_entities_response(package_id)
+    identifiers = self._read_text_response(response)
+    return sorted(identifiers.strip().split('\n'))
+
+  async def list_data_entities_response(self, package_id):
+    return await self.GET([
+      'data', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # List Data Package Identifiers
+
+  async def list_data_package_identifiers(self, scope):
+    response = await self.list_data_package_identifiers_response(scope)
+    identifiers = self._read_text_response(response)
+    return sorted(map(int, identifiers.strip().split('\n')))
+
+  async def list_data_package_identifiers_response(self, scope):
+    return await self.GET(['eml', scope])
+
+  # List Data Package Revisions
+
+  async def list_data_package_revisions(self, scope, identifier):
+    response = await self.list_data_package_revisions_response(
+      scope, identifier
+    )
+    identifiers = self._read_text_response(response)
+    return sorted(map(int, identifiers.strip().split('\n')))
+
+  async def list_data_package_revisions_response(self, scope, identifier):
+    return await self.GET(['eml', scope, str(identifier)])
+
+  # List Data Package Scopes
+
+  async def list_data_package_scopes(self):
+    response = await self.list_data_package_scopes_response()
+    identifiers = self._read_text_response(response)
+    return sorted(identifiers.strip().split('\n'))
+
+  async def list_data_package_scopes_response(self):
+    return await self.GET('eml')
+
+  # List Deleted Data Packages
+
+  async def list_deleted_packages(self):
+    response = await self.list_deleted_packages_response()
+    identifiers = self._read_text_response(response)
+    return sorted(identifiers.strip().split('\n'))
+
+  async def list_deleted_packages_response(self):
+    return await self.GET(['eml', 'deleted'])
+
+  # Read Data Entity Name
+
+  async def read_data_entity_name(self, package_id, entity_id):
+    response = await self.read_data_entity_name_response(package_id, entity_id)
+    return self._read_raw_response(response)
+
+  async def read_data_entity_name_response(self, package_id, entity_id):
+    return await self.GET([
+      'data', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision()), entity_id
+    ])
+
+  # Read Data Package DOI
+
+  async def read_data_package_doi(self, package_id):
+    response = await self.read_data_package_doi_response(package_id)
+    return self._read_text_response(response).strip()
+
+  async def read_data_package_doi_response(self, package_id):
+    return await self.GET([
+      'doi', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Data Package Resource Metadata
+
+  async def read_data_package_created(self, package_id):
+    response = await self.read_data_package_resource_metadata_response(
+      package_id
+    )
+    return self._read_date_created_response(response)
+
+  async def read_data_package_resource_metadata_response(self, package_id):
+    return await self.GET([
+      'rmd', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Is Authorized
+
+  async def is_authorized(self, package_id, entity_id):
+    """Determine if read access to data entity is authorized"""
+    response = await self.is_authorized_response(package_id, entity_id)
+    return self._read_text_response(response)
+
+  async def is_authorized_response(self, package_id, entity_id):
+    return await self.GET(['authz'], query={
+      'resourceId': self.entity_uri(package_id, entity_id),
+    })
+
+  # Read Data Package ACL
+
+  async def read_data_package_acl(self, package_id):
+    response = await self.read_data_package_acl_response(package_id)
+    return self._read_eml_access_response(response)
+
+  async def read_data_package_acl_response(self, package_id):
+    return await self.GET([
+      'acl', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Data Entity ACL
+
+  async def read_data_entity_acl(self, package_id, entity_id):
+    response = await self.read_data_entity_acl_response(package_id, entity_id)
+    return self._read_eml_access_response(response)
+
+  async def read_data_entity_acl_response(self, package_id, entity_id):
+    return await self.GET([
+      'data', 'acl', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision()), entity_id
+    ])
+
+  # Read Data Package Report ACL
+
+  async def read_quality_report_acl(self, package_id):
+    response = await self.read_quality_report_acl_response(package_id)
+    return self._read_eml_access_response(response)
+
+  async def read_quality_report_acl_response(self, package_id):
+    return await self.GET([
+      'report', 'acl', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Metadata ACL
+
+  async def read_metadata_acl(self, package_id):
+    response = await self.read_metadata_acl_response(package_id)
+    return self._read_eml_access_response(response)
+
+  async def read_metadata_acl_response(self, package_id):
+    return await self.GET([
+      'metadata', 'acl', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Data Entity Checksum (SHA-1)
+
+  async def read_data_entity_checksum(self, package_id, entity_id):
+    response = await self.read_data_entity_checksum_response(
+      package_id, entity_id
+    )
+    return self._read_text_response(response).strip()
+
+  async def read_data_entity_checksum_response(self, package_id, entity_id):
+    return await self.GET([
+      'data', 'checksum', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision()),
+      str(entity_id)
+    ])
+
+  # Read Data Package Report Checksum (SHA-1)
+
+  async def read_data_package_report_checksum(self, package_id):
+    response = await self.read_data_package_report_checksum_response(
+      package_id
+    )
+    return self._read_text_response(response).strip()
+
+  async def read_data_package_report_checksum_response(self, package_id):
+    return await self.GET([
+      'report', 'checksum', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Metadata Checksum (SHA-1)
+
+  async def read_metadata_checksum(self, package_id):
+    response = await self.read_metadata_checksum_response(package_id)
+    return self._read_text_response(response).strip()
+
+  async def read_metadata_checksum_response(self, package_id):
+    return await self.GET([
+      'metadata', 'checksum', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Read Metadata Format ID
+
+  async def read_metadata_format_id(self, package_id):
+    """Returns the Format ID, e.g., eml://ecoinformatics.org/eml-2.1.0
+    """
+    response = await self.read_metadata_format_id_response(package_id)
+    return self._read_text_response(response).strip()
+
+  async def read_metadata_format_id_response(self, package_id):
+    return await self.GET([
+      'metadata', 'format', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
+  # Get Data Entry Header
+
+  async def get_data_entry_header(self, resource_url):
+    logging.info('Resource URL: {}'.format(resource_url))
+    response = await self.get_data_entry_header_response(resource_url)
+    if self._status_is_307_temporary_redirect(response):
+      temporary_url = response.headers['Location']
+      response = await self._get_data_redirect_header(temporary_url)
+    return self._read_header_response(response)
+
+  async def get_data_entry_header_response(self, resource_url):
+    return await self.HEAD_URL(resource_url)
+
+  # Read EML
+
+  async def read_eml(self, eml_url):
+    response = await self.read_eml_response(eml_url)
+    return self._read_xml_response(response)
+
+  async def read_eml_response(self, eml_url):
+    return await self.GET_URL(eml_url)
+
+  # Utils
+
+  async def read_metadata_replication_policy(self, package_id):
+    """Retrieve EML doc from {eml_url}, extract and return the DataONE
+    Replication Policy XML document if one exists. Else return None.
+    """
+    eml_url = self.metadata_url(package_id)
+    return self.parse_replication_policy(await self.read_eml(eml_url))
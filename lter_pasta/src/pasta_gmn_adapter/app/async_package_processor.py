@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`async_package_processor`
+=================================
+
+:Synopsis:
+  Process several queued packages at once on an asyncio event loop.
+
+  The PASTA information for the packages is collected with
+  AsyncDataPackageManagerClient. All requests for a package, including the
+  per-entity requests, are issued together, so a single thread can keep
+  hundreds of requests to PASTA in flight. The objects are created on GMN by
+  the existing GMNPackageCreator, running in a pool of threads, with the members
+  of a package created concurrently before its resource map.
+
+  The Django ORM cannot be used from a thread that runs an event loop, so all
+  database access goes through a dedicated thread, which also keeps it on a
+  single connection.
+
+  The revisions of a package are processed in order. Packages in different
+  series are processed concurrently, in the order given by the scheduler.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+import django.db
+
+import pasta_gmn_adapter.app.async_data_package_manager_client
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.metrics
+import pasta_gmn_adapter.app.population_queue_processor
+import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
+
+
+class AsyncPackageProcessor(object):
+  def __init__(
+      self, package_concurrency, request_concurrency, gmn_worker_count,
+      insert_status_fn, abandon_fn
+  ):
+    """{insert_status_fn} records the status of a queue item. It is called as
+    insert_status_fn(package, status, return_code, return_body, start_sec).
+    {abandon_fn} records a package that exceeded its time budget. It is called
+    as abandon_fn(package, e, start_sec). Both are called from the database
+    thread."""
+    self._package_concurrency = package_concurrency
+    self._request_concurrency = request_concurrency
+    self._gmn_worker_count = gmn_worker_count
+    self._insert_status_fn = insert_status_fn
+    self._abandon_fn = abandon_fn
+    self._thread_local = threading.local()
+    self._db_executor = None
+    self._gmn_executor = None
+
+  def process_population_queue(self, population_queue):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as db_executor:
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._gmn_worker_count
+      ) as gmn_executor:
+        self._db_executor = db_executor
+        self._gmn_executor = gmn_executor
+        try:
+          asyncio.run(self._process_population_queue(population_queue))
+        finally:
+          db_executor.submit(django.db.connection.close).result()
+
+  async def _process_population_queue(self, population_queue):
+    self._package_semaphore = asyncio.Semaphore(self._package_concurrency)
+    self._collector = AsyncDataPackageInfoCollector(
+      self._request_concurrency, self.run_db
+    )
+    series_dict = collections.OrderedDict()
+    for package in population_queue:
+      series_dict.setdefault(
+        (package['package_scope'], package['package_identifier']), []
+      ).append(package)
+    await asyncio.gather(
+      *[self._process_series(package_list) for package_list in
+        series_dict.values()]
+    )
+
+  async def _process_series(self, package_list):
+    for package in package_list:
+      async with self._package_semaphore:
+        await self._process_package_with_status(package)
+
+  async def _process_package_with_status(self, package):
+    start_sec = time.time()
+    budget_sec = pasta_gmn_adapter.settings.PACKAGE_DEADLINE_SECONDS
+    gmn_future_list = []
+    try:
+      try:
+        await asyncio.wait_for(
+          self._process_package(
+            package, None if budget_sec is None else start_sec + budget_sec,
+            gmn_future_list
+          ), budget_sec
+        )
+      except asyncio.TimeoutError:
+        # Cancelling the package does not stop GMN calls that are already
+        # running in the thread pool. They stop when their requests run into the
+        # package budget, so wait for them before recording the package as
+        # abandoned, so that the next revision is not started alongside them.
+        await asyncio.gather(
+          *[asyncio.wrap_future(f) for f in gmn_future_list if not f.done()],
+          return_exceptions=True
+        )
+        raise pasta_gmn_adapter.app.deadline.DeadlineExceeded(
+          'Package budget spent. budget={} sec'.format(budget_sec)
+        )
+    except pasta_gmn_adapter.app.deadline.DeadlineExceeded as e:
+      logging.error('Abandoned: {0}'.format(str(e)))
+      await self.run_db(self._abandon_fn, package, e, start_sec)
+    except Exception as e:
+      status, return_code, return_body = (
+        pasta_gmn_adapter.app.population_queue_processor.get_failure_status(e)
+      )
+      await self.run_db(
+        self._insert_status_fn, package, status, return_code, return_body,
+        start_sec
+      )
+    else:
+      await self.run_db(
+        self._insert_status_fn, package, 'completed', 0, '', start_sec
+      )
+
+  async def _process_package(self, package, end_sec, gmn_future_list):
+    package_id = pasta_gmn_adapter.app.population_queue_processor.PackageID(
+      package['package_scope'], package['package_identifier'],
+      package['package_revision']
+    )
+    logging.info('Processing Package: {0}'.format(package_id))
+    package_info = await self.run_db(
+      pasta_gmn_adapter.app.population_queue_processor.
+      get_prefetched_package_info, package
+    )
+    if package_info is None:
+      package_info = await self._collector.collect_package_info(package_id)
+    previous_revision = await self.run_db(
+      pasta_gmn_adapter.app.sql.select_latest_package_revision,
+      package['package_scope'], package['package_identifier']
+    )
+    member_list = package_info['entities'] + [
+      package_info['report'], package_info['metadata']
+    ]
+    await asyncio.gather(
+      *[
+        self.run_gmn(end_sec, gmn_future_list, 'create_object', object_meta)
+        for object_meta in member_list
+      ]
+    )
+    if previous_revision is None:
+      await self.run_gmn(
+        end_sec, gmn_future_list, 'create_resource_map', package_info
+      )
+    else:
+      # Only the PID of the previous resource map is needed for the update.
+      previous_package_pid = await self._collector.collect_package_doi(
+        pasta_gmn_adapter.app.population_queue_processor.PackageID(
+          package['package_scope'], package['package_identifier'],
+          previous_revision
+        )
+      )
+      await self.run_gmn(
+        end_sec, gmn_future_list, 'update_resource_map', package_info,
+        previous_package_pid
+      )
+    await self.run_db(
+      pasta_gmn_adapter.app.sql.delete_prefetched_package_info, package['id']
+    )
+
+  async def run_db(self, fn, *args):
+    """Run {fn} in the database thread."""
+    return await asyncio.get_running_loop().run_in_executor(
+      self._db_executor, fn, *args
+    )
+
+  async def run_gmn(self, end_sec, gmn_future_list, method_name, *args):
+    """Call a method of the GMN package creator in the GMN thread pool, with
+    the remaining budget of the package applied to its requests. The future of
+    the call is added to {gmn_future_list}."""
+    future = self._gmn_executor.submit(
+      self._call_creator, end_sec, method_name, args
+    )
+    gmn_future_list.append(future)
+    return await asyncio.wrap_future(future)
+
+  def _call_creator(self, end_sec, method_name, args):
+    with pasta_gmn_adapter.app.deadline.package_budget(
+        None if end_sec is None else end_sec - time.time(),
+        pasta_gmn_adapter.settings.PACKAGE_WATCHDOG_GRACE_SECONDS
+    ):
+      return getattr(self._get_creator(), method_name)(*args)
+
+  def _get_creator(self):
+    """Return a GMN package creator for the current thread."""
+    try:
+      return self._thread_local.creator
+    except AttributeError:
+      self._thread_local.creator = (
+        pasta_gmn_adapter.app.population_queue_processor.GMNPackageCreator()
+      )
+      return self._thread_local.creator
+
+
+# ===============================================================================
+
+
+class AsyncDataPackageInfoCollector(object):
+  """Collect the same information as DataPackageInfoCollector, with the
+  requests for the package and all its entities issued concurrently."""
+
+  def __init__(self, request_concurrency, run_db):
+    """{run_db} is a coroutine function that runs a function in the database
+    thread."""
+    self._pasta_client = (
+      pasta_gmn_adapter.app.async_data_package_manager_client.
+      AsyncDataPackageManagerClient(
+        add_basic_auth_header=True, max_concurrency=request_concurrency
+      )
+    )
+    self._pasta_client_public_access = (
+      pasta_gmn_adapter.app.async_data_package_manager_client.
+      AsyncDataPackageManagerClient(
+        add_basic_auth_header=False, max_concurrency=request_concurrency
+      )
+    )
+    self._run_db = run_db
+
+  async def collect_package_info(self, package_id):
+    entity_ids = await self._pasta_client.list_data_entities(package_id)
+    await asyncio.gather(
+      *[
+        self._pasta_client_public_access.is_authorized(package_id, entity_id)
+        for entity_id in entity_ids
+      ]
+    )
+    package_info = await _gather_dict(
+      package=self._get_package_info(package_id),
+      entities=asyncio.gather(
+        *[
+          self._get_entity_info(package_id, entity_id)
+          for entity_id in entity_ids
+        ]
+      ),
+      report=self._get_quality_report_info(package_id),
+      metadata=self._get_metadata_info(package_id),
+      d1_replication_policy=self._pasta_client.
+      read_metadata_replication_policy(package_id),
+    )
+    d1_replication_policy = package_info.pop('d1_replication_policy')
+    package_info['entities'] = list(package_info['entities'])
+    package_info['package']['d1_replication_policy'] = d1_replication_policy
+    for entity_info in package_info['entities']:
+      entity_info['d1_replication_policy'] = d1_replication_policy
+    package_info['report']['d1_replication_policy'] = d1_replication_policy
+    package_info['metadata']['d1_replication_policy'] = d1_replication_policy
+    return package_info
+
+  async def collect_package_doi(self, package_id):
+    return await self._pasta_client.read_data_package_doi(package_id)
+
+  async def _get_package_info(self, package_id):
+    return await _gather_dict(
+      doi=self._pasta_client.read_data_package_doi(package_id),
+      permissions=self._pasta_client.read_data_package_acl(package_id),
+      timestamp=self._pasta_client.read_data_package_created(package_id),
+    )
+
+  async def _get_entity_info(self, package_id, entity_id):
+    resource_id = self._pasta_client.entity_uri(package_id, entity_id)
+    checksum, permissions = await asyncio.gather(
+      self._pasta_client.read_data_entity_checksum(package_id, entity_id),
+      self._pasta_client.read_data_entity_acl(package_id, entity_id),
+    )
+    return {
+      'entity_id': entity_id,
+      'resource_id': resource_id,
+      'header': await self._get_entity_header(entity_id, resource_id, checksum),
+      'permissions': permissions,
+      'checksum': checksum,
+    }
+
+  async def _get_entity_header(self, entity_id, resource_id, checksum):
+    """As DataPackageInfoCollector._get_entity_header()."""
+    if not pasta_gmn_adapter.settings.REUSE_ENTITY_HEADERS:
+      return await self._pasta_client.get_data_entry_header(resource_id)
+    header = await self._run_db(
+      pasta_gmn_adapter.app.sql.select_entity_header, entity_id, checksum
+    )
+    pasta_gmn_adapter.app.metrics.registry.inc(
+      'pasta_gmn_adapter_entity_header_lookups_total',
+      {'result': 'miss' if header is None else 'hit'}
+    )
+    if header is None:
+      header = await self._pasta_client.get_data_entry_header(resource_id)
+      await self._run_db(
+        pasta_gmn_adapter.app.sql.insert_entity_header, entity_id, checksum,
+        header['content-length'], header['content-type']
+      )
+    return header
+
+  async def _get_quality_report_info(self, package_id):
+    report_uri = self._pasta_client.report_uri(package_id)
+    report_info = await _gather_dict(
+      header=self._pasta_client.get_data_entry_header(report_uri),
+      permissions=self._pasta_client.read_quality_report_acl(package_id),
+      checksum=self._pasta_client.read_data_package_report_checksum(package_id),
+    )
+    report_info['resource_id'] = report_uri
+    return report_info
+
+  async def _get_metadata_info(self, package_id):
+    metadata_url = self._pasta_client.metadata_url(package_id)
+    metadata_info = await _gather_dict(
+      header=self._pasta_client.get_data_entry_header(metadata_url),
+      permissions=self._pasta_client.read_metadata_acl(package_id),
+      format_id=self._pasta_client.read_metadata_format_id(package_id),
+      checksum=self._pasta_client.read_metadata_checksum(package_id),
+    )
+    metadata_info['resource_id'] = metadata_url
+    return metadata_info
+
+
+async def _gather_dict(**awaitable_dict):
+  """Await the values of {awaitable_dict} concurrently, and return a dict of
+  the results under the same keys."""
+  key_list = list(awaitable_dict)
+  result_list = await asyncio.gather(*awaitable_dict.values())
+  return dict(zip(key_list, result_list))
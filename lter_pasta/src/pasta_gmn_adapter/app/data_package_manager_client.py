@@ -22,13 +22,14 @@
 """
 
 import base64
-import http.client
+import datetime
+import http
 import io
 import logging
-import pprint
 import urllib.parse
 import xml.etree.ElementTree as ET
 
+import requests
 import requests.structures
 
 import d1_common.const
@@ -37,7 +38,11 @@ import d1_common.util
 
 import d1_client.baseclient
 
+import connector_util.lazy_log
+
 import pasta_gmn_adapter.api_types.eml_access
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.metrics
 from pasta_gmn_adapter import api_types
 from pasta_gmn_adapter import settings
 
@@ -46,6 +51,10 @@ NAMESPACE_DICT = {
   'd1v1': 'http://ns.dataone.org/service/types/v1'
 }
 
+# Format of dateCreated in PASTA resource metadata, e.g.,
+# "2017-05-11 13:42:50.418".
+DATE_CREATED_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
 
 # Raised when the Data Package Manager returns an error response.
 class DataPackageManagerException(Exception):
@@ -64,43 +73,10 @@ class DataPackageManagerException(Exception):
 #=============================================================================
 
 
-class DataPackageManagerClient(
-    d1_client.baseclient.DataONEBaseClient,):
-  """PASTA Data Package Manager web service API methods that are used by the
-  PASTA GMN Adapter.
-
-  Error responses are translated into exceptions.
-  """
-
-  def __init__(self, **kwargs):
-    """Connect to the PASTA Data Package Manager web service API.
-    """
-    base_url = kwargs.pop('base_url', settings.PASTA_BASE_URL)
-    logging.debug('PASTA BaseURL: {0}'.format(base_url))
-
-    add_basic_auth_header = kwargs.pop('add_basic_auth_header', True)
-
-    # Workaround for issue where PASTA appears to return an invalid response
-    # after the connection has been reused many times (only happens for
-    # packages with many data entities).
-    kwargs.setdefault('headers', requests.structures.CaseInsensitiveDict())
-    kwargs['headers'].setdefault('Connection', 'close')
-    kwargs.setdefault('user_agent', settings.PASTA_GMN_ADAPTER_USER_AGENT)
-    kwargs.setdefault('user_agent', settings.PASTA_GMN_ADAPTER_USER_AGENT)
-
-    # Debug: Disable server side certificate verification
-    kwargs.setdefault('verify_tls', False)
-
-    if add_basic_auth_header:
-      kwargs['headers'].update((self._mk_http_basic_auth_header(),))
-
-    logging.debug('DataPackageManagerClient() kwargs={}'.format(pprint.pformat(kwargs)))
-
-    super(DataPackageManagerClient, self).__init__(base_url, **kwargs)
-
-  def _get_api_version_path_element(self):
-    """Override the default API version selection for PASTA"""
-    return ''
+class DataPackageManagerBase(object):
+  """Request authentication, URL construction and response handling that are
+  shared by the synchronous and asynchronous PASTA clients. Responses must
+  provide status_code, headers and text, like requests.Response."""
 
   def _mk_http_basic_auth_header(self):
     return (
@@ -113,24 +89,6 @@ class DataPackageManagerClient(
       )
     )
 
-  def _parse_url(self, url):
-    parts = urllib.parse.urlsplit(url)
-    if parts.port is None:
-      port = 443 if parts.scheme == 'https' else 80
-    else:
-      port = parts.port
-    host = parts.netloc.split(':')[0]
-    return parts.scheme, host, port, parts.path, parts.query, parts.fragment
-
-  def GET_URL(self, url, **kwargs):
-    return self._session.request('GET', url, **kwargs)
-
-  def HEAD_URL(self, url, **kwargs):
-    return self._session.request('HEAD', url, **kwargs)
-
-  def POST_URL(self, url, **kwargs):
-    return self._session.request('POST', url, **kwargs)
-
   # ----------------------------------------------------------------------------
   # Response handling.
   # ----------------------------------------------------------------------------
@@ -157,13 +115,6 @@ class DataPackageManagerClient(
   #   Else:
   #     - Raise exception with body of response as error message.
 
-  def _get_data_redirect_header(self, redirect_url):
-    urlsplit = urllib.parse.urlparse(redirect_url)
-    full_path = urlsplit.path + '?' + urlsplit.query
-    conn = http.client.HTTPConnection(urlsplit.netloc)
-    conn.request('HEAD', full_path)
-    return conn.getresponse()
-
   def _read_and_capture(self, response):
     response_body = response.text
     return response_body
@@ -236,6 +187,144 @@ class DataPackageManagerClient(
     eml_access_xml_doc = response.text
     return pasta_gmn_adapter.api_types.eml_access.EMLAccess(eml_access_xml_doc)
 
+  def _read_date_created_response(self, response):
+    """Return the time at which PASTA created the package, from the
+    dateCreated element of a resource metadata document, as a naive datetime.
+    """
+    resource_metadata_xml = self._read_raw_response(response)
+    date_created = ET.fromstring(resource_metadata_xml).findtext('dateCreated')
+    if date_created is None:
+      self._raise_data_package_manager_exception(
+        'Resource metadata has no dateCreated', response
+      )
+    date_created = date_created.strip()
+    if '.' not in date_created:
+      date_created += '.0'
+    return datetime.datetime.strptime(date_created, DATE_CREATED_FORMAT)
+
+  def entity_uri(self, package_id, entity_id):
+    return d1_common.url.joinPathElements(
+      self.base_url,
+      self.encode_and_join_path_elements(
+        'data', 'eml', package_id.scope(), package_id.identifier(),
+        package_id.revision(), entity_id
+      )
+    )
+
+  def report_uri(self, package_id):
+    return d1_common.url.joinPathElements(
+      self.base_url,
+      self.encode_and_join_path_elements(
+        'report', 'eml', package_id.scope(), package_id.identifier(),
+        package_id.revision()
+      )
+    )
+
+  def metadata_url(self, package_id):
+    return d1_common.url.joinPathElements(
+      self.base_url,
+      self.encode_and_join_path_elements(
+        'metadata', 'eml', package_id.scope(), package_id.identifier(),
+        package_id.revision()
+      )
+    )
+
+  def encode_and_join_path_elements(self, *elements):
+    return d1_common.url.joinPathElements(
+      *[d1_common.url.encodePathElement(e) for e in elements]
+    )
+
+  def parse_replication_policy(self, eml_xml):
+    """Extract and return the DataONE Replication Policy XML document from
+    {eml_xml} if one exists. Else return None.
+    """
+    tree = ET.ElementTree(ET.fromstring(eml_xml))
+    root = tree.getroot()
+    replication_policy_list = root.findall(
+      "additionalMetadata/metadata/d1v1:replicationPolicy", NAMESPACE_DICT
+    )
+    if len(replication_policy_list):
+      return ET.tostring(replication_policy_list[0])
+
+
+#=============================================================================
+
+
+class DataPackageManagerClient(
+    DataPackageManagerBase, d1_client.baseclient.DataONEBaseClient,):
+  """PASTA Data Package Manager web service API methods that are used by the
+  PASTA GMN Adapter.
+
+  Error responses are translated into exceptions.
+  """
+
+  def __init__(self, **kwargs):
+    """Connect to the PASTA Data Package Manager web service API.
+    """
+    base_url = kwargs.pop('base_url', settings.PASTA_BASE_URL)
+    logging.debug('PASTA BaseURL: {0}'.format(base_url))
+
+    add_basic_auth_header = kwargs.pop('add_basic_auth_header', True)
+
+    # Workaround for issue where PASTA appears to return an invalid response
+    # after the connection has been reused many times (only happens for
+    # packages with many data entities).
+    kwargs.setdefault('headers', requests.structures.CaseInsensitiveDict())
+    kwargs['headers'].setdefault('Connection', 'close')
+    kwargs.setdefault('user_agent', settings.PASTA_GMN_ADAPTER_USER_AGENT)
+    kwargs.setdefault('user_agent', settings.PASTA_GMN_ADAPTER_USER_AGENT)
+    kwargs.setdefault('timeout', settings.PASTA_RESPONSE_TIMEOUT)
+
+    # Debug: Disable server side certificate verification
+    kwargs.setdefault('verify_tls', False)
+
+    if add_basic_auth_header:
+      kwargs['headers'].update((self._mk_http_basic_auth_header(),))
+
+    logging.debug(
+      'DataPackageManagerClient() kwargs=%s',
+      connector_util.lazy_log.pformat(kwargs)
+    )
+
+    super(DataPackageManagerClient, self).__init__(base_url, **kwargs)
+
+    # The temporary URLs to which PASTA redirects data entity requests are
+    # requested through a separate session, so that the credentials for PASTA
+    # are not passed on to them. The package budget and the request metrics
+    # apply to both sessions.
+    self._redirect_session = requests.Session()
+    self._redirect_session.headers['User-Agent'] = kwargs['user_agent']
+    for session in (self._session, self._redirect_session):
+      pasta_gmn_adapter.app.metrics.add_request_hook(session, 'pasta')
+      pasta_gmn_adapter.app.deadline.add_deadline_hook(session, 'pasta')
+
+  def _get_api_version_path_element(self):
+    """Override the default API version selection for PASTA"""
+    return ''
+
+  def _parse_url(self, url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.port is None:
+      port = 443 if parts.scheme == 'https' else 80
+    else:
+      port = parts.port
+    host = parts.netloc.split(':')[0]
+    return parts.scheme, host, port, parts.path, parts.query, parts.fragment
+
+  def GET_URL(self, url, **kwargs):
+    return self._session.request('GET', url, **kwargs)
+
+  def HEAD_URL(self, url, **kwargs):
+    return self._session.request('HEAD', url, **kwargs)
+
+  def POST_URL(self, url, **kwargs):
+    return self._session.request('POST', url, **kwargs)
+
+  def _get_data_redirect_header(self, redirect_url):
+    return self._redirect_session.head(
+      redirect_url, timeout=settings.PASTA_RESPONSE_TIMEOUT
+    )
+
   # ----------------------------------------------------------------------------
   # Misc.
   # ----------------------------------------------------------------------------
@@ -353,6 +442,20 @@ class DataPackageManagerClient(
       str(package_id.revision())
     ])
 
+  # Read Data Package Resource Metadata
+
+  def read_data_package_created(self, package_id):
+    response = self.read_data_package_resource_metadata_response(package_id)
+    return self._read_date_created_response(response)
+
+  def read_data_package_resource_metadata_response(self, package_id):
+    return self.GET([
+      'rmd', 'eml',
+      package_id.scope(),
+      str(package_id.identifier()),
+      str(package_id.revision())
+    ])
+
   # Is Authorized
 
   def is_authorized(self, package_id, entity_id):
@@ -509,46 +612,7 @@ class DataPackageManagerClient(
     Replication Policy XML document if one exists. Else return None.
     """
     eml_url = self.metadata_url(package_id)
-    eml_xml = self.read_eml(eml_url)
-    tree = ET.ElementTree(ET.fromstring(eml_xml))
-    root = tree.getroot()
-    replication_policy_list = root.findall(
-      "additionalMetadata/metadata/d1v1:replicationPolicy", NAMESPACE_DICT
-    )
-    if len(replication_policy_list):
-      return ET.tostring(replication_policy_list[0])
-
-  def entity_uri(self, package_id, entity_id):
-    return d1_common.url.joinPathElements(
-      self.base_url,
-      self.encode_and_join_path_elements(
-        'data', 'eml', package_id.scope(), package_id.identifier(),
-        package_id.revision(), entity_id
-      )
-    )
-
-  def report_uri(self, package_id):
-    return d1_common.url.joinPathElements(
-      self.base_url,
-      self.encode_and_join_path_elements(
-        'report', 'eml', package_id.scope(), package_id.identifier(),
-        package_id.revision()
-      )
-    )
-
-  def metadata_url(self, package_id):
-    return d1_common.url.joinPathElements(
-      self.base_url,
-      self.encode_and_join_path_elements(
-        'metadata', 'eml', package_id.scope(), package_id.identifier(),
-        package_id.revision()
-      )
-    )
-
-  def encode_and_join_path_elements(self, *elements):
-    return d1_common.url.joinPathElements(
-      *[d1_common.url.encodePathElement(e) for e in elements]
-    )
+    return self.parse_replication_policy(self.read_eml(eml_url))
 
   # Metadata DOIs are not yet implemented in PASTA.
 
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`deadline`
+==================
+
+:Synopsis:
+  Wall clock budget for processing a package.
+
+  While a package is being processed, each request to PASTA and GMN gets the
+  remaining budget as its timeout, if that is shorter than the configured
+  response timeout, and requests are refused once the budget is spent. This
+  bounds the time spent on a package when an endpoint is slow to respond.
+
+  Calls that do not return within the budget, such as a response that
+  trickles in below the socket timeout, are interrupted by a watchdog based on
+  SIGALRM, which fires when the budget and a grace period have passed. The
+  watchdog is only available in the main thread, where the management commands
+  run.
+
+  The budget is kept per thread, so clients used outside of the queue processor
+  are not affected.
+"""
+
+import contextlib
+import signal
+import threading
+import time
+
+import requests.exceptions
+
+import pasta_gmn_adapter.app.metrics
+
+
+class DeadlineExceeded(Exception):
+  def __init__(self, msg):
+    self.msg = msg
+
+  def __str__(self):
+    return 'DeadlineExceeded: {}'.format(self.msg)
+
+
+class PackageDeadline(object):
+  """Per thread package budget, and the time lost to requests that timed out
+  since the last call to reset_stats()."""
+
+  def __init__(self):
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self.reset_stats()
+
+  def start(self, budget_sec):
+    self._local.end_sec = time.time() + budget_sec
+
+  def clear(self):
+    self._local.end_sec = None
+
+  def is_active(self):
+    return getattr(self._local, 'end_sec', None) is not None
+
+  def get_remaining_sec(self):
+    """Return the remaining budget, or None if no budget is active."""
+    if not self.is_active():
+      return None
+    return self._local.end_sec - time.time()
+
+  def get_timeout(self, timeout):
+    """Return the timeout to use for a request, given the configured
+    {timeout}. Raise DeadlineExceeded if the budget is spent."""
+    remaining_sec = self.get_remaining_sec()
+    if remaining_sec is None:
+      return timeout
+    if remaining_sec <= 0:
+      raise DeadlineExceeded(
+        'Package budget spent. overdue={:.2f} sec'.format(-remaining_sec)
+      )
+    if timeout is None:
+      return remaining_sec
+    # requests accepts a single timeout or a (connect, read) tuple.
+    if isinstance(timeout, tuple):
+      return tuple(
+        remaining_sec if t is None else min(t, remaining_sec) for t in timeout
+      )
+    return min(timeout, remaining_sec)
+
+  def add_timed_out_request(self, elapsed_sec):
+    with self._lock:
+      self.timed_out_request_count += 1
+      self.timed_out_sec += elapsed_sec
+
+  def reset_stats(self):
+    with self._lock:
+      self.timed_out_request_count = 0
+      self.timed_out_sec = 0.0
+
+
+deadline = PackageDeadline()
+
+
+@contextlib.contextmanager
+def package_budget(budget_sec, grace_sec):
+  """Apply a budget of {budget_sec} to the requests made by the current thread
+  within the block, and interrupt the block with DeadlineExceeded if it is still
+  running {grace_sec} after the budget is spent. No budget is applied if
+  {budget_sec} is None."""
+  if budget_sec is None:
+    yield
+    return
+  deadline.start(budget_sec)
+  is_watchdog_set = _set_watchdog(budget_sec + grace_sec)
+  try:
+    yield
+  finally:
+    if is_watchdog_set:
+      _clear_watchdog()
+    deadline.clear()
+
+
+def add_deadline_hook(session, service):
+  """Cap the timeout of all requests made through a requests Session to the
+  remaining package budget, and record the time spent on requests that time
+  out. {service} is "pasta" or "gmn"."""
+  request_fn = session.request
+
+  def request_with_deadline(method, url, **kwargs):
+    kwargs['timeout'] = deadline.get_timeout(kwargs.get('timeout'))
+    start_sec = time.time()
+    try:
+      return request_fn(method, url, **kwargs)
+    except requests.exceptions.Timeout:
+      elapsed_sec = time.time() - start_sec
+      deadline.add_timed_out_request(elapsed_sec)
+      pasta_gmn_adapter.app.metrics.registry.inc(
+        'pasta_gmn_adapter_timed_out_request_seconds_total',
+        {'service': service}, elapsed_sec
+      )
+      remaining_sec = deadline.get_remaining_sec()
+      if remaining_sec is not None and remaining_sec <= 0:
+        raise DeadlineExceeded(
+          'Request timed out when the package budget was spent. url="{}"'.
+          format(url)
+        )
+      raise
+
+  session.request = request_with_deadline
+
+
+def cancel_watchdog():
+  """Disarm the watchdog set by package_budget() as soon as the work in the block
+  is done. Does nothing if no watchdog is set."""
+  if threading.current_thread() is threading.main_thread():
+    _clear_watchdog()
+
+
+def _set_watchdog(timeout_sec):
+  if threading.current_thread() is not threading.main_thread():
+    return False
+  signal.signal(signal.SIGALRM, _on_watchdog)
+  signal.setitimer(signal.ITIMER_REAL, max(timeout_sec, 0.001))
+  return True
+
+
+def _clear_watchdog():
+  signal.setitimer(signal.ITIMER_REAL, 0)
+  signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+
+def _on_watchdog(_signum, _frame):
+  raise DeadlineExceeded('Watchdog interrupted a call that exceeded the budget')
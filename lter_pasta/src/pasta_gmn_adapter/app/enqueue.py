@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`enqueue`
+================
+
+:Synopsis:
+  Validate package IDs and add them to the population queue in bulk.
+
+  The packages are validated against the queue with a single set based query
+  and the accepted packages are inserted with COPY, so the cost of adding
+  thousands of packages is a handful of round trips to the database.
+
+  Package IDs accepted from PASTA with FAST_ACCEPT_NEW_PACKAGES are held in the
+  intake table until drain_package_intake() validates them and moves them to
+  the queue in batches, the same way. As the new_package endpoint does for the
+  packages it adds to the queue, drain_package_intake() schedules prefetching
+  of the package info, if enabled with PREFETCH_PACKAGE_INFO.
+"""
+import logging
+import re
+
+import django.db.transaction
+
+import pasta_gmn_adapter.app.prefetch
+import pasta_gmn_adapter.app.sql
+
+PACKAGE_ID_RX = re.compile(r'(.*)\.(\d+)\.(\d+)\s*$')
+
+# Number of package IDs moved from the intake to the queue per transaction.
+INTAKE_BATCH_SIZE = 1000
+
+
+def parse_package_id(package_id):
+  """Split a package ID, e.g., "knb-lter-nin.18.2", into a (scope, identifier,
+  revision) tuple. Return None if the package ID is invalid."""
+  m = PACKAGE_ID_RX.match(package_id)
+  if not m:
+    return None
+  return m.group(1), int(m.group(2)), int(m.group(3))
+
+
+def enqueue_package_ids(package_id_list, prefetch=False):
+  """Add the packages in {package_id_list} to the population queue. Blank
+  package IDs are ignored. If {prefetch} is True, prefetching of the package
+  info is scheduled for the accepted packages. See prefetch.
+
+  Return a list with one (package_id, is_accepted, reason) tuple for each
+  package ID, in the same order. The same rules as for single packages added
+  by PASTA apply: A package is rejected if the same or a later revision has
+  already been completed.
+  """
+  result_list = []
+  parsed_dict = {}
+  for package_id in package_id_list:
+    package_id = package_id.strip()
+    if not package_id:
+      continue
+    package_tup = parse_package_id(package_id)
+    if package_tup is None:
+      result_list.append((package_id, False, 'Invalid package ID'))
+    elif package_id in parsed_dict:
+      result_list.append((package_id, False, 'Duplicate package ID'))
+    else:
+      parsed_dict[package_id] = package_tup
+      result_list.append((package_id, True, ''))
+
+  with django.db.transaction.atomic():
+    latest_revision_dict = pasta_gmn_adapter.app.sql.select_latest_package_revisions(
+      list({p[:2] for p in parsed_dict.values()})
+    )
+    accepted_list = []
+    for i, (package_id, is_accepted, _reason) in enumerate(result_list):
+      if not is_accepted:
+        continue
+      scope, identifier, revision = parsed_dict[package_id]
+      latest_revision = latest_revision_dict.get((scope, identifier))
+      if latest_revision is not None and latest_revision == revision:
+        result_list[i] = (package_id, False, 'Package already exists')
+      elif latest_revision is not None and latest_revision > revision:
+        result_list[i] = (
+          package_id, False,
+          'Later revision {} already exists'.format(latest_revision)
+        )
+      else:
+        accepted_list.append((scope, identifier, revision))
+    if accepted_list:
+      inserted_list = pasta_gmn_adapter.app.sql.insert_population_queue_items(
+        accepted_list
+      )
+      if prefetch:
+        for queue_id, scope, identifier, revision in inserted_list:
+          pasta_gmn_adapter.app.prefetch.prefetch_package_info_on_commit(
+            queue_id, scope, identifier, revision
+          )
+
+  return result_list
+
+
+def format_result_list(result_list):
+  """Format the result from enqueue_package_ids() as one tab separated line
+  per package ID."""
+  return ''.join(
+    '{}\t{}{}\n'.format(
+      package_id, 'accepted' if is_accepted else 'rejected',
+      '' if is_accepted else '\t{}'.format(reason)
+    ) for package_id, is_accepted, reason in result_list
+  )
+
+
+def drain_package_intake(batch_size=INTAKE_BATCH_SIZE):
+  """Validate the package IDs in the intake and move them to the queue, in
+  batches of {batch_size}. Rejected package IDs are logged and dropped, as they
+  would have been rejected by the new_package endpoint.
+  Prefetching of the package info is scheduled for the accepted packages.
+
+  Return a (accepted_count, rejected_count) tuple.
+  """
+  accepted_count = 0
+  rejected_count = 0
+  while True:
+    with django.db.transaction.atomic():
+      intake_list = pasta_gmn_adapter.app.sql.delete_package_intake_batch(
+        batch_size
+      )
+      if not intake_list:
+        break
+      result_list = enqueue_package_ids(
+        [i['package_id'] for i in intake_list], prefetch=True
+      )
+    for package_id, is_accepted, reason in result_list:
+      if is_accepted:
+        accepted_count += 1
+      else:
+        rejected_count += 1
+        logging.warning(
+          'Rejected package from intake. package_id="{}" reason="{}"'.format(
+            package_id, reason
+          )
+        )
+  logging.info(
+    'Drained package intake. accepted={} rejected={}'.format(
+      accepted_count, rejected_count
+    )
+  )
+  return accepted_count, rejected_count
@@ -29,10 +29,9 @@ import time
 
 import psycopg2
 
+import connector_util.http_trace
 import d1_common.util
 
-import d1_client.d1client
-
 import django.conf
 import django.core
 import django.core.management.base
@@ -79,6 +78,10 @@ def log_setup(debug_bool, show_process_and_thread=True):
     }
   })
 
+  # Opt-in tracing of the HTTP calls to PASTA and GMN made by the management
+  # commands, enabled with CONNECTOR_HTTP_TRACE=1.
+  connector_util.http_trace.install_if_enabled()
+
 
 def exit_if_other_instance_is_running(command_name_str):
   global single_instance_lock_file
@@ -165,6 +168,7 @@ def assert_path_is_dir(dir_path):
 
 
 def find_api_major(base_url, client_arg_dict):
+  import d1_client.d1client
   return d1_client.d1client.get_api_major_by_base_url(
     base_url, **client_arg_dict
   )
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`benchmark_eml_access`
+==============================
+
+:Synopsis:
+  Compare the time to parse EML access documents with ElementTree and with the
+  pyxb binding.
+
+  Each document is parsed with parse_eml_access(), which bypasses the rule
+  cache, with EMLAccess(), which uses the cache, and with
+  EMLAccess(use_pyxb=True). The time per document is reported for each. The
+  command fails if the parsers disagree on the rules of a document.
+
+  By default, a set of sample documents is used. EML access documents, such as
+  the ACLs returned by PASTA, can be given as paths instead.
+"""
+
+import argparse
+import logging
+import timeit
+
+import django.core.management.base
+
+import pasta_gmn_adapter.api_types.eml_access
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+
+DEFAULT_COUNT = 200
+
+SAMPLE_EML_ACCESS_LIST = [
+  (
+    'allow_first', """<?xml version="1.0" encoding="UTF-8"?>
+<access:access xmlns:access="eml://ecoinformatics.org/access-2.1.0" authSystem="https://pasta.lternet.edu/authentication" order="allowFirst" system="https://pasta.lternet.edu">
+  <allow>
+    <principal>uid=dcosta,o=LTER,dc=ecoinformatics,dc=org</principal>
+    <permission>changePermission</permission>
+  </allow>
+  <allow>
+    <principal>uid=PIE,o=lter,dc=ecoinformatics,dc=org</principal>
+    <permission>changePermission</permission>
+  </allow>
+  <allow>
+    <principal>public</principal>
+    <permission>read</permission>
+  </allow>
+</access:access>
+"""
+  ),
+  (
+    'deny_first', """<?xml version="1.0" encoding="UTF-8"?>
+<access:access xmlns:access="eml://ecoinformatics.org/access-2.1.0" authSystem="https://pasta.lternet.edu/authentication" order="denyFirst" system="https://pasta.lternet.edu">
+  <deny>
+    <principal>uid=someone,o=LTER,dc=ecoinformatics,dc=org</principal>
+    <permission>write</permission>
+  </deny>
+  <allow>
+    <principal>uid=dcosta,o=LTER,dc=ecoinformatics,dc=org</principal>
+    <principal>uid=PIE,o=lter,dc=ecoinformatics,dc=org</principal>
+    <permission>all</permission>
+  </allow>
+  <allow>
+    <principal>public</principal>
+    <permission>read</permission>
+  </allow>
+</access:access>
+"""
+  ),
+]
+
+
+class Command(django.core.management.base.BaseCommand):
+  requires_system_checks = False
+
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--count', type=int, default=DEFAULT_COUNT,
+      help='Number of times to parse each document'
+    )
+    parser.add_argument(
+      'path', nargs='*', help='EML access documents to use instead of the samples'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    logging.info('Running management command: {}'.format(__name__))
+
+    if options['path']:
+      eml_access_list = []
+      for path in options['path']:
+        with open(path, 'rb') as f:
+          eml_access_list.append((path, f.read()))
+    else:
+      eml_access_list = SAMPLE_EML_ACCESS_LIST
+
+    logging.info(
+      '{:<40} {:>14} {:>14} {:>14} {:>8}'.format(
+        'Document', 'ElementTree', 'Cached', 'pyxb', 'Speedup'
+      )
+    )
+    mismatch_list = []
+    for name, eml_access_xml in eml_access_list:
+      result = benchmark_document(eml_access_xml, options['count'])
+      logging.info(
+        '{:<40} {:>11.1f} us {:>11.1f} us {:>11.1f} us {:>7.1f}x'.format(
+          name[-40:], result['element_tree_sec'] * 1000000,
+          result['cached_sec'] * 1000000, result['pyxb_sec'] * 1000000,
+          result['pyxb_sec'] / result['element_tree_sec']
+        )
+      )
+      if not result['is_match']:
+        mismatch_list.append(name)
+
+    for name in mismatch_list:
+      logging.error('Parsers disagree on the rules of document: {}'.format(name))
+    if mismatch_list:
+      raise django.core.management.base.CommandError(
+        'Parsers disagree on {} documents'.format(len(mismatch_list))
+      )
+
+
+# ===============================================================================
+
+
+def benchmark_document(eml_access_xml, count):
+  """Parse {eml_access_xml} {count} times with each parser. Return the time per
+  parse, in seconds, and whether the parsers returned the same rules."""
+  eml_access = pasta_gmn_adapter.api_types.eml_access
+  fast = eml_access.EMLAccess(eml_access_xml)
+  pyxb_access = eml_access.EMLAccess(eml_access_xml, use_pyxb=True)
+  return {
+    'element_tree_sec': timeit.timeit(
+      lambda: eml_access.parse_eml_access(eml_access_xml), number=count
+    ) / count,
+    'cached_sec': timeit.timeit(
+      lambda: eml_access.EMLAccess(eml_access_xml), number=count
+    ) / count,
+    'pyxb_sec': timeit.timeit(
+      lambda: eml_access.EMLAccess(eml_access_xml, use_pyxb=True),
+      number=count
+    ) / count,
+    'is_match': (
+      (fast._allow_list, fast._deny_list) ==
+      (pyxb_access._allow_list, pyxb_access._deny_list)
+    ),
+  }
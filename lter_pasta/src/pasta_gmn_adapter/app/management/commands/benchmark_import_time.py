@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`benchmark_import_time`
+===============================
+
+:Synopsis:
+  Measure the cold start import cost of the management commands that run from
+  cron.
+
+  Each command module is imported in a fresh interpreter with
+  "python -X importtime", after setting up Django, and the time spent importing
+  modules beyond Django itself is reported, together with the slowest modules.
+
+  The command fails if a command imports any of the modules that are only
+  needed when there is work to do, such as the DataONE type bindings and
+  clients, or if its import time has grown by more than the tolerance relative
+  to the baseline file. Use --save-baseline to create or update the baseline.
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import django.core.management.base
+
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+
+DEFAULT_BASELINE_PATH = 'import_time_baseline.json'
+DEFAULT_TOLERANCE = 1.5
+DEFAULT_REPEAT_COUNT = 3
+# Import times below this are dominated by noise and are not checked.
+MIN_CHECKED_SEC = 0.05
+
+COMMAND_MODULE_LIST = [
+  'pasta_gmn_adapter.app.management.commands.process_population_queue',
+  'pasta_gmn_adapter.app.management.commands.register_packages',
+  'pasta_gmn_adapter.app.management.commands.clean_queue_tables',
+]
+
+# Modules that must not be imported before the commands know there is work.
+HEAVY_MODULE_LIST = [
+  'pyxb',
+  'rdflib',
+  'd1_client',
+  'd1_common.types.dataoneTypes',
+  'd1_common.resource_map',
+  'pasta_gmn_adapter.api_types.generated',
+  'pasta_gmn_adapter.app.population_queue_processor',
+]
+
+_SETUP_STR = 'import django; django.setup()'
+
+
+class Command(django.core.management.base.BaseCommand):
+  requires_system_checks = False
+
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--baseline-path', default=DEFAULT_BASELINE_PATH,
+      help='Baseline file to compare against or save to'
+    )
+    parser.add_argument(
+      '--save-baseline', action='store_true',
+      help='Save the results as the new baseline instead of comparing'
+    )
+    parser.add_argument(
+      '--repeat', type=int, default=DEFAULT_REPEAT_COUNT,
+      help='Number of times to import each module. The minimum is reported'
+    )
+    parser.add_argument(
+      '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+      help='Allowed slowdown factor relative to the baseline'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    logging.info('Running management command: {}'.format(__name__))
+
+    result_dict = {}
+    problem_list = []
+    for module_name in COMMAND_MODULE_LIST:
+      result_dict[module_name] = measure_command_import(
+        module_name, options['repeat']
+      )
+      result = result_dict[module_name]
+      logging.info('{:<70} {:>8.1f} ms'.format(module_name, result['sec'] * 1000))
+      for name, sec in result['slowest_list']:
+        logging.debug('  {:<68} {:>8.1f} ms'.format(name, sec * 1000))
+      for heavy_name in result['heavy_list']:
+        problem_list.append(
+          '{}: Imports {}'.format(module_name, heavy_name)
+        )
+
+    if options['save_baseline']:
+      with open(options['baseline_path'], 'w') as f:
+        json.dump(
+          {k: {'sec': v['sec']} for k, v in result_dict.items()}, f, indent=2,
+          sort_keys=True
+        )
+      logging.info('Saved baseline: {}'.format(options['baseline_path']))
+    else:
+      problem_list.extend(
+        compare_to_baseline(
+          load_baseline(options['baseline_path']), result_dict,
+          options['tolerance']
+        )
+      )
+
+    for msg in problem_list:
+      logging.error('Regression: {}'.format(msg))
+    if problem_list:
+      raise django.core.management.base.CommandError(
+        'Found {} regressions'.format(len(problem_list))
+      )
+    logging.info('No regressions')
+
+
+# ===============================================================================
+
+
+def measure_command_import(module_name, repeat_count):
+  """Import {module_name} in fresh interpreters and return the time spent on
+  imports beyond Django setup, the slowest modules and the heavy modules that
+  were imported."""
+  base_dict = min(
+    (_run_importtime(_SETUP_STR) for _ in range(repeat_count)),
+    key=lambda d: sum(d.values())
+  )
+  module_dict = min(
+    (
+      _run_importtime('{}; import {}'.format(_SETUP_STR, module_name))
+      for _ in range(repeat_count)
+    ),
+    key=lambda d: sum(d.values())
+  )
+  added_dict = {
+    k: v for k, v in module_dict.items() if k not in base_dict
+  }
+  return {
+    'sec': sum(added_dict.values()),
+    'slowest_list': sorted(added_dict.items(), key=lambda x: -x[1])[:10],
+    'heavy_list': find_heavy_modules(added_dict),
+  }
+
+
+def parse_importtime(importtime_str):
+  """Parse the stderr output of "python -X importtime" and return a dict of
+  module name to the time spent importing the module itself, in seconds."""
+  module_dict = {}
+  for line in importtime_str.splitlines():
+    if not line.startswith('import time:'):
+      continue
+    try:
+      self_us, _cumulative_us, name = line[len('import time:'):].split('|')
+      module_dict[name.strip()] = int(self_us) / 1000000.0
+    except ValueError:
+      # Header line
+      pass
+  return module_dict
+
+
+def find_heavy_modules(module_dict):
+  return sorted({
+    heavy_name
+    for heavy_name in HEAVY_MODULE_LIST
+    for name in module_dict
+    if name == heavy_name or name.startswith(heavy_name + '.')
+  })
+
+
+def compare_to_baseline(baseline_dict, result_dict, tolerance):
+  regression_list = []
+  for module_name, result in sorted(result_dict.items()):
+    try:
+      baseline_sec = baseline_dict[module_name]['sec']
+    except KeyError:
+      logging.warning('No baseline for module: {}'.format(module_name))
+      continue
+    if result['sec'] > MIN_CHECKED_SEC and result['sec'] > baseline_sec * tolerance:
+      regression_list.append(
+        '{}: {:.1f} ms, baseline {:.1f} ms'.format(
+          module_name, result['sec'] * 1000, baseline_sec * 1000
+        )
+      )
+  return regression_list
+
+
+def load_baseline(baseline_path):
+  try:
+    with open(baseline_path) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    raise django.core.management.base.CommandError(
+      'Baseline not found. Create it with --save-baseline. path="{}"'.format(
+        baseline_path
+      )
+    )
+
+
+def _run_importtime(code_str):
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+  env.setdefault('DJANGO_SETTINGS_MODULE', 'pasta_gmn_adapter.settings')
+  completed = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', code_str],
+    stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+    universal_newlines=True
+  )
+  if completed.returncode:
+    raise django.core.management.base.CommandError(
+      'Import failed. code="{}" error="{}"'.format(
+        code_str, completed.stderr.strip().splitlines()[-1:]
+      )
+    )
+  return parse_importtime(completed.stderr)
@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`benchmark_queries`
+===========================
+
+:Synopsis:
+  Time the queries in sql.py and the admin views, and capture the query plans.
+
+  Run on a database filled by generate_queue_data. Each benchmark is run in a
+  transaction that is rolled back, so benchmarks that write leave the database
+  unchanged. For each statement a benchmark issues, the plan is captured with
+  EXPLAIN (ANALYZE, BUFFERS).
+
+  The results are compared against a baseline file. The command fails if a
+  benchmark has become slower than the baseline by more than the tolerance, or
+  if a statement now does a sequential scan on a table that it did not scan
+  sequentially in the baseline. Use --save-baseline to create or update the
+  baseline.
+
+  With --compare-prepared, the queries that are issued for every package are
+  instead timed with PREPARE_HOT_QUERIES disabled and enabled, to show the
+  effect of the prepared statements. The new_package view is also timed with a
+  new database connection for each call, as in the web server when
+  CONN_MAX_AGE is 0.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import time
+
+import django.core.cache
+import django.core.management.base
+import django.db
+import django.db.transaction
+import django.test
+
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.enqueue
+import pasta_gmn_adapter.app.management.commands.generate_queue_data
+import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.app.views.admin
+import pasta_gmn_adapter.app.views.pasta
+import pasta_gmn_adapter.settings
+
+DEFAULT_BASELINE_PATH = 'benchmark_baseline.json'
+DEFAULT_REPEAT_COUNT = 5
+DEFAULT_TOLERANCE = 2.0
+# Statements faster than this are not checked for slowdowns, as their timing
+# is dominated by noise.
+MIN_CHECKED_SEC = 0.005
+DEFAULT_PREPARED_CALL_COUNT = 1000
+# Benchmarks for the queries that run as prepared statements.
+PREPARED_BENCHMARK_NAME_LIST = [
+  'sql.insert_population_queue_item',
+  'sql.select_latest_package_revision',
+  'sql.insert_process_status',
+  'views.pasta.add_package_to_queue',
+]
+# Benchmarks that are also timed with a new connection for each call.
+PREPARED_NEW_CONNECTION_BENCHMARK_NAME_LIST = [
+  'views.pasta.add_package_to_queue',
+]
+
+
+class Command(django.core.management.base.BaseCommand):
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--baseline-path', default=DEFAULT_BASELINE_PATH,
+      help='Baseline file to compare against or save to'
+    )
+    parser.add_argument(
+      '--save-baseline', action='store_true',
+      help='Save the results as the new baseline instead of comparing'
+    )
+    parser.add_argument(
+      '--report-path', help='Write the timings and full query plans to file'
+    )
+    parser.add_argument(
+      '--repeat', type=int, default=DEFAULT_REPEAT_COUNT,
+      help='Number of times to run each benchmark. The median is reported'
+    )
+    parser.add_argument(
+      '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+      help='Allowed slowdown factor relative to the baseline'
+    )
+    parser.add_argument(
+      '--filter', help='Run only benchmarks with names containing this string'
+    )
+    parser.add_argument(
+      '--compare-prepared', action='store_true',
+      help='Time the queries that run as prepared statements, with and without '
+      'PREPARE_HOT_QUERIES'
+    )
+    parser.add_argument(
+      '--prepared-calls', type=int, default=DEFAULT_PREPARED_CALL_COUNT,
+      help='Number of calls per query with --compare-prepared'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+
+    if options['compare_prepared']:
+      compare_prepared(options['prepared_calls'])
+      return
+
+    result_dict = {}
+    for name, func in get_benchmark_list():
+      if options['filter'] and options['filter'] not in name:
+        continue
+      result_dict[name] = run_benchmark(func, options['repeat'])
+      logging.info(
+        '{:<60} {:>10.2f} ms  seq scans: {}'.format(
+          name, result_dict[name]['median_sec'] * 1000,
+          ', '.join(result_dict[name]['seq_scan_list']) or '-'
+        )
+      )
+
+    if options['report_path']:
+      with open(options['report_path'], 'w') as f:
+        json.dump(result_dict, f, indent=2, sort_keys=True)
+
+    if options['save_baseline']:
+      save_baseline(options['baseline_path'], result_dict)
+      logging.info('Saved baseline: {}'.format(options['baseline_path']))
+      return
+
+    regression_list = compare_to_baseline(
+      load_baseline(options['baseline_path']), result_dict,
+      options['tolerance']
+    )
+    for msg in regression_list:
+      logging.error('Regression: {}'.format(msg))
+    if regression_list:
+      raise django.core.management.base.CommandError(
+        'Found {} regressions'.format(len(regression_list))
+      )
+    logging.info('No regressions')
+
+
+# ===============================================================================
+
+
+def get_benchmark_list():
+  """Return a list of (name, func) tuples, with one benchmark for each query in
+  sql.py and each admin view. The arguments are picked from the data in the
+  database."""
+  sql = pasta_gmn_adapter.app.sql
+  admin = pasta_gmn_adapter.app.views.admin
+  pasta = pasta_gmn_adapter.app.views.pasta
+  request_factory = django.test.RequestFactory()
+  queue_item = _select_sample_queue_item()
+  scope = queue_item['package_scope']
+  identifier = queue_item['package_identifier']
+  revision = queue_item['package_revision']
+  queue_id = queue_item['id']
+  object_job = _select_sample_object_job()
+  entity_header = _select_sample_entity_header()
+  sample_metric_list = (
+    pasta_gmn_adapter.app.management.commands.generate_queue_data.
+    get_sample_metrics()
+  )
+  return [
+    (
+      'sql.insert_population_queue_item',
+      lambda: sql.insert_population_queue_item(scope, identifier, revision + 1)
+    ),
+    (
+      'sql.insert_population_queue_items',
+      lambda: sql.insert_population_queue_items(
+        [(scope, identifier, revision + i) for i in range(1, 1001)]
+      )
+    ),
+    (
+      'sql.select_population_queue_with_latest_status',
+      sql.select_population_queue_with_latest_status
+    ),
+    (
+      'sql.select_population_queue_with_latest_status_uncompleted',
+      sql.select_population_queue_with_latest_status_uncompleted
+    ),
+    ('sql.select_status', lambda: sql.select_status(queue_id)),
+    ('sql.select_statistics', sql.select_statistics),
+    ('sql.refresh_status_count', sql.refresh_status_count),
+    (
+      'sql.remove_from_status_count',
+      lambda: sql.remove_from_status_count([queue_id])
+    ),
+    ('sql.select_population_queue_all', sql.select_population_queue_all),
+    (
+      'sql.select_population_queue_uncompleted',
+      sql.select_population_queue_uncompleted
+    ),
+    (
+      'sql.select_latest_package_revision',
+      lambda: sql.select_latest_package_revision(scope, identifier)
+    ),
+    (
+      'sql.select_latest_package_revisions',
+      lambda: sql.select_latest_package_revisions([(scope, identifier)])
+    ),
+    (
+      'sql.select_queued_package_revisions',
+      lambda: sql.select_queued_package_revisions(scope)
+    ),
+    (
+      'sql.insert_process_status',
+      lambda: sql.insert_process_status(queue_id, 'error', 500, 'Benchmark')
+    ),
+    (
+      'sql.select_process_status_by_package_id',
+      lambda: sql.select_process_status_by_package_id(scope, identifier, revision)
+    ),
+    (
+      'sql.select_entity_header',
+      lambda: sql.select_entity_header(
+        entity_header['entity_id'], entity_header['checksum']
+      )
+    ),
+    (
+      'sql.insert_entity_header',
+      lambda: sql.insert_entity_header(
+        entity_header['entity_id'], 'benchmark', 1234, 'text/csv'
+      )
+    ),
+    (
+      'sql.insert_package_intake',
+      lambda: sql.insert_package_intake(
+        '{}.{}.{}'.format(scope, identifier, revision + 1)
+      )
+    ),
+    (
+      'sql.delete_package_intake_batch',
+      lambda: sql.delete_package_intake_batch(
+        pasta_gmn_adapter.app.enqueue.INTAKE_BATCH_SIZE
+      )
+    ),
+    ('sql.select_package_intake_count', sql.select_package_intake_count),
+    ('sql.add_to_metrics', lambda: sql.add_to_metrics(sample_metric_list)),
+    ('sql.set_metrics', lambda: sql.set_metrics(sample_metric_list)),
+    ('sql.select_metrics', sql.select_metrics),
+    (
+      'sql.insert_object_jobs',
+      lambda: sql.insert_object_jobs(
+        queue_id, [
+          ('entity', '{{"entity_id": "{}"}}'.format(i)) for i in range(100)
+        ] + [('report', '{}'), ('metadata', '{}')], '{}'
+      )
+    ),
+    ('sql.claim_object_job', sql.claim_object_job),
+    (
+      'sql.finish_object_job',
+      lambda: sql.finish_object_job(object_job['id'], 'error', 500, 'Benchmark')
+    ),
+    (
+      'sql.select_object_job_rollup',
+      lambda: sql.select_object_job_rollup(
+        object_job['population_queue_item_id']
+      )
+    ),
+    (
+      'views.admin.get_statistics',
+      lambda: _clear_cache_and_call(
+        admin.get_statistics, request_factory.get('/admin/statistics')
+      )
+    ),
+    (
+      'views.admin.get_population_queue',
+      lambda: admin.get_population_queue(
+        request_factory.get('/admin/population_queue')
+      )
+    ),
+    (
+      'views.admin.get_population_queue?excludecompleted',
+      lambda: admin.get_population_queue(
+        request_factory.get('/admin/population_queue', {'excludecompleted': ''})
+      )
+    ),
+    (
+      'views.admin.get_status',
+      lambda: admin.get_status(
+        request_factory.get('/admin/status/{}'.format(queue_id)), queue_id
+      )
+    ),
+    (
+      'views.pasta.add_package_to_queue',
+      lambda: pasta.add_package_to_queue(
+        request_factory.post(
+          '/adapter/new_package', '{}.{}.{}'.format(
+            scope, identifier, revision + 1
+          ), content_type='text/plain'
+        )
+      )
+    ),
+  ]
+
+
+def run_benchmark(func, repeat_count):
+  """Run {func} {repeat_count} times, each time in a transaction that is rolled
+  back, and capture the plans of the statements issued on the first run.
+
+  The plans are captured before the first run is rolled back, as the
+  statements may use objects that the run created, such as the temporary table
+  used by insert_population_queue_items().
+  """
+  sec_list = []
+  plan_list = None
+  for _ in range(repeat_count):
+    connection = django.db.connection
+    connection.force_debug_cursor = True
+    connection.queries_log.clear()
+    try:
+      with django.db.transaction.atomic():
+        start_sec = time.time()
+        func()
+        sec_list.append(time.time() - start_sec)
+        connection.force_debug_cursor = False
+        if plan_list is None:
+          plan_list = [
+            explain_analyze(statement_str)
+            for sql_str in [q['sql'] for q in connection.queries]
+            for statement_str in _split_statements(sql_str)
+            if _is_explainable(statement_str)
+          ]
+        django.db.transaction.set_rollback(True)
+    finally:
+      connection.force_debug_cursor = False
+  return {
+    'median_sec': statistics.median(sec_list),
+    'seq_scan_list': sorted({r for p in plan_list for r in p['seq_scan_list']}),
+    'plan_list': plan_list,
+  }
+
+
+def compare_prepared(call_count):
+  """Log the time per call of the queries that run as prepared statements, with
+  PREPARE_HOT_QUERIES disabled and enabled."""
+  benchmark_dict = dict(get_benchmark_list())
+  case_list = [
+    (name, name, time_calls) for name in PREPARED_BENCHMARK_NAME_LIST
+  ] + [
+    (
+      '{} (new connection)'.format(name), name,
+      time_calls_on_new_connections
+    ) for name in PREPARED_NEW_CONNECTION_BENCHMARK_NAME_LIST
+  ]
+  saved_prepare = pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES
+  try:
+    for case_name, name, time_func in case_list:
+      func = benchmark_dict[name]
+      pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES = False
+      unprepared_sec = time_func(func, call_count)
+      pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES = True
+      prepared_sec = time_func(func, call_count)
+      logging.info(
+        '{:<52} unprepared: {:>8.3f} ms  prepared: {:>8.3f} ms  '
+        'speedup: {:.2f}x'.format(
+          case_name, unprepared_sec * 1000, prepared_sec * 1000,
+          unprepared_sec / prepared_sec
+        )
+      )
+  finally:
+    pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES = saved_prepare
+
+
+def time_calls(func, call_count):
+  """Return the median time of {call_count} calls of {func}, made in a
+  transaction that is rolled back. The first call is not timed, so that the
+  prepared statements are in place."""
+  sec_list = []
+  with django.db.transaction.atomic():
+    func()
+    for _ in range(call_count):
+      start_sec = time.time()
+      func()
+      sec_list.append(time.time() - start_sec)
+    django.db.transaction.set_rollback(True)
+  return statistics.median(sec_list)
+
+
+def time_calls_on_new_connections(func, call_count):
+  """Return the median time of {call_count} calls of {func}, each made on a new
+  database connection, in a transaction that is rolled back. This is the cost
+  of a view in the web server when CONN_MAX_AGE is 0. The time to connect is not
+  included."""
+  sec_list = []
+  for _ in range(call_count):
+    django.db.connection.close()
+    django.db.connection.ensure_connection()
+    with django.db.transaction.atomic():
+      start_sec = time.time()
+      func()
+      sec_list.append(time.time() - start_sec)
+      django.db.transaction.set_rollback(True)
+  return statistics.median(sec_list)
+
+
+def explain_analyze(sql_str):
+  """Return the plan of {sql_str}, as executed. The statement is run in a
+  savepoint that is rolled back."""
+  cursor = django.db.connection.cursor()
+  with django.db.transaction.atomic():
+    cursor.execute(
+      'explain (analyze, buffers, format json) ' + sql_str
+    )
+    plan = cursor.fetchone()[0]
+    django.db.transaction.set_rollback(True)
+  if isinstance(plan, str):
+    plan = json.loads(plan)
+  return {
+    'sql': sql_str,
+    'plan': plan,
+    'seq_scan_list': sorted(_find_seq_scans(plan[0]['Plan'])),
+  }
+
+
+def compare_to_baseline(baseline_dict, result_dict, tolerance):
+  """Return a list of regressions of {result_dict} relative to
+  {baseline_dict}."""
+  regression_list = []
+  for name, result in sorted(result_dict.items()):
+    try:
+      baseline = baseline_dict[name]
+    except KeyError:
+      logging.warning('No baseline for benchmark: {}'.format(name))
+      continue
+    if (
+        result['median_sec'] > MIN_CHECKED_SEC
+        and result['median_sec'] > baseline['median_sec'] * tolerance
+    ):
+      regression_list.append(
+        '{}: {:.2f} ms, baseline {:.2f} ms'.format(
+          name, result['median_sec'] * 1000, baseline['median_sec'] * 1000
+        )
+      )
+    new_seq_scan_set = (
+      set(result['seq_scan_list']) - set(baseline['seq_scan_list'])
+    )
+    if new_seq_scan_set:
+      regression_list.append(
+        '{}: New sequential scans on: {}'.format(
+          name, ', '.join(sorted(new_seq_scan_set))
+        )
+      )
+  return regression_list
+
+
+def save_baseline(baseline_path, result_dict):
+  with open(baseline_path, 'w') as f:
+    json.dump(
+      {
+        name: {
+          'median_sec': r['median_sec'],
+          'seq_scan_list': r['seq_scan_list'],
+        } for name, r in result_dict.items()
+      }, f, indent=2, sort_keys=True
+    )
+
+
+def load_baseline(baseline_path):
+  try:
+    with open(baseline_path) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    raise django.core.management.base.CommandError(
+      'Baseline not found. Create it with --save-baseline. path="{}"'.format(
+        baseline_path
+      )
+    )
+
+
+def _find_seq_scans(plan_node):
+  seq_scan_set = set()
+  if plan_node['Node Type'] == 'Seq Scan':
+    seq_scan_set.add(plan_node['Relation Name'])
+  for child_node in plan_node.get('Plans', []):
+    seq_scan_set |= _find_seq_scans(child_node)
+  return seq_scan_set
+
+
+def _split_statements(sql_str):
+  """Split a string holding several SQL statements. The statements in sql.py
+  do not have semicolons in literals, so a simple split is sufficient."""
+  return [s for s in sql_str.split(';') if s.strip()]
+
+
+def _is_explainable(sql_str):
+  return sql_str.lstrip().split(None, 1)[0].lower() in (
+    'select', 'insert', 'update', 'delete', 'with', 'execute'
+  )
+
+
+def _clear_cache_and_call(view_func, request):
+  django.core.cache.cache.clear()
+  return view_func(request)
+
+
+def _select_sample_object_job():
+  """Select a pending member job of the queue item with the most jobs, so that
+  finishing it with an error cancels the largest set of dependent jobs."""
+  cursor = django.db.connection.cursor()
+  cursor.execute(
+    """
+    select id, population_queue_item_id from adapter_object_job
+    where population_queue_item_id = (
+      select population_queue_item_id from adapter_object_job
+      group by population_queue_item_id order by count(*) desc limit 1
+    )
+    and job_type <> 'resource_map'
+    order by status = 'pending' desc, id
+    limit 1;
+    """
+  )
+  row = pasta_gmn_adapter.app.sql.dict_fetch_all(cursor)
+  if not row:
+    raise django.core.management.base.CommandError(
+      'The job table is empty. Fill it with generate_queue_data'
+    )
+  return row[0]
+
+
+def _select_sample_entity_header():
+  cursor = django.db.connection.cursor()
+  cursor.execute(
+    """
+    select entity_id, checksum from adapter_entity_header
+    order by entity_id
+    limit 1;
+    """
+  )
+  row = pasta_gmn_adapter.app.sql.dict_fetch_all(cursor)
+  if not row:
+    raise django.core.management.base.CommandError(
+      'There are no entity headers. Fill them with generate_queue_data'
+    )
+  return row[0]
+
+
+def _select_sample_queue_item():
+  """Select a queue item from the largest scope, which is the most expensive to
+  query."""
+  cursor = django.db.connection.cursor()
+  cursor.execute(
+    """
+    select apq.id, package_scope, package_identifier, package_revision
+    from adapter_population_queue apq
+    join adapter_population_queue_package_scope apqps
+      on (apq.package_scope_id = apqps.id)
+    where package_scope_id = (
+      select package_scope_id from adapter_population_queue
+      group by package_scope_id order by count(*) desc limit 1
+    )
+    order by package_identifier desc, package_revision desc
+    limit 1;
+    """
+  )
+  row = pasta_gmn_adapter.app.sql.dict_fetch_all(cursor)
+  if not row:
+    raise django.core.management.base.CommandError(
+      'The queue is empty. Fill it with generate_queue_data'
+    )
+  return row[0]
@@ -15,17 +15,29 @@
 
 All but the latest version of a package scope/identifier can be deleted. The very latest
 version must be preserved in order for the adapter to know which object to update.
+
+Earlier revisions are found with a window function over each scope/identifier and
+deleted in batches, each batch in its own transaction, to keep lock times and WAL
+bursts bounded.
 """
 import argparse
 import logging
+import time
 
 import django.core.management.base
 import django.db
+import django.db.transaction
 
 import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.sql
+
+DEFAULT_BATCH_SIZE = 10000
 
 
 class Command(django.core.management.base.BaseCommand):
+    # The system checks import the URLconf and, through it, all the views.
+    requires_system_checks = False
+
     def _init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -33,53 +45,113 @@ class Command(django.core.management.base.BaseCommand):
         parser.description = __doc__
         parser.formatter_class = argparse.RawDescriptionHelpFormatter
         parser.add_argument("--debug", action="store_true", help="Debug level logging")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of queue items to delete per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the number of items that would be deleted without deleting",
+        )
 
     def handle(self, *args, **options):
         util.log_setup(options["debug"])
         util.exit_if_other_instance_is_running(__name__)
         logging.info("Running management command: {}".format(__name__))
 
-        for (
-            package_scope,
-            package_identifier,
-            latest_revision,
-        ) in select_all_latest_revisions():
-            print("{}.{}.{}".format(package_scope, package_identifier, latest_revision))
-            deleted_package_count = delete_all_but_latest_revision(
-                package_scope, package_identifier, latest_revision
+        if options["batch_size"] < 1:
+            raise django.core.management.base.CommandError(
+                "Invalid batch size: {}".format(options["batch_size"])
+            )
+
+        total_count = count_all_but_latest_revisions()
+        logging.info("Earlier revisions in queue: {}".format(total_count))
+        if not total_count:
+            return
+        if options["dry_run"]:
+            logging.info("Dry run: No items deleted")
+            return
+
+        start_sec = time.time()
+        deleted_count = 0
+        while True:
+            with django.db.transaction.atomic():
+                batch_count = delete_all_but_latest_revisions(options["batch_size"])
+            if not batch_count:
+                break
+            deleted_count += batch_count
+            elapsed_sec = time.time() - start_sec
+            logging.info(
+                "Deleted earlier revisions: {}/{} ({:.2f}%) {:.1f} rows/sec".format(
+                    deleted_count,
+                    total_count,
+                    deleted_count / float(max(total_count, deleted_count)) * 100,
+                    deleted_count / elapsed_sec if elapsed_sec else 0.0,
+                )
+            )
+        logging.info(
+            "Completed. Deleted earlier revisions: {} in {:.2f} sec".format(
+                deleted_count, time.time() - start_sec
             )
-            print("Deleted earlier revisions: {}".format(deleted_package_count))
+        )
 
 
-def select_all_latest_revisions():
-    """Select the package scope, identifier and latest revision for each package
+def count_all_but_latest_revisions():
+    """Count the queue items that are not the latest revision of their package
     """
     cursor = django.db.connection.cursor()
     cursor.execute(
         """
-    select package_scope, package_identifier, max(package_revision) latest_revision 
-    from adapter_population_queue q 
-    join adapter_population_queue_package_scope s on s.id = q.package_scope_id 
-    group by package_scope, package_identifier
-    order by package_scope, package_identifier
+    select count(*) from (
+        select rank() over (
+            partition by package_scope_id, package_identifier
+            order by package_revision desc
+        ) revision_rank
+        from adapter_population_queue
+    ) ranked
+    where revision_rank > 1
     ;
     """
     )
-    return cursor
+    return cursor.fetchone()[0]
 
 
-def delete_all_but_latest_revision(package_scope, package_identifier, latest_revision):
+def delete_all_but_latest_revisions(batch_size):
+    """Delete up to {batch_size} queue items that are not the latest revision of their
+    package. Return the number of deleted items.
+
+    rank() gives all items holding the latest revision of a package rank 1, so they are
+    always preserved. Status rows are removed by the cascading foreign key and the
+    items are removed from the per-status counts in the same transaction.
+    """
     cursor = django.db.connection.cursor()
     cursor.execute(
         """
-    delete from adapter_population_queue q
-    where package_scope_id = (
-        select id from adapter_population_queue_package_scope where package_scope = %s
+    select id from (
+        select id, rank() over (
+            partition by package_scope_id, package_identifier
+            order by package_revision desc
+        ) revision_rank
+        from adapter_population_queue
+    ) ranked
+    where revision_rank > 1
+    limit %s
+    ;
+    """,
+        [batch_size],
     )
-    and package_identifier = %s
-    and package_revision < %s
+    queue_item_id_list = [row[0] for row in cursor.fetchall()]
+    if not queue_item_id_list:
+        return 0
+    pasta_gmn_adapter.app.sql.remove_from_status_count(queue_item_id_list)
+    cursor.execute(
+        """
+    delete from adapter_population_queue where id = any(%s)
     ;
     """,
-        [package_scope, package_identifier, latest_revision],
+        [queue_item_id_list],
     )
     return cursor.rowcount
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`drain_package_intake`
+==============================
+
+:Synopsis:
+  Move the package IDs accepted from PASTA with FAST_ACCEPT_NEW_PACKAGES from
+  the intake to the queue. The package IDs are validated with the same rules as
+  for the new_package endpoint, in batches, and rejected package IDs are logged.
+
+  Run from cron at short intervals, e.g., every minute, so that packages do not
+  wait in the intake for long before they can be processed.
+
+  With PREFETCH_PACKAGE_INFO, the package info is prefetched for the packages
+  that are moved to the queue, as for packages added by the new_package
+  endpoint without FAST_ACCEPT_NEW_PACKAGES. The command waits for the
+  prefetches to finish before it exits.
+"""
+import argparse
+import logging
+
+import django.core.management.base
+
+import pasta_gmn_adapter.app.enqueue
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.prefetch
+
+
+class Command(django.core.management.base.BaseCommand):
+  # The system checks import the URLconf and, through it, all the views.
+  requires_system_checks = False
+
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--batch-size', type=int,
+      default=pasta_gmn_adapter.app.enqueue.INTAKE_BATCH_SIZE,
+      help='Number of package IDs to move to the queue per transaction'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+    pasta_gmn_adapter.app.enqueue.drain_package_intake(options['batch_size'])
+    pasta_gmn_adapter.app.prefetch.wait_for_prefetch()
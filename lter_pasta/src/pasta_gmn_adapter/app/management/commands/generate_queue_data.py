@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`generate_queue_data`
+=============================
+
+:Synopsis:
+  Clear the database and fill it with synthetic packages and processing history,
+  for benchmarking the queries in sql.py. See benchmark_queries.
+
+  - Packages are spread over the scopes with a heavy skew towards a few large
+    scopes, and each identifier has several revisions.
+  - Each item has a "new" status, followed by a skewed number of "error"
+    retries, where most items have none and a few have many.
+  - Most items then end as "completed", with some "private",
+    "permanent_error" or still unprocessed.
+  - The unprocessed items have object jobs, with a skewed number of entity
+    jobs. Most member jobs have completed, and the resource map jobs, which
+    depend on the members, are pending or cancelled.
+  - Each package identifier has a skewed number of entity headers, which are
+    shared by its revisions.
+  - The intake holds a batch of package IDs for new revisions, and the metrics
+    hold the samples of a processing run.
+
+  Only available when GMN_ADAPTER_DEBUG is True in settings.py.
+"""
+
+import argparse
+import logging
+import time
+
+import django.conf
+import django.core.management.base
+import django.db
+import django.db.transaction
+
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.metrics
+import pasta_gmn_adapter.app.sql
+
+DEFAULT_ITEM_COUNT = 1000000
+DEFAULT_SCOPE_COUNT = 40
+DEFAULT_REVISION_COUNT = 3
+RETURN_BODY_COUNT = 100
+MAX_RETRY_COUNT = 20
+MAX_ENTITY_JOB_COUNT = 50
+MAX_ENTITY_HEADER_COUNT = 20
+INTAKE_COUNT = 1000
+
+
+class Command(django.core.management.base.BaseCommand):
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--items', type=int, default=DEFAULT_ITEM_COUNT,
+      help='Number of queue items to generate'
+    )
+    parser.add_argument(
+      '--scopes', type=int, default=DEFAULT_SCOPE_COUNT,
+      help='Number of package scopes'
+    )
+    parser.add_argument(
+      '--revisions', type=int, default=DEFAULT_REVISION_COUNT,
+      help='Number of revisions per package identifier'
+    )
+    parser.add_argument(
+      '--seed', type=float, default=0.5,
+      help='Seed for the random generator, between -1 and 1'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+    if not django.conf.settings.GMN_ADAPTER_DEBUG:
+      raise django.core.management.base.CommandError(
+        'This command is only available when GMN_ADAPTER_DEBUG is True in '
+        'settings.py'
+      )
+    start_sec = time.time()
+    with django.db.transaction.atomic():
+      pasta_gmn_adapter.app.sql.clear_database()
+      generate_queue_data(
+        options['items'], options['scopes'], options['revisions'],
+        options['seed']
+      )
+    logging.info(
+      'Generated {} queue items in {:.2f} sec'.format(
+        options['items'], time.time() - start_sec
+      )
+    )
+    for s in pasta_gmn_adapter.app.sql.select_statistics():
+      logging.info('{}: {}'.format(s['status'], s['count']))
+
+
+def generate_queue_data(item_count, scope_count, revision_count, seed):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute('select setseed(%s);', [seed])
+
+  cursor.execute(
+    """
+    insert into adapter_population_queue_package_scope (package_scope)
+    select 'knb-lter-' || to_char(i, 'FM000') from generate_series(1, %s) i;
+
+    insert into adapter_process_status_status (status)
+    values ('new'), ('completed'), ('private'), ('error'), ('permanent_error');
+
+    insert into adapter_process_status_return_body (return_body, return_body_hash)
+    select body, md5(body)::uuid from (
+      select '' as body
+      union all
+      select 'msg(Error) body(Synthetic error ' || i || ')'
+      from generate_series(1, %s) i
+    ) b;
+    """,
+    [scope_count, RETURN_BODY_COUNT]
+  )
+
+  # The scope is derived from a hash of the identifier, so that all revisions
+  # of a package get the same scope. Cubing the hash skews the distribution
+  # towards the first scopes.
+  cursor.execute(
+    """
+    insert into adapter_population_queue
+      (package_scope_id, package_identifier, package_revision, "timestamp")
+    select
+      (select min(id) from adapter_population_queue_package_scope)
+        + floor(%s * power(((identifier * 2654435761) %% 1000003) / 1000003.0, 3)),
+      identifier, revision,
+      now() - (%s - i) * interval '1 second'
+    from (
+      select i, i / %s + 1 as identifier, i %% %s + 1 as revision
+      from generate_series(0, %s - 1) i
+    ) g;
+    """,
+    [scope_count, item_count, revision_count, revision_count, item_count]
+  )
+
+  cursor.execute(
+    """
+    with s as (
+      select
+        (select id from adapter_process_status_status where status = 'new') as new_id,
+        (select id from adapter_process_status_status where status = 'error') as error_id,
+        (select id from adapter_process_status_return_body where return_body = '') as empty_id,
+        (select min(id) from adapter_process_status_return_body where return_body <> '') as error_body_id
+    )
+    insert into adapter_process_status
+      (population_queue_item_id, "timestamp", status_id, return_code, return_body_id)
+    select apq.id, apq."timestamp", s.new_id, 0, s.empty_id
+    from adapter_population_queue apq, s
+    union all
+    select apq.id, apq."timestamp" + retry * interval '1 hour', s.error_id, 500,
+      s.error_body_id + floor(random() * %s)::int
+    from adapter_population_queue apq
+    cross join s
+    cross join lateral generate_series(1, floor(power(random(), 6) * %s)::int) retry
+    ;
+    """,
+    [RETURN_BODY_COUNT, MAX_RETRY_COUNT]
+  )
+
+  cursor.execute(
+    """
+    insert into adapter_process_status
+      (population_queue_item_id, "timestamp", status_id, return_code, return_body_id)
+    select id, "timestamp" + interval '1 day',
+      (select id from adapter_process_status_status where status = final_status),
+      0,
+      (select id from adapter_process_status_return_body where return_body = '')
+    from (
+      select id, "timestamp",
+        case
+          when r < 0.80 then 'completed'
+          when r < 0.85 then 'private'
+          when r < 0.87 then 'permanent_error'
+        end as final_status
+      from (select id, "timestamp", random() as r from adapter_population_queue) q
+    ) f
+    where final_status is not null
+    ;
+    """
+  )
+
+  generate_object_job_data(cursor)
+  generate_entity_header_data(cursor)
+  generate_intake_data(cursor)
+  pasta_gmn_adapter.app.sql.set_metrics(get_sample_metrics())
+
+  pasta_gmn_adapter.app.sql.refresh_status_count()
+
+  cursor.execute(
+    """
+    analyze adapter_entity_header;
+    analyze adapter_metric;
+    analyze adapter_package_intake;
+    analyze adapter_object_job;
+    analyze adapter_object_job_dependency;
+    analyze adapter_population_queue;
+    analyze adapter_population_queue_package_scope;
+    analyze adapter_process_status;
+    analyze adapter_process_status_return_body;
+    analyze adapter_process_status_status;
+    analyze adapter_process_status_count;
+    """
+  )
+
+
+def generate_object_job_data(cursor):
+  """Add object jobs for the queue items that have not been processed, as
+  insert_object_jobs() would."""
+  cursor.execute(
+    """
+    with job_item as (
+      select apq.id, apq."timestamp",
+        1 + floor(power(random(), 4) * %s)::int as entity_count
+      from adapter_population_queue apq
+      where not exists (
+        select 1 from adapter_process_status aps
+        join adapter_process_status_status apss on (apss.id = aps.status_id)
+        where aps.population_queue_item_id = apq.id
+        and apss.status in ('completed', 'private', 'permanent_error')
+      )
+    )
+    insert into adapter_object_job
+      (population_queue_item_id, job_type, payload, status, return_code,
+      return_body, rolled_up, "timestamp")
+    select id,
+      case
+        when n <= entity_count then 'entity'
+        when n = entity_count + 1 then 'report'
+        else 'metadata'
+      end,
+      '{"entity_id": "' || n || '", "d1_replication_policy": null}',
+      case
+        when r < 0.70 then 'completed'
+        when r < 0.90 then 'pending'
+        when r < 0.95 then 'error'
+        else 'cancelled'
+      end,
+      case when r >= 0.90 then 500 else 0 end,
+      case when r >= 0.90 then 'Synthetic error' else '' end,
+      false, "timestamp"
+    from (
+      select job_item.id, job_item."timestamp", job_item.entity_count, n,
+        random() as r
+      from job_item
+      cross join lateral generate_series(1, job_item.entity_count + 2) n
+    ) j
+    order by id, n;
+
+    insert into adapter_object_job
+      (population_queue_item_id, job_type, payload, status, return_code,
+      return_body, rolled_up, "timestamp")
+    select population_queue_item_id, 'resource_map',
+      '{"entity_ids": [], "d1_replication_policy": null}',
+      case
+        when bool_or(status in ('error', 'cancelled')) then 'cancelled'
+        else 'pending'
+      end,
+      0, '', false, min("timestamp")
+    from adapter_object_job
+    group by population_queue_item_id
+    order by population_queue_item_id;
+
+    insert into adapter_object_job_dependency (job_id, depends_on_job_id)
+    select aoj_map.id, aoj.id
+    from adapter_object_job aoj_map
+    join adapter_object_job aoj on (
+      aoj.population_queue_item_id = aoj_map.population_queue_item_id
+      and aoj.job_type <> 'resource_map'
+    )
+    where aoj_map.job_type = 'resource_map';
+    """,
+    [MAX_ENTITY_JOB_COUNT]
+  )
+
+
+def generate_entity_header_data(cursor):
+  """Add entity headers for the package identifiers. The checksums differ
+  between the revisions for a few of the entities."""
+  cursor.execute(
+    """
+    insert into adapter_entity_header
+      (entity_id, checksum, content_length, content_type, "timestamp")
+    select md5(package_scope_id || '.' || package_identifier || '.' || n),
+      md5(package_scope_id || '.' || package_identifier || '.' || n || '.' ||
+        case when random() < 0.1 then package_revision else 0 end),
+      floor(power(random(), 4) * 1000000000)::bigint, 'text/csv', "timestamp"
+    from (
+      select package_scope_id, package_identifier, package_revision,
+        "timestamp", 1 + floor(power(random(), 4) * %s)::int as entity_count
+      from adapter_population_queue
+    ) apq
+    cross join lateral generate_series(1, apq.entity_count) n
+    on conflict (entity_id, checksum) do nothing;
+    """,
+    [MAX_ENTITY_HEADER_COUNT]
+  )
+
+
+def generate_intake_data(cursor):
+  """Add package IDs for new revisions of the most recently added packages to
+  the intake."""
+  cursor.execute(
+    """
+    insert into adapter_package_intake (package_id, "timestamp")
+    select package_scope || '.' || package_identifier || '.' ||
+      (package_revision + 1), now()
+    from adapter_population_queue apq
+    join adapter_population_queue_package_scope apqps
+      on (apqps.id = apq.package_scope_id)
+    order by apq.id desc
+    limit %s;
+    """,
+    [INTAKE_COUNT]
+  )
+
+
+def get_sample_metrics():
+  """Return the metric samples recorded by a synthetic processing run, as
+  (sample_name, labels, value) tuples."""
+  registry = pasta_gmn_adapter.app.metrics.MetricRegistry()
+  for i in range(1000):
+    for service in ('pasta', 'gmn'):
+      for method in ('GET', 'HEAD', 'POST'):
+        registry.observe(
+          'pasta_gmn_adapter_upstream_request_seconds', (i % 100) / 10.0,
+          {'service': service, 'method': method}
+        )
+    registry.observe(
+      'pasta_gmn_adapter_package_processing_seconds', i / 10.0,
+      {'status': ('completed', 'error', 'private')[i % 3]}
+    )
+    registry.inc(
+      'pasta_gmn_adapter_entity_header_lookups_total',
+      {'result': ('hit', 'miss')[i % 2]}
+    )
+  return registry.get_samples()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`reconcile_gmn`
+=======================
+
+:Synopsis:
+  Compare the packages in PASTA with the objects on GMN, and report the packages
+  that are missing or incomplete on GMN, the packages that exist only on GMN,
+  and, optionally, packages for which the metadata checksum differs.
+
+  The PASTA inventory and the GMN object list are streamed into temporary
+  tables in batches, and PostgreSQL joins them by package ID. GMN does not
+  return objects sorted by identifier, so the sort and merge are left to the
+  database, and memory use in this command is bounded by the batch size.
+
+  The objects on GMN are matched to packages by the PASTA URLs that are used as
+  their PIDs. The resource maps, which use DOIs as PIDs, are not matched.
+
+  Prints one tab separated line per package, with the result, the package ID
+  and, for incomplete packages, the number of objects of each type on GMN.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+
+import django.core.management.base
+import django.db.transaction
+
+import pasta_gmn_adapter.app.data_package_manager_client
+import pasta_gmn_adapter.app.enqueue
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.population_queue_processor
+import pasta_gmn_adapter.app.sql
+
+DEFAULT_WORKER_COUNT = 8
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 10000
+
+
+class Command(django.core.management.base.BaseCommand):
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--workers', type=int, default=DEFAULT_WORKER_COUNT,
+      help='Number of concurrent requests to PASTA'
+    )
+    parser.add_argument(
+      '--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+      help='Number of objects to request per GMN listObjects call'
+    )
+    parser.add_argument(
+      '--verify-checksums', action='store_true',
+      help='Compare the metadata checksums of packages found on both PASTA '
+      'and GMN. Requires one request to PASTA per package'
+    )
+    parser.add_argument(
+      '--enqueue', action='store_true',
+      help='Add the packages that are missing on GMN to the queue'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+    reconciler = GMNReconciler(
+      options['workers'], options['page_size'], options['verify_checksums'],
+      options['enqueue'], self.stdout
+    )
+    with django.db.transaction.atomic():
+      reconciler.reconcile()
+
+
+# ===============================================================================
+
+
+class GMNReconciler(object):
+  def __init__(self, worker_count, page_size, verify_checksums, enqueue, out):
+    self._worker_count = worker_count
+    self._page_size = page_size
+    self._verify_checksums = verify_checksums
+    self._enqueue = enqueue
+    self._out = out
+    self._thread_local = threading.local()
+    self._pid_rx = create_pid_regex(self._get_pasta_client().base_url)
+    self._result_count_dict = {}
+    self._enqueue_list = []
+
+  def reconcile(self):
+    start_sec = time.time()
+    pasta_gmn_adapter.app.sql.create_reconciliation_tables()
+    self._load_pasta_inventory()
+    self._load_gmn_objects()
+    for package in pasta_gmn_adapter.app.sql.select_reconciliation_report(
+        include_complete=self._verify_checksums
+    ):
+      self._report_package(package)
+    self._flush_enqueue_list()
+    logging.info(
+      'Completed. {} Time: {:.2f} sec'.format(
+        ' '.join(
+          '{}: {}'.format(k.capitalize(), v)
+          for k, v in sorted(self._result_count_dict.items())
+        ) or 'No differences.', time.time() - start_sec
+      )
+    )
+
+  def _load_pasta_inventory(self):
+    row_list = []
+    package_count = 0
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._worker_count
+    ) as executor:
+      for scope in self._get_pasta_client().list_data_package_scopes():
+        identifier_list = self._get_pasta_client(
+        ).list_data_package_identifiers(scope)
+        for identifier, revision_list in zip(
+            identifier_list,
+            executor.map(
+              lambda i: self._get_pasta_client().list_data_package_revisions(
+                scope, i
+              ), identifier_list
+            )
+        ):
+          row_list.extend((scope, identifier, r) for r in revision_list)
+          if len(row_list) >= DEFAULT_BATCH_SIZE:
+            package_count += len(row_list)
+            pasta_gmn_adapter.app.sql.copy_reconciliation_pasta_rows(row_list)
+            row_list = []
+        logging.info(
+          'PASTA packages: {} ({})'.format(package_count + len(row_list), scope)
+        )
+    pasta_gmn_adapter.app.sql.copy_reconciliation_pasta_rows(row_list)
+
+  def _load_gmn_objects(self):
+    gmn_client = (
+      pasta_gmn_adapter.app.population_queue_processor.create_gmn_client()
+    )
+    start = 0
+    while True:
+      object_list = gmn_client.listObjects(start=start, count=self._page_size)
+      row_list = []
+      for object_info in object_list.objectInfo:
+        row = parse_object_info(self._pid_rx, object_info)
+        if row is not None:
+          row_list.append(row)
+      pasta_gmn_adapter.app.sql.copy_reconciliation_gmn_rows(row_list)
+      start += len(object_list.objectInfo)
+      logging.info('GMN objects: {} / {}'.format(start, object_list.total))
+      if not object_list.objectInfo or start >= object_list.total:
+        break
+
+  def _report_package(self, package):
+    package_id_str = '{}.{}.{}'.format(
+      package['package_scope'], package['package_identifier'],
+      package['package_revision']
+    )
+    detail_str = ''
+    if not package['in_pasta']:
+      result = 'extra'
+    elif not (
+        package['metadata_count'] or package['report_count'] or
+        package['data_count']
+    ):
+      result = 'missing'
+      self._enqueue_list.append(package_id_str)
+    elif not (package['metadata_count'] and package['report_count']):
+      result = 'incomplete'
+      detail_str = 'metadata={} report={} data={}'.format(
+        package['metadata_count'], package['report_count'],
+        package['data_count']
+      )
+    elif self._is_checksum_divergent(package):
+      result = 'checksum'
+    else:
+      return
+    self._result_count_dict[result] = (
+      self._result_count_dict.get(result, 0) + 1
+    )
+    self._out.write('\t'.join(filter(None, (result, package_id_str, detail_str))))
+    if len(self._enqueue_list) >= DEFAULT_BATCH_SIZE:
+      self._flush_enqueue_list()
+
+  def _is_checksum_divergent(self, package):
+    package_id = pasta_gmn_adapter.app.population_queue_processor.PackageID(
+      package['package_scope'], package['package_identifier'],
+      package['package_revision']
+    )
+    pasta_checksum = self._get_pasta_client().read_metadata_checksum(package_id)
+    return format_checksum('SHA-1', pasta_checksum) != package['metadata_checksum']
+
+  def _flush_enqueue_list(self):
+    if self._enqueue and self._enqueue_list:
+      result_list = pasta_gmn_adapter.app.enqueue.enqueue_package_ids(
+        self._enqueue_list
+      )
+      logging.info(
+        'Enqueued missing packages. Accepted: {} Rejected: {}'.format(
+          sum(1 for r in result_list if r[1]),
+          sum(1 for r in result_list if not r[1]),
+        )
+      )
+    self._enqueue_list = []
+
+  def _get_pasta_client(self):
+    """Return a PASTA client for the current thread."""
+    try:
+      return self._thread_local.client
+    except AttributeError:
+      self._thread_local.client = (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerClient()
+      )
+      return self._thread_local.client
+
+
+def create_pid_regex(pasta_base_url):
+  """Return a regex matching the PASTA URLs that are used as PIDs for the
+  metadata, quality report and data entities of a package."""
+  return re.compile(
+    r'^{}/(metadata|report|data)/eml/([^/]+)/(\d+)/(\d+)(?:/.*)?$'.format(
+      re.escape(pasta_base_url.rstrip('/'))
+    )
+  )
+
+
+def parse_object_info(pid_rx, object_info):
+  """Return a (scope, identifier, revision, object_type, checksum) tuple for a
+  GMN ObjectInfo, or None if the object is not a member of a PASTA package."""
+  m = pid_rx.match(object_info.identifier.value())
+  if not m:
+    return None
+  return (
+    m.group(2), int(m.group(3)), int(m.group(4)), m.group(1),
+    format_checksum(
+      object_info.checksum.algorithm, object_info.checksum.value()
+    )
+  )
+
+
+def format_checksum(algorithm, checksum):
+  return '{}:{}'.format(algorithm.upper(), checksum.strip().lower())
@@ -19,25 +19,43 @@
   Populate the queue with packages that already exist on PASTA. For use when
   initially deploying PASTA-GMN.
 
+  The PASTA inventory is crawled concurrently across scopes and identifiers and
+  the packages are inserted directly into the queue in batches. Each completed
+  scope/identifier is recorded in a checkpoint file, so that an interrupted
+  crawl resumes where it left off when the command is run again. A resumed
+  crawl skips packages that are already in the queue, as the last batch may
+  have been inserted without being recorded in the checkpoint.
+
+  By default, the database is cleared before a new crawl is started. With
+  --incremental, the database is kept and only packages that are not already in
+  the queue are added.
+
 :Author:
   Roger Dahl
 """
 
 import argparse
-import http.client
+import concurrent.futures
 import logging
-import sys
-import urllib.parse
+import os
+import tempfile
+import threading
+import time
 
 import django.core.management.base
 import django.db
 
 import pasta_gmn_adapter
 import pasta_gmn_adapter.app.data_package_manager_client
+import pasta_gmn_adapter.app.enqueue
 # noinspection PyProtectedMember
 import pasta_gmn_adapter.app.management.commands._util as util
 import pasta_gmn_adapter.app.sql
 
+DEFAULT_WORKER_COUNT = 8
+DEFAULT_BATCH_SIZE = 1000
+CHECKPOINT_FILENAME = 'register_existing_packages.checkpoint'
+
 debug_filter = (
   ('knb-lter-mcr', 5008),
   ('knb-lter-mcr', 32),
@@ -65,42 +83,212 @@ class Command(django.core.management.base.BaseCommand):
     parser.add_argument(
       '--debug', action='store_true', help='Debug level logging'
     )
+    parser.add_argument(
+      '--incremental', action='store_true',
+      help='Keep the database and add only packages not already in the queue'
+    )
+    parser.add_argument(
+      '--restart', action='store_true',
+      help='Discard the checkpoint of an interrupted crawl and start over'
+    )
+    parser.add_argument(
+      '--workers', type=int, default=DEFAULT_WORKER_COUNT,
+      help='Number of concurrent requests to PASTA'
+    )
+    parser.add_argument(
+      '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+      help='Number of packages to insert into the queue per transaction'
+    )
+    parser.add_argument(
+      '--checkpoint-path',
+      default=os.path.join(tempfile.gettempdir(), CHECKPOINT_FILENAME),
+      help='File in which to record the progress of the crawl'
+    )
 
   def handle(self, *args, **options):
     util.log_setup(options['debug'])
     util.exit_if_other_instance_is_running(__name__)
     logging.info('Running management command: {}'.format(__name__))
-    self.register_existing_packages()
-
-  def register_existing_packages(self):
-    self._clear_database()
-    self._register_packages()
-
-  def _register_packages(self):
-    c = pasta_gmn_adapter.app.data_package_manager_client.DataPackageManagerClient()
-    for scope in c.list_data_package_scopes():
-      ####################################################################################
-      # for now, ignore ecotrends because all the packages are private.
-      #if 'ecotrends' in scope:
-      #  logging.info('Skipped ecotrends')
-      #  continue
-      for identifier in c.list_data_package_identifiers(scope):
-        ##################################################################################
-        # For debugging, filter all but packages that are being debugged.
-        #if (scope, identifier) not in debug_filter:
-        #  logging.info('Skipped {0} {1}'.format(scope, identifier))
-        #  continue
-        for revision in c.list_data_package_revisions(scope, identifier):
-          package_id = '{0}.{1}.{2}'.format(scope, identifier, revision)
-          self._add_to_queue(package_id)
-
-  def _add_to_queue(self, package_id):
-    o = urllib.parse.urlparse(pasta_gmn_adapter.settings.ADAPTER_BASE_URL)
-    c = http.client.HTTPConnection(o.netloc)
-    headers = {"INTERNAL_CLIENT": '1'}
-    c.request('POST', o.path + '/pasta/new_package', package_id, headers)
-    response = c.getresponse()
-    logging.info('ADD RESPONSE: {0}'.format(response.text))
+    crawler = PackageInventoryCrawler(
+      options['checkpoint_path'], options['workers'], options['batch_size'],
+      options['incremental']
+    )
+    crawler.register_existing_packages(options['restart'])
+
+
+# ===============================================================================
+
+
+class PackageInventoryCrawler(object):
+  def __init__(self, checkpoint_path, worker_count, batch_size, incremental):
+    self._checkpoint_path = checkpoint_path
+    self._worker_count = worker_count
+    self._batch_size = batch_size
+    self._incremental = incremental
+    # Skip revisions that are already in the queue.
+    self._skip_queued = incremental
+    self._thread_local = threading.local()
+    self._queued_dict = {}
+    self._batch_list = []
+    self._batch_scope_identifier_list = []
+    self._identifier_count = 0
+    self._accepted_count = 0
+    self._rejected_count = 0
+    self._failed_count = 0
+    self._start_sec = None
+
+  def register_existing_packages(self, restart):
+    if restart and os.path.exists(self._checkpoint_path):
+      os.unlink(self._checkpoint_path)
+    checkpoint_set = self._read_checkpoint()
+    if checkpoint_set:
+      logging.info(
+        'Resuming crawl. Completed identifiers: {}'.format(len(checkpoint_set))
+      )
+      # The batch that was being inserted when the crawl was interrupted may
+      # have been committed to the queue without being recorded as completed.
+      self._skip_queued = True
+    elif not self._incremental:
+      self._clear_database()
+    self._start_sec = time.time()
+    with open(self._checkpoint_path, 'a') as self._checkpoint_file:
+      self._register_packages(checkpoint_set)
+    logging.info(
+      'Completed. Identifiers: {} Accepted: {} Rejected: {} Failed: {} '
+      'Time: {:.2f} sec'.format(
+        self._identifier_count, self._accepted_count, self._rejected_count,
+        self._failed_count, time.time() - self._start_sec
+      )
+    )
+    # Keep the checkpoint if there were failures, so that running the command
+    # again retries only the failed scopes and identifiers.
+    if not self._failed_count:
+      os.unlink(self._checkpoint_path)
+
+  def _register_packages(self, checkpoint_set):
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._worker_count
+    ) as executor:
+      identifier_future_dict = {
+        executor.submit(self._list_identifiers, scope): scope
+        for scope in self._get_client().list_data_package_scopes()
+      }
+      revision_future_dict = {}
+      for future in concurrent.futures.as_completed(identifier_future_dict):
+        scope = identifier_future_dict[future]
+        try:
+          identifier_list = future.result()
+        except Exception as e:
+          logging.error(
+            'Listing identifiers failed. scope="{}" error="{}"'.format(
+              scope, str(e)
+            )
+          )
+          self._failed_count += 1
+          continue
+        for identifier in identifier_list:
+          if (scope, identifier) in checkpoint_set:
+            continue
+          revision_future_dict[executor.submit(
+            self._list_revisions, scope, identifier
+          )] = scope, identifier
+      for future in concurrent.futures.as_completed(revision_future_dict):
+        scope, identifier = revision_future_dict[future]
+        try:
+          revision_list = future.result()
+        except Exception as e:
+          logging.error(
+            'Listing revisions failed. scope="{}" identifier="{}" error="{}"'.
+            format(scope, identifier, str(e))
+          )
+          self._failed_count += 1
+          continue
+        self._add_to_batch(scope, identifier, revision_list)
+    self._flush_batch()
+
+  def _list_identifiers(self, scope):
+    return self._get_client().list_data_package_identifiers(scope)
+
+  def _list_revisions(self, scope, identifier):
+    return self._get_client().list_data_package_revisions(scope, identifier)
+
+  def _get_client(self):
+    """Return a PASTA client for the current thread. The client's connection
+    session cannot be shared between threads."""
+    try:
+      return self._thread_local.client
+    except AttributeError:
+      self._thread_local.client = (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerClient()
+      )
+      return self._thread_local.client
+
+  def _add_to_batch(self, scope, identifier, revision_list):
+    if self._skip_queued:
+      queued_set = self._get_queued_set(scope)
+      revision_list = [
+        r for r in revision_list if (identifier, r) not in queued_set
+      ]
+    self._batch_list.extend(
+      '{0}.{1}.{2}'.format(scope, identifier, revision)
+      for revision in revision_list
+    )
+    self._batch_scope_identifier_list.append((scope, identifier))
+    self._identifier_count += 1
+    if len(self._batch_list) >= self._batch_size:
+      self._flush_batch()
+
+  def _flush_batch(self):
+    """Insert the batch into the queue, then record the identifiers as completed
+    in the checkpoint file."""
+    if self._batch_list:
+      result_list = pasta_gmn_adapter.app.enqueue.enqueue_package_ids(
+        self._batch_list
+      )
+      for package_id, is_accepted, reason in result_list:
+        if is_accepted:
+          self._accepted_count += 1
+        else:
+          self._rejected_count += 1
+          logging.info('Rejected: {} {}'.format(package_id, reason))
+    for scope, identifier in self._batch_scope_identifier_list:
+      self._checkpoint_file.write('{}\t{}\n'.format(scope, identifier))
+    self._checkpoint_file.flush()
+    elapsed_sec = time.time() - self._start_sec
+    logging.info(
+      'Identifiers: {} Accepted: {} Rejected: {} ({:.1f} identifiers/sec)'.
+      format(
+        self._identifier_count, self._accepted_count, self._rejected_count,
+        self._identifier_count / elapsed_sec if elapsed_sec else 0.0
+      )
+    )
+    self._batch_list = []
+    self._batch_scope_identifier_list = []
+
+  def _get_queued_set(self, scope):
+    try:
+      return self._queued_dict[scope]
+    except KeyError:
+      self._queued_dict[scope] = (
+        pasta_gmn_adapter.app.sql.select_queued_package_revisions(scope)
+      )
+      return self._queued_dict[scope]
+
+  def _read_checkpoint(self):
+    checkpoint_set = set()
+    try:
+      with open(self._checkpoint_path) as f:
+        for line in f:
+          # The last line may be incomplete if the crawl was interrupted.
+          try:
+            scope, identifier = line.split('\t')
+            checkpoint_set.add((scope, int(identifier)))
+          except ValueError:
+            pass
+    except FileNotFoundError:
+      pass
+    return checkpoint_set
 
   def _clear_database(self):
     pasta_gmn_adapter.app.sql.clear_database()
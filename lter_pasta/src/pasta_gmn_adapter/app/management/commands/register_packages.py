@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`register_packages`
+===========================
+
+:Synopsis:
+  Add many packages to the queue in bulk. The package IDs are read from a file,
+  or from stdin, with one package ID per line. The packages are validated with
+  a single query and inserted with COPY, directly into the database.
+
+  Prints one tab separated line per package ID, with the package ID, "accepted"
+  or "rejected" and, for rejected packages, the reason.
+"""
+import argparse
+import logging
+import sys
+
+import django.core.management.base
+
+import pasta_gmn_adapter.app.enqueue
+import pasta_gmn_adapter.app.management.commands._util as util
+
+
+class Command(django.core.management.base.BaseCommand):
+  # The system checks import the URLconf and, through it, all the views.
+  requires_system_checks = False
+
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      'package_id_path', nargs='?', default='-',
+      help='File with one package ID per line, e.g., "knb-lter-nin.18.2". '
+      'Default is stdin'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+    self._register_packages(options['package_id_path'])
+
+  def _register_packages(self, package_id_path):
+    if package_id_path == '-':
+      package_id_list = sys.stdin.read().splitlines()
+    else:
+      with open(package_id_path) as f:
+        package_id_list = f.read().splitlines()
+    if not any(s.strip() for s in package_id_list):
+      logging.info('No package IDs to register')
+      return
+    result_list = pasta_gmn_adapter.app.enqueue.enqueue_package_ids(
+      package_id_list
+    )
+    self.stdout.write(
+      pasta_gmn_adapter.app.enqueue.format_result_list(result_list), ending=''
+    )
+    logging.info(
+      'Accepted: {} Rejected: {}'.format(
+        sum(1 for r in result_list if r[1]),
+        sum(1 for r in result_list if not r[1]),
+      )
+    )
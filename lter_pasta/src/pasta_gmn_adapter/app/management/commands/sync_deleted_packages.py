@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`sync_deleted_packages`
+===============================
+
+:Synopsis:
+  Archive on GMN the packages that have been deleted in PASTA.
+
+  The list of deleted packages is retrieved from PASTA and joined against the
+  completed packages in the queue in a single query. For each completed
+  revision of a deleted package, the resource map is retrieved from GMN and the
+  members of the package and then the resource map itself are archived.
+  Revisions are archived concurrently.
+
+  When all revisions of a deleted package have been archived, the package is
+  recorded in the database, and later runs skip it. Packages that fail are
+  retried on the next run.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+
+import d1_common.resource_map
+import d1_common.types.exceptions
+
+import django.core.management.base
+import django.db.transaction
+
+import pasta_gmn_adapter.app.data_package_manager_client
+# noinspection PyProtectedMember
+import pasta_gmn_adapter.app.management.commands._util as util
+import pasta_gmn_adapter.app.population_queue_processor
+import pasta_gmn_adapter.app.sql
+
+DEFAULT_WORKER_COUNT = 4
+
+# PASTA lists deleted packages as "scope.identifier".
+DELETED_PACKAGE_RX = re.compile(r'^\s*([\w-]+)\.(\d+)(?:\.\d+)?\s*$')
+
+
+class Command(django.core.management.base.BaseCommand):
+  def _init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+
+  def add_arguments(self, parser):
+    parser.description = __doc__
+    parser.formatter_class = argparse.RawDescriptionHelpFormatter
+    parser.add_argument(
+      '--debug', action='store_true', help='Debug level logging'
+    )
+    parser.add_argument(
+      '--workers', type=int, default=DEFAULT_WORKER_COUNT,
+      help='Number of package revisions to archive concurrently'
+    )
+    parser.add_argument(
+      '--dry-run', action='store_true',
+      help='List the package revisions that would be archived without '
+      'archiving them'
+    )
+
+  def handle(self, *args, **options):
+    util.log_setup(options['debug'])
+    util.exit_if_other_instance_is_running(__name__)
+    logging.info('Running management command: {}'.format(__name__))
+    syncer = DeletedPackageSyncer(options['workers'], options['dry_run'])
+    syncer.sync_deleted_packages()
+
+
+# ===============================================================================
+
+
+class DeletedPackageSyncer(object):
+  def __init__(self, worker_count, dry_run):
+    self._worker_count = worker_count
+    self._dry_run = dry_run
+    self._thread_local = threading.local()
+    self._archived_object_count = 0
+    self._archived_package_count = 0
+    self._failed_package_count = 0
+
+  def sync_deleted_packages(self):
+    start_sec = time.time()
+    scope_identifier_list = parse_deleted_package_list(
+      self._get_pasta_client().list_deleted_packages()
+    )
+    logging.info(
+      'Packages deleted in PASTA: {}'.format(len(scope_identifier_list))
+    )
+    with django.db.transaction.atomic():
+      item_list = (
+        pasta_gmn_adapter.app.sql.select_unarchived_deleted_package_revisions(
+          scope_identifier_list
+        )
+      )
+    package_dict = collections.OrderedDict()
+    for item in item_list:
+      package_dict.setdefault(
+        (item['package_scope'], item['package_identifier']), []
+      ).append(item)
+    logging.info(
+      'Deleted packages to archive on GMN: {} Revisions: {}'.format(
+        len(package_dict), len(item_list)
+      )
+    )
+    if self._dry_run:
+      for item in item_list:
+        logging.info(
+          'Dry run: Would archive: {}.{}.{}'.format(
+            item['package_scope'], item['package_identifier'],
+            item['package_revision']
+          )
+        )
+      return
+    self._archive_packages(package_dict)
+    logging.info(
+      'Completed. Archived packages: {} Archived objects: {} '
+      'Failed packages: {} Time: {:.2f} sec'.format(
+        self._archived_package_count, self._archived_object_count,
+        self._failed_package_count, time.time() - start_sec
+      )
+    )
+
+  def _archive_packages(self, package_dict):
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._worker_count
+    ) as executor:
+      future_dict = {
+        (scope, identifier): [
+          executor.submit(self._archive_package_revision, item)
+          for item in item_list
+        ] for (scope, identifier), item_list in package_dict.items()
+      }
+      for (scope, identifier), future_list in future_dict.items():
+        is_failed = False
+        for future in future_list:
+          try:
+            self._archived_object_count += future.result()
+          except Exception as e:
+            logging.error(
+              'Archiving failed. scope="{}" identifier="{}" error="{}"'.format(
+                scope, identifier, str(e)
+              )
+            )
+            is_failed = True
+        if is_failed:
+          self._failed_package_count += 1
+        else:
+          pasta_gmn_adapter.app.sql.insert_archived_deleted_package(
+            scope, identifier
+          )
+          self._archived_package_count += 1
+
+  def _archive_package_revision(self, item):
+    """Archive the members and the resource map of a package revision. Return
+    the number of archived objects."""
+    package_id = pasta_gmn_adapter.app.population_queue_processor.PackageID(
+      item['package_scope'], item['package_identifier'],
+      item['package_revision']
+    )
+    logging.info('Archiving: {}'.format(package_id))
+    gmn_client = self._get_gmn_client()
+    resource_map_pid = self._get_pasta_client().read_data_package_doi(
+      package_id
+    )
+    try:
+      resource_map_xml = gmn_client.get(resource_map_pid).content
+    except d1_common.types.exceptions.NotFound:
+      logging.info(
+        'Resource map not found on GMN. pid="{}"'.format(resource_map_pid)
+      )
+      return 0
+    resource_map = d1_common.resource_map.ResourceMap()
+    resource_map.parseDoc(resource_map_xml)
+    archived_count = 0
+    for pid in resource_map.getAggregatedPids():
+      archived_count += self._archive(gmn_client, pid)
+    archived_count += self._archive(gmn_client, resource_map_pid)
+    return archived_count
+
+  def _archive(self, gmn_client, pid):
+    try:
+      gmn_client.archive(pid)
+    except d1_common.types.exceptions.NotFound:
+      logging.info('Object not found on GMN. pid="{}"'.format(pid))
+      return 0
+    logging.debug('Archived. pid="{}"'.format(pid))
+    return 1
+
+  def _get_pasta_client(self):
+    """Return a PASTA client for the current thread."""
+    try:
+      return self._thread_local.pasta_client
+    except AttributeError:
+      self._thread_local.pasta_client = (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerClient()
+      )
+      return self._thread_local.pasta_client
+
+  def _get_gmn_client(self):
+    """Return a GMN client for the current thread."""
+    try:
+      return self._thread_local.gmn_client
+    except AttributeError:
+      self._thread_local.gmn_client = (
+        pasta_gmn_adapter.app.population_queue_processor.create_gmn_client()
+      )
+      return self._thread_local.gmn_client
+
+
+def parse_deleted_package_list(deleted_package_list):
+  """Return a sorted list of unique (scope, identifier) tuples from the list of
+  deleted packages returned by PASTA."""
+  scope_identifier_set = set()
+  for deleted_package_str in deleted_package_list:
+    m = DELETED_PACKAGE_RX.match(deleted_package_str)
+    if m:
+      scope_identifier_set.add((m.group(1), int(m.group(2))))
+    elif deleted_package_str.strip():
+      logging.warning(
+        'Ignored invalid deleted package: {}'.format(deleted_package_str)
+      )
+  return sorted(scope_identifier_set)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`metrics`
+=================
+
+:Synopsis:
+  Counters and histograms for monitoring the adapter, rendered in the
+  Prometheus text exposition format by /admin/metrics.
+
+  Metrics are recorded in an in-process registry. The web service records the
+  latency of each view, and of the requests made by the prefetch. The queue
+  processor runs from cron in a separate
+  process, so it adds its metrics to the adapter_metric table at the end of
+  each run, where the web service can read them without running any heavy
+  queries.
+"""
+
+import threading
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (
+  0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180, 600,
+  1800, 3600
+)
+# Upper bounds of the buckets for queue latency, which spans minutes to days.
+LATENCY_BUCKETS = (
+  60, 300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 24 * 3600,
+  3 * 24 * 3600, 7 * 24 * 3600
+)
+
+# Metric families: name -> (type, help)
+METRIC_DICT = {
+  'pasta_gmn_adapter_queue_items': (
+    'gauge', 'Number of queue items by latest processing status.'
+  ),
+  'pasta_gmn_adapter_enqueued_items_total': (
+    'counter', 'Number of items added to the queue.'
+  ),
+  'pasta_gmn_adapter_intake_items': (
+    'gauge', 'Number of package IDs waiting in the intake to be queued.'
+  ),
+  'pasta_gmn_adapter_oldest_unprocessed_item_age_seconds': (
+    'gauge', 'Age of the oldest item left unprocessed by the last run.'
+  ),
+  'pasta_gmn_adapter_last_run_timestamp_seconds': (
+    'gauge', 'Time at which the last queue processing run completed.'
+  ),
+  'pasta_gmn_adapter_package_processing_seconds': (
+    'histogram', 'Time spent processing a package, by resulting status.'
+  ),
+  'pasta_gmn_adapter_queue_latency_seconds': (
+    'histogram',
+    'Time from enqueue to completion of a package, by scheduling policy.'
+  ),
+  'pasta_gmn_adapter_upstream_request_seconds': (
+    'histogram', 'Latency of requests to PASTA and GMN.'
+  ),
+  'pasta_gmn_adapter_upstream_request_errors_total': (
+    'counter', 'Number of requests to PASTA and GMN that returned an error.'
+  ),
+  'pasta_gmn_adapter_timed_out_request_seconds_total': (
+    'counter', 'Time spent on requests to PASTA and GMN that timed out.'
+  ),
+  'pasta_gmn_adapter_abandoned_packages_total': (
+    'counter', 'Number of packages abandoned for exceeding their time budget.'
+  ),
+  'pasta_gmn_adapter_entity_header_lookups_total': (
+    'counter',
+    'Lookups of entity headers in the index of previously collected entities.'
+  ),
+  'pasta_gmn_adapter_view_request_seconds': (
+    'histogram', 'Latency of requests to the adapter, by view. Per process.'
+  ),
+}
+
+
+class MetricRegistry(object):
+  """Thread safe registry of counters and histograms."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counter_dict = {}
+    self._histogram_dict = {}
+
+  def inc(self, name, labels=None, value=1):
+    key = name, format_labels(labels)
+    with self._lock:
+      self._counter_dict[key] = self._counter_dict.get(key, 0) + value
+
+  def observe(self, name, value, labels=None, buckets=DEFAULT_BUCKETS):
+    key = name, format_labels(labels)
+    with self._lock:
+      try:
+        histogram = self._histogram_dict[key]
+      except KeyError:
+        histogram = self._histogram_dict[key] = {
+          'buckets': buckets,
+          'bucket_counts': [0] * len(buckets),
+          'sum': 0.0,
+          'count': 0,
+        }
+      for i, upper_bound in enumerate(buckets):
+        if value <= upper_bound:
+          histogram['bucket_counts'][i] += 1
+      histogram['sum'] += value
+      histogram['count'] += 1
+
+  def get_samples(self):
+    """Return a list of (sample_name, labels, value) tuples. Histograms are
+    expanded to cumulative buckets, sum and count, so that the samples from
+    several runs can be combined by adding them."""
+    sample_list = []
+    with self._lock:
+      for (name, labels), value in sorted(self._counter_dict.items()):
+        sample_list.append((name, labels, value))
+      for (name, labels), histogram in sorted(self._histogram_dict.items()):
+        for upper_bound, count in zip(
+            histogram['buckets'], histogram['bucket_counts']
+        ):
+          sample_list.append((
+            name + '_bucket',
+            _add_label(labels, 'le', '{}'.format(upper_bound)), count
+          ))
+        sample_list.append((
+          name + '_bucket', _add_label(labels, 'le', '+Inf'),
+          histogram['count']
+        ))
+        sample_list.append((name + '_sum', labels, histogram['sum']))
+        sample_list.append((name + '_count', labels, histogram['count']))
+    return sample_list
+
+  def clear(self):
+    with self._lock:
+      self._counter_dict.clear()
+      self._histogram_dict.clear()
+
+
+registry = MetricRegistry()
+
+
+def add_request_hook(session, service):
+  """Record the latency and errors of all requests made through a requests
+  Session. {service} is "pasta" or "gmn"."""
+
+  def record_response(response, *_args, **_kwargs):
+    labels = {'service': service, 'method': response.request.method}
+    registry.observe(
+      'pasta_gmn_adapter_upstream_request_seconds',
+      response.elapsed.total_seconds(), labels
+    )
+    if response.status_code >= 400:
+      labels['status'] = response.status_code
+      registry.inc('pasta_gmn_adapter_upstream_request_errors_total', labels)
+
+  session.hooks['response'].append(record_response)
+
+
+def format_labels(labels):
+  """Format a dict of labels as '{a="1",b="2"}'."""
+  if not labels:
+    return ''
+  return '{{{}}}'.format(
+    ','.join(
+      '{}="{}"'.format(
+        k,
+        str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+      ) for k, v in sorted(labels.items())
+    )
+  )
+
+
+def render(sample_list):
+  """Render a list of (sample_name, labels, value) tuples in the text
+  exposition format, grouped by metric family."""
+  family_dict = {}
+  for sample in sample_list:
+    family_dict.setdefault(_get_family(sample[0]), []).append(sample)
+  line_list = []
+  for family_name, family_sample_list in sorted(family_dict.items()):
+    try:
+      metric_type, help_str = METRIC_DICT[family_name]
+    except KeyError:
+      metric_type, help_str = 'untyped', ''
+    line_list.append('# HELP {} {}'.format(family_name, help_str))
+    line_list.append('# TYPE {} {}'.format(family_name, metric_type))
+    for sample_name, labels, value in family_sample_list:
+      line_list.append('{}{} {}'.format(sample_name, labels, _format_value(value)))
+  return '\n'.join(line_list) + '\n'
+
+
+def merge_samples(sample_list):
+  """Combine the samples that have the same name and labels by adding their
+  values, keeping the order in which the series first appear. A series may be
+  recorded both by the queue processor, which stores its samples in the
+  database, and in the registry of the web process, e.g., the latency of the
+  requests made by the prefetch. Each series must appear only once in the
+  exposition. Only counters and histograms can be combined this way."""
+  merged_dict = {}
+  for name, labels, value in sample_list:
+    key = name, labels
+    merged_dict[key] = merged_dict.get(key, 0) + value
+  return [
+    (name, labels, value) for (name, labels), value in merged_dict.items()
+  ]
+
+
+def _get_family(sample_name):
+  for suffix in ('_bucket', '_sum', '_count'):
+    if sample_name.endswith(suffix):
+      family_name = sample_name[:-len(suffix)]
+      if METRIC_DICT.get(family_name, ('',))[0] == 'histogram':
+        return family_name
+  return sample_name
+
+
+def _add_label(labels, name, value):
+  label_str = '{}="{}"'.format(name, value)
+  if not labels:
+    return '{{{}}}'.format(label_str)
+  return '{},{}}}'.format(labels[:-1], label_str)
+
+
+def _format_value(value):
+  if isinstance(value, float) and value.is_integer():
+    return '{:.1f}'.format(value)
+  return '{}'.format(value)
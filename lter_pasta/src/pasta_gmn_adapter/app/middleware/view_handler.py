@@ -16,14 +16,17 @@
 :mod:`view_handler`
 ===================
 
-:Synopsis: Log view accesses.
+:Synopsis: Log view accesses and record view latency.
 :Author: Roger Dahl
 """
 
 import logging
+import time
 
 import django.utils.deprecation
 
+import pasta_gmn_adapter.app.metrics
+
 
 class ViewHandler(django.utils.deprecation.MiddlewareMixin):
   def process_view(self, request, view_func, view_args, view_kwargs):
@@ -32,5 +35,19 @@ class ViewHandler(django.utils.deprecation.MiddlewareMixin):
       'View: func_name({0}) method({1}) args({2}) kwargs({3})'
       .format(view_func.__name__, request.method, view_args, view_kwargs)
     )
+    request.pasta_gmn_adapter_view = view_func.__name__, time.time()
     # Returning None continues regular handling.
     return None
+
+  def process_response(self, request, response):
+    # Record the latency of the view, including the middleware below this one.
+    try:
+      view_name, start_sec = request.pasta_gmn_adapter_view
+    except AttributeError:
+      return response
+    pasta_gmn_adapter.app.metrics.registry.observe(
+      'pasta_gmn_adapter_view_request_seconds',
+      time.time() - start_sec,
+      {'view': view_name, 'method': request.method},
+    )
+    return response
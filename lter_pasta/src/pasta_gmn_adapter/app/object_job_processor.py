@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`object_job_processor`
+==============================
+
+:Synopsis:
+  Process the queue as jobs for the individual objects of each package, so that
+  the objects of a large package are created by several workers.
+
+  Each queue item is expanded into one job per data entity, one for the quality
+  report and one for the metadata, and a resource map job that depends on all of
+  them, and on the resource map job of the previous revision of the package, if
+  that is also queued. The jobs are held in the adapter_object_job table. Any
+  worker can claim any job whose dependencies have completed, so the members of
+  a package are created concurrently. A package with an entity that is not
+  publicly readable is recorded as private when it is expanded, and no jobs are
+  added for it.
+
+  When all the jobs of a queue item have finished, the status of the queue item
+  is rolled up from the jobs and recorded as before, so the admin views are not
+  affected. Jobs that did not complete are retried on the next run, while the
+  completed ones are not repeated.
+"""
+
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+
+import django.db
+import django.db.transaction
+
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.population_queue_processor
+import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
+
+# Seconds to wait before trying again when there are no jobs that can be claimed
+# but other workers are still running jobs.
+CLAIM_POLL_SEC = 1.0
+
+
+class ObjectJobProcessor(object):
+  def __init__(self, worker_count, insert_status_fn):
+    """{insert_status_fn} records the rolled up status of a queue item. It is
+    called as insert_status_fn(package, status, return_code, return_body,
+    start_sec)."""
+    self._worker_count = worker_count
+    self._insert_status_fn = insert_status_fn
+    self._thread_local = threading.local()
+    self._is_expansion_done = threading.Event()
+    self._start_sec_dict = {}
+
+  def process_population_queue(self, population_queue):
+    """Expand the queue items into jobs, in the order of {population_queue},
+    while the workers process the jobs that have already been added."""
+    pasta_gmn_adapter.app.sql.reset_object_jobs()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._worker_count
+    ) as executor:
+      future_list = [
+        executor.submit(self._run_worker) for _ in range(self._worker_count)
+      ]
+      try:
+        for package in population_queue:
+          self._expand_package(package)
+      finally:
+        self._is_expansion_done.set()
+      for future in future_list:
+        future.result()
+
+  def _expand_package(self, package):
+    self._start_sec_dict[package['id']] = time.time()
+    package_id = self._get_package_id(package)
+    if pasta_gmn_adapter.app.sql.select_object_job_count(package['id']):
+      logging.info('Resuming jobs for package: {}'.format(package_id))
+      return
+    logging.info('Adding jobs for package: {}'.format(package_id))
+    try:
+      entity_ids, d1_replication_policy = (
+        self._get_collector().collect_job_info(package_id)
+      )
+    except Exception as e:
+      status, return_code, return_body = (
+        pasta_gmn_adapter.app.population_queue_processor.get_failure_status(e)
+      )
+      self._insert_status_fn(
+        package, status, return_code, return_body,
+        self._start_sec_dict[package['id']]
+      )
+      return
+    if d1_replication_policy is not None:
+      d1_replication_policy = d1_replication_policy.decode('utf-8')
+    member_job_list = [(
+      'entity',
+      json.dumps({
+        'entity_id': entity_id,
+        'd1_replication_policy': d1_replication_policy,
+      })
+    ) for entity_id in entity_ids]
+    for object_type in ('report', 'metadata'):
+      member_job_list.append((
+        object_type,
+        json.dumps({'d1_replication_policy': d1_replication_policy})
+      ))
+    with django.db.transaction.atomic():
+      pasta_gmn_adapter.app.sql.insert_object_jobs(
+        package['id'], member_job_list,
+        json.dumps({
+          'entity_ids': entity_ids,
+          'd1_replication_policy': d1_replication_policy,
+        })
+      )
+
+  def _run_worker(self):
+    try:
+      while True:
+        job = pasta_gmn_adapter.app.sql.claim_object_job()
+        if job is not None:
+          self._process_job(job)
+        elif (
+            self._is_expansion_done.is_set() and
+            not pasta_gmn_adapter.app.sql.select_claimed_object_job_count()
+        ):
+          break
+        else:
+          time.sleep(CLAIM_POLL_SEC)
+    finally:
+      django.db.connection.close()
+
+  def _process_job(self, job):
+    package = {
+      'id': job['population_queue_item_id'],
+      'package_scope': job['package_scope'],
+      'package_identifier': job['package_identifier'],
+      'package_revision': job['package_revision'],
+      'timestamp': job['timestamp'],
+    }
+    logging.info(
+      'Processing job: {} {} {}'.format(
+        job['job_type'], self._get_package_id(package), job['payload']
+      )
+    )
+    try:
+      with pasta_gmn_adapter.app.deadline.package_budget(
+          pasta_gmn_adapter.settings.PACKAGE_DEADLINE_SECONDS,
+          pasta_gmn_adapter.settings.PACKAGE_WATCHDOG_GRACE_SECONDS
+      ):
+        self._run_job(job['job_type'], package, json.loads(job['payload']))
+    except Exception as e:
+      status, return_code, return_body = (
+        pasta_gmn_adapter.app.population_queue_processor.get_failure_status(e)
+      )
+    else:
+      status, return_code, return_body = 'completed', 0, ''
+    # The job is finished and the queue item rolled up in a single transaction,
+    # so the completed status of a revision is recorded before the resource map
+    # job of the next revision can be claimed.
+    with django.db.transaction.atomic():
+      cancelled_id_list = pasta_gmn_adapter.app.sql.finish_object_job(
+        job['id'], status, return_code, return_body
+      )
+      self._roll_up(package['id'])
+    for population_queue_id in cancelled_id_list:
+      with django.db.transaction.atomic():
+        self._roll_up(population_queue_id)
+
+  def _run_job(self, job_type, package, payload):
+    package_id = self._get_package_id(package)
+    collector = self._get_collector()
+    if job_type == 'resource_map':
+      package_info = collector.collect_resource_map_info(
+        package_id, payload['entity_ids']
+      )
+      package_info['package']['d1_replication_policy'] = (
+        payload['d1_replication_policy']
+      )
+      previous_revision = (
+        pasta_gmn_adapter.app.sql.select_latest_package_revision(
+          package['package_scope'], package['package_identifier']
+        )
+      )
+      if previous_revision is None:
+        self._get_creator().create_resource_map(package_info)
+      else:
+        self._get_creator().update_resource_map(
+          package_info,
+          collector.collect_package_doi(
+            self._get_package_id(package, previous_revision)
+          )
+        )
+    else:
+      object_meta = collector.collect_object_info(
+        package_id, job_type, payload.get('entity_id')
+      )
+      object_meta['d1_replication_policy'] = payload['d1_replication_policy']
+      self._get_creator().create_object(object_meta)
+
+  def _roll_up(self, population_queue_id):
+    """Record the status of the queue item if all its jobs have finished and the
+    status has not already been recorded. Must be called in a transaction."""
+    rollup = pasta_gmn_adapter.app.sql.select_object_job_rollup(
+      population_queue_id
+    )
+    if (
+        rollup is None or not rollup['job_count'] or
+        rollup['unfinished_count'] or not rollup['unreported_count']
+    ):
+      return
+    if rollup['private_count']:
+      status = 'private'
+    elif rollup['error_count']:
+      status = 'error'
+    else:
+      status = 'completed'
+    logging.info(
+      'Package {}: {}'.format(self._get_package_id(rollup['package']), status)
+    )
+    self._insert_status_fn(
+      rollup['package'], status, rollup['return_code'] or 0,
+      rollup['return_body'] or '',
+      self._start_sec_dict.get(population_queue_id, time.time())
+    )
+    if status == 'error':
+      pasta_gmn_adapter.app.sql.set_object_jobs_rolled_up(population_queue_id)
+    else:
+      pasta_gmn_adapter.app.sql.delete_object_jobs(population_queue_id)
+      pasta_gmn_adapter.app.sql.delete_prefetched_package_info(
+        population_queue_id
+      )
+
+  def _get_package_id(self, package, revision=None):
+    return pasta_gmn_adapter.app.population_queue_processor.PackageID(
+      package['package_scope'], package['package_identifier'],
+      package['package_revision'] if revision is None else revision
+    )
+
+  def _get_collector(self):
+    """Return a PASTA info collector for the current thread."""
+    try:
+      return self._thread_local.collector
+    except AttributeError:
+      self._thread_local.collector = (
+        pasta_gmn_adapter.app.population_queue_processor.
+        DataPackageInfoCollector()
+      )
+      return self._thread_local.collector
+
+  def _get_creator(self):
+    """Return a GMN package creator for the current thread."""
+    try:
+      return self._thread_local.creator
+    except AttributeError:
+      self._thread_local.creator = (
+        pasta_gmn_adapter.app.population_queue_processor.GMNPackageCreator()
+      )
+      return self._thread_local.creator
@@ -0,0 +1,877 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`population_queue_processor`
+====================================
+
+:Synopsis:
+  Iterate over queue of objects registered for population and attempt to
+  create them on GMN.
+
+  Used by the process_population_queue management command, which imports this
+  module only when there is work in the queue.
+:Author:
+  Roger Dahl
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import d1_common.checksum
+import d1_common.const
+import d1_common.types.dataoneTypes
+import d1_common.types.exceptions
+import d1_common.url
+
+import d1_client.cnclient
+import d1_client.mnclient
+
+import connector_util.lazy_log
+import connector_util.sysmeta_template
+
+import django.db
+import django.db.transaction
+import django.utils.timezone
+
+import pasta_gmn_adapter
+import pasta_gmn_adapter.api_types.eml_access
+import pasta_gmn_adapter.app.async_package_processor
+import pasta_gmn_adapter.app.data_package_manager_client
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.metrics
+import pasta_gmn_adapter.app.object_job_processor
+import pasta_gmn_adapter.app.prefetch
+import pasta_gmn_adapter.app.resource_map
+import pasta_gmn_adapter.app.scheduler
+import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
+
+# Number of concurrent requests to PASTA when looking up the entity counts of
+# the queued packages for the smallest_first scheduling policy.
+ENTITY_COUNT_LOOKUP_WORKER_COUNT = 8
+
+
+class PopulationQueueProcessor(object):
+  def __init__(self):
+    self._package_start_sec = None
+    self._unprocessed_timestamp_list = []
+    self._abandoned_package_count = 0
+    self._abandoned_sec = 0.0
+
+  def process_population_queue(self):
+    # Debug: Try a single package without catching any exceptions.
+    # package = {
+    #   'package_scope': 'knb-lter-nes',
+    #   'package_identifier': 1,
+    #   'package_revision': 1,
+    # }
+    # self._process_package(package)
+    # exit()
+
+    pasta_gmn_adapter.app.deadline.deadline.reset_stats()
+    population_queue = self._get_uncompleted_packages()
+    if pasta_gmn_adapter.settings.OBJECT_JOB_WORKER_COUNT:
+      pasta_gmn_adapter.app.object_job_processor.ObjectJobProcessor(
+        pasta_gmn_adapter.settings.OBJECT_JOB_WORKER_COUNT,
+        self._insert_package_processing_status
+      ).process_population_queue(population_queue)
+    elif pasta_gmn_adapter.settings.ASYNC_PACKAGE_CONCURRENCY:
+      pasta_gmn_adapter.app.async_package_processor.AsyncPackageProcessor(
+        pasta_gmn_adapter.settings.ASYNC_PACKAGE_CONCURRENCY,
+        pasta_gmn_adapter.settings.ASYNC_PASTA_REQUEST_CONCURRENCY,
+        pasta_gmn_adapter.settings.ASYNC_GMN_WORKER_COUNT,
+        self._insert_package_processing_status, self._abandon_package
+      ).process_population_queue(population_queue)
+    else:
+      self._process_packages(population_queue)
+    self._log_time_lost_to_timeouts()
+    self._save_metrics()
+
+  def _process_packages(self, population_queue):
+    for package in population_queue:
+      self._package_start_sec = time.time()
+      try:
+        with pasta_gmn_adapter.app.deadline.package_budget(
+            pasta_gmn_adapter.settings.PACKAGE_DEADLINE_SECONDS,
+            pasta_gmn_adapter.settings.PACKAGE_WATCHDOG_GRACE_SECONDS
+        ):
+          try:
+            self._process_package(package)
+          finally:
+            # Don't let the alarm fire on a package that has just completed.
+            pasta_gmn_adapter.app.deadline.cancel_watchdog()
+      except pasta_gmn_adapter.app.deadline.DeadlineExceeded as e:
+        logging.error('Abandoned: {0}'.format(str(e)))
+        self._abandon_package(package, e)
+      except Exception as e:
+        self._insert_package_processing_status(package, *get_failure_status(e))
+      else:
+        self._insert_package_processing_status(package, 'completed')
+
+  def _get_uncompleted_packages(self):
+    population_queue = (
+      pasta_gmn_adapter.app.sql.select_population_queue_uncompleted()
+    )
+    if pasta_gmn_adapter.settings.QUEUE_SCHEDULING_POLICY == 'smallest_first':
+      look_up_entity_counts(population_queue)
+    return pasta_gmn_adapter.app.scheduler.order_queue_items(
+      population_queue, pasta_gmn_adapter.settings.QUEUE_SCHEDULING_POLICY,
+      django.utils.timezone.now()
+    )
+
+  def _process_package(self, package):
+    logging.info('-' * 80)
+    package_id = PackageID(
+      package['package_scope'], package['package_identifier'],
+      package['package_revision']
+    )
+    logging.info('Processing Package: {0}'.format(package_id))
+    data_package_info_collector = DataPackageInfoCollector()
+    package_info = get_prefetched_package_info(package)
+    if package_info is None:
+      package_info = data_package_info_collector.collect_package_info(package_id)
+    previous_revision = pasta_gmn_adapter.app.sql.select_latest_package_revision(
+      package['package_scope'], package['package_identifier']
+    )
+    gmn_package_creator = GMNPackageCreator()
+    if previous_revision is None:
+      gmn_package_creator.create_package(package_info)
+    else:
+      previous_package_id = PackageID(
+        package['package_scope'], package['package_identifier'],
+        previous_revision
+      )
+      previous_package_info = data_package_info_collector.collect_package_info(
+        previous_package_id
+      )
+      gmn_package_creator.update_package(package_info, previous_package_info)
+    pasta_gmn_adapter.app.sql.delete_prefetched_package_info(package['id'])
+
+  def _abandon_package(self, package, e, start_sec=None):
+    """Record a package that was abandoned for exceeding its time budget."""
+    self._abandoned_package_count += 1
+    self._abandoned_sec += time.time() - (start_sec or self._package_start_sec)
+    pasta_gmn_adapter.app.metrics.registry.inc(
+      'pasta_gmn_adapter_abandoned_packages_total'
+    )
+    self._insert_package_processing_status(
+      package, 'error', return_body=str(e), start_sec=start_sec
+    )
+
+  def _insert_package_processing_status(
+      self, package, status, return_code=0, return_body='', start_sec=None
+  ):
+    pasta_gmn_adapter.app.sql.insert_process_status(
+      package['id'], status, return_code,
+      return_body[:pasta_gmn_adapter.app.sql.VCHAR_LENGTH]
+    )
+    pasta_gmn_adapter.app.metrics.registry.observe(
+      'pasta_gmn_adapter_package_processing_seconds',
+      time.time() - (start_sec or self._package_start_sec), {'status': status}
+    )
+    if status == 'error':
+      self._unprocessed_timestamp_list.append(package['timestamp'].timestamp())
+    elif status == 'completed':
+      pasta_gmn_adapter.app.metrics.registry.observe(
+        'pasta_gmn_adapter_queue_latency_seconds',
+        time.time() - package['timestamp'].timestamp(),
+        {'policy': pasta_gmn_adapter.settings.QUEUE_SCHEDULING_POLICY},
+        buckets=pasta_gmn_adapter.app.metrics.LATENCY_BUCKETS
+      )
+
+  def _log_time_lost_to_timeouts(self):
+    deadline = pasta_gmn_adapter.app.deadline.deadline
+    logging.info(
+      'Time lost to timeouts: {:.2f} sec in {} timed out requests. '
+      'Abandoned packages: {} ({:.2f} sec)'.format(
+        deadline.timed_out_sec, deadline.timed_out_request_count,
+        self._abandoned_package_count, self._abandoned_sec
+      )
+    )
+
+  def _save_metrics(self):
+    """Add the metrics recorded during this run to the metrics stored in the
+    database, from where they are served by /admin/metrics."""
+    with django.db.transaction.atomic():
+      pasta_gmn_adapter.app.sql.add_to_metrics(
+        pasta_gmn_adapter.app.metrics.registry.get_samples()
+      )
+      pasta_gmn_adapter.app.sql.set_metrics([
+        (
+          'pasta_gmn_adapter_oldest_unprocessed_item_timestamp_seconds', '',
+          min(self._unprocessed_timestamp_list, default=0)
+        ),
+        ('pasta_gmn_adapter_last_run_timestamp_seconds', '', time.time()),
+      ])
+    pasta_gmn_adapter.app.metrics.registry.clear()
+
+
+def look_up_entity_counts(population_queue):
+  """Fill in the entity counts of the queue items for which it is not known, by
+  listing the data entities of the packages in PASTA. The counts are stored in
+  the queue, so each package is only looked up once."""
+  item_list = [i for i in population_queue if i['entity_count'] is None]
+  if not item_list:
+    return
+  logging.info('Looking up entity counts. packages={}'.format(len(item_list)))
+  thread_local = threading.local()
+
+  def get_entity_count(item):
+    try:
+      pasta_client = thread_local.pasta_client
+    except AttributeError:
+      pasta_client = thread_local.pasta_client = (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerClient()
+      )
+    package_id = PackageID(
+      item['package_scope'], item['package_identifier'],
+      item['package_revision']
+    )
+    try:
+      return len([e for e in pasta_client.list_data_entities(package_id) if e])
+    except Exception as e:
+      logging.warning(
+        'Unable to get entity count. package="{}" error="{}"'.format(
+          package_id, str(e)
+        )
+      )
+      return None
+
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=ENTITY_COUNT_LOOKUP_WORKER_COUNT
+  ) as executor:
+    entity_count_list = list(executor.map(get_entity_count, item_list))
+  for item, entity_count in zip(item_list, entity_count_list):
+    item['entity_count'] = entity_count
+  pasta_gmn_adapter.app.sql.update_population_queue_entity_counts([
+    (item['id'], entity_count)
+    for item, entity_count in zip(item_list, entity_count_list)
+    if entity_count is not None
+  ])
+
+
+def get_prefetched_package_info(package):
+  try:
+    package_info = pasta_gmn_adapter.app.prefetch.get_prefetched_package_info(
+      package['id']
+    )
+  except pasta_gmn_adapter.app.deadline.DeadlineExceeded:
+    raise
+  except Exception:
+    logging.exception('Unable to use prefetched package info:')
+    return None
+  if package_info is not None:
+    logging.info('Using prefetched package info')
+  return package_info
+
+
+def get_failure_status(e):
+  """Log the exception that caused processing of a package or object to fail,
+  and return the (status, return_code, return_body) to record for it. Must be
+  called from the exception handler."""
+  if isinstance(
+      e, (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerException,
+        pasta_gmn_adapter.api_types.eml_access.EMLAccessException
+      )
+  ):
+    logging.error('Failed: {0}'.format(str(e)))
+    return (
+      'private' if e.status == 401 else 'error', e.status,
+      'msg({0}) body({1})'.format(e.msg, e.body)
+    )
+  if isinstance(e, d1_common.types.exceptions.DataONEException):
+    logging.exception('Population failed with DataONE Exception:')
+    return 'error', e.errorCode, 'description({0}) body({1})'.format(
+      e.description, e.traceInformation
+    )
+  logging.exception('Population failed with internal exception:')
+  return 'error', 0, str(e)
+
+
+# ===============================================================================
+
+
+class DataPackageInfoCollector(object):
+  """Collect all the information about the data package and its entities that
+  is required for exposing the objects to DataONE.
+
+  Cardinality of a PASTA data package:
+  Metadata: 1
+  Quality report: 1
+  Data: 1 to many
+  """
+
+  def __init__(self):
+    self._pasta_client = pasta_gmn_adapter.app.data_package_manager_client.DataPackageManagerClient(
+      add_basic_auth_header=True
+    )
+    self._pasta_client_public_access = \
+      pasta_gmn_adapter.app.data_package_manager_client.DataPackageManagerClient(
+        add_basic_auth_header=False)
+
+  def collect_package_info(self, package_id):
+    entity_ids = self._pasta_client.list_data_entities(package_id)
+    self._raise_if_not_authorized_for_all_entities(package_id, entity_ids)
+    package_info = {
+      'package': self._get_package_info(package_id),
+      'entities': self._get_package_entities_info(package_id, entity_ids),
+      'report': self._get_quality_report_info(package_id),
+      'metadata': self._get_metadata_info(package_id),
+    }
+    d1_replication_policy = self._pasta_client.read_metadata_replication_policy(
+      package_id
+    )
+    package_info['package']['d1_replication_policy'] = d1_replication_policy
+    for entity_info in package_info['entities']:
+      entity_info['d1_replication_policy'] = d1_replication_policy
+    package_info['report']['d1_replication_policy'] = d1_replication_policy
+    package_info['metadata']['d1_replication_policy'] = d1_replication_policy
+    return package_info
+
+  def collect_job_info(self, package_id):
+    """Return the entity IDs and the DataONE Replication Policy of the package,
+    which are needed for creating the object jobs for the package. Access to all
+    the entities is checked here, so that no jobs are created for a package
+    that has a private entity."""
+    entity_ids = self._pasta_client.list_data_entities(package_id)
+    self._raise_if_not_authorized_for_all_entities(package_id, entity_ids)
+    return (
+      entity_ids,
+      self._pasta_client.read_metadata_replication_policy(package_id),
+    )
+
+  def collect_object_info(self, package_id, object_type, entity_id=None):
+    """Collect the information for a single member of the package.
+    {object_type} is "entity", "report" or "metadata"."""
+    if object_type == 'entity':
+      return self._get_package_entities_info(package_id, [entity_id])[0]
+    if object_type == 'report':
+      return self._get_quality_report_info(package_id)
+    if object_type == 'metadata':
+      return self._get_metadata_info(package_id)
+    raise ValueError('Invalid object type: {}'.format(object_type))
+
+  def collect_resource_map_info(self, package_id, entity_ids):
+    """Collect the information for creating the resource map of the package.
+    Only the PIDs of the members are included."""
+    return {
+      'package': self._get_package_info(package_id),
+      'entities': [{
+        'resource_id': self._pasta_client.entity_uri(package_id, entity_id)
+      } for entity_id in entity_ids],
+      'report': {'resource_id': self._pasta_client.report_uri(package_id)},
+      'metadata': {'resource_id': self._pasta_client.metadata_url(package_id)},
+    }
+
+  def collect_package_doi(self, package_id):
+    return self._pasta_client.read_data_package_doi(package_id)
+
+  def _raise_if_not_authorized_for_all_entities(self, package_id, entity_ids):
+    for entity_id in entity_ids:
+      self._raise_if_not_authorized(package_id, entity_id)
+
+  def _raise_if_not_authorized(self, package_id, entity_id):
+    self._pasta_client_public_access.is_authorized(package_id, entity_id)
+
+  def _get_package_info(self, package_id):
+    logging.debug('_get_package_info() package_id="{}"'.format(package_id))
+    return {
+      'doi': self._pasta_client.read_data_package_doi(package_id),
+      'permissions': self._pasta_client.read_data_package_acl(package_id),
+      # The time at which PASTA created the package, used as the created and
+      # modified timestamps of the resource map.
+      'timestamp': self._pasta_client.read_data_package_created(package_id),
+    }
+
+  def _get_package_entities_info(self, package_id, entity_ids):
+    entity_info = []
+    for entity_id in entity_ids:
+      logging.debug(
+        '_get_package_entities_info() package_id="{}" entity_id="{}"'.format(
+          package_id, entity_id
+        )
+      )
+      resource_id = self._pasta_client.entity_uri(package_id, entity_id)
+      checksum = self._pasta_client.read_data_entity_checksum(
+        package_id, entity_id
+      )
+      entity_info.append({
+        'entity_id':
+          entity_id,
+        'resource_id':
+          resource_id,
+        'header':
+          self._get_entity_header(entity_id, resource_id, checksum),
+        'permissions':
+          self._pasta_client.read_data_entity_acl(package_id, entity_id),
+        'checksum':
+          checksum,
+      })
+    return entity_info
+
+  def _get_entity_header(self, entity_id, resource_id, checksum):
+    """Return the size and content type of an entity. Entities are usually
+    carried over unchanged between revisions of a package, under the same
+    entity ID, so the values are looked up by the entity ID and checksum in the
+    index of previously collected entities before PASTA is queried."""
+    if not pasta_gmn_adapter.settings.REUSE_ENTITY_HEADERS:
+      return self._pasta_client.get_data_entry_header(resource_id)
+    header = pasta_gmn_adapter.app.sql.select_entity_header(entity_id, checksum)
+    pasta_gmn_adapter.app.metrics.registry.inc(
+      'pasta_gmn_adapter_entity_header_lookups_total',
+      {'result': 'miss' if header is None else 'hit'}
+    )
+    if header is None:
+      header = self._pasta_client.get_data_entry_header(resource_id)
+      pasta_gmn_adapter.app.sql.insert_entity_header(
+        entity_id, checksum, header['content-length'], header['content-type']
+      )
+    return header
+
+  def _get_quality_report_info(self, package_id):
+    logging.debug(
+      '_get_quality_report_info() package_id="{}"'.format(package_id)
+    )
+    report_uri_list = self._pasta_client.report_uri(package_id)
+    return {
+      'resource_id':
+        report_uri_list,
+      'header':
+        self._pasta_client.get_data_entry_header(report_uri_list),
+      'permissions':
+        self._pasta_client.read_quality_report_acl(package_id),
+      'checksum':
+        self._pasta_client.read_data_package_report_checksum(package_id),
+    }
+
+  def _get_metadata_info(self, package_id):
+    logging.debug('_get_metadata_info() package_id="{}"'.format(package_id))
+    metadata_url = self._pasta_client.metadata_url(package_id)
+    return {
+      'resource_id': metadata_url,
+      'header': self._pasta_client.get_data_entry_header(metadata_url),
+      'permissions': self._pasta_client.read_metadata_acl(package_id),
+      'format_id': self._pasta_client.read_metadata_format_id(package_id),
+      'checksum': self._pasta_client.read_metadata_checksum(package_id),
+    }
+
+
+# ===============================================================================
+
+
+class GMNPackageCreator(object):
+  def __init__(self):
+    self._gmn_client = self._create_gmn_client()
+    self._sys_meta_creator = SysMetaCreator()
+
+  def create_package(self, package_info):
+    self._create_data_entities(package_info['entities'])
+    self._create_quality_report(package_info['report'])
+    self._create_metadata(package_info['metadata'])
+    self.create_resource_map(package_info)
+
+  def update_package(self, package_info, previous_package_info):
+    self._create_data_entities(package_info['entities'])
+    self._create_quality_report(package_info['report'])
+    self._create_metadata(package_info['metadata'])
+    self.update_resource_map(
+      package_info, previous_package_info['package']['doi']
+    )
+
+  def create_object(self, object_meta):
+    """Create a single member of the package."""
+    self._create_wrapped_object(object_meta)
+
+  def create_resource_map(self, package_info):
+    resource_map, resource_map_meta = self._generate_resource_map_with_meta(
+      package_info
+    )
+    # Resource maps are generated with the time at which PASTA created the
+    # package as their timestamp, so an existing resource map for the package
+    # has the same checksum. Resource maps created with the Foresite library, by
+    # earlier versions of the adapter, have the time of creation as their
+    # modified timestamp and never match, so they are assumed to be for the
+    # correct package. Any other mismatch is an error.
+    try:
+      self._create_managed_object(resource_map, resource_map_meta)
+    except PopulateError:
+      pid = resource_map_meta['resource_id']
+      existing_resource_map = self._gmn_client.get(pid).content
+      if pasta_gmn_adapter.app.resource_map.is_written_by_adapter(
+          existing_resource_map
+      ):
+        raise
+      logging.warning(
+        'Keeping legacy resource map created with Foresite. '
+        'pid="{}"'.format(pid)
+      )
+
+  def update_resource_map(self, package_info, previous_package_pid):
+    resource_map, resource_map_meta = self._generate_resource_map_with_meta(
+      package_info
+    )
+    self._update_managed_object(
+      resource_map, resource_map_meta, previous_package_pid
+    )
+
+  def _create_data_entities(self, entities):
+    for data_entity_meta in entities:
+      self._create_wrapped_object(data_entity_meta)
+
+  def _create_quality_report(self, report_meta):
+    self._create_wrapped_object(report_meta)
+
+  def _create_metadata(self, metadata_meta):
+    self._create_wrapped_object(metadata_meta)
+
+  def _generate_resource_map_with_meta(self, package_info):
+    package_pid = package_info['package']['doi']
+    metadata_pid = package_info['metadata']['resource_id']
+    report_pid = package_info['report']['resource_id']
+    entity_pid_list = [e['resource_id'] for e in package_info['entities']]
+    resource_map = self._generate_resource_map(
+      package_pid, metadata_pid, [report_pid] + entity_pid_list,
+      package_info['package']['timestamp']
+    )
+    resource_map_meta = {
+      'resource_id': package_pid,
+      'header': {
+        'content-length': len(resource_map),
+        'content-type': 'http://www.openarchives.org/ore/terms',
+      },
+      # The permissions for the resource map are generated from the permissions
+      # on the PASTA package itself.
+      'permissions': package_info['package']['permissions'],
+      'd1_replication_policy': package_info['package']['d1_replication_policy'],
+    }
+    return resource_map, resource_map_meta
+
+  def _generate_resource_map(
+      self, package_pid, metadata_pid, entity_pid_list, timestamp
+  ):
+    return pasta_gmn_adapter.app.resource_map.generate_resource_map(
+      package_pid, metadata_pid, entity_pid_list, timestamp
+    )
+
+  def _create_wrapped_object(self, object_meta, verify_checksum=True):
+    pid = object_meta['resource_id']
+    sha1_checksum = object_meta['checksum']
+    if not self._object_exists(pid, sha1_checksum, verify_checksum):
+      sci_obj_placeholder = io.StringIO()
+      sys_meta = self._generate_sys_meta_for_object(object_meta, sha1_checksum)
+      header = self._generate_vendor_extension_remote_url(pid)
+      self._gmn_client.create(pid, sci_obj_placeholder, sys_meta, header)
+
+  def _create_managed_object(self, sci_obj, object_meta, verify_checksum=True):
+    pid = object_meta['resource_id']
+    sha1_checksum = self._calculate_sci_obj_checksum(sci_obj)
+    if not self._object_exists(pid, sha1_checksum, verify_checksum):
+      sys_meta = self._generate_sys_meta_for_object(object_meta, sha1_checksum)
+      logging.debug(
+        'sys_meta=%s', connector_util.lazy_log.call(sys_meta.toxml, 'utf-8')
+      )
+      sci_obj_flo = io.BytesIO(sci_obj)
+      self._gmn_client.create(pid, sci_obj_flo, sys_meta)
+
+  def _update_managed_object(
+      self, sci_obj, object_meta, previous_package_pid, verify_checksum=True
+  ):
+    pid = object_meta['resource_id']
+    sha1_checksum = self._calculate_sci_obj_checksum(sci_obj)
+    if not self._object_exists(pid, sha1_checksum, verify_checksum):
+      sys_meta = self._generate_sys_meta_for_object(
+        object_meta, sha1_checksum, obsoletes=previous_package_pid
+      )
+      sci_obj_flo = io.BytesIO(sci_obj)
+      self._gmn_client.update(previous_package_pid, sci_obj_flo, pid, sys_meta)
+
+  def _object_exists(self, pid, sha1_checksum, verify_checksum):
+    try:
+      sys_meta_existing = self._gmn_client.getSystemMetadata(pid)
+    except d1_common.types.exceptions.NotFound:
+      return False
+    checksum = d1_common.types.dataoneTypes.checksum(sha1_checksum)
+    checksum.algorithm = 'SHA-1'
+    if verify_checksum and not d1_common.checksum.are_checksums_equal(
+        checksum, sys_meta_existing.checksum):
+      raise PopulateError(
+        'Object already exists but has a different checksum.'
+        'pid={}, existing={}/{}, new={}/{}'.format(
+          pid,
+          sys_meta_existing.checksum.algorithm,
+          sys_meta_existing.checksum.value(),
+          checksum.algorithm,
+          checksum.value(),
+        )
+      )
+    return True
+
+  def _calculate_sci_obj_checksum(self, sci_obj):
+    logging.debug('sci_obj=%s', connector_util.lazy_log.truncated(sci_obj))
+    return hashlib.sha1(sci_obj).hexdigest()
+
+  def _generate_sys_meta_for_object(
+      self, object_meta, sha1_checksum, obsoletes=None
+  ):
+    logging.debug(
+      'object_meta=%s', connector_util.lazy_log.pformat(object_meta)
+    )
+    pid = object_meta['resource_id']
+    size = object_meta['header']['content-length']
+    content_type = object_meta['header']['content-type']
+    permissions = object_meta['permissions']
+    format_id = object_meta.get('format_id', None)
+    d1_replication_policy = object_meta['d1_replication_policy']
+    sys_meta = self._sys_meta_creator.create_sys_meta_for_resource(
+      pid, size, content_type, sha1_checksum, permissions, format_id,
+      d1_replication_policy, obsoletes
+    )
+    return sys_meta
+
+  def _generate_vendor_extension_remote_url(self, object_url):
+    """GMN has a "vendor specific extension" that allows it to stream data
+    from a web server instead of storing it locally. This generates the header
+    that enables the extension."""
+    return {'VENDOR-GMN-REMOTE-URL': object_url}
+
+  def _create_gmn_client(self):
+    return create_gmn_client()
+
+
+def create_gmn_client():
+  gmn_client = d1_client.mnclient.MemberNodeClient(
+    base_url=pasta_gmn_adapter.settings.GMN_BASE_URL,
+    cert_pem_path=pasta_gmn_adapter.settings.CLIENT_CERT_PEM_PATH,
+    cert_key_path=pasta_gmn_adapter.settings.CLIENT_CERT_PRIVATE_CERT_KEY_PATH,
+    timeout=pasta_gmn_adapter.settings.GMN_RESPONSE_TIMEOUT,
+    # Debug: Disable server side certificate verification
+    verify_tls=False
+  )
+  pasta_gmn_adapter.app.metrics.add_request_hook(gmn_client._session, 'gmn')
+  pasta_gmn_adapter.app.deadline.add_deadline_hook(gmn_client._session, 'gmn')
+  return gmn_client
+
+
+# ===============================================================================
+
+
+class SysMetaCreator(object):
+  def __init__(self):
+    self._media_type_mapper = self._create_media_type_mapper()
+    # The fields that are the same for all objects are rendered once.
+    self._sys_meta_template = connector_util.sysmeta_template.SysMetaTemplate(
+      serialVersion=1,
+      rightsHolder=pasta_gmn_adapter.settings.DATAONE_OWNER_IDENTITY,
+    )
+
+  def create_sys_meta_for_resource(
+      self, pid, size, content_type, sha1_checksum, eml_access_rules,
+      format_id=None, d1_replication_policy=None, obsoletes=None
+  ):
+    """Return System Metadata that can be passed to the GMN client. Rendered
+    from a template with SYSMETA_FROM_TEMPLATE, else a pyxb binding."""
+    if format_id is None:
+      format_id = self._media_type_mapper.format_id_from_media_type(
+        content_type
+      )
+    if pasta_gmn_adapter.settings.SYSMETA_FROM_TEMPLATE:
+      return self._render_sys_meta(
+        pid, size, format_id, sha1_checksum,
+        eml_access_rules.get_as_dataone_rule_list(), d1_replication_policy,
+        obsoletes
+      )
+    d1_access_rules = eml_access_rules.get_as_dataone_rules()
+    return self._generate_sys_meta(
+      pid, size, format_id, sha1_checksum, d1_access_rules,
+      d1_replication_policy, obsoletes
+    )
+
+  def _render_sys_meta(
+      self, pid, size, format_id, sha1_checksum, d1_access_rule_list,
+      d1_replication_policy, obsoletes
+  ):
+    return self._sys_meta_template.create(
+      identifier=pid,
+      formatId=format_id,
+      size=int(size),
+      checksum=('SHA-1', sha1_checksum),
+      accessPolicy=d1_access_rule_list,
+      replicationPolicy=self._parse_replication_policy(d1_replication_policy),
+      obsoletes=obsoletes,
+    )
+
+  def _generate_sys_meta(
+      self, pid, size, format_id, sha1_checksum, d1_access_rules,
+      d1_replication_policy, obsoletes=None
+  ):
+    sys_meta = d1_common.types.dataoneTypes.systemMetadata()
+    sys_meta.serialVersion = 1
+    sys_meta.identifier = pid
+    sys_meta.size = size
+    sys_meta.formatId = format_id
+    sys_meta.rightsHolder = pasta_gmn_adapter.settings.DATAONE_OWNER_IDENTITY
+    sys_meta.checksum = d1_common.types.dataoneTypes.checksum(sha1_checksum)
+    sys_meta.checksum.algorithm = 'SHA-1'
+    sys_meta.accessPolicy = d1_access_rules
+    sys_meta.replicationPolicy = self._generate_replication_policy(
+      d1_replication_policy
+    )
+    if obsoletes is not None:
+      sys_meta.obsoletes = obsoletes
+    return sys_meta
+
+  def _generate_public_access_policy(self):
+    accessPolicy = d1_common.types.dataoneTypes.accessPolicy()
+    accessRule = d1_common.types.dataoneTypes.AccessRule()
+    accessRule.subject.append(d1_common.const.SUBJECT_PUBLIC)
+    permission = d1_common.types.dataoneTypes.Permission('read')
+    accessRule.permission.append(permission)
+    accessPolicy.append(accessRule)
+    return accessPolicy
+
+  def _generate_replication_policy(self, d1_replication_policy):
+    if d1_replication_policy is None:
+      return None
+    return d1_common.types.dataoneTypes.CreateFromDocument(
+      d1_replication_policy
+    )
+
+  def _parse_replication_policy(self, d1_replication_policy):
+    """Parse the replicationPolicy element from the EML document to the dict
+    used by the System Metadata template."""
+    if d1_replication_policy is None:
+      return None
+    root_el = ET.fromstring(d1_replication_policy)
+    allowed_str = root_el.get('replicationAllowed')
+    number_str = root_el.get('numberReplicas')
+    node_dict = {'preferredMemberNode': [], 'blockedMemberNode': []}
+    for el in root_el:
+      node_list = node_dict.get(el.tag.rsplit('}', 1)[-1])
+      if node_list is not None:
+        node_list.append(el.text or '')
+    return {
+      'replicationAllowed':
+        None if allowed_str is None else allowed_str.strip() in ('true', '1'),
+      'numberReplicas': None if number_str is None else int(number_str),
+      'preferredMemberNode': node_dict['preferredMemberNode'],
+      'blockedMemberNode': node_dict['blockedMemberNode'],
+    }
+
+  def _create_media_type_mapper(self):
+    return MediaTypeToFormatIDMapper()
+
+
+# ===============================================================================
+
+
+class MediaTypeToFormatIDMapper:
+  def __init__(self):
+    self._format_ids = self._get_valid_format_ids()
+
+  def format_id_from_media_type(self, media_type):
+    if media_type in pasta_gmn_adapter.settings.ASYNC_MEDIA_TYPE_MAP:
+      return pasta_gmn_adapter.settings.ASYNC_MEDIA_TYPE_MAP[media_type]
+    if media_type in self._format_ids:
+      return media_type
+    return pasta_gmn_adapter.settings.DEFAULT_MEDIA_TYPE
+
+  def _get_valid_format_ids(self):
+    refresh = False
+    try:
+      if self._format_id_cache_file_is_stale():
+        refresh = True
+    except OSError:
+      refresh = True
+    if refresh:
+      self._refresh_format_id_cache_file()
+    return self._read_format_ids_from_cache_file()
+
+  def _read_format_ids_from_cache_file(self):
+    p = self._get_format_id_cache_file_path()
+    return [line.strip() for line in open(p).readlines()]
+
+  def _refresh_format_id_cache_file(self):
+    cn_client = d1_client.cnclient.CoordinatingNodeClient(
+      base_url=pasta_gmn_adapter.settings.DATAONE_ROOT_URL
+    )
+    format_ids = cn_client.listFormats()
+    p = self._get_format_id_cache_file_path()
+    open(p, 'w').write('\n'.join([o.formatId for o in format_ids.objectFormat]))
+
+  def _format_id_cache_file_is_stale(self):
+    p = self._get_format_id_cache_file_path()
+    file_age_seconds = time.time() - os.stat(p)[stat.ST_MTIME]
+    return file_age_seconds > pasta_gmn_adapter.settings.ASYNC_MAX_FORMAT_ID_AGE_SECONDS
+
+  def _get_format_id_cache_file_path(self):
+    return os.path.join(
+      tempfile.gettempdir(), pasta_gmn_adapter.settings.FORMAT_ID_CACHE_FILENAME
+    )
+
+
+# ==============================================================================
+
+
+class UncheckedCreateError(Exception):
+  def __init__(self, value):
+    self.value = value
+
+  def __str__(self):
+    return str(self.value)
+
+
+# ==============================================================================
+
+
+class PopulateError(Exception):
+  def __init__(self, value):
+    self.value = value
+
+  def __str__(self):
+    return str(self.value)
+
+
+# ===============================================================================
+
+
+class PackageID:
+  def __init__(self, scope, identifier, revision):
+    self._scope = scope
+    self._identifier = identifier
+    self._revision = revision
+
+  def __str__(self):
+    return '{0}({1}, {2}, {3})'.format(
+      self.__class__.__name__, self._scope, self._identifier, self._revision
+    )
+
+  def scope(self):
+    return self._scope
+
+  def identifier(self):
+    return self._identifier
+
+  def revision(self):
+    return self._revision
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`prefetch`
+==================
+
+:Synopsis:
+  Collect the PASTA information for a package in the background as soon as the
+  package is added to the queue, and stage it in the database. When the queue
+  processor later processes the package, it reads the staged information
+  instead of querying PASTA.
+
+  Enabled with PREFETCH_PACKAGE_INFO in settings.py. If prefetching fails, for
+  instance because PASTA has not yet registered the DOI for the package, the
+  queue processor collects the information as usual.
+"""
+
+import concurrent.futures
+import datetime
+import json
+import logging
+
+import requests.structures
+
+import django.db
+import django.db.transaction
+
+import pasta_gmn_adapter.api_types.eml_access
+import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
+
+# Bound the number of threads used for prefetching in each web server process.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+def prefetch_package_info_on_commit(queue_id, scope, identifier, revision):
+  """Schedule prefetching of the information for a package that is being added
+  to the queue. Prefetching starts when the current transaction commits, so
+  that the queue item exists when the information is staged."""
+  if not pasta_gmn_adapter.settings.PREFETCH_PACKAGE_INFO:
+    return
+  django.db.transaction.on_commit(
+    lambda: _executor.submit(
+      _prefetch_package_info, queue_id, scope, identifier, revision
+    )
+  )
+
+
+def wait_for_prefetch():
+  """Wait for the scheduled prefetches to finish. Called by management
+  commands that add packages to the queue before they exit."""
+  global _executor
+  _executor.shutdown(wait=True)
+  _executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+def _prefetch_package_info(queue_id, scope, identifier, revision):
+  # The collector lives with the queue processor, which imports this module.
+  import pasta_gmn_adapter.app.population_queue_processor as population_queue_processor
+  try:
+    package_id = population_queue_processor.PackageID(scope, identifier, revision)
+    package_info = population_queue_processor.DataPackageInfoCollector(
+    ).collect_package_info(package_id)
+    pasta_gmn_adapter.app.sql.insert_prefetched_package_info(
+      queue_id, serialize_package_info(package_info)
+    )
+    logging.info('Prefetched package info. package_id="{}"'.format(package_id))
+  except Exception as e:
+    logging.warning(
+      'Prefetching package info failed. package_id="{}.{}.{}" error="{}"'.
+      format(scope, identifier, revision, str(e))
+    )
+  finally:
+    django.db.connection.close()
+
+
+def get_prefetched_package_info(queue_id):
+  """Return the staged information for a queue item, or None if there is no
+  staged information or it is older than PREFETCH_MAX_AGE_SECONDS."""
+  package_info_json = pasta_gmn_adapter.app.sql.select_prefetched_package_info(
+    queue_id, pasta_gmn_adapter.settings.PREFETCH_MAX_AGE_SECONDS
+  )
+  if package_info_json is None:
+    return None
+  package_info = deserialize_package_info(package_info_json)
+  # Information staged by earlier versions of the adapter has no package
+  # timestamp.
+  if package_info['package'].get('timestamp') is None:
+    return None
+  return package_info
+
+
+def serialize_package_info(package_info):
+  """Serialize the information returned by
+  DataPackageInfoCollector.collect_package_info() to JSON. The EML access rules
+  are stored as XML, the headers as plain dicts, the replication policy,
+  which is a bytes object, as a string and the package timestamp in ISO 8601."""
+  return json.dumps(
+    _map_package_info(
+      package_info, _serialize_permissions, dict, _serialize_replication_policy,
+      _serialize_timestamp
+    )
+  )
+
+
+def deserialize_package_info(package_info_json):
+  return _map_package_info(
+    json.loads(package_info_json), _deserialize_permissions,
+    requests.structures.CaseInsensitiveDict, _deserialize_replication_policy,
+    _deserialize_timestamp
+  )
+
+
+def _map_package_info(
+    package_info, permissions_func, header_func, replication_policy_func,
+    timestamp_func
+):
+  def map_object_meta(object_meta):
+    object_meta = dict(object_meta)
+    object_meta['permissions'] = permissions_func(object_meta['permissions'])
+    object_meta['d1_replication_policy'] = replication_policy_func(
+      object_meta['d1_replication_policy']
+    )
+    if 'header' in object_meta:
+      object_meta['header'] = header_func(object_meta['header'].items())
+    return object_meta
+
+  package_meta = map_object_meta(package_info['package'])
+  if 'timestamp' in package_meta:
+    package_meta['timestamp'] = timestamp_func(package_meta['timestamp'])
+  return {
+    'package': package_meta,
+    'entities': [map_object_meta(e) for e in package_info['entities']],
+    'report': map_object_meta(package_info['report']),
+    'metadata': map_object_meta(package_info['metadata']),
+  }
+
+
+def _serialize_permissions(eml_access):
+  eml_access_xml = eml_access.serialize()
+  if isinstance(eml_access_xml, bytes):
+    eml_access_xml = eml_access_xml.decode('utf-8')
+  return eml_access_xml
+
+
+def _deserialize_permissions(eml_access_xml):
+  return pasta_gmn_adapter.api_types.eml_access.EMLAccess(eml_access_xml)
+
+
+def _serialize_replication_policy(d1_replication_policy):
+  if d1_replication_policy is None:
+    return None
+  return d1_replication_policy.decode('utf-8')
+
+
+def _deserialize_replication_policy(d1_replication_policy):
+  if d1_replication_policy is None:
+    return None
+  return d1_replication_policy.encode('utf-8')
+
+
+def _serialize_timestamp(timestamp):
+  return timestamp.isoformat()
+
+
+def _deserialize_timestamp(timestamp_str):
+  return datetime.datetime.fromisoformat(timestamp_str)
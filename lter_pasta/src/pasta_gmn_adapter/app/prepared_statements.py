@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`prepared_statements`
+=============================
+
+:Synopsis:
+  Server side prepared statements for the queries in sql.py that are issued
+  for every package, so that PostgreSQL parses and plans them once per
+  connection instead of on every call.
+
+  A statement is PREPAREd the first time it is used on a connection, and
+  EXECUTEd after that. The statements that have been prepared are tracked per
+  underlying database connection, so they are prepared again when Django opens
+  a new connection. If the statements are dropped by the server while the
+  connection stays open, e.g., by DISCARD ALL, the call fails with
+  invalid_sql_statement_name. The statement is then prepared again and the call
+  is retried, if not in a transaction. In a transaction, the error is raised,
+  as the transaction cannot continue, and the statements are prepared again
+  on the next call.
+
+  Enabled with PREPARE_HOT_QUERIES in settings.py. When disabled, the
+  statements are executed directly, as before.
+"""
+
+import re
+
+import django.db
+
+import pasta_gmn_adapter.settings
+
+# SQLSTATE for EXECUTE of a statement that has not been prepared.
+INVALID_SQL_STATEMENT_NAME = '26000'
+
+_PLACEHOLDER_RX = re.compile(r'(?<!%)%s')
+
+
+class PreparedStatement(object):
+  def __init__(self, name, param_type_list, sql):
+    """{sql} is written as for cursor.execute(), with a %s placeholder for each
+    parameter. {param_type_list} holds the PostgreSQL type of each
+    parameter."""
+    self.name = 'adapter_{}'.format(name)
+    self.sql = sql
+    counter = iter(range(1, len(param_type_list) + 1))
+    # The PREPARE is executed without parameters, so a literal % is not escaped.
+    self._prepare_sql = 'prepare {} ({}) as {}'.format(
+      self.name, ', '.join(param_type_list),
+      _PLACEHOLDER_RX.sub(lambda _m: '${}'.format(next(counter)),
+                          sql.strip().rstrip(';')).replace('%%', '%')
+    )
+    self._execute_sql = 'execute {} ({})'.format(
+      self.name, ', '.join(['%s'] * len(param_type_list))
+    ) if param_type_list else 'execute {}'.format(self.name)
+
+  def execute(self, cursor, params):
+    """Execute the statement with {params} on {cursor}, a Django cursor. The
+    results are read from the cursor as usual."""
+    if not pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES:
+      cursor.execute(self.sql, params)
+      return
+    connection = cursor.db
+    prepared_name_set = _get_prepared_name_set(connection)
+    if self.name not in prepared_name_set:
+      cursor.execute(self._prepare_sql)
+      prepared_name_set.add(self.name)
+    try:
+      cursor.execute(self._execute_sql, params)
+    except django.db.Error as e:
+      # Django wraps the psycopg2 error, which holds the SQLSTATE.
+      if getattr(e.__cause__, 'pgcode', None) != INVALID_SQL_STATEMENT_NAME:
+        raise
+      prepared_name_set.clear()
+      if connection.in_atomic_block:
+        raise
+      cursor.execute(self._prepare_sql)
+      prepared_name_set.add(self.name)
+      cursor.execute(self._execute_sql, params)
+
+
+def _get_prepared_name_set(connection):
+  """Return the set of names of the statements that have been prepared on the
+  current underlying connection of the Django {connection}."""
+  connection.ensure_connection()
+  raw_connection, prepared_name_set = getattr(
+    connection, '_adapter_prepared_statements', (None, None)
+  )
+  if raw_connection is not connection.connection:
+    prepared_name_set = set()
+    connection._adapter_prepared_statements = (
+      connection.connection, prepared_name_set
+    )
+  return prepared_name_set
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`resource_map`
+======================
+
+:Synopsis:
+  Write OAI-ORE Resource Maps in RDF/XML, with the same content as the simple
+  resource maps created by d1_common.resource_map.createSimpleResourceMap().
+
+  The document is written directly, in a single pass over the members of the
+  package, instead of being built as an RDF graph and serialized by rdflib. The
+  created and modified timestamps are supplied by the caller, and the members
+  are written in the order they are given, so the same package always results
+  in the same bytes, and the same checksum.
+
+  Resource Maps created with the Foresite library, by earlier versions of the
+  adapter, are recognized with is_written_by_adapter().
+"""
+
+import datetime
+import io
+import urllib.parse
+import xml.sax.saxutils
+
+import pasta_gmn_adapter.settings
+
+CREATOR = 'PASTA GMN Adapter'
+AGGREGATION_TITLE = 'Simple aggregation containing DataONE objects'
+
+NAMESPACE_LIST = [
+  ('cito', 'http://purl.org/spar/cito/'),
+  ('dcterms', 'http://purl.org/dc/terms/'),
+  ('ore', 'http://www.openarchives.org/ore/terms/'),
+  ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+  ('rdfs', 'http://www.w3.org/2000/01/rdf-schema#'),
+]
+XSD_DATETIME = 'http://www.w3.org/2001/XMLSchema#dateTime'
+ORE_AGGREGATION = 'http://www.openarchives.org/ore/terms/Aggregation'
+ORE_TERMS = 'http://www.openarchives.org/ore/terms/'
+
+# Same set of safe characters as d1_common.url.encodePathElement().
+PATH_ELEMENT_SAFE_CHARS = ':@$!&\'()*+,;='
+
+
+def generate_resource_map(ore_pid, scimeta_pid, sciobj_pid_list, timestamp):
+  """Return a Resource Map aggregating {scimeta_pid} and the objects in
+  {sciobj_pid_list}, which it documents, as UTF-8 encoded bytes."""
+  f = io.BytesIO()
+  write_resource_map(f, ore_pid, scimeta_pid, sciobj_pid_list, timestamp)
+  return f.getvalue()
+
+
+def write_resource_map(f, ore_pid, scimeta_pid, sciobj_pid_list, timestamp):
+  """Write a Resource Map to the binary file-like object {f}. {timestamp} is
+  used as the created and modified time of the Resource Map."""
+  w = _Writer(f)
+  resource_map_uri = get_resolve_url(ore_pid)
+  aggregation_uri = resource_map_uri + '#aggregation'
+  scimeta_uri = get_resolve_url(scimeta_pid)
+  sciobj_uri_list = [get_resolve_url(pid) for pid in sciobj_pid_list]
+  timestamp_str = format_timestamp(timestamp)
+
+  w.write(get_prolog())
+
+  w.start('ore:ResourceMap', resource_map_uri)
+  w.literal('dcterms:identifier', ore_pid)
+  w.literal('dcterms:creator', CREATOR)
+  w.literal('dcterms:created', timestamp_str, XSD_DATETIME)
+  w.literal('dcterms:modified', timestamp_str, XSD_DATETIME)
+  w.resource('ore:describes', aggregation_uri)
+  w.end('ore:ResourceMap')
+
+  w.start('ore:Aggregation', aggregation_uri)
+  w.literal('dcterms:title', AGGREGATION_TITLE)
+  w.resource('ore:isDescribedBy', resource_map_uri)
+  w.resource('ore:aggregates', scimeta_uri)
+  for sciobj_uri in sciobj_uri_list:
+    w.resource('ore:aggregates', sciobj_uri)
+  w.end('ore:Aggregation')
+
+  w.start('rdf:Description', scimeta_uri)
+  w.literal('dcterms:identifier', scimeta_pid)
+  w.resource('ore:isAggregatedBy', aggregation_uri)
+  for sciobj_uri in sciobj_uri_list:
+    w.resource('cito:documents', sciobj_uri)
+  w.end('rdf:Description')
+
+  for sciobj_pid, sciobj_uri in zip(sciobj_pid_list, sciobj_uri_list):
+    w.start('rdf:Description', sciobj_uri)
+    w.literal('dcterms:identifier', sciobj_pid)
+    w.resource('ore:isAggregatedBy', aggregation_uri)
+    w.resource('cito:isDocumentedBy', scimeta_uri)
+    w.end('rdf:Description')
+
+  w.start('rdf:Description', ORE_AGGREGATION)
+  w.literal('rdfs:label', 'Aggregation')
+  w.resource('rdfs:isDefinedBy', ORE_TERMS)
+  w.end('rdf:Description')
+
+  w.write('</rdf:RDF>\n')
+
+
+def is_written_by_adapter(resource_map):
+  """Return True if the UTF-8 encoded {resource_map} was written by
+  write_resource_map(), and False if it is a legacy Resource Map, created with
+  the Foresite library. The prolog and the order of the namespace declarations
+  are only written by write_resource_map()."""
+  return resource_map.startswith(get_prolog().encode('utf-8'))
+
+
+def get_prolog():
+  return '<?xml version="1.0" encoding="utf-8"?>\n<rdf:RDF{}>\n'.format(
+    ''.join(
+      '\n  xmlns:{}={}'.format(prefix, xml.sax.saxutils.quoteattr(uri))
+      for prefix, uri in NAMESPACE_LIST
+    )
+  )
+
+
+def get_resolve_url(pid):
+  return '{}/v2/resolve/{}'.format(
+    pasta_gmn_adapter.settings.DATAONE_ROOT_URL.rstrip('/'),
+    urllib.parse.quote(pid, safe=PATH_ELEMENT_SAFE_CHARS)
+  )
+
+
+def format_timestamp(timestamp):
+  """Format {timestamp} as ISO 8601 in UTC, to whole seconds. A naive
+  datetime is assumed to be in UTC."""
+  if timestamp.tzinfo is not None:
+    timestamp = timestamp.astimezone(datetime.timezone.utc)
+  return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class _Writer(object):
+  def __init__(self, f):
+    self._f = f
+
+  def write(self, s):
+    self._f.write(s.encode('utf-8'))
+
+  def start(self, tag, about_uri):
+    self.write(
+      '  <{} rdf:about={}>\n'.format(tag, xml.sax.saxutils.quoteattr(about_uri))
+    )
+
+  def end(self, tag):
+    self.write('  </{}>\n'.format(tag))
+
+  def literal(self, tag, value, datatype=None):
+    self.write(
+      '    <{}{}>{}</{}>\n'.format(
+        tag, '' if datatype is None else
+        ' rdf:datatype={}'.format(xml.sax.saxutils.quoteattr(datatype)),
+        xml.sax.saxutils.escape(value), tag
+      )
+    )
+
+  def resource(self, tag, uri):
+    self.write(
+      '    <{} rdf:resource={}/>\n'.format(
+        tag, xml.sax.saxutils.quoteattr(uri)
+      )
+    )
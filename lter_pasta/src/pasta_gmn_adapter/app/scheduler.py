@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""":mod:`scheduler`
+===================
+
+:Synopsis:
+  Order the uncompleted queue items for processing, by the policy selected with
+  QUEUE_SCHEDULING_POLICY in settings.py:
+
+  - package_id: By scope, identifier and revision. A scope with many packages
+    delays all the scopes that sort after it.
+  - fair_share: Take turns between the scopes. The scope whose oldest waiting
+    item has waited the longest, relative to the number of items already
+    scheduled from the scope, goes next.
+  - smallest_first: By the estimated cost of the package, which is the number
+    of data entities, then by age. The entity count is taken from the prefetched
+    info (see PREFETCH_PACKAGE_INFO), or looked up in PASTA by the queue
+    processor before the queue is ordered. Packages whose count could not be
+    found are assumed to have UNKNOWN_ENTITY_COUNT entities, so they go after
+    all the packages with a known count.
+
+  With all policies, the revisions of a package are processed in order, as each
+  revision is created on GMN as an update of the previous one.
+"""
+
+import collections
+import datetime
+import heapq
+
+POLICY_LIST = ['package_id', 'fair_share', 'smallest_first']
+UNKNOWN_ENTITY_COUNT = float('inf')
+
+
+def order_queue_items(item_list, policy, now=None):
+  """Return {item_list} ordered by {policy}. The items are dicts as returned by
+  sql.select_population_queue_uncompleted(). Waiting times are measured to
+  {now}, which defaults to the current time."""
+  if policy == 'package_id':
+    return sorted(item_list, key=_package_id_key)
+  series_dict = _get_series_dict(item_list)
+  if policy == 'fair_share':
+    if now is None and item_list:
+      now = datetime.datetime.now(item_list[0]['timestamp'].tzinfo)
+    return _order_fair_share(series_dict, now)
+  if policy == 'smallest_first':
+    return _order_smallest_first(series_dict)
+  raise ValueError(
+    'Invalid scheduling policy. policy="{}" valid="{}"'.format(
+      policy, ', '.join(POLICY_LIST)
+    )
+  )
+
+
+def _order_fair_share(series_dict, now):
+  # Within each scope, the series are ordered by the age of their next item.
+  scope_dict = {}
+  for series_key, series_deque in series_dict.items():
+    heapq.heappush(
+      scope_dict.setdefault(series_key[0], []),
+      (_age_key(series_deque[0]), series_key)
+    )
+  scheduled_count_dict = collections.Counter()
+  scope_heap = [
+    _fair_share_key(scope, series_heap, 0, now)
+    for scope, series_heap in scope_dict.items()
+  ]
+  heapq.heapify(scope_heap)
+  ordered_list = []
+  while scope_heap:
+    scope = heapq.heappop(scope_heap)[-1]
+    series_heap = scope_dict[scope]
+    series_key = heapq.heappop(series_heap)[1]
+    series_deque = series_dict[series_key]
+    ordered_list.append(series_deque.popleft())
+    if series_deque:
+      heapq.heappush(series_heap, (_age_key(series_deque[0]), series_key))
+    scheduled_count_dict[scope] += 1
+    if series_heap:
+      heapq.heappush(
+        scope_heap,
+        _fair_share_key(scope, series_heap, scheduled_count_dict[scope], now)
+      )
+  return ordered_list
+
+
+def _fair_share_key(scope, series_heap, scheduled_count, now):
+  # The priority of a scope is the waiting time of its oldest item, divided by
+  # the number of items already scheduled from the scope in this run. The
+  # extra second lets the newest items count as waiting.
+  oldest_timestamp = series_heap[0][0][0]
+  wait_sec = (now - oldest_timestamp).total_seconds() + 1
+  return (-wait_sec / (scheduled_count + 1), oldest_timestamp, scope)
+
+
+def _order_smallest_first(series_dict):
+  candidate_heap = [
+    (_cost_key(series_deque[0]), series_key)
+    for series_key, series_deque in series_dict.items()
+  ]
+  heapq.heapify(candidate_heap)
+  ordered_list = []
+  while candidate_heap:
+    series_key = heapq.heappop(candidate_heap)[1]
+    series_deque = series_dict[series_key]
+    ordered_list.append(series_deque.popleft())
+    if series_deque:
+      heapq.heappush(candidate_heap, (_cost_key(series_deque[0]), series_key))
+  return ordered_list
+
+
+def _get_series_dict(item_list):
+  """Group the items by scope and identifier, each group ordered by
+  revision."""
+  series_dict = {}
+  for item in sorted(item_list, key=_package_id_key):
+    series_dict.setdefault(
+      (item['package_scope'], item['package_identifier']),
+      collections.deque()
+    ).append(item)
+  return series_dict
+
+
+def _package_id_key(item):
+  return (
+    item['package_scope'], item['package_identifier'], item['package_revision']
+  )
+
+
+def _age_key(item):
+  return (item['timestamp'],) + _package_id_key(item)
+
+
+def _cost_key(item):
+  entity_count = item.get('entity_count')
+  if entity_count is None:
+    entity_count = UNKNOWN_ENTITY_COUNT
+  return (entity_count,) + _age_key(item)
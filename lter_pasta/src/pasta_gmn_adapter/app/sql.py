@@ -26,12 +26,26 @@
   Roger Dahl
 
 :Requires:
-  PostgreSQL >= 9.1.
+  PostgreSQL >= 9.5.
 """
+import csv
+import io
+import re
+
 import django.db
 
+import pasta_gmn_adapter.app.prepared_statements
+
 VCHAR_LENGTH = 2048
 
+# ISO 8601 (2017-05-14T12:00:00.123Z) and RFC 1123 HTTP dates
+# (Sun, 14 May 2017 12:00:00 GMT).
+_TIMESTAMP_RX = re.compile(
+  r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?'
+  r'|\w{3}, \d{2} \w{3} \d{4} \d{2}:\d{2}:\d{2} GMT'
+)
+_URL_QUERY_RX = re.compile(r'(https?://[^\s?#\'"]+)\?[^\s#\'"]+')
+
 
 def dict_fetch_all(cursor):
   """Return all rows from a cursor as a dict."""
@@ -41,35 +55,166 @@ def dict_fetch_all(cursor):
   ]
 
 
+_INSERT_PACKAGE_SCOPE = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'insert_package_scope', ['text', 'text'],
+  """
+  insert into adapter_population_queue_package_scope (package_scope)
+  select %s where not exists (
+    select id from adapter_population_queue_package_scope where package_scope = %s
+  );
+  """
+)
+
+_INSERT_POPULATION_QUEUE_ITEM = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'insert_population_queue_item', ['bigint', 'bigint', 'text'],
+  """
+  insert into adapter_population_queue
+  (package_scope_id, package_identifier, package_revision, "timestamp")
+  select id, %s, %s, now() from adapter_population_queue_package_scope
+  where package_scope = %s
+  returning id;
+  """
+)
+
+
 def insert_population_queue_item(scope, identifier, revision):
   cursor = django.db.connection.cursor()
 
+  _INSERT_PACKAGE_SCOPE.execute(cursor, [scope, scope])
+
+  _INSERT_POPULATION_QUEUE_ITEM.execute(
+    cursor, [int(identifier), int(revision), scope]
+  )
+
+  queue_id = cursor.fetchone()[0]
+
+  insert_process_status(queue_id, 'new')
+
+  return queue_id
+
+
+def insert_population_queue_items(package_list):
+  """Add many packages to the queue with a single COPY. Each package is
+  a (scope, identifier, revision) tuple. The packages must already have been
+  validated. Return a list of (population_queue_id, scope, identifier,
+  revision) tuples for the inserted items.
+
+  Must be called within a transaction.
+  """
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    create temporary table if not exists adapter_population_queue_copy (
+      package_scope character varying(1024) not null,
+      package_identifier bigint not null,
+      package_revision bigint not null
+    ) on commit delete rows;
+    truncate adapter_population_queue_copy;
+    """
+  )
+
+  copy_file = io.StringIO()
+  csv.writer(copy_file).writerows(package_list)
+  copy_file.seek(0)
+  cursor.copy_expert(
+    """
+    copy adapter_population_queue_copy
+    (package_scope, package_identifier, package_revision)
+    from stdin with (format csv);
+    """, copy_file
+  )
+
   cursor.execute(
     """
     insert into adapter_population_queue_package_scope (package_scope)
-    select %s where not exists (
-      select id from adapter_population_queue_package_scope where package_scope = %s
-    );
-    """,
-    [scope, scope]
+    select distinct package_scope from adapter_population_queue_copy
+    on conflict (package_scope) do nothing;
+    """
   )
 
+  new_status_id = _select_or_insert_status_id(cursor, 'new')
+  return_body_id = _upsert_return_body(cursor, '')
+
   cursor.execute(
     """
-    insert into adapter_population_queue
-    (package_scope_id, package_identifier, package_revision, "timestamp")
-    select id, %s, %s, now() from adapter_population_queue_package_scope
-    where package_scope = %s
-    returning id;
+    with inserted as (
+      insert into adapter_population_queue
+      (package_scope_id, package_identifier, package_revision, "timestamp")
+      select apqps.id, package_identifier, package_revision, now()
+      from adapter_population_queue_copy apqc
+      join adapter_population_queue_package_scope apqps using (package_scope)
+      returning id, package_scope_id, package_identifier, package_revision
+    ), inserted_status as (
+      insert into adapter_process_status (population_queue_item_id, "timestamp",
+        status_id, return_code, return_body_id)
+      select id, now(), %s, 0, %s from inserted
+    )
+    select inserted.id, apqps.package_scope, inserted.package_identifier,
+      inserted.package_revision
+    from inserted
+    join adapter_population_queue_package_scope apqps
+      on (apqps.id = inserted.package_scope_id)
+    order by inserted.id
+    ;
     """,
-    [int(identifier), int(revision), scope]
+    [new_status_id, return_body_id]
   )
+  inserted_list = cursor.fetchall()
 
-  queue_id = cursor.fetchone()[0]
+  _add_to_status_count(cursor, new_status_id, len(inserted_list))
 
-  insert_process_status(queue_id, 'new')
+  return inserted_list
 
-  return queue_id
+
+def insert_package_intake(package_id):
+  """Add a raw package ID, as received from PASTA, to the intake. The package
+  ID is validated and moved to the queue later, by drain_package_intake()."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    insert into adapter_package_intake (package_id, "timestamp")
+    values (%s, now());
+    """, [package_id]
+  )
+
+
+def delete_package_intake_batch(batch_size):
+  """Remove and return up to {batch_size} of the oldest package IDs in the
+  intake. Rows locked by a concurrent drainer are skipped.
+
+  Must be called within a transaction, which should also add the package IDs
+  to the queue, so that they are returned to the intake if it fails.
+  """
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    delete from adapter_package_intake
+    where id in (
+      select id from adapter_package_intake
+      order by id
+      limit %s
+      for update skip locked
+    )
+    returning id, package_id, "timestamp";
+    """, [batch_size]
+  )
+
+  return sorted(dict_fetch_all(cursor), key=lambda r: r['id'])
+
+
+def select_package_intake_count():
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select count(*) from adapter_package_intake;
+    """
+  )
+
+  return cursor.fetchone()[0]
 
 
 def select_population_queue_with_latest_status():
@@ -155,20 +300,20 @@ def select_status(population_queue_id):
 
 
 def select_statistics():
+  """Return the number of queue items currently in each processing status.
+
+  The counts are maintained by insert_process_status(), so this does not scan
+  the status history.
+  """
   cursor = django.db.connection.cursor()
 
   cursor.execute(
     """
-    select status, count(*)
-    from adapter_process_status aps
-    join adapter_process_status_status apss on (apss.id = aps.status_id)
-    where aps.timestamp = (
-      select max(timestamp)
-      from adapter_process_status aps2
-      where aps2.population_queue_item_id = aps.population_queue_item_id
-    )
-    or aps.timestamp is null
-    group by status
+    select status, count
+    from adapter_process_status_count apsc
+    join adapter_process_status_status apss on (apss.id = apsc.status_id)
+    where count > 0
+    order by status
     ;
   """
   )
@@ -176,6 +321,635 @@ def select_statistics():
   return dict_fetch_all(cursor)
 
 
+def refresh_status_count():
+  """Rebuild the per-status counts of queue items from the full status
+  history."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    delete from adapter_process_status_count;
+    insert into adapter_process_status_count (status_id, count)
+    select status_id, count(*) from (
+      select distinct on (population_queue_item_id) status_id
+      from adapter_process_status
+      order by population_queue_item_id, "timestamp" desc, id desc
+    ) latest
+    group by status_id
+    ;
+    """
+  )
+
+
+def remove_from_status_count(queue_item_id_list):
+  """Remove the given queue items from the per-status counts. Must be called in
+  the same transaction, and before, the items are deleted."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    update adapter_process_status_count apsc
+    set count = apsc.count - latest.count
+    from (
+      select status_id, count(*) from (
+        select distinct on (population_queue_item_id) status_id
+        from adapter_process_status
+        where population_queue_item_id = any(%s)
+        order by population_queue_item_id, "timestamp" desc, id desc
+      ) latest_by_item
+      group by status_id
+    ) latest
+    where apsc.status_id = latest.status_id
+    ;
+    """,
+    [list(queue_item_id_list)]
+  )
+
+
+def select_enqueued_item_count():
+  """Return the number of items that have been added to the queue, including
+  items that have since been deleted. Read from the id sequence, so it is
+  cheap."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select case when is_called then last_value else 0 end
+    from adapter_population_queue_id_seq;
+    """
+  )
+
+  return cursor.fetchone()[0]
+
+
+def select_metrics():
+  """Return the metrics stored by the queue processor as a list of
+  (sample_name, labels, value) tuples."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select name, labels, value from adapter_metric order by name, labels;
+    """
+  )
+
+  return cursor.fetchall()
+
+
+def add_to_metrics(sample_list):
+  """Add the values of a list of (sample_name, labels, value) tuples to the
+  stored metrics."""
+  cursor = django.db.connection.cursor()
+
+  cursor.executemany(
+    """
+    insert into adapter_metric (name, labels, value)
+    values (%s, %s, %s)
+    on conflict (name, labels) do update
+    set value = adapter_metric.value + excluded.value;
+    """,
+    sample_list
+  )
+
+
+def set_metrics(sample_list):
+  """Replace the values of the stored metrics with the values in a list of
+  (sample_name, labels, value) tuples."""
+  cursor = django.db.connection.cursor()
+
+  cursor.executemany(
+    """
+    insert into adapter_metric (name, labels, value)
+    values (%s, %s, %s)
+    on conflict (name, labels) do update
+    set value = excluded.value;
+    """,
+    sample_list
+  )
+
+
+def insert_prefetched_package_info(population_queue_id, package_info_json):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    insert into adapter_package_info_prefetch
+      (population_queue_item_id, "timestamp", package_info)
+    select id, now(), %s from adapter_population_queue where id = %s
+    on conflict (population_queue_item_id) do update
+    set "timestamp" = excluded."timestamp", package_info = excluded.package_info;
+    """,
+    [package_info_json, population_queue_id]
+  )
+
+
+def select_prefetched_package_info(population_queue_id, max_age_seconds):
+  """Return the prefetched package info JSON for a queue item, or None if there
+  is none that is younger than {max_age_seconds}."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select package_info from adapter_package_info_prefetch
+    where population_queue_item_id = %s
+    and "timestamp" > now() - %s * interval '1 second';
+    """,
+    [population_queue_id, max_age_seconds]
+  )
+
+  try:
+    return cursor.fetchone()[0]
+  except TypeError:
+    return None
+
+
+def delete_prefetched_package_info(population_queue_id):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    delete from adapter_package_info_prefetch
+    where population_queue_item_id = %s;
+    """,
+    [population_queue_id]
+  )
+
+
+def insert_object_jobs(population_queue_id, member_job_list, resource_map_payload):
+  """Add the jobs for a queue item. {member_job_list} is a list of (job_type,
+  payload) tuples for the members of the package. The resource map job depends
+  on all the members, and on the resource map jobs of earlier revisions of the
+  package that are still in the job table."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    insert into adapter_object_job
+      (population_queue_item_id, job_type, payload, status, return_code,
+      return_body, rolled_up, "timestamp")
+    select %s, t.job_type, t.payload, 'pending', 0, '', false, now()
+    from unnest(%s::text[], %s::text[]) with ordinality as t(job_type, payload, n)
+    order by t.n;
+    """,
+    [
+      population_queue_id, [j[0] for j in member_job_list],
+      [j[1] for j in member_job_list]
+    ]
+  )
+
+  cursor.execute(
+    """
+    with resource_map_job as (
+      insert into adapter_object_job
+        (population_queue_item_id, job_type, payload, status, return_code,
+        return_body, rolled_up, "timestamp")
+      values (%s, 'resource_map', %s, 'pending', 0, '', false, now())
+      returning id
+    )
+    insert into adapter_object_job_dependency (job_id, depends_on_job_id)
+    select resource_map_job.id, aoj.id
+    from resource_map_job, adapter_object_job aoj
+    where aoj.population_queue_item_id = %s
+    union all
+    select resource_map_job.id, aoj.id
+    from resource_map_job, adapter_object_job aoj
+    join adapter_population_queue apq on (apq.id = aoj.population_queue_item_id)
+    join adapter_population_queue apq_new on (
+      apq_new.package_scope_id = apq.package_scope_id
+      and apq_new.package_identifier = apq.package_identifier
+      and apq_new.package_revision > apq.package_revision
+    )
+    where apq_new.id = %s and aoj.job_type = 'resource_map';
+    """,
+    [
+      population_queue_id, resource_map_payload, population_queue_id,
+      population_queue_id
+    ]
+  )
+
+
+def select_object_job_count(population_queue_id):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select count(*) from adapter_object_job where population_queue_item_id = %s;
+    """,
+    [population_queue_id]
+  )
+
+  return cursor.fetchone()[0]
+
+
+def reset_object_jobs():
+  """Make the jobs that did not complete, including jobs claimed by a run that
+  did not finish, available to be claimed again."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    update adapter_object_job
+    set status = 'pending', return_code = 0, return_body = ''
+    where status <> 'completed';
+    update adapter_object_job set rolled_up = false where rolled_up;
+    """
+  )
+
+
+def claim_object_job():
+  """Claim the oldest pending job for which all the jobs it depends on have
+  completed, and return it together with its queue item. Return None if no job
+  can be claimed. Rows locked by other workers are skipped, so concurrent
+  workers never claim the same job."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    with claimed_job as (
+      update adapter_object_job set status = 'claimed', "timestamp" = now()
+      where id = (
+        select aoj.id from adapter_object_job aoj
+        where aoj.status = 'pending'
+        and not exists (
+          select 1 from adapter_object_job_dependency aojd
+          join adapter_object_job aoj_dep on (aoj_dep.id = aojd.depends_on_job_id)
+          where aojd.job_id = aoj.id and aoj_dep.status <> 'completed'
+        )
+        order by aoj.id
+        limit 1
+        for update skip locked
+      )
+      returning id, population_queue_item_id, job_type, payload
+    )
+    select claimed_job.*, apqps.package_scope, apq.package_identifier,
+      apq.package_revision, apq."timestamp"
+    from claimed_job
+    join adapter_population_queue apq on (apq.id = claimed_job.population_queue_item_id)
+    join adapter_population_queue_package_scope apqps on (apqps.id = apq.package_scope_id);
+    """
+  )
+
+  job_list = dict_fetch_all(cursor)
+  return job_list[0] if job_list else None
+
+
+def select_claimed_object_job_count():
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select count(*) from adapter_object_job where status = 'claimed';
+    """
+  )
+
+  return cursor.fetchone()[0]
+
+
+def finish_object_job(job_id, status, return_code=0, return_body=''):
+  """Record the result of a job. If the job did not complete, the jobs that
+  depend on it, directly or indirectly, are cancelled. Return the ids of the
+  queue items that had jobs cancelled."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    update adapter_object_job
+    set status = %s, return_code = %s, return_body = %s, "timestamp" = now()
+    where id = %s;
+    """,
+    [status, return_code, return_body[:VCHAR_LENGTH], job_id]
+  )
+
+  if status == 'completed':
+    return []
+
+  cursor.execute(
+    """
+    with recursive dependent_job (id) as (
+      select job_id from adapter_object_job_dependency
+      where depends_on_job_id = %s
+      union
+      select aojd.job_id from adapter_object_job_dependency aojd
+      join dependent_job on (aojd.depends_on_job_id = dependent_job.id)
+    )
+    update adapter_object_job
+    set status = 'cancelled', return_body = %s, "timestamp" = now()
+    where id in (select id from dependent_job) and status = 'pending'
+    returning population_queue_item_id;
+    """,
+    [job_id, 'Cancelled: A job it depends on did not complete']
+  )
+
+  return sorted({row[0] for row in cursor.fetchall()})
+
+
+def select_object_job_rollup(population_queue_id):
+  """Lock the queue item and return it together with a summary of the status of
+  its jobs. The status and return body of the first failed job are included.
+  Return None if the queue item does not exist. Must be called in a
+  transaction."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select apq.id, apqps.package_scope, apq.package_identifier,
+      apq.package_revision, apq."timestamp"
+    from adapter_population_queue apq
+    join adapter_population_queue_package_scope apqps on (apqps.id = apq.package_scope_id)
+    where apq.id = %s
+    for update of apq;
+    """,
+    [population_queue_id]
+  )
+
+  package_list = dict_fetch_all(cursor)
+  if not package_list:
+    return None
+
+  cursor.execute(
+    """
+    select
+      count(*) as job_count,
+      count(*) filter (where status in ('pending', 'claimed')) as unfinished_count,
+      count(*) filter (where not rolled_up) as unreported_count,
+      count(*) filter (where status = 'private') as private_count,
+      count(*) filter (where status in ('error', 'cancelled')) as error_count,
+      (array_agg(return_code order by status = 'cancelled', id)
+        filter (where status in ('error', 'private', 'cancelled')))[1]
+        as return_code,
+      (array_agg(return_body order by status = 'cancelled', id)
+        filter (where status in ('error', 'private', 'cancelled')))[1]
+        as return_body
+    from adapter_object_job
+    where population_queue_item_id = %s;
+    """,
+    [population_queue_id]
+  )
+
+  rollup = dict_fetch_all(cursor)[0]
+  rollup['package'] = package_list[0]
+  return rollup
+
+
+def set_object_jobs_rolled_up(population_queue_id):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    update adapter_object_job set rolled_up = true
+    where population_queue_item_id = %s;
+    """,
+    [population_queue_id]
+  )
+
+
+def delete_object_jobs(population_queue_id):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    delete from adapter_object_job where population_queue_item_id = %s;
+    """,
+    [population_queue_id]
+  )
+
+
+def select_entity_header(entity_id, checksum):
+  """Return the content-length and content-type headers previously collected
+  for an entity with the given entity ID and checksum, as a dict, or None if
+  there are none."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select content_length, content_type from adapter_entity_header
+    where entity_id = %s and checksum = %s;
+    """,
+    [entity_id, checksum]
+  )
+
+  row = cursor.fetchone()
+  if row is None:
+    return None
+  return {'content-length': str(row[0]), 'content-type': row[1]}
+
+
+def insert_entity_header(entity_id, checksum, content_length, content_type):
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    insert into adapter_entity_header
+      (entity_id, checksum, content_length, content_type, "timestamp")
+    values (%s, %s, %s, %s, now())
+    on conflict (entity_id, checksum) do nothing;
+    """,
+    [entity_id, checksum, int(content_length), content_type]
+  )
+
+
+def select_unarchived_deleted_package_revisions(scope_identifier_list):
+  """Return the completed queue items for packages in {scope_identifier_list},
+  a list of (scope, identifier) tuples of packages that have been deleted in
+  PASTA, skipping packages that have already been archived on GMN.
+
+  Must be called within a transaction.
+  """
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    create temporary table if not exists adapter_deleted_package_copy (
+      package_scope character varying(1024) not null,
+      package_identifier bigint not null
+    ) on commit delete rows;
+    truncate adapter_deleted_package_copy;
+    """
+  )
+
+  copy_file = io.StringIO()
+  csv.writer(copy_file).writerows(scope_identifier_list)
+  copy_file.seek(0)
+  cursor.copy_expert(
+    """
+    copy adapter_deleted_package_copy (package_scope, package_identifier)
+    from stdin with (format csv);
+    """, copy_file
+  )
+
+  cursor.execute(
+    """
+    select apq.id, apqps.package_scope, apq.package_identifier,
+      apq.package_revision
+    from adapter_deleted_package_copy adpc
+    join adapter_population_queue_package_scope apqps using (package_scope)
+    join adapter_population_queue apq
+      on (apq.package_scope_id = apqps.id
+      and apq.package_identifier = adpc.package_identifier)
+    where exists (
+      select 1 from adapter_process_status aps
+      join adapter_process_status_status apss on (apss.id = aps.status_id)
+      where aps.population_queue_item_id = apq.id and apss.status = 'completed'
+    )
+    and not exists (
+      select 1 from adapter_deleted_package adp
+      where adp.package_scope_id = apq.package_scope_id
+      and adp.package_identifier = apq.package_identifier
+    )
+    order by package_scope, package_identifier, package_revision
+    ;
+    """
+  )
+
+  return dict_fetch_all(cursor)
+
+
+def insert_archived_deleted_package(scope, identifier):
+  """Record that all revisions of a package that has been deleted in PASTA have
+  been archived on GMN."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    insert into adapter_deleted_package
+      (package_scope_id, package_identifier, "timestamp")
+    select id, %s, now() from adapter_population_queue_package_scope
+    where package_scope = %s
+    on conflict (package_scope_id, package_identifier) do nothing;
+    """,
+    [int(identifier), scope]
+  )
+
+
+def create_reconciliation_tables():
+  """Create temporary tables for the PASTA inventory and the GMN object list.
+
+  Must be called within a transaction, which must also hold the calls that
+  fill and query the tables.
+  """
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    create temporary table adapter_reconcile_pasta (
+      package_scope character varying(1024) not null,
+      package_identifier bigint not null,
+      package_revision bigint not null
+    ) on commit drop;
+    create temporary table adapter_reconcile_gmn (
+      package_scope character varying(1024) not null,
+      package_identifier bigint not null,
+      package_revision bigint not null,
+      object_type character varying(16) not null,
+      checksum character varying(1024) not null
+    ) on commit drop;
+    """
+  )
+
+
+def copy_reconciliation_pasta_rows(row_list):
+  """Add (scope, identifier, revision) tuples to the PASTA inventory table."""
+  _copy_rows('adapter_reconcile_pasta', row_list)
+
+
+def copy_reconciliation_gmn_rows(row_list):
+  """Add (scope, identifier, revision, object_type, checksum) tuples to the GMN
+  object table."""
+  _copy_rows('adapter_reconcile_gmn', row_list)
+
+
+def _copy_rows(table_name, row_list):
+  cursor = django.db.connection.cursor()
+  copy_file = io.StringIO()
+  csv.writer(copy_file).writerows(row_list)
+  copy_file.seek(0)
+  cursor.copy_expert(
+    'copy {} from stdin with (format csv);'.format(table_name), copy_file
+  )
+
+
+def select_reconciliation_report(include_complete=False, fetch_size=1000):
+  """Join the PASTA inventory against the GMN object list, by package ID.
+
+  Yield a dict for each package with the package ID, the number of objects of
+  each type found on GMN, and the GMN checksum of the metadata object. Packages
+  that exist only on PASTA have no GMN objects, and packages that exist only on
+  GMN have in_pasta false. Unless {include_complete} is True, only packages that
+  are missing objects on GMN or that exist only on GMN are included.
+  """
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    analyze adapter_reconcile_pasta;
+    analyze adapter_reconcile_gmn;
+    """
+  )
+
+  # With the default client side cursor, the whole result would be loaded into
+  # memory by execute(). A server side cursor keeps only {fetch_size} rows in
+  # memory at a time.
+  cursor = django.db.connection.chunked_cursor()
+
+  cursor.execute(
+    """
+    select
+      package_scope, package_identifier, package_revision,
+      p.package_scope is not null as in_pasta,
+      coalesce(g.metadata_count, 0) as metadata_count,
+      coalesce(g.report_count, 0) as report_count,
+      coalesce(g.data_count, 0) as data_count,
+      g.metadata_checksum
+    from (
+      select distinct package_scope, package_identifier, package_revision
+      from adapter_reconcile_pasta
+    ) p
+    full outer join (
+      select package_scope, package_identifier, package_revision,
+        count(*) filter (where object_type = 'metadata') as metadata_count,
+        count(*) filter (where object_type = 'report') as report_count,
+        count(*) filter (where object_type = 'data') as data_count,
+        max(checksum) filter (where object_type = 'metadata') as metadata_checksum
+      from adapter_reconcile_gmn
+      group by package_scope, package_identifier, package_revision
+    ) g using (package_scope, package_identifier, package_revision)
+    where %s
+    or p.package_scope is null
+    or g.package_scope is null
+    or g.metadata_count = 0
+    or g.report_count = 0
+    order by package_scope, package_identifier, package_revision
+    ;
+    """,
+    [include_complete]
+  )
+
+  try:
+    row_list = cursor.fetchmany(fetch_size)
+    # The description of a server side cursor is only set by the first fetch.
+    column_list = [col[0] for col in cursor.description]
+    while row_list:
+      for row in row_list:
+        yield dict(zip(column_list, row))
+      row_list = cursor.fetchmany(fetch_size)
+  finally:
+    cursor.close()
+
+
+def update_population_queue_entity_counts(entity_count_list):
+  """Store the number of data entities of queued packages, from a list of
+  (population_queue_id, entity_count) tuples."""
+  cursor = django.db.connection.cursor()
+
+  cursor.executemany(
+    """
+    update adapter_population_queue set entity_count = %s where id = %s;
+    """,
+    [(entity_count, population_queue_id)
+     for population_queue_id, entity_count in entity_count_list]
+  )
+
+
 def select_population_queue_all():
   cursor = django.db.connection.cursor()
 
@@ -222,14 +996,21 @@ def select_population_queue_all():
 
 def select_population_queue_uncompleted():
   """Select all the population tasks that have not yet been successfully
-  processed."""
+  processed. The number of data entities is taken from the prefetched info, or
+  from the count stored in the queue, and is None if neither is available."""
   cursor = django.db.connection.cursor()
 
   cursor.execute(
     """
-    select apq.id, package_scope, package_identifier, package_revision, "timestamp"
+    select apq.id, package_scope, package_identifier, package_revision,
+      apq."timestamp",
+      coalesce(
+        json_array_length(apip.package_info::json -> 'entities'),
+        apq.entity_count
+      ) as entity_count
     from adapter_population_queue apq
     left join adapter_population_queue_package_scope apqps on (apq.package_scope_id = apqps.id)
+    left join adapter_package_info_prefetch apip on (apip.population_queue_item_id = apq.id)
     where apq.id not in (
       select population_queue_item_id
       from adapter_process_status aps
@@ -243,6 +1024,30 @@ def select_population_queue_uncompleted():
   return dict_fetch_all(cursor)
 
 
+_SELECT_PACKAGE_SCOPE_ID = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'select_package_scope_id', ['text'],
+  """
+  select id from adapter_population_queue_package_scope where package_scope = %s
+  ;
+  """
+)
+
+_SELECT_LATEST_PACKAGE_REVISION = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'select_latest_package_revision', ['integer', 'bigint'],
+  """
+  select max(package_revision) from adapter_population_queue
+  where package_scope_id = %s and package_identifier = %s
+  and id in (
+    select population_queue_item_id
+    from adapter_process_status aps
+    join adapter_process_status_status apss on (apss.id = aps.status_id)
+    where apss.status in ('completed')
+  )
+  ;
+  """
+)
+
+
 def select_latest_package_revision(scope, identifier):
   """If one or more packages with the given scope and identifier exist, return
   the revision of the latest package. Else, return None. Only the latest package
@@ -250,35 +1055,68 @@ def select_latest_package_revision(scope, identifier):
   have not been inserted into GMN cannot be updated."""
   cursor = django.db.connection.cursor()
 
-  cursor.execute(
-    """
-    select id from adapter_population_queue_package_scope where package_scope = %s
-  ;
-  """,
-    [scope]
-  )
+  _SELECT_PACKAGE_SCOPE_ID.execute(cursor, [scope])
 
   try:
     scope_id = cursor.fetchone()[0]
   except TypeError:
     return None
 
+  _SELECT_LATEST_PACKAGE_REVISION.execute(cursor, [scope_id, int(identifier)])
+
+  return cursor.fetchone()[0]
+
+
+def select_latest_package_revisions(scope_identifier_list):
+  """Set based version of select_latest_package_revision(). Return a dict that
+  maps each (scope, identifier) tuple in {scope_identifier_list} for which a
+  completed package exists to the latest completed revision."""
+  cursor = django.db.connection.cursor()
+
   cursor.execute(
     """
-    select max(package_revision) from adapter_population_queue
-    where package_scope_id = %s and package_identifier = %s
-    and id in (
+    select apqps.package_scope, apq.package_identifier,
+      max(apq.package_revision) as latest_revision
+    from unnest(%s::text[], %s::bigint[]) as r(package_scope, package_identifier)
+    join adapter_population_queue_package_scope apqps
+      on (apqps.package_scope = r.package_scope)
+    join adapter_population_queue apq
+      on (apq.package_scope_id = apqps.id
+          and apq.package_identifier = r.package_identifier)
+    where apq.id in (
       select population_queue_item_id
       from adapter_process_status aps
       join adapter_process_status_status apss on (apss.id = aps.status_id)
       where apss.status in ('completed')
     )
-  ;
-  """,
-    [scope_id, identifier]
+    group by apqps.package_scope, apq.package_identifier
+    ;
+    """,
+    [[p[0] for p in scope_identifier_list],
+     [p[1] for p in scope_identifier_list]]
   )
 
-  return cursor.fetchone()[0]
+  return {(r[0], r[1]): r[2] for r in cursor.fetchall()}
+
+
+def select_queued_package_revisions(scope):
+  """Return a set of (identifier, revision) tuples for all the packages with
+  scope {scope} that are in the queue, regardless of status."""
+  cursor = django.db.connection.cursor()
+
+  cursor.execute(
+    """
+    select package_identifier, package_revision
+    from adapter_population_queue apq
+    join adapter_population_queue_package_scope apqps
+      on (apq.package_scope_id = apqps.id)
+    where apqps.package_scope = %s
+    ;
+    """,
+    [scope]
+  )
+
+  return set(cursor.fetchall())
 
 
 def insert_process_status(task_id, status, return_code=0, return_body=''):
@@ -296,14 +1134,81 @@ def insert_process_status(task_id, status, return_code=0, return_body=''):
 
   cursor = django.db.connection.cursor()
 
-  cursor.execute(
-    """
-    select id from adapter_process_status_status where status = %s
-    """,
-    [status]
+  status_id = _select_or_insert_status_id(cursor, status)
+
+  return_body_id = _upsert_return_body(cursor, return_body)
+
+  previous_status_id = _select_latest_status_id(cursor, task_id)
+
+  _INSERT_PROCESS_STATUS.execute(
+    cursor, [task_id, status_id, return_code, return_body_id]
   )
+
+  _update_status_count(cursor, previous_status_id, status_id)
+
+  return status_id
+
+
+_INSERT_PROCESS_STATUS = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'insert_process_status', ['integer', 'integer', 'integer', 'integer'],
+  """
+  insert into adapter_process_status (population_queue_item_id, "timestamp",
+    status_id, return_code, return_body_id)
+  values (%s, now(), %s, %s, %s)
+  ;
+  """
+)
+
+_SELECT_STATUS_ID = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'select_status_id', ['text'],
+  """
+  select id from adapter_process_status_status where status = %s
+  """
+)
+
+_SELECT_LATEST_STATUS_ID = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'select_latest_status_id', ['integer'],
+  """
+  select status_id from adapter_process_status
+  where population_queue_item_id = %s
+  order by "timestamp" desc, id desc
+  limit 1;
+  """
+)
+
+_ADD_TO_STATUS_COUNT = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'add_to_status_count', ['integer', 'bigint'],
+  """
+  insert into adapter_process_status_count (status_id, count)
+  values (%s, %s)
+  on conflict (status_id) do update
+  set count = adapter_process_status_count.count + excluded.count;
+  """
+)
+
+_SELECT_RETURN_BODY_ID = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'select_return_body_id', ['text'],
+  """
+  select id from adapter_process_status_return_body
+  where return_body_hash = md5(%s)::uuid;
+  """
+)
+
+_INSERT_RETURN_BODY = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+  'insert_return_body', ['text', 'text'],
+  """
+  insert into adapter_process_status_return_body (return_body, return_body_hash)
+  values (%s, md5(%s)::uuid)
+  on conflict (return_body_hash) do nothing
+  returning id;
+  """
+)
+
+
+def _select_or_insert_status_id(cursor, status):
+  _SELECT_STATUS_ID.execute(cursor, [status])
   try:
-    status_id = cursor.fetchone()[0]
+    return cursor.fetchone()[0]
   except TypeError:
     cursor.execute(
       """
@@ -313,38 +1218,60 @@ def insert_process_status(task_id, status, return_code=0, return_body=''):
       """,
       [status]
     )
-    status_id = cursor.fetchone()[0]
+    return cursor.fetchone()[0]
 
-  cursor.execute(
-    """
-    select id from adapter_process_status_return_body where return_body = %s
-    """,
-    [return_body]
-  )
+
+def _select_latest_status_id(cursor, task_id):
+  _SELECT_LATEST_STATUS_ID.execute(cursor, [task_id])
   try:
-    return_body_id = cursor.fetchone()[0]
+    return cursor.fetchone()[0]
   except TypeError:
-    cursor.execute(
-      """
-      insert into adapter_process_status_return_body (return_body)
-      values (%s)
-      returning id;
-      """,
-      [return_body]
-    )
-    return_body_id = cursor.fetchone()[0]
+    return None
 
-  cursor.execute(
-    """
-    insert into adapter_process_status (population_queue_item_id, "timestamp",
-      status_id, return_code, return_body_id)
-    values (%s, now(), %s, %s, %s)
-    ;
-    """,
-    [task_id, status_id, return_code, return_body_id]
-  )
 
-  return status_id
+def _update_status_count(cursor, previous_status_id, status_id):
+  """Move one queue item from the count for its previous status to the count
+  for its new status."""
+  if previous_status_id == status_id:
+    return
+  if previous_status_id is not None:
+    _add_to_status_count(cursor, previous_status_id, -1)
+  _add_to_status_count(cursor, status_id, 1)
+
+
+def _add_to_status_count(cursor, status_id, n):
+  _ADD_TO_STATUS_COUNT.execute(cursor, [status_id, n])
+
+
+def _upsert_return_body(cursor, return_body):
+  """Return the id of the row holding {return_body}, creating the row if it
+  does not already exist.
+
+  Rows are looked up by an MD5 hash of the body, stored as a 16 byte uuid, so
+  that the unique index does not have to hold the full text of the bodies.
+  """
+  return_body = normalize_return_body(return_body)
+  _SELECT_RETURN_BODY_ID.execute(cursor, [return_body])
+  try:
+    return cursor.fetchone()[0]
+  except TypeError:
+    pass
+  _INSERT_RETURN_BODY.execute(cursor, [return_body, return_body])
+  try:
+    return cursor.fetchone()[0]
+  except TypeError:
+    # Inserted by a concurrent transaction after the select.
+    _SELECT_RETURN_BODY_ID.execute(cursor, [return_body])
+    return cursor.fetchone()[0]
+
+
+def normalize_return_body(return_body):
+  """Replace the volatile parts of an error message, such as timestamps and URL
+  query strings, with placeholders, so that errors that differ only in those
+  parts are stored as a single return body."""
+  return_body = _TIMESTAMP_RX.sub('<timestamp>', return_body)
+  return_body = _URL_QUERY_RX.sub(r'\1?<query>', return_body)
+  return return_body
 
 
 def select_process_status_by_package_id(scope, identifier, revision):
@@ -374,10 +1301,17 @@ def clear_database():
 
   cursor.execute(
     """
+    delete from adapter_process_status_count;
+    delete from adapter_package_info_prefetch;
+    delete from adapter_package_intake;
+    delete from adapter_entity_header;
+    delete from adapter_object_job_dependency;
+    delete from adapter_object_job;
     delete from adapter_process_status;
     delete from adapter_process_status_status;
     delete from adapter_process_status_return_body;
     delete from adapter_population_queue;
+    delete from adapter_deleted_package;
     delete from adapter_population_queue_package_scope;
     ;
     """
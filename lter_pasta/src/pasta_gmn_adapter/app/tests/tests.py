@@ -29,18 +29,50 @@
   Roger Dahl
 """
 
+import asyncio
+import datetime
+import http.server
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree
+
 import pytest
 
+import d1_common.resource_map
 import d1_common.types.dataoneTypes
 
+import django.core.management
 import django.db
 import django.db.transaction
 import django.test
 import django.utils
 
 import pasta_gmn_adapter
+import pasta_gmn_adapter.api_types.eml_access
+import pasta_gmn_adapter.app.async_data_package_manager_client
 import pasta_gmn_adapter.app.data_package_manager_client
+import pasta_gmn_adapter.app.deadline
+import pasta_gmn_adapter.app.enqueue
+import pasta_gmn_adapter.app.management.commands.benchmark_import_time
+import pasta_gmn_adapter.app.management.commands.benchmark_queries
+import pasta_gmn_adapter.app.management.commands.clean_queue_tables
+import pasta_gmn_adapter.app.management.commands.generate_queue_data
+import pasta_gmn_adapter.app.management.commands.process_population_queue
+import pasta_gmn_adapter.app.management.commands.reconcile_gmn
+import pasta_gmn_adapter.app.management.commands.register_existing_packages
+import pasta_gmn_adapter.app.management.commands.sync_deleted_packages
+import pasta_gmn_adapter.app.metrics
+import pasta_gmn_adapter.app.object_job_processor
+import pasta_gmn_adapter.app.population_queue_processor
+import pasta_gmn_adapter.app.prefetch
+import pasta_gmn_adapter.app.prepared_statements
+import pasta_gmn_adapter.app.resource_map
+import pasta_gmn_adapter.app.scheduler
 import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
 from pasta_gmn_adapter import api_types
 
 # App.
@@ -62,6 +94,64 @@ TEST_EML_ACCESS_XML = """<access:access xmlns:access="eml://ecoinformatics.org/a
 """
 
 
+class InventoryStubClient(object):
+  """Serves the package inventory of PASTA from a dict"""
+
+  def __init__(self, inventory_dict):
+    self._inventory_dict = inventory_dict
+
+  def list_data_package_scopes(self):
+    return sorted(self._inventory_dict)
+
+  def list_data_package_identifiers(self, scope):
+    return sorted(self._inventory_dict[scope])
+
+  def list_data_package_revisions(self, scope, identifier):
+    return self._inventory_dict[scope][identifier]
+
+
+class InventoryStubCrawler(
+    pasta_gmn_adapter.app.management.commands.register_existing_packages.
+    PackageInventoryCrawler
+):
+  def __init__(self, inventory_dict, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._stub_client = InventoryStubClient(inventory_dict)
+
+  def _get_client(self):
+    return self._stub_client
+
+
+class AccessStubClient(object):
+  """Serves the entities of a package, one of which is private"""
+
+  def __init__(self, entity_ids, private_entity_id):
+    self._entity_ids = entity_ids
+    self._private_entity_id = private_entity_id
+
+  def list_data_entities(self, package_id):
+    return self._entity_ids
+
+  def read_metadata_replication_policy(self, package_id):
+    return None
+
+  def is_authorized(self, package_id, entity_id):
+    if entity_id == self._private_entity_id:
+      raise (
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerException('Unauthorized', 401, entity_id)
+      )
+    return 'authorized'
+
+
+class AccessStubCollector(
+    pasta_gmn_adapter.app.population_queue_processor.DataPackageInfoCollector
+):
+  def __init__(self, *args):
+    self._pasta_client = AccessStubClient(*args)
+    self._pasta_client_public_access = self._pasta_client
+
+
 class TestSQL(django.test.TestCase):
   # Tried using setUpClass() to get Django to retain the table contents between
   # tests, but couldn't get it to work. Also tried forcing transactions to be
@@ -187,20 +277,1126 @@ class TestSQL(django.test.TestCase):
       select_latest_package_revision('non_existing_package', 333) is None
     )
 
+  def test_210_select_unarchived_deleted_package_revisions(self):
+    self._populate_with_test_objects()
+    sync_deleted_packages = pasta_gmn_adapter.app.management.commands.sync_deleted_packages
+    scope_identifier_list = sync_deleted_packages.parse_deleted_package_list(
+      ['test_package_2.333', 'test_package_3.555', 'test_package_2.333', '']
+    )
+    self.assertEqual(
+      scope_identifier_list, [('test_package_2', 333), ('test_package_3', 555)]
+    )
+    with django.db.transaction.atomic():
+      q = pasta_gmn_adapter.app.sql.select_unarchived_deleted_package_revisions(
+        scope_identifier_list
+      )
+    self.assertEqual(
+      [(r['package_scope'], r['package_revision']) for r in q],
+      [('test_package_2', 445)]
+    )
+    pasta_gmn_adapter.app.sql.insert_archived_deleted_package(
+      'test_package_2', 333
+    )
+    with django.db.transaction.atomic():
+      q = pasta_gmn_adapter.app.sql.select_unarchived_deleted_package_revisions(
+        scope_identifier_list
+      )
+    self.assertEqual(q, [])
+    # The record of archived packages is kept when the counts are rebuilt.
+    pasta_gmn_adapter.app.sql.refresh_status_count()
+    with django.db.transaction.atomic():
+      q = pasta_gmn_adapter.app.sql.select_unarchived_deleted_package_revisions(
+        scope_identifier_list
+      )
+    self.assertEqual(q, [])
+
+  def test_220_object_jobs(self):
+    self._populate_with_test_objects()
+    sql = pasta_gmn_adapter.app.sql
+    queue_id = sql.select_population_queue_all()[0]['task_id']
+    next_queue_id = sql.insert_population_queue_item('test_package', 111, 223)
+    for population_queue_id in (queue_id, next_queue_id):
+      sql.insert_object_jobs(
+        population_queue_id, [('entity', '{}'), ('report', '{}'),
+                              ('metadata', '{}')], '{}'
+      )
+    member_job_list = [sql.claim_object_job() for _ in range(6)]
+    self.assertEqual(
+      sorted(j['job_type'] for j in member_job_list),
+      ['entity', 'entity', 'metadata', 'metadata', 'report', 'report']
+    )
+    # The resource maps wait for the members.
+    self.assertIsNone(sql.claim_object_job())
+    for job in member_job_list:
+      self.assertEqual(sql.finish_object_job(job['id'], 'completed'), [])
+    resource_map_job = sql.claim_object_job()
+    self.assertEqual(resource_map_job['job_type'], 'resource_map')
+    self.assertEqual(resource_map_job['population_queue_item_id'], queue_id)
+    self.assertEqual(resource_map_job['package_revision'], 222)
+    # The resource map of the next revision waits for the previous revision.
+    self.assertIsNone(sql.claim_object_job())
+    self.assertEqual(
+      sql.finish_object_job(resource_map_job['id'], 'error', 500, 'failed'),
+      [next_queue_id]
+    )
+    rollup = sql.select_object_job_rollup(queue_id)
+    self.assertEqual(
+      (
+        rollup['unfinished_count'], rollup['error_count'],
+        rollup['return_code'], rollup['return_body']
+      ), (0, 1, 500, 'failed')
+    )
+    self.assertEqual(
+      sql.select_object_job_rollup(next_queue_id)['error_count'], 1
+    )
+    sql.reset_object_jobs()
+    self.assertEqual(sql.claim_object_job()['id'], resource_map_job['id'])
+    self.assertIsNone(sql.claim_object_job())
+
+  def test_230_entity_header(self):
+    sql = pasta_gmn_adapter.app.sql
+    self.assertIsNone(sql.select_entity_header('abc', 'def'))
+    sql.insert_entity_header('abc', 'def', '123', 'text/csv')
+    sql.insert_entity_header('abc', 'def', '123', 'text/csv')
+    self.assertEqual(
+      sql.select_entity_header('abc', 'def'),
+      {'content-length': '123', 'content-type': 'text/csv'}
+    )
+    self.assertIsNone(sql.select_entity_header('abc', 'xyz'))
+
+  def test_240_drain_package_intake(self):
+    sql = pasta_gmn_adapter.app.sql
+    for package_id in ('test_package_5.1.1', 'test_package_5.1.1', 'invalid'):
+      sql.insert_package_intake(package_id)
+    self.assertEqual(sql.select_package_intake_count(), 3)
+    self.assertEqual(
+      pasta_gmn_adapter.app.enqueue.drain_package_intake(batch_size=2), (1, 2)
+    )
+    self.assertEqual(sql.select_package_intake_count(), 0)
+    self.assertEqual(
+      [(p['package_scope'], p['package_identifier'], p['package_revision'])
+       for p in sql.select_population_queue_uncompleted()],
+      [('test_package_5', 1, 1)],
+    )
+
+  def test_245_drain_package_intake_prefetch(self):
+    """The package info is prefetched for the packages moved to the queue"""
+    sql = pasta_gmn_adapter.app.sql
+    prefetch = pasta_gmn_adapter.app.prefetch
+    for package_id in ('test_package_5.1.1', 'test_package_5.1.2', 'invalid'):
+      sql.insert_package_intake(package_id)
+    prefetch_list = []
+    saved_prefetch_func = prefetch.prefetch_package_info_on_commit
+    prefetch.prefetch_package_info_on_commit = (
+      lambda *args: prefetch_list.append(args)
+    )
+    try:
+      pasta_gmn_adapter.app.enqueue.drain_package_intake()
+    finally:
+      prefetch.prefetch_package_info_on_commit = saved_prefetch_func
+    queue_id_dict = {
+      p['package_revision']: p['id']
+      for p in sql.select_population_queue_uncompleted()
+    }
+    self.assertEqual(
+      sorted(prefetch_list),
+      sorted([
+        (queue_id_dict[1], 'test_package_5', 1, 1),
+        (queue_id_dict[2], 'test_package_5', 1, 2),
+      ])
+    )
+
+  def test_250_prepared_statements(self):
+    sql = pasta_gmn_adapter.app.sql
+    self._populate_with_test_objects()
+    saved_prepare = pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES
+    result_list = []
+    try:
+      for prepare in (False, True):
+        pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES = prepare
+        queue_id = sql.insert_population_queue_item('test_package_4', 777, 888)
+        sql.insert_process_status(queue_id, 'error', 404, 'test_return_body')
+        result_list.append((
+          sql.select_latest_package_revision('test_package_2', 333),
+          sql.select_latest_package_revision('test_package_4', 777),
+          sql.select_status(queue_id)[-1]['return_body'],
+        ))
+    finally:
+      pasta_gmn_adapter.settings.PREPARE_HOT_QUERIES = saved_prepare
+    self.assertEqual(result_list, [(445, None, 'test_return_body')] * 2)
+
+  def test_260_prepared_statements_deallocated_in_transaction(self):
+    sql = pasta_gmn_adapter.app.sql
+    self._populate_with_test_objects()
+    sql.select_latest_package_revision('test_package_2', 333)
+    with pytest.raises(django.db.Error):
+      with django.db.transaction.atomic():
+        django.db.connection.cursor().execute('deallocate all')
+        sql.select_latest_package_revision('test_package_2', 333)
+    self.assertEqual(
+      sql.select_latest_package_revision('test_package_2', 333), 445
+    )
+
+  def _crawl_inventory(self, inventory_dict, checkpoint_list, incremental):
+    """Run PackageInventoryCrawler against {inventory_dict}, which maps scopes to
+    dicts of identifiers and revision lists, resuming from {checkpoint_list}.
+    Return the package IDs in the queue, with duplicates."""
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+      checkpoint_path = os.path.join(
+        tmp_dir_path, 'register_existing_packages.checkpoint'
+      )
+      with open(checkpoint_path, 'w') as f:
+        for scope, identifier in checkpoint_list:
+          f.write('{}\t{}\n'.format(scope, identifier))
+      crawler = InventoryStubCrawler(
+        inventory_dict, checkpoint_path, worker_count=2, batch_size=1,
+        incremental=incremental
+      )
+      crawler.register_existing_packages(restart=False)
+      self.assertFalse(os.path.exists(checkpoint_path))
+    return sorted(
+      '{}.{}.{}'.format(
+        p['package_scope'], p['package_identifier'], p['package_revision']
+      ) for p in pasta_gmn_adapter.app.sql.select_population_queue_all()
+    )
+
+  def test_270_register_existing_packages_resume(self):
+    """A resumed crawl does not queue the revisions of the interrupted batch
+    again"""
+    sql = pasta_gmn_adapter.app.sql
+    sql.insert_population_queue_item('test_scope', 1, 1)
+    # Batch committed to the queue, but not recorded in the checkpoint.
+    sql.insert_population_queue_item('test_scope', 2, 1)
+    self.assertEqual(
+      self._crawl_inventory(
+        {'test_scope': {1: [1], 2: [1, 2], 3: [1]}}, [('test_scope', 1)],
+        incremental=False
+      ), ['test_scope.1.1', 'test_scope.2.1', 'test_scope.2.2', 'test_scope.3.1']
+    )
+
+  def test_280_register_existing_packages_incremental(self):
+    """An incremental crawl keeps the queue and adds only the revisions that are
+    not already in it"""
+    self._populate_with_test_objects()
+    self.assertEqual(
+      self._crawl_inventory(
+        {'test_package_3': {555: [666, 667]}}, [], incremental=True
+      ), [
+        'test_package.111.222', 'test_package_2.333.444',
+        'test_package_2.333.445', 'test_package_3.555.666',
+        'test_package_3.555.667'
+      ]
+    )
+
+  def test_282_reconciliation_report(self):
+    """The report is read in batches from a server side cursor"""
+    sql = pasta_gmn_adapter.app.sql
+    sql.create_reconciliation_tables()
+    sql.copy_reconciliation_pasta_rows([
+      ('test_scope', 1, 1),
+      ('test_scope', 2, 1),
+      ('test_scope', 3, 1),
+    ])
+    sql.copy_reconciliation_gmn_rows([
+      ('test_scope', 1, 1, 'metadata', 'SHA-1:abc'),
+      ('test_scope', 1, 1, 'report', 'SHA-1:def'),
+      ('test_scope', 4, 1, 'metadata', 'SHA-1:123'),
+    ])
+    report_list = list(sql.select_reconciliation_report(fetch_size=1))
+    self.assertEqual(
+      [(p['package_identifier'], p['in_pasta'], p['metadata_count'])
+       for p in report_list], [(2, True, 0), (3, True, 0), (4, False, 1)]
+    )
+    self.assertEqual(
+      len(
+        list(
+          sql.select_reconciliation_report(include_complete=True, fetch_size=2)
+        )
+      ), 4
+    )
+
+  def test_284_entity_count(self):
+    """The entity count comes from the prefetched info, or else from the count
+    stored in the queue"""
+    sql = pasta_gmn_adapter.app.sql
+    prefetched_id = sql.insert_population_queue_item('test_scope', 1, 1)
+    stored_id = sql.insert_population_queue_item('test_scope', 2, 1)
+    unknown_id = sql.insert_population_queue_item('test_scope', 3, 1)
+    sql.insert_prefetched_package_info(
+      prefetched_id, '{"entities": [{}, {}, {}]}'
+    )
+    sql.update_population_queue_entity_counts([
+      (prefetched_id, 10), (stored_id, 5)
+    ])
+    self.assertEqual({
+      i['id']: i['entity_count']
+      for i in sql.select_population_queue_uncompleted()
+    }, {prefetched_id: 3, stored_id: 5, unknown_id: None})
+
+  def test_285_object_jobs_private_entity(self):
+    """A package with a private entity is recorded as private without adding
+    any object jobs"""
+    sql = pasta_gmn_adapter.app.sql
+    queue_id = sql.insert_population_queue_item('test_scope', 1, 1)
+    package = {
+      'id': queue_id,
+      'package_scope': 'test_scope',
+      'package_identifier': 1,
+      'package_revision': 1,
+    }
+    status_list = []
+    processor = pasta_gmn_adapter.app.object_job_processor.ObjectJobProcessor(
+      1, lambda package, status, *args: status_list.append(status)
+    )
+    processor._thread_local.collector = AccessStubCollector(
+      ['e1', 'e2', 'e3'], 'e2'
+    )
+    processor._expand_package(package)
+    self.assertEqual(status_list, ['private'])
+    self.assertEqual(sql.select_object_job_count(queue_id), 0)
+
+  def test_290_empty_queue_metrics(self):
+    """A run that finds the queue empty still records its timestamp"""
+    process_population_queue = (
+      pasta_gmn_adapter.app.management.commands.process_population_queue
+    )
+    self.assertFalse(process_population_queue.is_work_queued())
+    process_population_queue.save_empty_queue_metrics()
+    metric_dict = {
+      name: value
+      for name, labels, value in pasta_gmn_adapter.app.sql.select_metrics()
+    }
+    self.assertGreater(
+      metric_dict['pasta_gmn_adapter_last_run_timestamp_seconds'], 0
+    )
+    self.assertEqual(
+      metric_dict['pasta_gmn_adapter_oldest_unprocessed_item_timestamp_seconds'],
+      0
+    )
+
+  def test_200_enqueue_package_ids(self):
+    self._populate_with_test_objects()
+    result_list = pasta_gmn_adapter.app.enqueue.enqueue_package_ids([
+      'test_package_2.333.446',
+      'test_package_2.333.445',
+      'test_package_2.333.1',
+      'test_package_4.1.1',
+      'test_package_4.1.1',
+      '',
+      'invalid',
+    ])
+    self.assertEqual(
+      [(r[0], r[1]) for r in result_list], [
+        ('test_package_2.333.446', True),
+        ('test_package_2.333.445', False),
+        ('test_package_2.333.1', False),
+        ('test_package_4.1.1', True),
+        ('test_package_4.1.1', False),
+        ('invalid', False),
+      ]
+    )
+    q = pasta_gmn_adapter.app.sql.select_population_queue_uncompleted()
+    self.assertEqual(len(q), 5)
+    self.assertEqual(
+      pasta_gmn_adapter.app.sql.select_process_status_by_package_id(
+        'test_package_4', 1, 1
+      )[0]['status'], 'new'
+    )
+
+  def test_190_select_statistics(self):
+    self._populate_with_test_objects()
+    self.assertEqual(
+      pasta_gmn_adapter.app.sql.select_statistics(), [
+        {'status': 'completed', 'count': 1},
+        {'status': 'new', 'count': 3},
+      ]
+    )
+    queue_id = pasta_gmn_adapter.app.sql.select_population_queue_all()[0]['task_id']
+    pasta_gmn_adapter.app.sql.insert_prefetched_package_info(queue_id, '{}')
+    pasta_gmn_adapter.app.sql.refresh_status_count()
+    self.assertEqual(
+      pasta_gmn_adapter.app.sql.select_statistics(), [
+        {'status': 'completed', 'count': 1},
+        {'status': 'new', 'count': 3},
+      ]
+    )
+    # Only the counts are rebuilt.
+    self.assertIsNotNone(
+      pasta_gmn_adapter.app.sql.select_prefetched_package_info(queue_id, 3600)
+    )
+
+  def test_180_insert_status_normalized_return_body(self):
+    self._populate_with_test_objects()
+    package_id = pasta_gmn_adapter.app.sql.select_population_queue_all()[1]['task_id']
+    for return_body in (
+        'Timeout at 2017-05-14T12:00:00Z for http://a.org/x?token=1',
+        'Timeout at 2017-05-15T13:30:00Z for http://a.org/x?token=2',
+    ):
+      pasta_gmn_adapter.app.sql.insert_process_status(
+        package_id, 'error', 500, return_body
+      )
+    q = pasta_gmn_adapter.app.sql.select_status(package_id)
+    self.assertEqual(len(q), 3)
+    self.assertEqual(q[1]['return_body_id'], q[2]['return_body_id'])
+    self.assertEqual(
+      q[2]['return_body'], 'Timeout at <timestamp> for http://a.org/x?<query>'
+    )
+
+  def test_170_delete_all_but_latest_revisions(self):
+    self._populate_with_test_objects()
+    clean_queue_tables = pasta_gmn_adapter.app.management.commands.clean_queue_tables
+    self.assertEqual(clean_queue_tables.count_all_but_latest_revisions(), 1)
+    self.assertEqual(clean_queue_tables.delete_all_but_latest_revisions(100), 1)
+    self.assertEqual(clean_queue_tables.delete_all_but_latest_revisions(100), 0)
+    q = pasta_gmn_adapter.app.sql.select_population_queue_all()
+    self.assertEqual(len(q), 3)
+    self.assertEqual(
+      [(r['package_scope'], r['package_revision']) for r in q if r['package_identifier'] == 333],
+      [('test_package_2', 445)]
+    )
+
+
+
+class TestPreparedStatements(django.test.TransactionTestCase):
+  """Outside of a transaction, so that the connection can be closed, and the
+  retry is used."""
+
+  def setUp(self):
+    create_sql = open('pasta_gmn_adapter.sql').read()
+    django.db.connection.cursor().execute(create_sql)
+    pasta_gmn_adapter.app.sql.insert_population_queue_item('test_package', 1, 2)
+
+  def test_100_reconnect(self):
+    sql = pasta_gmn_adapter.app.sql
+    self.assertIsNone(sql.select_latest_package_revision('test_package', 1))
+    django.db.connection.close()
+    self.assertIsNone(sql.select_latest_package_revision('test_package', 1))
+
+  def test_110_deallocated(self):
+    sql = pasta_gmn_adapter.app.sql
+    self.assertIsNone(sql.select_latest_package_revision('test_package', 1))
+    django.db.connection.cursor().execute('deallocate all')
+    self.assertIsNone(sql.select_latest_package_revision('test_package', 1))
+
+  def test_120_placeholders(self):
+    statement = pasta_gmn_adapter.app.prepared_statements.PreparedStatement(
+      'test', ['text', 'integer'],
+      "select %s, %s, '100%%';"
+    )
+    self.assertEqual(
+      statement._prepare_sql,
+      "prepare adapter_test (text, integer) as select $1, $2, '100%'"
+    )
+    self.assertEqual(statement._execute_sql, 'execute adapter_test (%s, %s)')
+
+
+class TestBenchmarkQueries(django.test.TestCase):
+  def test_100_compare_to_baseline(self):
+    benchmark_queries = pasta_gmn_adapter.app.management.commands.benchmark_queries
+    baseline_dict = {
+      'a': {'median_sec': 0.1, 'seq_scan_list': ['adapter_population_queue']},
+      'b': {'median_sec': 0.1, 'seq_scan_list': []},
+    }
+    result_dict = {
+      'a': {'median_sec': 0.15, 'seq_scan_list': ['adapter_population_queue']},
+      'b': {'median_sec': 0.3, 'seq_scan_list': ['adapter_process_status']},
+    }
+    regression_list = benchmark_queries.compare_to_baseline(
+      baseline_dict, result_dict, 2.0
+    )
+    self.assertEqual(len(regression_list), 2)
+    self.assertTrue(all(r.startswith('b:') for r in regression_list))
+
+  def test_200_default_run(self):
+    """The command runs with the default arguments against a generated queue,
+    including the benchmarks with statements that use temporary tables. The
+    tolerance is raised, as the timings are not of interest here."""
+    cursor = django.db.connection.cursor()
+    cursor.execute(open('pasta_gmn_adapter.sql').read())
+    pasta_gmn_adapter.app.management.commands.generate_queue_data.generate_queue_data(
+      100, 3, 2, 0.5
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+      baseline_path = os.path.join(tmp_dir_path, 'benchmark_baseline.json')
+      django.core.management.call_command(
+        'benchmark_queries', baseline_path=baseline_path, save_baseline=True
+      )
+      django.core.management.call_command(
+        'benchmark_queries', baseline_path=baseline_path, tolerance=1000.0
+      )
+
+
+class TestBenchmarkImportTime(django.test.TestCase):
+  def test_100_parse_importtime(self):
+    benchmark_import_time = pasta_gmn_adapter.app.management.commands.benchmark_import_time
+    module_dict = benchmark_import_time.parse_importtime(
+      'import time: self [us] | cumulative | imported package\n'
+      'import time:       474 |       8882 |   d1_common.types.dataoneTypes_v2_0\n'
+      'import time:      2000 |      10882 | d1_common.types.dataoneTypes\n'
+      'Other output\n'
+    )
+    self.assertEqual(
+      module_dict, {
+        'd1_common.types.dataoneTypes_v2_0': 0.000474,
+        'd1_common.types.dataoneTypes': 0.002,
+      }
+    )
+    self.assertEqual(
+      benchmark_import_time.find_heavy_modules(module_dict),
+      ['d1_common.types.dataoneTypes']
+    )
+
+
+class TestMetrics(django.test.TestCase):
+  def test_100_render_histogram(self):
+    registry = pasta_gmn_adapter.app.metrics.MetricRegistry()
+    for value in (0.5, 2.0, 2.0):
+      registry.observe(
+        'pasta_gmn_adapter_view_request_seconds', value, {'view': 'admin'},
+        buckets=(1, 5)
+      )
+    self.assertEqual(
+      pasta_gmn_adapter.app.metrics.render(registry.get_samples()),
+      '# HELP pasta_gmn_adapter_view_request_seconds Latency of requests to the '
+      'adapter, by view. Per process.\n'
+      '# TYPE pasta_gmn_adapter_view_request_seconds histogram\n'
+      'pasta_gmn_adapter_view_request_seconds_bucket{view="admin",le="1"} 1\n'
+      'pasta_gmn_adapter_view_request_seconds_bucket{view="admin",le="5"} 3\n'
+      'pasta_gmn_adapter_view_request_seconds_bucket{view="admin",le="+Inf"} 3\n'
+      'pasta_gmn_adapter_view_request_seconds_sum{view="admin"} 4.5\n'
+      'pasta_gmn_adapter_view_request_seconds_count{view="admin"} 3\n'
+    )
+
+  def test_200_merge_samples(self):
+    """Series recorded by both the queue processor and the web process are
+    exposed once"""
+    registry = pasta_gmn_adapter.app.metrics.MetricRegistry()
+    registry.inc('pasta_gmn_adapter_upstream_request_errors_total', {'a': 1})
+    registry.inc('pasta_gmn_adapter_upstream_request_errors_total', {'a': 2})
+    stored_sample_list = [
+      ('pasta_gmn_adapter_last_run_timestamp_seconds', '', 1500000000.0),
+      ('pasta_gmn_adapter_upstream_request_errors_total', '{a="1"}', 4),
+    ]
+    self.assertEqual(
+      pasta_gmn_adapter.app.metrics.merge_samples(
+        stored_sample_list + registry.get_samples()
+      ), [
+        ('pasta_gmn_adapter_last_run_timestamp_seconds', '', 1500000000.0),
+        ('pasta_gmn_adapter_upstream_request_errors_total', '{a="1"}', 5),
+        ('pasta_gmn_adapter_upstream_request_errors_total', '{a="2"}', 1),
+      ]
+    )
+
+
+class TestDeadline(django.test.TestCase):
+  def setUp(self):
+    self.deadline = pasta_gmn_adapter.app.deadline.PackageDeadline()
+
+  def test_100_no_budget(self):
+    self.assertEqual(self.deadline.get_timeout(180), 180)
+    self.assertIsNone(self.deadline.get_timeout(None))
+
+  def test_110_timeout_capped_to_remaining(self):
+    self.deadline.start(10)
+    self.assertLessEqual(self.deadline.get_timeout(180), 10)
+    self.assertEqual(self.deadline.get_timeout(5), 5)
+    connect_timeout, read_timeout = self.deadline.get_timeout((5, None))
+    self.assertEqual(connect_timeout, 5)
+    self.assertLessEqual(read_timeout, 10)
+
+  def test_120_budget_spent(self):
+    self.deadline.start(-1)
+    self.assertRaises(
+      pasta_gmn_adapter.app.deadline.DeadlineExceeded, self.deadline.get_timeout,
+      180
+    )
+
+  def test_130_watchdog(self):
+    with self.assertRaises(pasta_gmn_adapter.app.deadline.DeadlineExceeded):
+      with pasta_gmn_adapter.app.deadline.package_budget(0.1, 0.1):
+        time.sleep(5)
+    self.assertFalse(pasta_gmn_adapter.app.deadline.deadline.is_active())
+
+  def test_140_cancel_watchdog(self):
+    with pasta_gmn_adapter.app.deadline.package_budget(0.1, 0.1):
+      pasta_gmn_adapter.app.deadline.cancel_watchdog()
+      time.sleep(0.5)
+    self.assertFalse(pasta_gmn_adapter.app.deadline.deadline.is_active())
+
+
+class TestReconcileGMN(django.test.TestCase):
+  def test_100_create_pid_regex(self):
+    reconcile_gmn = pasta_gmn_adapter.app.management.commands.reconcile_gmn
+    pid_rx = reconcile_gmn.create_pid_regex('https://pasta.lternet.edu/package/')
+    self.assertEqual(
+      pid_rx.match(
+        'https://pasta.lternet.edu/package/data/eml/knb-lter-nin/6/1/abc'
+      ).groups(), ('data', 'knb-lter-nin', '6', '1')
+    )
+    self.assertEqual(
+      pid_rx.match(
+        'https://pasta.lternet.edu/package/metadata/eml/knb-lter-nin/6/1'
+      ).groups(), ('metadata', 'knb-lter-nin', '6', '1')
+    )
+    self.assertIsNone(pid_rx.match('doi:10.6073/pasta/0123'))
+    self.assertEqual(
+      reconcile_gmn.format_checksum('sha-1', 'ABC\n'), 'SHA-1:abc'
+    )
+
+
+TEST_EML_ACCESS_ALL_DENY_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<access:access xmlns:access="eml://ecoinformatics.org/access-2.1.0" authSystem="https://pasta.lternet.edu/authentication" order="denyFirst" system="https://pasta.lternet.edu">
+  <deny>
+    <principal>uid=someone,o=LTER,dc=ecoinformatics,dc=org</principal>
+    <permission>write</permission>
+  </deny>
+  <allow>
+    <principal>uid=dcosta,o=LTER,dc=ecoinformatics,dc=org</principal>
+    <principal>uid=PIE,o=lter,dc=ecoinformatics,dc=org</principal>
+    <permission>all</permission>
+  </allow>
+  <allow>
+    <principal>public</principal>
+    <permission>read</permission>
+    <permission>write</permission>
+  </allow>
+</access:access>
+"""
+
+
+class TestEMLAccess(django.test.TestCase):
+  def test_100_fast_parser_matches_pyxb(self):
+    for eml_access_xml in (TEST_EML_ACCESS_XML, TEST_EML_ACCESS_ALL_DENY_XML):
+      fast = pasta_gmn_adapter.api_types.eml_access.EMLAccess(eml_access_xml)
+      pyxb_access = pasta_gmn_adapter.api_types.eml_access.EMLAccess(
+        eml_access_xml, use_pyxb=True
+      )
+      self.assertEqual(fast._allow_list, pyxb_access._allow_list)
+      self.assertEqual(fast._deny_list, pyxb_access._deny_list)
+      self.assertEqual(
+        fast.get_as_dataone_rules().toxml('utf-8'),
+        pyxb_access.get_as_dataone_rules().toxml('utf-8')
+      )
+
+  def test_110_deny_rules(self):
+    e = pasta_gmn_adapter.api_types.eml_access.EMLAccess(
+      TEST_EML_ACCESS_ALL_DENY_XML
+    )
+    self.assertRaises(
+      pasta_gmn_adapter.api_types.eml_access.EMLAccessException,
+      e._raise_if_access_rules_not_supported_by_dataone
+    )
+
+  def test_120_invalid_document(self):
+    self.assertRaises(
+      pasta_gmn_adapter.api_types.eml_access.EMLAccessException,
+      pasta_gmn_adapter.api_types.eml_access.EMLAccess, '<notAccess/>'
+    )
+
+  def test_200_benchmark_command(self):
+    django.core.management.call_command('benchmark_eml_access', count=2)
+
+
+class NoMapperSysMetaCreator(
+    pasta_gmn_adapter.app.population_queue_processor.SysMetaCreator
+):
+  """SysMetaCreator that does not get the format IDs from the CN. The tests
+  pass the format ID."""
+
+  def _create_media_type_mapper(self):
+    return None
+
+
+class TestSysMetaTemplate(django.test.TestCase):
+  def setUp(self):
+    self.sys_meta_creator = NoMapperSysMetaCreator()
+    self.saved_sysmeta_from_template = (
+      pasta_gmn_adapter.settings.SYSMETA_FROM_TEMPLATE
+    )
+    replication_policy_el = xml.etree.ElementTree.fromstring(
+      TEST_EML_XML.encode('utf-8')
+    ).find('.//{http://ns.dataone.org/service/types/v1}replicationPolicy')
+    self.d1_replication_policy = xml.etree.ElementTree.tostring(
+      replication_policy_el
+    )
+
+  def tearDown(self):
+    pasta_gmn_adapter.settings.SYSMETA_FROM_TEMPLATE = (
+      self.saved_sysmeta_from_template
+    )
+
+  def _create(self, is_from_template, **kwargs):
+    pasta_gmn_adapter.settings.SYSMETA_FROM_TEMPLATE = is_from_template
+    sys_meta_kwargs = {
+      'pid': 'https://pasta.lternet.edu/package/data/eml/knb-lter-nin/6/1/'
+      '0123456789abcdef0123456789abcdef',
+      'size': '102400',
+      'content_type': 'text/csv',
+      'sha1_checksum': '0123456789abcdef0123456789abcdef01234567',
+      'eml_access_rules': api_types.eml_access.EMLAccess(TEST_EML_ACCESS_XML),
+      'format_id': 'text/csv',
+    }
+    sys_meta_kwargs.update(kwargs)
+    return self.sys_meta_creator.create_sys_meta_for_resource(**sys_meta_kwargs)
+
+  def _canonicalize(self, sys_meta):
+    return xml.etree.ElementTree.canonicalize(
+      sys_meta.toxml('utf-8').decode('utf-8'), rewrite_prefixes=True
+    )
+
+  def test_100(self):
+    """System Metadata from the template is the same as from the pyxb bindings
+    after canonicalization"""
+    kwargs_list = [
+      {},
+      {'size': 0},
+      {'d1_replication_policy': self.d1_replication_policy},
+      {
+        'd1_replication_policy':
+          b'<d1v1:replicationPolicy '
+          b'xmlns:d1v1="http://ns.dataone.org/service/types/v1" '
+          b'replicationAllowed="true" numberReplicas="2">'
+          b'<preferredMemberNode>urn:node:A</preferredMemberNode>'
+          b'<blockedMemberNode>urn:node:B</blockedMemberNode>'
+          b'</d1v1:replicationPolicy>'
+      },
+      {'obsoletes': 'https://pasta.lternet.edu/package/eml/knb-lter-nin/6/0'},
+      {
+        'eml_access_rules':
+          api_types.eml_access.EMLAccess(
+            TEST_EML_ACCESS_XML.replace('changePermission', 'all')
+          )
+      },
+      {
+        'pid': 'doi:10.6073/pasta/<&>',
+        'format_id': 'eml://ecoinformatics.org/eml-2.1.1'
+      },
+    ]
+    for kwargs in kwargs_list:
+      self.assertEqual(
+        self._canonicalize(self._create(True, **kwargs)),
+        self._canonicalize(self._create(False, **kwargs)),
+      )
+
+
+class TestResourceMap(django.test.TestCase):
+  def setUp(self):
+    self.timestamp = datetime.datetime(
+      2017, 5, 14, 12, 0, 0, 123, tzinfo=datetime.timezone.utc
+    )
+    self.sciobj_pid_list = [
+      'https://pasta.lternet.edu/package/report/eml/knb-lter-nes/1/1',
+      'https://pasta.lternet.edu/package/data/eml/knb-lter-nes/1/1/a&b',
+    ]
+
+  def _generate(self, sciobj_pid_list):
+    return pasta_gmn_adapter.app.resource_map.generate_resource_map(
+      'doi:10.6073/pasta/abc',
+      'https://pasta.lternet.edu/package/metadata/eml/knb-lter-nes/1/1',
+      sciobj_pid_list, self.timestamp
+    )
+
+  def test_100_deterministic(self):
+    self.assertEqual(
+      self._generate(self.sciobj_pid_list), self._generate(self.sciobj_pid_list)
+    )
+
+  def test_110_timestamp(self):
+    self.assertIn(b'2017-05-14T12:00:00Z', self._generate(self.sciobj_pid_list))
+
+  def test_120_parse(self):
+    resource_map = d1_common.resource_map.ResourceMap()
+    resource_map.parseDoc(self._generate(self.sciobj_pid_list))
+    self.assertEqual(
+      sorted(resource_map.getAggregatedPids()),
+      sorted(
+        self.sciobj_pid_list +
+        ['https://pasta.lternet.edu/package/metadata/eml/knb-lter-nes/1/1']
+      )
+    )
+
+  def test_130_large_package(self):
+    sciobj_pid_list = [
+      'https://pasta.lternet.edu/package/data/eml/knb-lter-nes/1/1/{}'.format(i)
+      for i in range(1000)
+    ]
+    resource_map = d1_common.resource_map.ResourceMap()
+    resource_map.parseDoc(self._generate(sciobj_pid_list))
+    self.assertEqual(
+      len(resource_map.getAggregatedPids()), len(sciobj_pid_list) + 1
+    )
+
+  def test_140_legacy_resource_map(self):
+    """Resource Maps created with Foresite are told apart from our own"""
+    resource_map = pasta_gmn_adapter.app.resource_map
+    self.assertTrue(
+      resource_map.is_written_by_adapter(self._generate(self.sciobj_pid_list))
+    )
+    legacy_resource_map = d1_common.resource_map.createSimpleResourceMap(
+      'doi:10.6073/pasta/abc',
+      'https://pasta.lternet.edu/package/metadata/eml/knb-lter-nes/1/1',
+      self.sciobj_pid_list
+    ).serialize()
+    self.assertFalse(resource_map.is_written_by_adapter(legacy_resource_map))
+
+
+class TestScheduler(django.test.TestCase):
+  def setUp(self):
+    self.now = datetime.datetime(2017, 5, 14, 12, 0, 0)
+    self.item_list = [
+      {
+        'package_scope': 'knb-lter-big',
+        'package_identifier': i,
+        'package_revision': r,
+        'timestamp': self.now - datetime.timedelta(hours=2, seconds=i),
+        'entity_count': 100,
+      } for i in range(1, 5) for r in (2, 1)
+    ] + [
+      {
+        'package_scope': 'knb-lter-small',
+        'package_identifier': 1,
+        'package_revision': 1,
+        'timestamp': self.now - datetime.timedelta(minutes=90),
+        'entity_count': 2,
+      },
+      {
+        'package_scope': 'knb-lter-and',
+        'package_identifier': 1,
+        'package_revision': 1,
+        'timestamp': self.now - datetime.timedelta(minutes=1),
+        'entity_count': None,
+      },
+    ]
+
+  def _order(self, policy):
+    return [
+      (i['package_scope'], i['package_identifier'], i['package_revision'])
+      for i in pasta_gmn_adapter.app.scheduler.order_queue_items(
+        self.item_list, policy, self.now
+      )
+    ]
+
+  def _assert_revisions_in_order(self, ordered_list):
+    revision_dict = {}
+    for scope, identifier, revision in ordered_list:
+      revision_dict.setdefault((scope, identifier), []).append(revision)
+    for revision_list in revision_dict.values():
+      self.assertEqual(revision_list, sorted(revision_list))
+
+  def test_100_package_id(self):
+    ordered_list = self._order('package_id')
+    self.assertEqual(ordered_list[-1], ('knb-lter-small', 1, 1))
+    self._assert_revisions_in_order(ordered_list)
+
+  def test_110_fair_share(self):
+    ordered_list = self._order('fair_share')
+    self.assertEqual(ordered_list[1], ('knb-lter-small', 1, 1))
+    self._assert_revisions_in_order(ordered_list)
+
+  def test_120_smallest_first(self):
+    ordered_list = self._order('smallest_first')
+    self.assertEqual(ordered_list[0], ('knb-lter-small', 1, 1))
+    # A package with an unknown entity count goes after all the known ones.
+    self.assertEqual(ordered_list[-1], ('knb-lter-and', 1, 1))
+    self._assert_revisions_in_order(ordered_list)
+
+  def test_130_invalid_policy(self):
+    self.assertRaises(ValueError, self._order, 'invalid')
+
+
+class TestPrefetch(django.test.TestCase):
+  def test_100_package_info_round_trip(self):
+    def object_meta(resource_id):
+      return {
+        'resource_id': resource_id,
+        'header': {'Content-Type': 'text/csv', 'Content-Length': '10'},
+        'permissions': api_types.eml_access.EMLAccess(TEST_EML_ACCESS_XML),
+        'checksum': '0123456789abcdef0123456789abcdef01234567',
+        'd1_replication_policy': b'<replicationPolicy/>',
+      }
+
+    package_info = {
+      'package': {
+        'doi': 'doi:10.6073/pasta/0123',
+        'permissions': api_types.eml_access.EMLAccess(TEST_EML_ACCESS_XML),
+        'd1_replication_policy': None,
+        'timestamp': datetime.datetime(2017, 5, 11, 13, 42, 50, 418000),
+      },
+      'entities': [object_meta('https://pasta/data/1')],
+      'report': object_meta('https://pasta/report'),
+      'metadata': object_meta('https://pasta/metadata'),
+    }
+    prefetch = pasta_gmn_adapter.app.prefetch
+    package_info_copy = prefetch.deserialize_package_info(
+      prefetch.serialize_package_info(package_info)
+    )
+    self.assertEqual(package_info_copy['package']['doi'], 'doi:10.6073/pasta/0123')
+    self.assertEqual(
+      package_info_copy['package']['timestamp'],
+      package_info['package']['timestamp']
+    )
+    entity = package_info_copy['entities'][0]
+    self.assertEqual(entity['header']['content-type'], 'text/csv')
+    self.assertEqual(entity['d1_replication_policy'], b'<replicationPolicy/>')
+    self.assertEqual(
+      entity['permissions'].get_as_dataone_rules().toxml('utf-8'),
+      package_info['entities'][0]['permissions'].get_as_dataone_rules().toxml('utf-8')
+    )
+
+
+TEST_EML_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1" xmlns:d1v1="http://ns.dataone.org/service/types/v1">
+  <additionalMetadata>
+    <metadata>
+      <d1v1:replicationPolicy replicationAllowed="false"/>
+    </metadata>
+  </additionalMetadata>
+</eml:eml>
+"""
+
+
+TEST_RESOURCE_METADATA_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<resourceMetadata>
+  <dateCreated>2017-05-11 13:42:50.418</dateCreated>
+  <doi>doi:10.6073/pasta/0123</doi>
+  <packageId>edi.1.2</packageId>
+  <principalOwner>uid=EDI,o=EDI,dc=edirepository,dc=org</principalOwner>
+  <resourceType>dataPackage</resourceType>
+</resourceMetadata>
+"""
+
+
+class PastaStubHandler(http.server.BaseHTTPRequestHandler):
+  """Serve fixed responses for the parts of the PASTA API used by the clients.
+  Responses to paths starting with /package/slow/ are delayed."""
+  protocol_version = 'HTTP/1.1'
+  header_list = []
+
+  def do_GET(self):
+    PastaStubHandler.header_list.append((self.path, dict(self.headers)))
+    path = urllib.parse.urlsplit(self.path).path
+    if path.startswith('/package/slow/'):
+      time.sleep(0.5)
+    if path == '/package/eml/edi/1':
+      # Chunked, to check that both clients read it.
+      self._send_chunked('2\n1\n')
+      return
+    response_dict = {
+      '/package/eml': ('edi\nknb-lter-nin\n', 'text/plain'),
+      '/package/eml/edi': ('2\n10\n1\n', 'text/plain'),
+      '/package/eml/deleted': ('edi.3.1\n', 'text/plain'),
+      '/package/data/eml/edi/1/2': ('e2\ne1\n', 'text/plain'),
+      '/package/data/eml/edi/1/2/e1': ('data.csv', 'text/plain'),
+      '/package/doi/eml/edi/1/2': ('doi:10.6073/pasta/0123\n', 'text/plain'),
+      '/package/rmd/eml/edi/1/2': (
+        TEST_RESOURCE_METADATA_XML, 'application/xml'
+      ),
+      '/package/authz': ('authorized', 'text/plain'),
+      '/package/acl/eml/edi/1/2': (TEST_EML_ACCESS_XML, 'application/xml'),
+      '/package/data/checksum/eml/edi/1/2/e1': ('abc123\n', 'text/plain'),
+      '/package/metadata/format/eml/edi/1/2': (
+        'eml://ecoinformatics.org/eml-2.1.1\n', 'text/plain'
+      ),
+      '/package/metadata/eml/edi/1/2': (TEST_EML_XML, 'application/xml'),
+      '/package/slow/eml': ('edi\n', 'text/plain'),
+    }
+    if path in response_dict:
+      self._send(200, *response_dict[path])
+    else:
+      self._send(404, 'Not found: {}'.format(path), 'text/plain')
+
+  def do_HEAD(self):
+    PastaStubHandler.header_list.append((self.path, dict(self.headers)))
+    if self.path == '/package/data/eml/edi/1/2/e1':
+      self.send_response(307)
+      self.send_header(
+        'Location', 'http://{}:{}/temporary/e1'.format(*self.server.server_address)
+      )
+    elif self.path in ('/temporary/e1', '/package/metadata/eml/edi/1/2'):
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/csv')
+    else:
+      self.send_response(404)
+    self.send_header('Content-Length', '1234')
+    self.send_header('Connection', 'close')
+    self.end_headers()
+
+  def _send(self, status, body, content_type):
+    body = body.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Connection', 'close')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _send_chunked(self, body):
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.send_header('Connection', 'close')
+    self.end_headers()
+    for chunk in (body[:1], body[1:]):
+      chunk = chunk.encode('utf-8')
+      self.wfile.write('{:x}\r\n'.format(len(chunk)).encode('ascii'))
+      self.wfile.write(chunk + b'\r\n')
+    self.wfile.write(b'0\r\n\r\n')
+
+  def log_message(self, *args):
+    pass
+
+
+class PastaStubServer(http.server.ThreadingHTTPServer):
+  request_queue_size = 1024
+  daemon_threads = True
+
+
+class PastaClientTests(object):
+  """Tests shared by the synchronous and asynchronous PASTA clients. Subclasses
+  implement call(), which calls a method of the client and returns the
+  result."""
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    cls.server = PastaStubServer(('127.0.0.1', 0), PastaStubHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.base_url = 'http://{}:{}/package'.format(*cls.server.server_address)
+    cls.package_id = (
+      pasta_gmn_adapter.app.population_queue_processor.PackageID('edi', 1, 2)
+    )
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+    super().tearDownClass()
+
+  def setUp(self):
+    PastaStubHandler.header_list = []
+
+  def call(self, method_name, *args):
+    raise NotImplementedError
+
+  def test_100_list(self):
+    self.assertEqual(
+      self.call('list_data_package_scopes'), ['edi', 'knb-lter-nin']
+    )
+    self.assertEqual(self.call('list_data_package_identifiers', 'edi'), [1, 2, 10])
+    self.assertEqual(self.call('list_data_package_revisions', 'edi', 1), [1, 2])
+    self.assertEqual(self.call('list_deleted_packages'), ['edi.3.1'])
+    self.assertEqual(
+      self.call('list_data_entities', self.package_id), ['e1', 'e2']
+    )
+
+  def test_110_read(self):
+    self.assertEqual(
+      self.call('read_data_package_doi', self.package_id),
+      'doi:10.6073/pasta/0123'
+    )
+    self.assertEqual(
+      self.call('read_data_package_created', self.package_id),
+      datetime.datetime(2017, 5, 11, 13, 42, 50, 418000)
+    )
+    self.assertEqual(
+      self.call('read_data_entity_checksum', self.package_id, 'e1'), 'abc123'
+    )
+    self.assertEqual(
+      self.call('read_data_entity_name', self.package_id, 'e1'), 'data.csv'
+    )
+    self.assertEqual(
+      self.call('read_metadata_format_id', self.package_id),
+      'eml://ecoinformatics.org/eml-2.1.1'
+    )
+    self.assertEqual(
+      self.call('is_authorized', self.package_id, 'e1'), 'authorized'
+    )
+    self.assertIsInstance(
+      self.call('read_data_package_acl', self.package_id),
+      pasta_gmn_adapter.api_types.eml_access.EMLAccess
+    )
+    self.assertIn(
+      b'replicationPolicy',
+      self.call('read_metadata_replication_policy', self.package_id)
+    )
+
+  def test_120_entry_header_redirect(self):
+    """The temporary URL is requested without the PASTA credentials."""
+    header = self.call(
+      'get_data_entry_header', '{}/data/eml/edi/1/2/e1'.format(self.base_url)
+    )
+    self.assertEqual(header['content-type'], 'text/csv')
+    self.assertEqual(header['content-length'], '1234')
+    header_dict = dict(PastaStubHandler.header_list)
+    self.assertIn('Authorization', header_dict['/package/data/eml/edi/1/2/e1'])
+    self.assertNotIn('Authorization', header_dict['/temporary/e1'])
+
+  def test_130_error_response(self):
+    with self.assertRaises(
+        pasta_gmn_adapter.app.data_package_manager_client.
+        DataPackageManagerException
+    ) as cm:
+      self.call(
+        'read_data_package_doi',
+        pasta_gmn_adapter.app.population_queue_processor.PackageID('edi', 9, 1)
+      )
+    self.assertEqual(cm.exception.status, 404)
+    self.assertIn('/package/doi/eml/edi/9/1', cm.exception.body)
+
+
+class TestDataPackageManagerClient(PastaClientTests, django.test.TestCase):
+  def call(self, method_name, *args):
+    client = (
+      pasta_gmn_adapter.app.data_package_manager_client.
+      DataPackageManagerClient(base_url=self.base_url)
+    )
+    return getattr(client, method_name)(*args)
+
+  def test_200_redirect_budget(self):
+    """The temporary URL is not requested once the package budget is spent"""
+    client = (
+      pasta_gmn_adapter.app.data_package_manager_client.
+      DataPackageManagerClient(base_url=self.base_url)
+    )
+    deadline = pasta_gmn_adapter.app.deadline.deadline
+    deadline.start(0)
+    try:
+      with self.assertRaises(pasta_gmn_adapter.app.deadline.DeadlineExceeded):
+        client._get_data_redirect_header(
+          'http://{}:{}/temporary/e1'.format(*self.server.server_address)
+        )
+    finally:
+      deadline.clear()
+    self.assertEqual(PastaStubHandler.header_list, [])
+
+
+class TestAsyncDataPackageManagerClient(PastaClientTests, django.test.TestCase):
+  def call(self, method_name, *args):
+    client = (
+      pasta_gmn_adapter.app.async_data_package_manager_client.
+      AsyncDataPackageManagerClient(base_url=self.base_url)
+    )
+    return asyncio.run(getattr(client, method_name)(*args))
+
+  def test_200_many_requests_in_flight(self):
+    """Each request takes 0.5 sec, so they must overlap to complete in time."""
+    client = (
+      pasta_gmn_adapter.app.async_data_package_manager_client.
+      AsyncDataPackageManagerClient(
+        base_url=self.base_url, max_concurrency=300
+      )
+    )
+
+    async def list_all():
+      return await asyncio.gather(
+        *[client.GET(['slow', 'eml']) for _ in range(300)]
+      )
+
+    start_sec = time.time()
+    response_list = asyncio.run(list_all())
+    self.assertTrue(all(r.status_code == 200 for r in response_list))
+    self.assertLess(time.time() - start_sec, 10)
 
-#
-#
-# class TestDataPackageManagerClient(django.test.TestCase):
-#   @classmethod
-#   def setUpClass(cls):
-#     cls.c = pasta_gmn_adapter.app.data_package_manager_client.DataPackageManagerClient()
-#
-#   @classmethod
-#   def tearDownClass(cls):
-#     pass
-#
-#   def test_100_initialize(self):
-#     pass
 #
 #
 # class TestDataEMLAccess(django.test.TestCase):
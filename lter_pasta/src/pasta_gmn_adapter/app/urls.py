@@ -30,6 +30,10 @@ urlpatterns = [
     r'^pasta/new_package/?$',
     pasta_gmn_adapter.app.views.pasta.add_package_to_queue
   ),
+  urls.url(
+    r'^pasta/new_packages/?$',
+    pasta_gmn_adapter.app.views.pasta.add_packages_to_queue
+  ),
   # Admin
   urls.url(r'^admin/$', pasta_gmn_adapter.app.views.admin.admin),
   # Statistics.
@@ -40,6 +44,8 @@ urlpatterns = [
     r'^admin/statistics\.xsl$',
     pasta_gmn_adapter.app.views.admin.get_statistics_xsl
   ),
+  # Metrics.
+  urls.url(r'^admin/metrics/?$', pasta_gmn_adapter.app.views.admin.get_metrics),
   # Population Queue.
   urls.url(
     r'^admin/population_queue/?$',
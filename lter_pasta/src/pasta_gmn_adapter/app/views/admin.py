@@ -19,11 +19,18 @@
   Administrator functionality.
 :Author: Roger Dahl
 """
+import hashlib
+import time
+
 import d1_common.const
 
+import django.core.cache
+import django.http
 import django.shortcuts
+import django.template.loader
 
 import pasta_gmn_adapter
+import pasta_gmn_adapter.app.metrics
 import pasta_gmn_adapter.app.restrict_to_verb
 import pasta_gmn_adapter.app.sql
 
@@ -46,13 +53,34 @@ def admin(request):
 # Statistics
 
 
+STATISTICS_CACHE_KEY = 'statistics_xml'
+
+
 @pasta_gmn_adapter.app.restrict_to_verb.get
-def get_statistics(_request):
-  p = pasta_gmn_adapter.app.sql.select_statistics()
-  return django.shortcuts.render_to_response(
-    'statistics.xml', {'statistics': p},
-    content_type=d1_common.const.CONTENT_TYPE_XML
+def get_statistics(request):
+  """The statistics are polled frequently by monitoring, so the rendered
+  document is cached for a few seconds and tagged with an ETag."""
+  statistics_xml = django.core.cache.cache.get(STATISTICS_CACHE_KEY)
+  if statistics_xml is None:
+    p = pasta_gmn_adapter.app.sql.select_statistics()
+    statistics_xml = django.template.loader.render_to_string(
+      'statistics.xml', {'statistics': p}
+    )
+    django.core.cache.cache.set(
+      STATISTICS_CACHE_KEY, statistics_xml,
+      pasta_gmn_adapter.settings.STATISTICS_CACHE_TIMEOUT
+    )
+  etag = '"{}"'.format(
+    hashlib.md5(statistics_xml.encode('utf-8')).hexdigest()
   )
+  if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+    response = django.http.HttpResponseNotModified()
+  else:
+    response = django.http.HttpResponse(
+      statistics_xml, content_type=d1_common.const.CONTENT_TYPE_XML
+    )
+  response['ETag'] = etag
+  return response
 
 
 @pasta_gmn_adapter.app.restrict_to_verb.get
@@ -62,6 +90,45 @@ def get_statistics_xsl(_request):
   )
 
 
+# Metrics
+
+
+@pasta_gmn_adapter.app.restrict_to_verb.get
+def get_metrics(_request):
+  """Metrics in the Prometheus text exposition format. Read from small tables
+  and counters only, so it is cheap to scrape."""
+  sample_list = [(
+    'pasta_gmn_adapter_queue_items',
+    pasta_gmn_adapter.app.metrics.format_labels({'status': s['status']}),
+    s['count']
+  ) for s in pasta_gmn_adapter.app.sql.select_statistics()]
+  sample_list.append((
+    'pasta_gmn_adapter_enqueued_items_total', '',
+    pasta_gmn_adapter.app.sql.select_enqueued_item_count()
+  ))
+  sample_list.append((
+    'pasta_gmn_adapter_intake_items', '',
+    pasta_gmn_adapter.app.sql.select_package_intake_count()
+  ))
+  for name, labels, value in pasta_gmn_adapter.app.sql.select_metrics():
+    # The processor stores the time of the oldest item, not its age, so that the
+    # age keeps increasing between runs.
+    if name == 'pasta_gmn_adapter_oldest_unprocessed_item_timestamp_seconds':
+      sample_list.append((
+        'pasta_gmn_adapter_oldest_unprocessed_item_age_seconds', labels,
+        max(time.time() - value, 0.0) if value else 0.0
+      ))
+    else:
+      sample_list.append((name, labels, value))
+  sample_list.extend(pasta_gmn_adapter.app.metrics.registry.get_samples())
+  return django.http.HttpResponse(
+    pasta_gmn_adapter.app.metrics.render(
+      pasta_gmn_adapter.app.metrics.merge_samples(sample_list)
+    ),
+    content_type='text/plain; version=0.0.4; charset=utf-8'
+  )
+
+
 # Population Queue
 
 
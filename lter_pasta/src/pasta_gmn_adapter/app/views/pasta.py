@@ -19,7 +19,6 @@
 :Author: Roger Dahl
 """
 import http.client
-import re
 
 import d1_common.const
 import d1_common.date_time
@@ -27,8 +26,11 @@ import d1_common.date_time
 import django.http
 
 import pasta_gmn_adapter.api_types.adapter_error
+import pasta_gmn_adapter.app.enqueue
+import pasta_gmn_adapter.app.prefetch
 import pasta_gmn_adapter.app.restrict_to_verb
 import pasta_gmn_adapter.app.sql
+import pasta_gmn_adapter.settings
 from pasta_gmn_adapter import api_types
 
 # ------------------------------------------------------------------------------
@@ -49,33 +51,66 @@ def _http_response_with_boolean_true_type():
 @pasta_gmn_adapter.app.restrict_to_verb.post
 def add_package_to_queue(request):
   """^adapter/new_package/?$
+
+  With FAST_ACCEPT_NEW_PACKAGES, the package ID is only added to the intake and
+  202 Accepted is returned. The package ID is validated when it is moved to the
+  queue by drain_package_intake.
   """
+  if pasta_gmn_adapter.settings.FAST_ACCEPT_NEW_PACKAGES:
+    pasta_gmn_adapter.app.sql.insert_package_intake(
+      request.body.decode('utf-8').strip()
+    )
+    return django.http.HttpResponse(
+      'Accepted', d1_common.const.CONTENT_TYPE_TEXT,
+      status=http.HTTPStatus.ACCEPTED
+    )
   scope, identifier, revision = _parse_package_id(request.body.decode('utf-8'))
-  _raise_if_current_revision_exists(scope, identifier, revision)
-  _raise_if_later_revision_exists(scope, identifier, revision)
-  pasta_gmn_adapter.app.sql.insert_population_queue_item(
+  latest_revision = pasta_gmn_adapter.app.sql.select_latest_package_revision(
+    scope, identifier
+  )
+  _raise_if_current_revision_exists(
+    scope, identifier, revision, latest_revision
+  )
+  _raise_if_later_revision_exists(scope, identifier, revision, latest_revision)
+  queue_id = pasta_gmn_adapter.app.sql.insert_population_queue_item(
     scope, identifier, revision
   )
+  pasta_gmn_adapter.app.prefetch.prefetch_package_info_on_commit(
+    queue_id, scope, identifier, revision
+  )
   return _http_response_with_boolean_true_type()
 
 
+@pasta_gmn_adapter.app.restrict_to_verb.post
+def add_packages_to_queue(request):
+  """^pasta/new_packages/?$
+
+  Add many packages to the queue. The body holds one package ID per line. The
+  response holds one tab separated line per package ID, with the package ID,
+  "accepted" or "rejected" and, for rejected packages, the reason.
+  """
+  result_list = pasta_gmn_adapter.app.enqueue.enqueue_package_ids(
+    request.body.decode('utf-8').splitlines()
+  )
+  return django.http.HttpResponse(
+    pasta_gmn_adapter.app.enqueue.format_result_list(result_list),
+    d1_common.const.CONTENT_TYPE_TEXT
+  )
+
+
 def _parse_package_id(package_id):
-  m = re.match(r'(.*)\.(\d+)\.(\d+)\s*$', package_id)
-  if not m:
+  package_tup = pasta_gmn_adapter.app.enqueue.parse_package_id(package_id)
+  if package_tup is None:
     raise pasta_gmn_adapter.api_types.adapter_error.AdapterError(
       description='Invalid package ID: {0}'.format(package_id),
       http_status_code=http.HTTPStatus.BAD_REQUEST
     )
-  scope = m.group(1)
-  identifier = int(m.group(2))
-  revision = int(m.group(3))
-  return scope, identifier, revision
+  return package_tup
 
 
-def _raise_if_current_revision_exists(scope, identifier, revision):
-  latest_revision = pasta_gmn_adapter.app.sql.select_latest_package_revision(
-    scope, identifier
-  )
+def _raise_if_current_revision_exists(
+    scope, identifier, revision, latest_revision
+):
   if latest_revision is not None and latest_revision == revision:
     raise pasta_gmn_adapter.api_types.adapter_error.AdapterError(
       description='Invalid package: {0}.{1}.{2}. Package already exists'
@@ -84,10 +119,9 @@ def _raise_if_current_revision_exists(scope, identifier, revision):
     )
 
 
-def _raise_if_later_revision_exists(scope, identifier, revision):
-  latest_revision = pasta_gmn_adapter.app.sql.select_latest_package_revision(
-    scope, identifier
-  )
+def _raise_if_later_revision_exists(
+    scope, identifier, revision, latest_revision
+):
   if latest_revision is not None and latest_revision > revision:
     raise pasta_gmn_adapter.api_types.adapter_error.AdapterError(
       description='Invalid package: {0}.{1}.{2}. Later revision {3} already exists'
@@ -10,12 +10,150 @@ SET default_with_oids = false;
 
 -- Drop everything first, in case we're modifying an existing db.
 
+drop table if exists adapter_deleted_package cascade;
+drop table if exists adapter_entity_header cascade;
+drop table if exists adapter_metric cascade;
+drop table if exists adapter_object_job cascade;
+drop table if exists adapter_object_job_dependency cascade;
+drop table if exists adapter_package_info_prefetch cascade;
+drop table if exists adapter_package_intake cascade;
 drop table if exists adapter_population_queue cascade;
 drop table if exists adapter_population_queue_package_scope cascade;
 drop table if exists adapter_process_status cascade;
+drop table if exists adapter_process_status_count cascade;
 drop table if exists adapter_process_status_return_body cascade;
 drop table if exists adapter_process_status_status cascade;
 
+-- adapter_deleted_package
+
+-- Packages deleted in PASTA for which all revisions have been archived on GMN.
+
+CREATE TABLE adapter_deleted_package (
+    package_scope_id integer NOT NULL,
+    package_identifier bigint NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL
+);
+
+-- ALTER TABLE public.adapter_deleted_package OWNER TO pasta_gmn_adapter;
+
+
+-- adapter_entity_header
+
+-- Size and content type of the data entities collected from PASTA, by entity ID
+-- and checksum, reused for later revisions of the package.
+
+CREATE TABLE adapter_entity_header (
+    entity_id character varying(1024) NOT NULL,
+    checksum character varying(1024) NOT NULL,
+    content_length bigint NOT NULL,
+    content_type character varying(1024) NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL
+);
+
+-- ALTER TABLE public.adapter_entity_header OWNER TO pasta_gmn_adapter;
+
+
+-- adapter_metric
+
+-- Metrics recorded by the queue processor, served by /admin/metrics.
+
+CREATE TABLE adapter_metric (
+    name character varying(1024) NOT NULL,
+    labels character varying(1024) NOT NULL,
+    value double precision NOT NULL
+);
+
+-- ALTER TABLE public.adapter_metric OWNER TO pasta_gmn_adapter;
+
+
+-- adapter_object_job
+
+-- Jobs for creating the individual objects of a package on GMN, with
+-- OBJECT_JOB_WORKER_COUNT > 0. job_type is entity, report, metadata or
+-- resource_map. status is pending, claimed, completed, error, private or
+-- cancelled. The status of the queue item is rolled up from its jobs.
+
+CREATE TABLE adapter_object_job (
+    id integer NOT NULL,
+    population_queue_item_id integer NOT NULL,
+    job_type character varying(32) NOT NULL,
+    payload text NOT NULL,
+    status character varying(32) NOT NULL,
+    return_code integer NOT NULL,
+    return_body character varying(2048) NOT NULL,
+    rolled_up boolean NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL
+);
+
+-- ALTER TABLE public.adapter_object_job OWNER TO pasta_gmn_adapter;
+
+CREATE SEQUENCE adapter_object_job_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MAXVALUE
+    NO MINVALUE
+    CACHE 1;
+
+-- ALTER TABLE public.adapter_object_job_id_seq OWNER TO pasta_gmn_adapter;
+
+ALTER SEQUENCE adapter_object_job_id_seq OWNED BY adapter_object_job.id;
+
+SELECT pg_catalog.setval('adapter_object_job_id_seq', 1, true);
+
+
+-- adapter_object_job_dependency
+
+-- A job can only be claimed when all the jobs it depends on have completed.
+
+CREATE TABLE adapter_object_job_dependency (
+    job_id integer NOT NULL,
+    depends_on_job_id integer NOT NULL
+);
+
+-- ALTER TABLE public.adapter_object_job_dependency OWNER TO pasta_gmn_adapter;
+
+
+-- adapter_package_info_prefetch
+
+-- Package info collected from PASTA when the package was added to the queue,
+-- held as JSON until the queue processor uses it.
+
+CREATE TABLE adapter_package_info_prefetch (
+    population_queue_item_id integer NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL,
+    package_info text NOT NULL
+);
+
+-- ALTER TABLE public.adapter_package_info_prefetch OWNER TO pasta_gmn_adapter;
+
+
+-- adapter_package_intake
+
+-- Raw package IDs accepted from PASTA with FAST_ACCEPT_NEW_PACKAGES, waiting to
+-- be validated and moved to the queue by drain_package_intake.
+
+CREATE TABLE adapter_package_intake (
+    id bigint NOT NULL,
+    package_id text NOT NULL,
+    "timestamp" timestamp with time zone NOT NULL
+);
+
+-- ALTER TABLE public.adapter_package_intake OWNER TO pasta_gmn_adapter;
+
+CREATE SEQUENCE adapter_package_intake_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MAXVALUE
+    NO MINVALUE
+    CACHE 1;
+
+-- ALTER TABLE public.adapter_package_intake_id_seq OWNER TO pasta_gmn_adapter;
+
+ALTER SEQUENCE adapter_package_intake_id_seq OWNED BY adapter_package_intake.id;
+
+SELECT pg_catalog.setval('adapter_package_intake_id_seq', 1, true);
+
+
 -- adapter_population_queue
 
 CREATE TABLE adapter_population_queue (
@@ -23,7 +161,8 @@ CREATE TABLE adapter_population_queue (
     package_scope_id integer NOT NULL,
     package_identifier bigint NOT NULL,
     package_revision bigint NOT NULL,
-    "timestamp" timestamp with time zone NOT NULL
+    "timestamp" timestamp with time zone NOT NULL,
+    entity_count integer
 );
 
 -- ALTER TABLE public.adapter_population_queue OWNER TO pasta_gmn_adapter;
@@ -91,11 +230,25 @@ ALTER SEQUENCE adapter_process_status_id_seq OWNED BY adapter_process_status.id;
 SELECT pg_catalog.setval('adapter_process_status_id_seq', 1, true);
 
 
+-- adapter_process_status_count
+
+-- Number of queue items for which each status is the latest status. Maintained
+-- by the adapter on each status change.
+
+CREATE TABLE adapter_process_status_count (
+    status_id integer NOT NULL,
+    count bigint NOT NULL
+);
+
+-- ALTER TABLE public.adapter_process_status_count OWNER TO pasta_gmn_adapter;
+
+
 -- adapter_process_status_return_body
 
 CREATE TABLE adapter_process_status_return_body (
     id integer NOT NULL,
-    return_body character varying(2048) NOT NULL
+    return_body character varying(2048) NOT NULL,
+    return_body_hash uuid NOT NULL
 );
 
 -- ALTER TABLE public.adapter_process_status_return_body OWNER TO pasta_gmn_adapter;
@@ -138,6 +291,8 @@ SELECT pg_catalog.setval('adapter_process_status_status_id_seq', 1, true);
 
 -- Defaults.
 
+ALTER TABLE ONLY adapter_object_job ALTER COLUMN id SET DEFAULT nextval('adapter_object_job_id_seq'::regclass);
+ALTER TABLE ONLY adapter_package_intake ALTER COLUMN id SET DEFAULT nextval('adapter_package_intake_id_seq'::regclass);
 ALTER TABLE ONLY adapter_population_queue ALTER COLUMN id SET DEFAULT nextval('adapter_population_queue_id_seq'::regclass);
 ALTER TABLE ONLY adapter_population_queue_package_scope ALTER COLUMN id SET DEFAULT nextval('adapter_population_queue_package_scope_id_seq'::regclass);
 ALTER TABLE ONLY adapter_process_status ALTER COLUMN id SET DEFAULT nextval('adapter_process_status_id_seq'::regclass);
@@ -146,6 +301,36 @@ ALTER TABLE ONLY adapter_process_status_status ALTER COLUMN id SET DEFAULT nextv
 
 -- Constraints.
 
+ALTER TABLE ONLY adapter_deleted_package
+    ADD CONSTRAINT adapter_deleted_package_pkey PRIMARY KEY (package_scope_id, package_identifier);
+
+ALTER TABLE ONLY adapter_entity_header
+    ADD CONSTRAINT adapter_entity_header_pkey PRIMARY KEY (entity_id, checksum);
+
+ALTER TABLE ONLY adapter_metric
+    ADD CONSTRAINT adapter_metric_pkey PRIMARY KEY (name, labels);
+
+ALTER TABLE ONLY adapter_object_job
+    ADD CONSTRAINT adapter_object_job_pkey PRIMARY KEY (id);
+
+CREATE INDEX adapter_object_job_population_queue_item_id
+    ON adapter_object_job (population_queue_item_id);
+
+CREATE INDEX adapter_object_job_pending
+    ON adapter_object_job (id) WHERE status = 'pending';
+
+ALTER TABLE ONLY adapter_object_job_dependency
+    ADD CONSTRAINT adapter_object_job_dependency_pkey PRIMARY KEY (job_id, depends_on_job_id);
+
+CREATE INDEX adapter_object_job_dependency_depends_on_job_id
+    ON adapter_object_job_dependency (depends_on_job_id);
+
+ALTER TABLE ONLY adapter_package_info_prefetch
+    ADD CONSTRAINT adapter_package_info_prefetch_pkey PRIMARY KEY (population_queue_item_id);
+
+ALTER TABLE ONLY adapter_package_intake
+    ADD CONSTRAINT adapter_package_intake_pkey PRIMARY KEY (id);
+
 ALTER TABLE ONLY adapter_population_queue
     ADD CONSTRAINT adapter_population_queue_pkey PRIMARY KEY (id);
 
@@ -158,12 +343,16 @@ ALTER TABLE ONLY adapter_population_queue_package_scope
 ALTER TABLE ONLY adapter_process_status
     ADD CONSTRAINT adapter_process_status_pkey PRIMARY KEY (id);
 
+-- The return bodies are deduplicated by an MD5 hash of the body, held in a uuid.
 ALTER TABLE ONLY adapter_process_status_return_body
-    ADD CONSTRAINT adapter_process_status_return_body_return_body_key UNIQUE (return_body);
+    ADD CONSTRAINT adapter_process_status_return_body_return_body_hash_key UNIQUE (return_body_hash);
 
 ALTER TABLE ONLY adapter_process_status_return_body
     ADD CONSTRAINT adapter_process_status_return_body_pkey PRIMARY KEY (id);
 
+ALTER TABLE ONLY adapter_process_status_count
+    ADD CONSTRAINT adapter_process_status_count_pkey PRIMARY KEY (status_id);
+
 ALTER TABLE ONLY adapter_process_status_status
     ADD CONSTRAINT adapter_process_status_status_pkey PRIMARY KEY (id);
 
@@ -173,12 +362,30 @@ ALTER TABLE ONLY adapter_process_status_status
 ALTER TABLE ONLY adapter_population_queue
     ADD CONSTRAINT adapter_population_queue_package_scope_id_fkey FOREIGN KEY (package_scope_id) REFERENCES adapter_population_queue_package_scope(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
 
+ALTER TABLE ONLY adapter_deleted_package
+    ADD CONSTRAINT adapter_deleted_package_package_scope_id_fkey FOREIGN KEY (package_scope_id) REFERENCES adapter_population_queue_package_scope(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE ONLY adapter_object_job
+    ADD CONSTRAINT adapter_object_job_population_queue_item_id_fkey FOREIGN KEY (population_queue_item_id) REFERENCES adapter_population_queue(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE ONLY adapter_object_job_dependency
+    ADD CONSTRAINT adapter_object_job_dependency_job_id_fkey FOREIGN KEY (job_id) REFERENCES adapter_object_job(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE ONLY adapter_object_job_dependency
+    ADD CONSTRAINT adapter_object_job_dependency_depends_on_job_id_fkey FOREIGN KEY (depends_on_job_id) REFERENCES adapter_object_job(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
+ALTER TABLE ONLY adapter_package_info_prefetch
+    ADD CONSTRAINT adapter_package_info_prefetch_population_queue_item_id_fkey FOREIGN KEY (population_queue_item_id) REFERENCES adapter_population_queue(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
 ALTER TABLE ONLY adapter_process_status
     ADD CONSTRAINT adapter_process_status_return_body_id_fkey FOREIGN KEY (return_body_id) REFERENCES adapter_process_status_return_body(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
 
 ALTER TABLE ONLY adapter_process_status
     ADD CONSTRAINT adapter_process_status_population_queue_item_id_fkey FOREIGN KEY (population_queue_item_id) REFERENCES adapter_population_queue(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
 
+ALTER TABLE ONLY adapter_process_status_count
+    ADD CONSTRAINT adapter_process_status_count_status_id_fkey FOREIGN KEY (status_id) REFERENCES adapter_process_status_status(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
+
 ALTER TABLE ONLY adapter_process_status
     ADD CONSTRAINT adapter_process_status_status_id_fkey FOREIGN KEY (status_id) REFERENCES adapter_process_status_status(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED;
 
@@ -0,0 +1,23 @@
+-- Replace the unique constraint on the full text of the process status return
+-- bodies with a unique constraint on an MD5 hash of the body, held in a uuid.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0001_return_body_hash.sql
+
+begin;
+
+alter table adapter_process_status_return_body
+    add column return_body_hash uuid;
+
+update adapter_process_status_return_body
+    set return_body_hash = md5(return_body)::uuid;
+
+alter table adapter_process_status_return_body
+    alter column return_body_hash set not null;
+
+alter table only adapter_process_status_return_body
+    drop constraint adapter_process_status_return_body_return_body_key;
+
+alter table only adapter_process_status_return_body
+    add constraint adapter_process_status_return_body_return_body_hash_key unique (return_body_hash);
+
+commit;
@@ -0,0 +1,27 @@
+-- Add the per-status counts of queue items that are served by
+-- /admin/statistics, and populate them from the existing status history.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0002_status_count.sql
+
+begin;
+
+create table adapter_process_status_count (
+    status_id integer not null,
+    count bigint not null
+);
+
+alter table only adapter_process_status_count
+    add constraint adapter_process_status_count_pkey primary key (status_id);
+
+alter table only adapter_process_status_count
+    add constraint adapter_process_status_count_status_id_fkey foreign key (status_id) references adapter_process_status_status(id) on delete cascade deferrable initially deferred;
+
+insert into adapter_process_status_count (status_id, count)
+select status_id, count(*) from (
+    select distinct on (population_queue_item_id) status_id
+    from adapter_process_status
+    order by population_queue_item_id, "timestamp" desc, id desc
+) latest
+group by status_id;
+
+commit;
@@ -0,0 +1,17 @@
+-- Add the table in which the queue processor stores the metrics that are
+-- served by /admin/metrics.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0003_metric.sql
+
+begin;
+
+create table adapter_metric (
+    name character varying(1024) not null,
+    labels character varying(1024) not null,
+    value double precision not null
+);
+
+alter table only adapter_metric
+    add constraint adapter_metric_pkey primary key (name, labels);
+
+commit;
@@ -0,0 +1,24 @@
+-- Add the table in which package info prefetched from PASTA is staged until the
+-- queue processor uses it.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0004_package_info_prefetch.sql
+
+begin;
+
+create table adapter_package_info_prefetch (
+    population_queue_item_id integer not null,
+    "timestamp" timestamp with time zone not null,
+    package_info text not null
+);
+
+alter table only adapter_package_info_prefetch
+    add constraint adapter_package_info_prefetch_pkey
+    primary key (population_queue_item_id);
+
+alter table only adapter_package_info_prefetch
+    add constraint adapter_package_info_prefetch_population_queue_item_id_fkey
+    foreign key (population_queue_item_id)
+    references adapter_population_queue(id)
+    on delete cascade deferrable initially deferred;
+
+commit;
@@ -0,0 +1,24 @@
+-- Add the table in which sync_deleted_packages records the packages deleted in
+-- PASTA that have been archived on GMN.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0005_deleted_package.sql
+
+begin;
+
+create table adapter_deleted_package (
+    package_scope_id integer not null,
+    package_identifier bigint not null,
+    "timestamp" timestamp with time zone not null
+);
+
+alter table only adapter_deleted_package
+    add constraint adapter_deleted_package_pkey
+    primary key (package_scope_id, package_identifier);
+
+alter table only adapter_deleted_package
+    add constraint adapter_deleted_package_package_scope_id_fkey
+    foreign key (package_scope_id)
+    references adapter_population_queue_package_scope(id)
+    on delete cascade deferrable initially deferred;
+
+commit;
@@ -0,0 +1,51 @@
+-- Add the tables for object level jobs, used by the queue processor when
+-- OBJECT_JOB_WORKER_COUNT > 0.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0006_object_job.sql
+
+begin;
+
+create table adapter_object_job (
+    id serial primary key,
+    population_queue_item_id integer not null,
+    job_type character varying(32) not null,
+    payload text not null,
+    status character varying(32) not null,
+    return_code integer not null,
+    return_body character varying(2048) not null,
+    rolled_up boolean not null,
+    "timestamp" timestamp with time zone not null
+);
+
+create index adapter_object_job_population_queue_item_id
+    on adapter_object_job (population_queue_item_id);
+
+create index adapter_object_job_pending
+    on adapter_object_job (id) where status = 'pending';
+
+alter table only adapter_object_job
+    add constraint adapter_object_job_population_queue_item_id_fkey
+    foreign key (population_queue_item_id)
+    references adapter_population_queue(id)
+    on delete cascade deferrable initially deferred;
+
+create table adapter_object_job_dependency (
+    job_id integer not null,
+    depends_on_job_id integer not null,
+    primary key (job_id, depends_on_job_id)
+);
+
+create index adapter_object_job_dependency_depends_on_job_id
+    on adapter_object_job_dependency (depends_on_job_id);
+
+alter table only adapter_object_job_dependency
+    add constraint adapter_object_job_dependency_job_id_fkey
+    foreign key (job_id) references adapter_object_job(id)
+    on delete cascade deferrable initially deferred;
+
+alter table only adapter_object_job_dependency
+    add constraint adapter_object_job_dependency_depends_on_job_id_fkey
+    foreign key (depends_on_job_id) references adapter_object_job(id)
+    on delete cascade deferrable initially deferred;
+
+commit;
@@ -0,0 +1,20 @@
+-- Add the index of entity sizes and content types that is used for reusing the
+-- headers of unchanged entities in new revisions of a package.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0007_entity_header.sql
+
+begin;
+
+create table adapter_entity_header (
+    entity_id character varying(1024) not null,
+    checksum character varying(1024) not null,
+    content_length bigint not null,
+    content_type character varying(1024) not null,
+    "timestamp" timestamp with time zone not null
+);
+
+alter table only adapter_entity_header
+    add constraint adapter_entity_header_pkey
+    primary key (entity_id, checksum);
+
+commit;
@@ -0,0 +1,14 @@
+-- Add the intake table for package IDs accepted from PASTA when
+-- FAST_ACCEPT_NEW_PACKAGES is enabled.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0008_package_intake.sql
+
+begin;
+
+create table adapter_package_intake (
+    id bigserial primary key,
+    package_id text not null,
+    "timestamp" timestamp with time zone not null
+);
+
+commit;
@@ -0,0 +1,10 @@
+-- Add the number of data entities of each queued package, looked up from PASTA
+-- by the queue processor for the smallest_first scheduling policy.
+--
+-- psql --dbname pasta_gmn_adapter --file upgrade/0009_entity_count.sql
+
+begin;
+
+alter table adapter_population_queue add column entity_count integer;
+
+commit;
@@ -15,6 +15,7 @@
 import logging
 from datetime import datetime
 
+import connector_util.run_ledger
 from dateutil import parser
 from nodc_connector import content_cache
 
@@ -26,6 +27,12 @@ logger = logging.getLogger('ncei_cache_reader')
 
 
 def main():
+    # Record the run in the run ledger shared by all connectors on this host.
+    with connector_util.run_ledger.record_run('ncei', settings.NODE_ID) as run:
+        return read_cache(run)
+
+
+def read_cache(run):
 
     f = open(settings.CACHE_REFRESH_FILE, 'r')
     cache_refresh_date = f.readline().strip()
@@ -35,6 +42,7 @@ def main():
     logger.info('Beginning cache read for new content since: {0}'.format(cache_refresh_date))
     cache = content_cache.ContentCache(settings.CACHE_PATH, settings.CACHE_DB)
     for record in cache.listNewSince(parser.parse(cache_refresh_date)):
+        run.count('seen')
         try:
             pid = record['pid']
             sid = record['sid']
@@ -42,17 +50,24 @@ def main():
             sci_sysmeta = record['sci_sysmeta']
             date_modified = record['date_modified']
             smb = scimeta_bundle.Scimeta_Bundle(pid, sci_metadata, sci_sysmeta)
+            run.add_bytes(smb.doc.size)
             predecessor = cache.getPredecessorPID(sid, date_modified)
             cache_refresh_date = date_modified
             logger.info('Adding PID-SID "{0}-{1}" with date "{2}"'.format(pid, sid, date_modified))
             if  predecessor is None:
-                smb.gmn_create()
+                with run.phase('gmn'):
+                    smb.gmn_create()
                 cnt += 1
+                run.count('created')
             else:
-                smb.gmn_update(predecessor)
+                with run.phase('gmn'):
+                    smb.gmn_update(predecessor)
                 cnt += 1
+                run.count('updated')
+            smb.close()
         except Exception as e:
             logger.error("Unknown fromIteratorEntry error: {0}".format(e.message))
+            run.count('failed')
 
     logger.info('Ending cache read for new content up to: {0}'.format(cache_refresh_date))
     f = open(settings.CACHE_REFRESH_FILE, 'w')
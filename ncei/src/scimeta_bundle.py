@@ -14,9 +14,9 @@
     3/4/16
 """
 
-import StringIO
 import logging
 
+import connector_util.spooled_upload
 from d1_client import mnclient
 from d1_common.types import dataoneTypes as d1_types
 
@@ -35,7 +35,9 @@ class Scimeta_Bundle(object):
             raise ValueError(
                 'Either "pid" or science metadata "doc" or "sysmeta_xml" is None.')
 
-        self.doc = doc.encode('utf-8')
+        # The document is encoded to a spooled file in chunks, so a large
+        # document is not held in memory a second time as bytes.
+        self.doc = connector_util.spooled_upload.from_text(doc)
         self.sysmeta = d1_types.CreateFromDocument(sysmeta_xml)
         self.pid = pid
 
@@ -51,6 +53,13 @@ class Scimeta_Bundle(object):
         """
         return self.sysmeta
 
+    def close(self):
+        """Delete the spooled science metadata document.
+
+        :return: None
+        """
+        self.doc.close()
+
     def gmn_create(self):
         """Create a new science metadata object into the NCEI GMN
 
@@ -60,7 +69,7 @@ class Scimeta_Bundle(object):
             client = mnclient.MemberNodeClient(settings.MN_BASE_URL,
                                                cert_path=settings.CERTIFICATE_FOR_CREATE,
                                                key_path=settings.CERTIFICATE_FOR_CREATE_KEY)
-            client.create(self.pid, StringIO.StringIO(self.doc), self.sysmeta)
+            client.create(self.pid, self.doc.rewind(), self.sysmeta)
         except UnicodeError as e:
             logger.error(
                 'GMN create error for PID "{0}" in science metadata bundle: {1}'.format(
@@ -82,7 +91,7 @@ class Scimeta_Bundle(object):
             client = mnclient.MemberNodeClient(settings.MN_BASE_URL,
                                                cert_path=settings.CERTIFICATE_FOR_CREATE,
                                                key_path=settings.CERTIFICATE_FOR_CREATE_KEY)
-            client.update(old_pid, StringIO.StringIO(self.doc), self.pid, self.sysmeta)
+            client.update(old_pid, self.doc.rewind(), self.pid, self.sysmeta)
         except Exception as e:
             logger.error(
                 'GMN update error for PID "{0}" in science metadata bundle: {1}'.format(
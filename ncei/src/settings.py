@@ -22,6 +22,7 @@ logging.basicConfig(level=logging.DEBUG,
 
 
 MN_BASE_URL = 'https://ncei-node.dataone.org/mn'
+NODE_ID = 'urn:node:mnTestNCEI'
 CERTIFICATE_FOR_CREATE = '/Users/servilla/Certs/DataONE/urn_node_mnTestNCEI/urn_node_mnTestNCEI.crt'
 CERTIFICATE_FOR_CREATE_KEY = '/Users/servilla/Certs/DataONE/urn_node_mnTestNCEI/private/urn_node_mnTestNCEI.key'
 CACHE_PATH = '/Users/servilla/DataONE/NCEI/content_cache'
@@ -4,6 +4,7 @@
 # No OAI-PMH support for deleted records, so no record archival functionality
 
 import datetime
+import hashlib
 import io
 import logging
 import requests
@@ -14,6 +15,10 @@ import sys
 
 import d1_common.types.exceptions
 
+import connector_util.http_trace
+import connector_util.run_ledger
+import connector_util.sysmeta_template
+
 import d1_client.mnclient_2_0
 import d1_common.checksum
 import d1_common.const
@@ -27,6 +32,10 @@ USER_AGENT = 'DataONE OAI-PMH Adapter/{}'.format(d1_common.const.USER_AGENT)
 # certificate. Use when connecting to a test instance of GMN that is using a
 # self-signed cert.
 VERIFY_TLS = True
+# Set SYSMETA_FROM_TEMPLATE to False to build the System Metadata with the pyxb
+# bindings instead of rendering it from a template that is prepared once for
+# each node. The documents are the same.
+SYSMETA_FROM_TEMPLATE = True
 
 SUMMARY_REPORT_FILE = "oaipmh-summary.csv" # track aggregate daily updates info in a csv-formatted log file
 
@@ -36,6 +45,8 @@ def main():
     filename='oaipmh.log',
     format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO
   )
+  # Opt-in tracing of the HTTP calls, enabled with CONNECTOR_HTTP_TRACE=1.
+  connector_util.http_trace.install_if_enabled()
 
   with open('mnconfig.yaml') as f:
     mn_config_dict = yaml.load(f)
@@ -65,14 +76,38 @@ def harvest_oai_pmh(mn_config_dict):
     logging.info('OAI-PMH BaseURL: {}'.format(node_dict['oaipmh_base_url']))
     logging.info('GMN BaseURL: {}'.format(node_dict['node_base_url']))
 
-    gmn_client = GMMClient(node_dict)
-    node_dict['last_harvest_time'] = gmn_client.get_last_harvest_time()
-    harvester = OAIPMHHarvester(node_dict)
+    with connector_util.run_ledger.record_run(
+        'figshare', node_dict['node_id']
+    ) as run:
+      harvest_node(node_dict, counter_dict, run)
+
+  logging.info('-' * 80)
+  logging.info('Checked OAI-PMH records: {}'.format(counter_dict['records']))
+  logging.info(
+    'New records: {}'.
+    format(counter_dict['created'] + counter_dict['updated'])
+  )
+  logging.info('Created SciObj: {}'.format(counter_dict['created']))
+  logging.info('Updated SciObj: {}'.format(counter_dict['updated']))
+  logging.info('Already harvested: {}'.format(counter_dict['already_harvested']))
+  logging.info('Minor revisions not updated: {}'.format(counter_dict['minor_revision_not_updated']))
+  logging.info('Errors: {}'.format(counter_dict['errors']))
+
+  summary_report(counter_dict, SUMMARY_REPORT_FILE)
+
+
+def harvest_node(node_dict, counter_dict, run):
+  node_start_counter_dict = dict(counter_dict)
 
+  gmn_client = GMMClient(node_dict)
+  node_dict['last_harvest_time'] = gmn_client.get_last_harvest_time()
+  harvester = OAIPMHHarvester(node_dict, run)
 
+  try:
     while True:
       try:
-        record_list = harvester.get_records()
+        with run.phase('list'):
+          record_list = harvester.get_records()
       except (d1_common.types.exceptions.DataONEException, AdapterError) as e:
         logging.error('get_records() failed. error="{}"'.format(str(e)))
         break
@@ -86,24 +121,24 @@ def harvest_oai_pmh(mn_config_dict):
         logging.info('-' * 80)
         logging.info('OAI-PMH record #: ' + str(counter_dict['records']))
         try:
-          process_record(record_el, node_dict, counter_dict, gmn_client)
+          with run.phase('gmn'):
+            process_record(record_el, node_dict, counter_dict, gmn_client)
         except (d1_common.types.exceptions.DataONEException, AdapterError) as e:
           logging.error('Record not processed: {}'.format(str(e)))
           counter_dict['errors'] += 1
-
-  logging.info('-' * 80)
-  logging.info('Checked OAI-PMH records: {}'.format(counter_dict['records']))
-  logging.info(
-    'New records: {}'.
-    format(counter_dict['created'] + counter_dict['updated'])
-  )
-  logging.info('Created SciObj: {}'.format(counter_dict['created']))
-  logging.info('Updated SciObj: {}'.format(counter_dict['updated']))
-  logging.info('Already harvested: {}'.format(counter_dict['already_harvested']))
-  logging.info('Minor revisions not updated: {}'.format(counter_dict['minor_revision_not_updated']))
-  logging.info('Errors: {}'.format(counter_dict['errors']))
-
-  summary_report(counter_dict, SUMMARY_REPORT_FILE)
+  finally:
+    # Record the outcomes for this node in the run ledger.
+    for run_counter, counter_list in (
+        ('seen', ['records']),
+        ('created', ['created']),
+        ('updated', ['updated']),
+        ('skipped', ['already_harvested', 'minor_revision_not_updated']),
+        ('failed', ['errors']),
+    ):
+      run.count(
+        run_counter,
+        sum(counter_dict[c] - node_start_counter_dict[c] for c in counter_list)
+      )
 
 
 def process_record(record_el, node_dict, counter_dict, gmn_client):
@@ -172,8 +207,9 @@ def write_to_summary(summary_log, counter_dict):
 
 
 class OAIPMHHarvester:
-  def __init__(self, node_dict):
+  def __init__(self, node_dict, run):
     self.node_dict = node_dict
+    self.run = run
     self.resume_token = None
     self.is_last_page = False
 
@@ -210,6 +246,7 @@ class OAIPMHHarvester:
       )
     except requests.RequestException as e:
       raise AdapterError(str(e))
+    self.run.add_request(len(response.content))
     root_el = ET.fromstring(response.content)
     record_list = root_el.find(
       '{http://www.openarchives.org/OAI/2.0/}ListRecords'
@@ -243,6 +280,9 @@ class GMMClient:
       timeout=120.0,
       verify_tls=VERIFY_TLS,
     )
+    self.sysmeta_template = None
+    if SYSMETA_FROM_TEMPLATE:
+      self.sysmeta_template = self._create_sysmeta_template()
 
   def get_last_harvest_time(self):
     """A function which checks the member node to see the most recently modified/created date of any object in GMN.
@@ -305,9 +345,7 @@ class GMMClient:
     sysmeta_pyxb = self._generate_sysmeta(
       scimeta_str, pid, sid, record_datetime
     )
-    self.client.create(
-      sysmeta_pyxb.identifier.value(), io.BytesIO(scimeta_str), sysmeta_pyxb
-    )
+    self.client.create(pid, io.BytesIO(scimeta_str), sysmeta_pyxb)
 
   def update_science_metadata(
       self, scimeta_str, new_pid, sid, record_datetime, old_pid
@@ -317,10 +355,35 @@ class GMMClient:
     )
     self.client.update(
       pid=old_pid, obj=io.BytesIO(scimeta_str),
-      newPid=sysmeta_pyxb.identifier.value(), sysmeta_pyxb=sysmeta_pyxb
+      newPid=new_pid, sysmeta_pyxb=sysmeta_pyxb
+    )
+
+  def _create_sysmeta_template(self):
+    return connector_util.sysmeta_template.SysMetaTemplate(
+      formatId=self.node_dict['sci_md_formatId'],
+      rightsHolder=self.node_dict['rightsholder'],
+      submitter=self.node_dict['submitter'],
+      authoritativeMemberNode=self.node_dict['authoritativeMN'],
+      originMemberNode=self.node_dict['originMN'],
+      accessPolicy=connector_util.sysmeta_template.PUBLIC_READ_ACCESS_POLICY,
     )
 
   def _generate_sysmeta(self, scimeta_str, pid, sid, record_datetime):
+    if self.sysmeta_template is not None:
+      return self._render_sysmeta(scimeta_str, pid, sid, record_datetime)
+    return self._generate_sysmeta_pyxb(scimeta_str, pid, sid, record_datetime)
+
+  def _render_sysmeta(self, scimeta_str, pid, sid, record_datetime):
+    return self.sysmeta_template.create(
+      seriesId=sid,
+      identifier=pid,
+      size=len(scimeta_str),
+      checksum=('SHA-1', hashlib.sha1(scimeta_str).hexdigest()),
+      dateUploaded=record_datetime,
+      dateSysMetadataModified=datetime.datetime.now(),
+    )
+
+  def _generate_sysmeta_pyxb(self, scimeta_str, pid, sid, record_datetime):
     sysmeta_pyxb = v2.systemMetadata()
     sysmeta_pyxb.seriesId = sid
     sysmeta_pyxb.formatId = self.node_dict['sci_md_formatId']
@@ -41,6 +41,7 @@ import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import datetime
 import pytz
+import connector_util.run_ledger
 # D1 functionality found here:
 import d1_client_manager_pangaea
 
@@ -66,6 +67,9 @@ SYSMETA_DICT = \
      'originMN': 'urn:node:PANGAEA',  # Use your node's DataONE URI
      'formatId_custom': 'http://www.isotc211.org/2005/gmd-pangaea' # should be consistent w/ scimeta_element format
       }
+# System metadata is rendered from a template prepared at startup (see d1_client_manager.py). False builds it with the
+# pyxb bindings for each record instead.
+SYSMETA_FROM_TEMPLATE = True
 created_count = 0  # global incrementer for metadata records harvested.
 updated_count = 0  # global incrementer for records updated each time program is run
 archived_count = 0 # global incrementer for records archived in a given run
@@ -79,14 +83,21 @@ last_harvest_time = ''
 
 # ----------------------------------------------------------------------------------------------------------------------
 def main():
+  # Record the run in the run ledger shared by all connectors on this host.
+  with connector_util.run_ledger.record_run('pangaea', SYSMETA_DICT['authoritativeMN']) as run:
+    harvest(run)
+
+
+def harvest(run):
   global rtoken
   global last_harvest_time
   requests.packages.urllib3.disable_warnings()
-  client_mgr = d1_client_manager_pangaea.D1ClientManager(MN_BASE_URL, CERT, KEY, SYSMETA_DICT)
-  harvester = OAIPMH_Harvester(OAIPMH_BASE_URL)
+  client_mgr = d1_client_manager_pangaea.D1ClientManager(MN_BASE_URL, CERT, KEY, SYSMETA_DICT, SYSMETA_FROM_TEMPLATE)
+  harvester = OAIPMH_Harvester(OAIPMH_BASE_URL, run)
   last_harvest_time = client_mgr.get_last_harvest_time()  # get date most recent sysmetamodified as start of timeslice
   while (start == 1) or (start == 0 and rtoken is not None):
-    record_list = harvester.get_records(harvester.define_params())
+    with run.phase('list'):
+      record_list = harvester.get_records(harvester.define_params())
     if record_list is not None:
       rtoken_record = record_list.find('{http://www.openarchives.org/OAI/2.0/}resumptionToken')
       if rtoken_record is None:
@@ -95,7 +106,9 @@ def main():
         rtoken = rtoken_record.text
         record_list.remove(rtoken_record) # excludes rtoken from the processing that happens to rest of results
       for metadata_record in record_list:
-        harvester.process_record(record=metadata_record, client_mgr=client_mgr)
+        run.count('seen')
+        with run.phase('gmn'):
+          harvester.process_record(record=metadata_record, client_mgr=client_mgr)
     else:
         pass
 
@@ -108,11 +121,13 @@ def main():
 
 # ----------------------------------------------------------------------------------------------------------------------
 class OAIPMH_Harvester:
-  def __init__(self, baseURL):
+  def __init__(self, baseURL, run):
     """
     :param baseURL: The OAI-PMH provider's base URL, not to be confused with the base URL configured for GMN.
+    :param run: connector_util.run_ledger.Run that records the requests and records of this run.
     """
     self.baseURL = baseURL
+    self.run = run
 
 # ----------------------------------------------------------------------------------------------------------------------
   def define_params(self):
@@ -156,6 +171,7 @@ class OAIPMH_Harvester:
       'From': 'mihli1@utk.edu'}
     try:
       r = requests.get(url=self.baseURL, params=parameters, headers=headers)
+      self.run.add_request(len(r.content))
       if r.status_code == requests.codes.ok:
         root = ET.fromstring(r.content)
         record_list = root.find('{http://www.openarchives.org/OAI/2.0/}ListRecords')
@@ -191,8 +207,12 @@ class OAIPMH_Harvester:
         if checkExistsDict['outcome'] == 'yes':
           if client_mgr.archive_science_metadata(checkExistsDict['current_version_pid']):
             archived_count += 1  # track the number of successfully archived objects
+            self.run.count('updated')  # the run ledger has no separate counter for archives
+          else:
+            self.run.count('failed')
         else: # record that a deleted record in OAI-PMH resultset was skipped over because not already in GMN
           skipped_deleted_count += 1
+          self.run.count('skipped')
 
     # Otherwise status is not deleted, so parse record ID, date, and metadata contents.
     # Then check if this identifier already exists in GMN.
@@ -215,22 +235,31 @@ class OAIPMH_Harvester:
       # the outcome of checkExistsDict determines how to handle the record.
       # if identifier exists in GMN but record date is different, this truly is an update so call update method.
       if (checkExistsDict['outcome'] == 'yes' and checkExistsDict['record_date'] != record_date):
-        if client_mgr.update_science_metadata(minidom.parseString(scimeta).toprettyxml(encoding='utf-8'),
-                                              identifier, record_date, checkExistsDict['current_version_pid']):
+        with d1_client_manager_pangaea.spool_science_metadata(minidom.parseString(scimeta)) as scimeta_upload:
+          is_updated = client_mgr.update_science_metadata(scimeta_upload, identifier, record_date,
+                                                          checkExistsDict['current_version_pid'])
+        if is_updated:
           updated_count += 1  # track the number of succesfully updated objects
+          self.run.count('updated')
+        else:
+          self.run.count('failed')
       # if identifier exists but record date is the same, it's not really an update. So skip it and move on.
       elif checkExistsDict['outcome'] == 'yes' and checkExistsDict['record_date'] == record_date:
         pass # identifier exists but there are no updates to apply because record date is the same
         skipped_exists_count += 1
+        self.run.count('skipped')
       # if check failed for some reason, d1_client_manager would have logged the error so just skip.
       elif checkExistsDict['outcome'] == 'failed':
-        pass
+        self.run.count('failed')
       # If this identifer is not already found in GMN in any way, then create a new object in GMN
       elif checkExistsDict['outcome'] == 'no':
-        if client_mgr.load_science_metadata(minidom.parseString(scimeta).toprettyxml(encoding='utf-8'),
-                                            identifier,
-                                            record_date):
+        with d1_client_manager_pangaea.spool_science_metadata(minidom.parseString(scimeta)) as scimeta_upload:
+          is_created = client_mgr.load_science_metadata(scimeta_upload, identifier, record_date)
+        if is_created:
           created_count += 1  # track number of successfully created new objects
+          self.run.count('created')
+        else:
+          self.run.count('failed')
 
 # ----------------------------------------------------------------------------------------------------------------------
 
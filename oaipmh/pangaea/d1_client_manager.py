@@ -10,12 +10,13 @@ ________________________________________________________________________________
 """
 
 import datetime
-import StringIO
 import logging
 import requests
-import hashlib
 import sys
 
+import connector_util.spooled_upload
+import connector_util.sysmeta_template
+
 # D1.
 import d1_common.types.dataoneTypes_v2_0 as v2
 import d1_common.const
@@ -24,9 +25,40 @@ import d1_common.checksum
 import d1_common.types.dataoneTypes_v2_0 as dataoneTypes
 
 
-def _generate_system_metadata(scimeta_bytes, native_identifier_sid, record_date, symeta_settings_dict):
+def spool_science_metadata(scimeta_dom):
+    """Write the science metadata document, pretty printed, to a rewindable file for upload to GMN. The MD5 checksum
+    and size used in the system metadata are computed while the document is written, and large documents are spooled to
+    disk instead of being held in memory."""
+    return connector_util.spooled_upload.from_dom(scimeta_dom, 'MD5')
+
+
+def _create_sysmeta_template(sysmeta_settings_dict):
+    """Render the system metadata fields which are the same for every object loaded into GMN once, so that only the
+    fields which differ between objects are rendered for each object. See _render_system_metadata()."""
+    return connector_util.sysmeta_template.SysMetaTemplate(
+        formatId=sysmeta_settings_dict['formatId_custom'],
+        rightsHolder=sysmeta_settings_dict['rightsholder'],
+        submitter=sysmeta_settings_dict['submitter'],
+        authoritativeMemberNode=sysmeta_settings_dict['authoritativeMN'],
+        originMemberNode=sysmeta_settings_dict['originMN'],
+        accessPolicy=connector_util.sysmeta_template.PUBLIC_READ_ACCESS_POLICY)
+
+
+def _render_system_metadata(sysmeta_template, scimeta_upload, native_identifier_sid, record_date):
+    """Render the same system metadata as _generate_system_metadata() from a template created by
+    _create_sysmeta_template(), without building it with the pyxb bindings."""
+    return sysmeta_template.create(
+        seriesId=native_identifier_sid,
+        identifier=scimeta_upload.checksum,
+        size=scimeta_upload.size,
+        checksum=(scimeta_upload.algorithm, scimeta_upload.checksum),
+        dateUploaded=record_date,
+        dateSysMetadataModified=datetime.datetime.now())
+
+
+def _generate_system_metadata(scimeta_upload, native_identifier_sid, record_date, symeta_settings_dict):
     """
-    :param scimeta_bytes: Bytes of the node's original metadata document.
+    :param scimeta_upload: The node's original metadata document, as returned by spool_science_metadata().
     :param native_identifier_sid: Node's system identifier for this object, which becomes the series ID.
     :param record_date: Date metadata document was created/modified in the source system. Becomes dateUploaded.
     :param sysmeta_settings_dict: A dict containing node-specific system metadata properties that will apply to all
@@ -41,9 +73,9 @@ def _generate_system_metadata(scimeta_bytes, native_identifier_sid, record_date,
     sys_meta.seriesId = native_identifier_sid
 
     sys_meta.formatId = symeta_settings_dict['formatId_custom']
-    sys_meta.size = len(scimeta_bytes)
-    sys_meta.checksum = dataoneTypes.checksum(hashlib.md5(scimeta_bytes).hexdigest())
-    sys_meta.checksum.algorithm = 'MD5'
+    sys_meta.size = scimeta_upload.size
+    sys_meta.checksum = dataoneTypes.checksum(scimeta_upload.checksum)
+    sys_meta.checksum.algorithm = scimeta_upload.algorithm
     sys_meta.identifier = sys_meta.checksum.value()
     # sys_meta.dateUploaded = datetime.datetime.strptime(record_date, "%Y-%m-%dT%H:%M:%SZ")
     sys_meta.dateUploaded = record_date
@@ -72,7 +104,7 @@ def _generate_public_access_policy():
 
 class D1ClientManager:
     # Initialize the client manager with an instance of a member node client
-    def __init__(self, gmn_baseurl, auth_cert, auth_cert_key, sysmeta_settings_dict):
+    def __init__(self, gmn_baseurl, auth_cert, auth_cert_key, sysmeta_settings_dict, sysmeta_from_template=True):
         """
         :param gmn_baseurl: The base URL configured for the Generic Member Node installation.
         :param auth_cert: Certificate used for authenticating with the GMN server to make changes. If the adapter script
@@ -85,6 +117,8 @@ class D1ClientManager:
          still in development or is registered.
         :param sysmeta_settings_dict: System metadata settings which apply to every object loaded into GMN are
          configured in the main script, and then passed within a dict to be used while creating and updating objects.
+        :param sysmeta_from_template: If True, the system metadata is rendered from a template which is prepared once,
+         instead of being built with the pyxb bindings for every object. The documents are the same.
          """
 
         self.client = d1_client.mnclient_2_0.MemberNodeClient_2_0(
@@ -96,6 +130,15 @@ class D1ClientManager:
             # verify_tls=False
             )
         self.sysmeta_settings_dict = sysmeta_settings_dict
+        self.sysmeta_template = None
+        if sysmeta_from_template:
+            self.sysmeta_template = _create_sysmeta_template(sysmeta_settings_dict)
+
+    def _generate_system_metadata(self, scimeta_upload, native_identifier_sid, record_date):
+        if self.sysmeta_template is not None:
+            return _render_system_metadata(self.sysmeta_template, scimeta_upload, native_identifier_sid, record_date)
+        return _generate_system_metadata(scimeta_upload, native_identifier_sid, record_date,
+                                         self.sysmeta_settings_dict)
 
     def get_last_harvest_time(self):
       """A function which checks the member node to see the most recently modified/created date of any object in GMN.
@@ -147,26 +190,26 @@ class D1ClientManager:
             checkExistsDict['current_version_pid'] = sys_meta.identifier.value()
             return checkExistsDict
 
-    def load_science_metadata(self, sci_metadata_bytes, native_identifier_sid, record_date):
+    def load_science_metadata(self, scimeta_upload, native_identifier_sid, record_date):
         """
         Loads a new science metadata record into GMN using the .create() method from the Member Node API.
 
-        :param sci_metadata_bytes: The bytes of the science metadata record as a utf-encoded string.
+        :param scimeta_upload: The science metadata record, as returned by spool_science_metadata().
         :param native_identifier_sid: The unique identifier of the metadata record in the native repository.
         :param record_date: The datestamp parsed from the OAI-PMH record. This becomes the dateUploaded in GMN.
         :return: True if the object successfully created or False if not. This allows the main program to track the
          number of successfully created objects.
         """
         try:
-            system_metadata= _generate_system_metadata(sci_metadata_bytes, native_identifier_sid,
-                                      record_date, self.sysmeta_settings_dict)
+            system_metadata = self._generate_system_metadata(scimeta_upload, native_identifier_sid, record_date)
 
         except Exception, e:
             logging.error('Failed to generate system metadata. Unable to create SID: ' + native_identifier_sid)
             logging.error(e)
             return False
         try:
-            self.client.create(system_metadata.identifier.value(), StringIO.StringIO(sci_metadata_bytes), system_metadata)
+            # The checksum is the identifier. See _generate_system_metadata().
+            self.client.create(scimeta_upload.checksum, scimeta_upload.rewind(), system_metadata)
         except Exception, e:
             logging.error('Failed to create object with SID: ' + native_identifier_sid)
             logging.error(e)
@@ -174,7 +217,7 @@ class D1ClientManager:
         else:
             return True
 
-    def update_science_metadata(self, sci_metadata_bytes, native_identifier_sid, record_date, old_version_pid):
+    def update_science_metadata(self, scimeta_upload, native_identifier_sid, record_date, old_version_pid):
         """
         When a record is harvested from an OAI-PMH query whose native repository identifier already exists as a seriesId
         in GMN, then it is understood that the record has been modified in the native repository. The .update() API
@@ -182,7 +225,8 @@ class D1ClientManager:
         new object. The .update() method automates setting the obsoletes / obsoleted by properties of both old and new
         objects in order to encode the relationship between the two, so there is no need to explicitly assign them.
 
-        :param sci_metadata_bytes: The bytes of the new version of the science metadata record as a utf-encoded string.
+        :param scimeta_upload: The new version of the science metadata record, as returned by
+         spool_science_metadata().
         :param native_identifier_sid: The identifier of the record in its native repository which is implemented as the
          seriesId property in GMN.
         :param record_date: The datestamp parsed from the OAI-PMH record. This becomes the dateUploaded in GMN. If the
@@ -196,12 +240,11 @@ class D1ClientManager:
          number of updated objects in a given run.
         """
         try:
-            new_version_system_metadata = _generate_system_metadata(sci_metadata_bytes, native_identifier_sid,
-                                                                    record_date,
-                                                                    self.sysmeta_settings_dict)
+            new_version_system_metadata = self._generate_system_metadata(scimeta_upload, native_identifier_sid,
+                                                                         record_date)
             self.client.update(old_version_pid,
-                               StringIO.StringIO(sci_metadata_bytes),
-                               new_version_system_metadata.identifier.value(),
+                               scimeta_upload.rewind(),
+                               scimeta_upload.checksum,
                                new_version_system_metadata)
         except Exception, e:
             logging.error('Failed to UPDATE object with SID: ' + native_identifier_sid + ' / PID: ' + old_version_pid)
@@ -26,6 +26,7 @@
 # Stdlib
 import datetime
 import fcntl
+import hashlib
 import logging
 import os
 import pprint
@@ -41,11 +42,13 @@ import requests
 import d1_client.mnclient_2_0
 import d1_common.date_time
 import d1_common.util
-import d1_common.checksum
 import d1_common.types.dataoneTypes_v2_0 as v2
 import d1_common.types.exceptions
 
 # App
+import connector_util.http_trace
+import connector_util.run_ledger
+import connector_util.sysmeta_template
 
 # Constants
 MAX_RECORDS_INT = 10 # R2R seems to clamp this to 10.
@@ -58,6 +61,9 @@ CERT_PUB_PATH = './client_cert.pem'
 CERT_KEY_PATH = './client_key_nopassword.pem'
 GMN_BASE_URL = 'https://r2r-node.test.dataone.org/mn'
 DEBUG_LOG_BOOL = True
+# Render the System Metadata from a template instead of building it with the
+# pyxb bindings
+SYSMETA_FROM_TEMPLATE = True
 
 NS_DICT = {
   'csw': 'http://www.opengis.net/cat/csw/2.0.2',
@@ -83,6 +89,8 @@ single_instance_lock_file = None
 
 def main():
   log_setup(DEBUG_LOG_BOOL)
+  # Opt-in tracing of the HTTP calls, enabled with CONNECTOR_HTTP_TRACE=1.
+  connector_util.http_trace.install_if_enabled()
   logging.info(u'Running: {}'.format(get_command_name()))
   abort_if_other_instance_is_running()
   try:
@@ -146,12 +154,19 @@ def make_absolute(p):
 class R2RConnector(object):
   def __init__(self):
     self._event_dict = {}
+    self._run = None
     self._disable_insecure_platform_warnings()
     self._register_namespaces()
     self._gmn_client = self._create_gmn_client()
+    self._sysmeta_template = (
+      self._create_sysmeta_template() if SYSMETA_FROM_TEMPLATE else None
+    )
 
   def run(self):
-    self._process_all()
+    with connector_util.run_ledger.record_run(
+      'r2r', AUTHORITATIVE_MEMBER_NODE_URN
+    ) as self._run:
+      self._process_all()
     self._log_status()
 
   def _log_status(self):
@@ -184,7 +199,8 @@ class R2RConnector(object):
   def _process_all(self):
     record_idx = 1
     while record_idx:
-      xml_str = self._get_page(record_idx) # .encode('utf-8')
+      with self._run.phase('list'):
+        xml_str = self._get_page(record_idx) # .encode('utf-8')
       root_et = ET.fromstring(xml_str)
       self._process_page(root_et)
       # nextRecord is 0 when there are no more pages.
@@ -207,6 +223,7 @@ class R2RConnector(object):
         'accept': 'application/xml',
       }
     )
+    self._run.add_request(len(response.content))
     return response.content
 
   def _process_page(self, root_et):
@@ -214,47 +231,53 @@ class R2RConnector(object):
       './csw30:SearchResults/gmi:MI_Metadata', NS_DICT
     ):
       # logging.debug(self._serialize_pretty(metadata_et))
+      self._run.count('seen')
       try:
-        self._process_metadata(metadata_et)
+        with self._run.phase('gmn'):
+          self._process_metadata(metadata_et)
       except Exception:
         # We just record the event and move on to the next metadata doc. The
         # operation that failed will be retried the next time the process is
         # launched by cron
         logging.exception('R2R metadata processing failed with exception:')
         self._count_event('R2R metadata processing failure')
+        self._run.count('failed')
 
   def _process_metadata(self, metadata_et):
     xml_str = self._serialize_pretty(metadata_et)
-    sha1_checksum_pyxb = d1_common.checksum.create_checksum_object(xml_str)
-    sysmeta_pyxb = self._generate_sysmeta_pyxb(
-      metadata_et, xml_str, sha1_checksum_pyxb, None
-    )
-    pid = sysmeta_pyxb.identifier.value()
+    # The SHA-1 checksum of the metadata doc is used as its PID.
+    sha1_checksum_str = hashlib.sha1(xml_str).hexdigest()
+    pid = sha1_checksum_str
     if self._pid_exists(pid):
       # This version of this metadata doc already exists on GMN so there's
       # nothing to do.
+      self._run.count('skipped')
       return
-    self._process_new_object(pid, sysmeta_pyxb, xml_str)
+    sysmeta = self._generate_sysmeta(
+      metadata_et, xml_str, sha1_checksum_str, None
+    )
+    self._process_new_object(pid, self._get_sid(metadata_et), sysmeta, xml_str)
 
-  def _process_new_object(self, pid, sysmeta_pyxb, xml_str):
-    sid = sysmeta_pyxb.seriesId.value()
+  def _process_new_object(self, pid, sid, sysmeta, xml_str):
     obsoleted_pid = self._resolve_sid(sid)
     if obsoleted_pid:
-      self._update_sciobj(pid, obsoleted_pid, sysmeta_pyxb, xml_str)
+      self._update_sciobj(pid, obsoleted_pid, sysmeta, xml_str)
     else:
-      self._create_sciobj(pid, sysmeta_pyxb, xml_str)
+      self._create_sciobj(pid, sysmeta, xml_str)
 
-  def _update_sciobj(self, pid, obsoleted_pid, sysmeta_pyxb, xml_str):
-    self._gmn_client.update(obsoleted_pid, xml_str, pid, sysmeta_pyxb)
+  def _update_sciobj(self, pid, obsoleted_pid, sysmeta, xml_str):
+    self._gmn_client.update(obsoleted_pid, xml_str, pid, sysmeta)
     self._count_event('Object update')
+    self._run.count('updated')
     logging.info(
       'Updated object. obsoleted_pid="{}", new_pid="{}"'.
         format(obsoleted_pid, pid)
     )
 
-  def _create_sciobj(self, pid, sysmeta_pyxb, xml_str):
-    self._gmn_client.create(pid, xml_str, sysmeta_pyxb)
+  def _create_sciobj(self, pid, sysmeta, xml_str):
+    self._gmn_client.create(pid, xml_str, sysmeta)
     self._count_event('Object create')
+    self._run.count('created')
     logging.info(
       'Created object. pid="{}"'.format(pid)
     )
@@ -288,22 +311,67 @@ class R2RConnector(object):
     """Serialize and normalize the XML subtree"""
     return d1_common.util.pretty_xml(ET.tostring(xml_et)).encode('utf-8')
 
+  def _get_sid(self, metadata_et):
+    return metadata_et.find(
+      './gmd:fileIdentifier/gco:CharacterString', NS_DICT
+    ).text
+
+  def _get_date_uploaded(self, metadata_et):
+    return d1_common.date_time.from_iso8601(
+      metadata_et.find('./gmd:dateStamp/gco:DateTime', NS_DICT).text
+    )
+
+  def _generate_sysmeta(
+      self, metadata_et, xml_str, sha1_checksum_str, obsoletes_pid
+  ):
+    if self._sysmeta_template is not None:
+      return self._render_sysmeta(
+        metadata_et, xml_str, sha1_checksum_str, obsoletes_pid
+      )
+    checksum_pyxb = v2.checksum(sha1_checksum_str)
+    checksum_pyxb.algorithm = 'SHA-1'
+    return self._generate_sysmeta_pyxb(
+      metadata_et, xml_str, checksum_pyxb, obsoletes_pid
+    )
+
+  def _create_sysmeta_template(self):
+    """The fields that are the same for all objects are rendered once"""
+    return connector_util.sysmeta_template.SysMetaTemplate(
+      serialVersion=1,
+      formatId=SCIOBJ_FORMAT_STR,
+      submitter=SUBMITTER_SUBJECT_STR,
+      rightsHolder=OWNER_SUBJECT_STR,
+      originMemberNode=ORIGIN_MEMBER_NODE_URN,
+      authoritativeMemberNode=AUTHORITATIVE_MEMBER_NODE_URN,
+      accessPolicy=connector_util.sysmeta_template.PUBLIC_READ_ACCESS_POLICY,
+    )
+
+  def _render_sysmeta(
+      self, metadata_et, xml_str, sha1_checksum_str, obsoletes_pid
+  ):
+    """Render the same System Metadata as _generate_sysmeta_pyxb()"""
+    return self._sysmeta_template.create(
+      identifier=sha1_checksum_str,
+      seriesId=self._get_sid(metadata_et),
+      size=len(xml_str),
+      checksum=('SHA-1', sha1_checksum_str),
+      dateUploaded=self._get_date_uploaded(metadata_et),
+      dateSysMetadataModified=datetime.datetime.now(),
+      obsoletes=obsoletes_pid,
+    )
+
   def _generate_sysmeta_pyxb(self, metadata_et, xml_str, checksum_pyxb, obsoletes_pid):
     now = datetime.datetime.now()
     sysmeta_pyxb = v2.systemMetadata()
     sysmeta_pyxb.serialVersion = 1
     sysmeta_pyxb.identifier = checksum_pyxb.value()
-    sysmeta_pyxb.seriesId = metadata_et.find(
-      './gmd:fileIdentifier/gco:CharacterString', NS_DICT
-    ).text
+    sysmeta_pyxb.seriesId = self._get_sid(metadata_et)
     sysmeta_pyxb.formatId = SCIOBJ_FORMAT_STR
     sysmeta_pyxb.size = len(xml_str)
     sysmeta_pyxb.submitter = SUBMITTER_SUBJECT_STR
     sysmeta_pyxb.rightsHolder = OWNER_SUBJECT_STR
     sysmeta_pyxb.checksum = checksum_pyxb
-    sysmeta_pyxb.dateUploaded = d1_common.date_time.from_iso8601(
-      metadata_et.find('./gmd:dateStamp/gco:DateTime', NS_DICT).text
-    )
+    sysmeta_pyxb.dateUploaded = self._get_date_uploaded(metadata_et)
     sysmeta_pyxb.dateSysMetadataModified = now
     sysmeta_pyxb.originMemberNode = ORIGIN_MEMBER_NODE_URN
     sysmeta_pyxb.authoritativeMemberNode = AUTHORITATIVE_MEMBER_NODE_URN